@@ -0,0 +1,46 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.services.agendador_backups import executar_backup_agendado
+
+
+class Command(BaseCommand):
+    help = ('Executa os backups agendados conforme as configurações de backup (horário, frequência '
+            'e quantidade de backups mantidos); roda continuamente, fora do servidor web')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Verifica o agendamento uma única vez e sai (ex.: para uso com cron)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=getattr(settings, 'BACKUP_SCHEDULER_INTERVAL_SECONDS', 60),
+            help='Segundos entre verificações (padrão: BACKUP_SCHEDULER_INTERVAL_SECONDS)',
+        )
+
+    def handle(self, *args, **options):
+        if not options['once']:
+            self.stdout.write(f"Agendador de backups iniciado (verificação a cada {options['intervalo']}s)")
+        while True:
+            close_old_connections()
+            try:
+                result = executar_backup_agendado()
+            except Exception as e:
+                # O agendador continua no próximo ciclo
+                result = {'success': False, 'error': str(e)}
+            if result is not None:
+                if result['success']:
+                    retencao = result.get('retention', {})
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Backup {result['backup_id']} concluído; "
+                        f"{retencao.get('deleted_count', 0)} backups antigos removidos"
+                    ))
+                else:
+                    self.stderr.write(self.style.ERROR(f"Backup agendado falhou: {result.get('error')}"))
+            if options['once']:
+                return
+            time.sleep(options['intervalo'])
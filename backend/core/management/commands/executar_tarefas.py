@@ -0,0 +1,57 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.services.executor_tarefas import ExecutorTarefas
+
+
+class Command(BaseCommand):
+    help = ('Executa as tarefas em fila (backups, migrações para o S3) em um pool de workers, '
+            'fora do servidor web; vários processos podem rodar sobre o mesmo banco')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Executa as tarefas pendentes no momento, espera terminarem e sai (ex.: para uso com cron)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'TASK_EXECUTOR_WORKERS', 2),
+            help='Tarefas executadas ao mesmo tempo (padrão: TASK_EXECUTOR_WORKERS)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=getattr(settings, 'TASK_EXECUTOR_INTERVAL_SECONDS', 5),
+            help='Segundos entre buscas na fila (padrão: TASK_EXECUTOR_INTERVAL_SECONDS)',
+        )
+
+    def handle(self, *args, **options):
+        executor = ExecutorTarefas(workers=options['workers'])
+        if options['once']:
+            while executor.ciclo():
+                executor.aguardar(options['intervalo'])
+            executor.encerrar()
+            return
+
+        self.stdout.write(
+            f"Executor de tarefas {executor.worker_id} iniciado "
+            f"({executor.workers} workers, busca a cada {options['intervalo']}s)"
+        )
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    iniciadas = executor.ciclo()
+                except Exception as e:
+                    # O executor continua no próximo ciclo
+                    iniciadas = 0
+                    self.stderr.write(self.style.ERROR(f"Erro ao buscar tarefas: {str(e)}"))
+                if iniciadas:
+                    self.stdout.write(f"{iniciadas} tarefa(s) iniciada(s)")
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write("Aguardando as tarefas em execução...")
+            executor.encerrar()
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Usuario
+from core.services.s3_service import S3Service
+from core.services.migracao_s3 import MigracaoS3, ORIGENS_MIGRACAO
+
+
+class Command(BaseCommand):
+    help = ('Migra os arquivos locais dos anexos (obras, compras, locações e despesas) para o S3, '
+            'em paralelo; pode ser executado novamente para retomar uma migração interrompida')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tipo',
+            action='append',
+            choices=list(ORIGENS_MIGRACAO),
+            help='Migra apenas um tipo de anexo (pode ser repetido)',
+        )
+        parser.add_argument(
+            '--object-id',
+            type=int,
+            help='Migra apenas os anexos de um objeto (ex.: ID da obra)',
+        )
+        parser.add_argument(
+            '--usuario',
+            help='Login do usuário responsável (padrão: primeiro superusuário)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Threads para hash e upload (padrão: 4)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=50,
+            help='Arquivos por lote gravado no banco (padrão: 50)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas mostra o que seria migrado, sem enviar nem gravar',
+        )
+
+    def handle(self, *args, **options):
+        login = options.get('usuario')
+        if login:
+            usuario = Usuario.objects.filter(login=login).first()
+            if not usuario:
+                raise CommandError(f'Usuário "{login}" não encontrado')
+        else:
+            usuario = Usuario.objects.filter(is_superuser=True).order_by('id').first()
+            if not usuario:
+                raise CommandError('Nenhum superusuário encontrado; informe --usuario')
+
+        s3_service = S3Service()
+        if not s3_service.s3_available:
+            raise CommandError('S3 não está disponível; verifique as credenciais e o bucket')
+
+        result = MigracaoS3(s3_service, workers=options['workers'], batch_size=options['lote']).run(
+            tipos=options.get('tipo'),
+            object_id=options.get('object_id'),
+            user_id=usuario.id,
+            dry_run=options['dry_run'],
+        )
+        if not result['success']:
+            raise CommandError(result['error'])
+
+        for falha in result['failed_files']:
+            self.stderr.write(f"{falha['origem']} ({falha['local_path']}): {falha['error']}")
+
+        acao = 'seriam migrados' if result['dry_run'] else 'migrados'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Tarefa {result['task_id']}: {result['migrated_count']} de {result['pending_count']} arquivos {acao} "
+                f"({result['deduplicated_count']} com conteúdo já existente no S3), {result['failed_count']} falhas"
+            )
+        )
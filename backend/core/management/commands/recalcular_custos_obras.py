@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Obra, ObraCustoResumo
+from core.services.custos_diarios import reconstruir_custos_diarios
+
+
+class Command(BaseCommand):
+    help = ('Reconstrói o resumo de custos por obra (ObraCustoResumo) e o consolidado diário '
+            '(CustoDiarioObra), ou confere o resumo com os valores reais')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Apenas compara o resumo gravado com as agregações reais, sem alterar nada',
+        )
+        parser.add_argument(
+            '--obra-id',
+            type=int,
+            help='Processa apenas uma obra específica pelo ID',
+        )
+
+    def handle(self, *args, **options):
+        verificar = options['verificar']
+        obra_id = options.get('obra_id')
+
+        obras = Obra.objects.select_related('custo_resumo').order_by('id')
+        if obra_id:
+            obras = obras.filter(id=obra_id)
+            if not obras.exists():
+                raise CommandError(f'Obra com ID {obra_id} não encontrada')
+
+        divergentes = 0
+        total = 0
+        for obra in obras.iterator(chunk_size=500):
+            total += 1
+            reais = ObraCustoResumo.calcular_categorias(obra.id)
+            try:
+                gravados = obra.custo_resumo.as_dict()
+            except ObraCustoResumo.DoesNotExist:
+                gravados = None
+
+            if gravados != reais:
+                divergentes += 1
+                self.stdout.write(f"Obra {obra.id} ({obra.nome_obra}): {gravados} -> {reais}")
+
+            if not verificar and gravados != reais:
+                ObraCustoResumo.objects.update_or_create(obra_id=obra.id, defaults=reais)
+
+        if verificar:
+            if divergentes:
+                raise CommandError(f'{divergentes} de {total} obras com resumo de custos divergente')
+            self.stdout.write(self.style.SUCCESS(f'Resumo de custos consistente para {total} obras'))
+        else:
+            dias = reconstruir_custos_diarios(obra_id)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Sucesso! {divergentes} de {total} resumos de custos foram reconstruídos '
+                    f'e {dias} dias de custos consolidados'
+                )
+            )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.services.ocupacao import reconstruir_ocupacoes
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de ocupação de funcionários (OcupacaoFuncionario) a partir das locações ativas'
+
+    def handle(self, *args, **options):
+        total = reconstruir_ocupacoes()
+        self.stdout.write(self.style.SUCCESS(f'Sucesso! {total} ocupações indexadas'))
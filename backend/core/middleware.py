@@ -5,7 +5,6 @@ from datetime import datetime
 import logging
 import time
 import json
-import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 from .logging_config import sgo_logger
 from django.core.exceptions import ValidationError
@@ -222,15 +221,15 @@ class SystemHealthChecker:
         Verificar conexão com S3
         """
         try:
-            import boto3
             from django.conf import settings
+            from .services.s3_service import get_shared_s3_client
             
             if hasattr(settings, 'AWS_ACCESS_KEY_ID'):
-                s3 = boto3.client(
-                    's3',
-                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                    region_name=getattr(settings, 'AWS_S3_REGION_NAME', 'us-east-1')
+                # Reaproveita o cliente do processo; o head_bucket aqui é sempre ao vivo
+                s3 = get_shared_s3_client(
+                    settings.AWS_ACCESS_KEY_ID,
+                    settings.AWS_SECRET_ACCESS_KEY,
+                    getattr(settings, 'AWS_S3_REGION_NAME', 'us-east-1')
                 )
                 s3.head_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
                 return True, "S3 OK"
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:39
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_arquivoobra_s3_anexo_id_arquivoobra_s3_url_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObraCustoResumo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('materiais', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('mao_de_obra', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('servicos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('despesas_extras', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('obra', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='custo_resumo', to='core.obra')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Custos da Obra',
+                'verbose_name_plural': 'Resumos de Custos das Obras',
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:48
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+
+def popular_ocupacoes(apps, schema_editor):
+    Locacao = apps.get_model('core', 'Locacao_Obras_Equipes')
+    Equipe = apps.get_model('core', 'Equipe')
+    OcupacaoFuncionario = apps.get_model('core', 'OcupacaoFuncionario')
+
+    membros = {}
+    for equipe_id, funcionario_id in Equipe.membros.through.objects.values_list('equipe_id', 'funcionario_id'):
+        membros.setdefault(equipe_id, []).append(funcionario_id)
+
+    novas = []
+    for loc in Locacao.objects.filter(status_locacao='ativa').iterator(chunk_size=1000):
+        if loc.funcionario_locado_id:
+            funcionario_ids = [loc.funcionario_locado_id]
+        elif loc.equipe_id:
+            funcionario_ids = membros.get(loc.equipe_id, [])
+        else:
+            continue
+        for funcionario_id in funcionario_ids:
+            novas.append(OcupacaoFuncionario(
+                funcionario_id=funcionario_id, locacao_id=loc.pk, obra_id=loc.obra_id, equipe_id=loc.equipe_id,
+                data_inicio=loc.data_locacao_inicio, data_fim=loc.data_locacao_fim or loc.data_locacao_inicio,
+            ))
+    OcupacaoFuncionario.objects.bulk_create(novas, batch_size=1000)
+
+
+def criar_indice_gist(apps, schema_editor):
+    # Apenas Postgres: índice GiST por funcionário + daterange. Requer btree_gist;
+    # se a extensão não puder ser criada, cai para um GiST só no daterange.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+            schema_editor.execute(
+                "CREATE INDEX IF NOT EXISTS ocupacao_func_daterange_gist ON core_ocupacaofuncionario "
+                "USING gist (funcionario_id, daterange(data_inicio, data_fim, '[]'))"
+            )
+    except Exception:
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS ocupacao_func_daterange_gist ON core_ocupacaofuncionario "
+            "USING gist (daterange(data_inicio, data_fim, '[]'))"
+        )
+
+
+def remover_indice_gist(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS ocupacao_func_daterange_gist')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_obracustoresumo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacaoFuncionario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_inicio', models.DateField()),
+                ('data_fim', models.DateField()),
+                ('equipe', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ocupacoes_membros', to='core.equipe')),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacoes', to='core.funcionario')),
+                ('locacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacoes', to='core.locacao_obras_equipes')),
+                ('obra', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacoes_funcionarios', to='core.obra')),
+            ],
+            options={
+                'verbose_name': 'Ocupação de Funcionário',
+                'verbose_name_plural': 'Ocupações de Funcionários',
+                'indexes': [models.Index(fields=['funcionario', 'data_inicio', 'data_fim'], name='ocupacao_func_periodo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('funcionario', 'locacao'), name='ocupacao_funcionario_locacao_unica')],
+            },
+        ),
+        migrations.RunPython(popular_ocupacoes, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_gist, remover_indice_gist),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def popular_custos_diarios(apps, schema_editor):
+    Compra = apps.get_model('core', 'Compra')
+    Locacao = apps.get_model('core', 'Locacao_Obras_Equipes')
+    Despesa_Extra = apps.get_model('core', 'Despesa_Extra')
+    CustoDiarioObra = apps.get_model('core', 'CustoDiarioObra')
+
+    origens = [
+        ('materiais', Compra.objects.filter(tipo='COMPRA'), 'data_compra', 'valor_total_liquido'),
+        ('mao_de_obra', Locacao.objects.filter(
+            Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False), status_locacao='ativa'
+        ), 'data_locacao_inicio', 'valor_pagamento'),
+        ('servicos', Locacao.objects.filter(
+            servico_externo__isnull=False, status_locacao='ativa'
+        ).exclude(servico_externo__exact=''), 'data_locacao_inicio', 'valor_pagamento'),
+        ('despesas_extras', Despesa_Extra.objects.all(), 'data', 'valor'),
+    ]
+    valores = {}
+    for categoria, queryset, campo_data, campo_valor in origens:
+        for linha in queryset.order_by().values('obra_id', campo_data).annotate(total=Sum(campo_valor)):
+            valores.setdefault((linha['obra_id'], linha[campo_data]), {})[categoria] = linha['total'] or Decimal('0.00')
+
+    CustoDiarioObra.objects.bulk_create([
+        CustoDiarioObra(obra_id=obra_id, data=dia, **valores_dia)
+        for (obra_id, dia), valores_dia in valores.items()
+        if any(valores_dia.values())
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_ocupacaofuncionario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustoDiarioObra',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('materiais', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('mao_de_obra', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('servicos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('despesas_extras', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('obra', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custos_diarios', to='core.obra')),
+            ],
+            options={
+                'verbose_name': 'Custo Diário da Obra',
+                'verbose_name_plural': 'Custos Diários das Obras',
+                'ordering': ['data'],
+                'indexes': [models.Index(fields=['data'], name='core_custod_data_8e626c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('obra', 'data'), name='custo_diario_obra_data_unico')],
+            },
+        ),
+        migrations.RunPython(popular_custos_diarios, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0040_custodiarioobra'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='task_type',
+            field=models.CharField(choices=[('backup', 'Backup'), ('migration', 'Migração'), ('deployment', 'Deploy'), ('maintenance', 'Manutenção'), ('report', 'Relatório'), ('other', 'Outro')], max_length=20),
+        ),
+    ]
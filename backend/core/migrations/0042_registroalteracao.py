@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0041_taskhistory_report'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroAlteracao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=100)),
+                ('objeto_id', models.CharField(max_length=64)),
+                ('alterado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['alterado_em'], name='core_regist_alterad_a54dd5_idx')],
+            },
+        ),
+    ]
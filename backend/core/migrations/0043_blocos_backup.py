@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0042_registroalteracao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlocoBackup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('tamanho', models.PositiveIntegerField()),
+                ('tamanho_armazenado', models.PositiveIntegerField()),
+                ('armazenamento', models.CharField(choices=[('local', 'Local'), ('s3', 'S3')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlocoManifesto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordem', models.PositiveIntegerField()),
+                ('backup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocos_manifesto', to='core.backuplog')),
+                ('bloco', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='referencias', to='core.blocobackup')),
+            ],
+            options={
+                'ordering': ['backup', 'ordem'],
+                'constraints': [models.UniqueConstraint(fields=('backup', 'ordem'), name='bloco_manifesto_ordem_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0043_blocos_backup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backuplog',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='backups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='taskhistory',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='created_tasks', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
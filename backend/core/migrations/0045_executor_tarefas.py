@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0044_backups_agendados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskhistory',
+            name='cancel_requested',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='taskhistory',
+            name='estimated_duration',
+            field=models.PositiveIntegerField(blank=True, help_text='Duração estimada em segundos', null=True),
+        ),
+        migrations.AddField(
+            model_name='taskhistory',
+            name='priority',
+            field=models.CharField(choices=[('low', 'Baixa'), ('medium', 'Média'), ('high', 'Alta'), ('critical', 'Crítica')], default='medium', max_length=10),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_executor_tarefas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taskhistory',
+            index=models.Index(fields=['created_at'], name='core_taskhi_created_d9d31a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0046_indice_estatisticas_tarefas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupsettings',
+            name='last_restore_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-17 21:10
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def falhar_relatorios_orfaos(apps, schema_editor):
+    # Jobs do antigo pool de threads do servidor web: sem handler, nenhum
+    # executor vai reivindicá-los e ficariam pendentes para sempre
+    TaskHistory = apps.get_model('core', 'TaskHistory')
+    TaskHistory.objects.filter(
+        task_type='report', status__in=['pending', 'in_progress'], metadata__handler__isnull=True
+    ).update(status='failed', completed_at=timezone.now(), error_message='Worker interrupted')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0047_restauracao_backup'),
+    ]
+
+    operations = [
+        migrations.RunPython(falhar_relatorios_orfaos, migrations.RunPython.noop),
+    ]
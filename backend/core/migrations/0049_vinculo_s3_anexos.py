@@ -0,0 +1,58 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:51
+
+from django.db import migrations, models
+
+
+def vincular_anexos_migrados(apps, schema_editor):
+    # Execuções anteriores da migração para o S3 criaram o AnexoS3 destes
+    # anexos sem vínculo na linha de origem (só metadata['origem'] = "Modelo:id")
+    AnexoS3 = apps.get_model('core', 'AnexoS3')
+    modelos = {nome: apps.get_model('core', nome) for nome in ('AnexoCompra', 'AnexoLocacao', 'AnexoDespesa')}
+    migrados = AnexoS3.objects.filter(is_migrated=True, metadata__has_key='origem')
+    for anexo in migrados.iterator(chunk_size=500):
+        nome, _, pk = anexo.metadata['origem'].partition(':')
+        if nome in modelos and pk.isdigit():
+            modelos[nome].objects.filter(pk=int(pk), s3_anexo_id__isnull=True).update(
+                s3_anexo_id=anexo.anexo_id, s3_url=anexo.s3_url
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0048_relatorios_no_executor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anexocompra',
+            name='s3_anexo_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='anexocompra',
+            name='s3_url',
+            field=models.URLField(blank=True, max_length=1000, null=True),
+        ),
+        migrations.AddField(
+            model_name='anexodespesa',
+            name='s3_anexo_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='anexodespesa',
+            name='s3_url',
+            field=models.URLField(blank=True, max_length=1000, null=True),
+        ),
+        migrations.AddField(
+            model_name='anexolocacao',
+            name='s3_anexo_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='anexolocacao',
+            name='s3_url',
+            field=models.URLField(blank=True, max_length=1000, null=True),
+        ),
+        migrations.RunPython(vincular_anexos_migrados, migrations.RunPython.noop),
+    ]
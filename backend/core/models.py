@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import Sum, Q, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from decimal import Decimal, InvalidOperation
 from django.core.exceptions import ValidationError
@@ -160,6 +163,42 @@ class Locacao_Obras_Equipes(models.Model):
     )
     observacoes = models.TextField(blank=True, null=True, verbose_name="Observações")
 
+    def calcular_valor_pagamento(self, membros=None):
+        """
+        Valor padrão da locação a partir dos valores cadastrados do funcionário
+        ou da soma dos membros da equipe.
+
+        Args:
+            membros: membros da equipe já carregados (evita consultar equipe.membros
+                     novamente quando várias locações da mesma equipe são precificadas)
+        """
+        dias_trabalhados = (self.data_locacao_fim - self.data_locacao_inicio).days + 1
+        valor = Decimal('0.00')
+
+        if self.funcionario_locado:
+            # Cálculo para funcionário individual
+            if self.tipo_pagamento == 'diaria' and self.funcionario_locado.valor_diaria_padrao:
+                valor = self.funcionario_locado.valor_diaria_padrao * dias_trabalhados
+            elif self.tipo_pagamento == 'metro' and self.funcionario_locado.valor_metro_padrao and self.obra.area_metragem:
+                valor = self.funcionario_locado.valor_metro_padrao * self.obra.area_metragem
+            elif self.tipo_pagamento == 'empreitada' and self.funcionario_locado.valor_empreitada_padrao:
+                valor = self.funcionario_locado.valor_empreitada_padrao
+
+        elif self.equipe:
+            # Cálculo para equipe (soma dos valores de todos os membros)
+            if membros is None:
+                membros = self.equipe.membros.all()
+
+            for membro in membros:
+                if self.tipo_pagamento == 'diaria' and membro.valor_diaria_padrao:
+                    valor += membro.valor_diaria_padrao * dias_trabalhados
+                elif self.tipo_pagamento == 'metro' and membro.valor_metro_padrao and self.obra.area_metragem:
+                    valor += membro.valor_metro_padrao * self.obra.area_metragem
+                elif self.tipo_pagamento == 'empreitada' and membro.valor_empreitada_padrao:
+                    valor += membro.valor_empreitada_padrao
+
+        return valor
+
     def save(self, *args, **kwargs):
         if self.data_locacao_inicio:  # data_locacao_inicio is non-nullable
             if self.data_locacao_fim is None or self.data_locacao_fim < self.data_locacao_inicio:
@@ -167,31 +206,7 @@ class Locacao_Obras_Equipes(models.Model):
         
         # Cálculo automático de pagamento
         if self.valor_pagamento == Decimal('0.00') or self.valor_pagamento is None:
-            dias_trabalhados = (self.data_locacao_fim - self.data_locacao_inicio).days + 1
-            
-            if self.funcionario_locado:
-                # Cálculo para funcionário individual
-                if self.tipo_pagamento == 'diaria' and self.funcionario_locado.valor_diaria_padrao:
-                    self.valor_pagamento = self.funcionario_locado.valor_diaria_padrao * dias_trabalhados
-                elif self.tipo_pagamento == 'metro' and self.funcionario_locado.valor_metro_padrao and self.obra.area_metragem:
-                    self.valor_pagamento = self.funcionario_locado.valor_metro_padrao * self.obra.area_metragem
-                elif self.tipo_pagamento == 'empreitada' and self.funcionario_locado.valor_empreitada_padrao:
-                    self.valor_pagamento = self.funcionario_locado.valor_empreitada_padrao
-            
-            elif self.equipe:
-                # Cálculo para equipe (soma dos valores de todos os membros)
-                valor_total_equipe = Decimal('0.00')
-                membros = self.equipe.membros.all()
-                
-                for membro in membros:
-                    if self.tipo_pagamento == 'diaria' and membro.valor_diaria_padrao:
-                        valor_total_equipe += membro.valor_diaria_padrao * dias_trabalhados
-                    elif self.tipo_pagamento == 'metro' and membro.valor_metro_padrao and self.obra.area_metragem:
-                        valor_total_equipe += membro.valor_metro_padrao * self.obra.area_metragem
-                    elif self.tipo_pagamento == 'empreitada' and membro.valor_empreitada_padrao:
-                        valor_total_equipe += membro.valor_empreitada_padrao
-                
-                self.valor_pagamento = valor_total_equipe
+            self.valor_pagamento = self.calcular_valor_pagamento()
             
             # Se foi calculado um valor, considera como pago automaticamente
             if self.valor_pagamento > Decimal('0.00') and not self.data_pagamento:
@@ -208,6 +223,36 @@ class Locacao_Obras_Equipes(models.Model):
             return f"{self.obra.nome_obra} - Externo: {self.servico_externo}"
         return f"Locação ID {self.id} para {self.obra.nome_obra} (detalhes pendentes)"
 
+class OcupacaoFuncionario(models.Model):
+    """
+    Índice de ocupação de funcionários por período, usado na detecção de conflitos.
+    Uma linha por funcionário ocupado por uma locação ativa: diretamente
+    (funcionario_locado) ou como membro da equipe locada (equipe preenchida).
+    Mantido por core/services/ocupacao.py a partir dos signals de
+    Locacao_Obras_Equipes e de Equipe.membros.
+    No Postgres há também um índice GiST sobre daterange(data_inicio, data_fim)
+    (migração 0039).
+    """
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name='ocupacoes')
+    locacao = models.ForeignKey(Locacao_Obras_Equipes, on_delete=models.CASCADE, related_name='ocupacoes')
+    obra = models.ForeignKey(Obra, on_delete=models.CASCADE, related_name='ocupacoes_funcionarios')
+    equipe = models.ForeignKey(Equipe, on_delete=models.CASCADE, null=True, blank=True, related_name='ocupacoes_membros')
+    data_inicio = models.DateField()
+    data_fim = models.DateField()
+
+    class Meta:
+        verbose_name = 'Ocupação de Funcionário'
+        verbose_name_plural = 'Ocupações de Funcionários'
+        constraints = [
+            models.UniqueConstraint(fields=['funcionario', 'locacao'], name='ocupacao_funcionario_locacao_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['funcionario', 'data_inicio', 'data_fim'], name='ocupacao_func_periodo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.funcionario_id} ocupado de {self.data_inicio} a {self.data_fim} (locação {self.locacao_id})"
+
 class Material(models.Model):
     nome = models.CharField(max_length=100, unique=True)
     unidade_medida = models.CharField(max_length=20, choices=[('un', 'Unidade'), ('m²', 'Metro Quadrado'), ('kg', 'Quilograma'), ('saco', 'Saco')])
@@ -426,6 +471,150 @@ class Despesa_Extra(models.Model):
     def __str__(self):
         return f"{self.categoria} - {self.descricao[:50]} ({self.obra.nome_obra})"
 
+
+class ObraCustoResumo(models.Model):
+    """
+    Resumo desnormalizado dos custos realizados de uma obra, por categoria.
+    Mantido pelos signals de Compra, ItemCompra, Locacao_Obras_Equipes e Despesa_Extra
+    (ver core/signals.py) e reconstruível com `manage.py recalcular_custos_obras`.
+    """
+    CATEGORIAS = ('materiais', 'mao_de_obra', 'servicos', 'despesas_extras')
+
+    obra = models.OneToOneField(Obra, on_delete=models.CASCADE, related_name='custo_resumo')
+    materiais = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    mao_de_obra = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    servicos = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    despesas_extras = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Resumo de Custos da Obra'
+        verbose_name_plural = 'Resumos de Custos das Obras'
+
+    def __str__(self):
+        return f"Custos de {self.obra_id}: {self.total}"
+
+    @property
+    def total(self):
+        return self.materiais + self.mao_de_obra + self.servicos + self.despesas_extras
+
+    def as_dict(self):
+        return {categoria: getattr(self, categoria) for categoria in self.CATEGORIAS}
+
+    @classmethod
+    def calcular_categorias(cls, obra_id, categorias=None):
+        """
+        Calcula os custos a partir das tabelas de origem (consultas de agregação).
+        Apenas as categorias pedidas são consultadas.
+        """
+        categorias = categorias or cls.CATEGORIAS
+        valores = {}
+        if 'materiais' in categorias:
+            valores['materiais'] = Compra.objects.filter(
+                obra_id=obra_id, tipo='COMPRA'
+            ).aggregate(total=Sum('valor_total_liquido'))['total']
+        if 'mao_de_obra' in categorias:
+            valores['mao_de_obra'] = Locacao_Obras_Equipes.objects.filter(
+                Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False),
+                obra_id=obra_id
+            ).aggregate(total=Sum('valor_pagamento'))['total']
+        if 'servicos' in categorias:
+            valores['servicos'] = Locacao_Obras_Equipes.objects.filter(
+                obra_id=obra_id, servico_externo__isnull=False
+            ).exclude(servico_externo__exact='').aggregate(total=Sum('valor_pagamento'))['total']
+        if 'despesas_extras' in categorias:
+            valores['despesas_extras'] = Despesa_Extra.objects.filter(
+                obra_id=obra_id
+            ).aggregate(total=Sum('valor'))['total']
+        return {categoria: valor or Decimal('0.00') for categoria, valor in valores.items()}
+
+    @classmethod
+    def anotar_queryset(cls, queryset):
+        """
+        Anota um queryset de Obra com os custos de cada categoria (custo_<categoria>)
+        usando subconsultas correlacionadas, de modo que a listagem inteira seja
+        resolvida em uma única consulta SQL.
+        """
+        def _subquery(qs, campo):
+            total = qs.filter(obra=OuterRef('pk')).order_by().values('obra').annotate(
+                total=Sum(campo)
+            ).values('total')[:1]
+            return Coalesce(
+                Subquery(total, output_field=models.DecimalField(max_digits=15, decimal_places=2)),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=15, decimal_places=2)
+            )
+
+        return queryset.annotate(
+            custo_materiais=_subquery(Compra.objects.filter(tipo='COMPRA'), 'valor_total_liquido'),
+            custo_mao_de_obra=_subquery(
+                Locacao_Obras_Equipes.objects.filter(Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False)),
+                'valor_pagamento'
+            ),
+            custo_servicos=_subquery(
+                Locacao_Obras_Equipes.objects.filter(servico_externo__isnull=False).exclude(servico_externo__exact=''),
+                'valor_pagamento'
+            ),
+            custo_despesas_extras=_subquery(Despesa_Extra.objects.all(), 'valor'),
+        )
+
+    @classmethod
+    def atualizar(cls, obra_id, categorias=None):
+        """
+        Recalcula só as categorias afetadas de um resumo já existente.
+        Não cria o registro: durante a exclusão em cascata de uma obra o resumo
+        já pode ter sido removido, e recriá-lo violaria a FK.
+        """
+        if not obra_id:
+            return 0
+        valores = cls.calcular_categorias(obra_id, categorias)
+        return cls.objects.filter(obra_id=obra_id).update(updated_at=timezone.now(), **valores)
+
+    @classmethod
+    def recalcular(cls, obra):
+        """Recalcula todas as categorias da obra, criando o resumo se necessário."""
+        obra_id = getattr(obra, 'pk', obra)
+        resumo, _ = cls.objects.update_or_create(
+            obra_id=obra_id, defaults=cls.calcular_categorias(obra_id)
+        )
+        return resumo
+
+class CustoDiarioObra(models.Model):
+    """
+    Consolidado diário de custos por obra, base das séries temporais de custos.
+    Compras (tipo COMPRA) entram pela data_compra, locações ativas pela
+    data_locacao_inicio e despesas extras pela data. Mantido pelos signals em
+    core/signals.py via core/services/custos_diarios.py.
+    """
+    CATEGORIAS = ('materiais', 'mao_de_obra', 'servicos', 'despesas_extras')
+
+    obra = models.ForeignKey(Obra, on_delete=models.CASCADE, related_name='custos_diarios')
+    data = models.DateField()
+    materiais = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    mao_de_obra = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    servicos = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    despesas_extras = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['data']
+        verbose_name = 'Custo Diário da Obra'
+        verbose_name_plural = 'Custos Diários das Obras'
+        constraints = [
+            models.UniqueConstraint(fields=['obra', 'data'], name='custo_diario_obra_data_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['data']),
+        ]
+
+    def __str__(self):
+        return f"Custos de {self.obra_id} em {self.data}"
+
+    @property
+    def total(self):
+        return self.materiais + self.mao_de_obra + self.servicos + self.despesas_extras
+
+
 class Ocorrencia_Funcionario(models.Model):
     funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name='ocorrencias')
     data = models.DateField()
@@ -477,6 +666,9 @@ class BackupSettings(models.Model):
     backup_location = models.CharField(max_length=500, default='/backups/')
     email_notifications = models.BooleanField(default=True)
     notification_email = models.EmailField(blank=True, null=True)
+    # Última restauração do banco: cadeias incrementais anteriores a ela não
+    # correspondem mais ao banco, e o próximo backup é completo
+    last_restore_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -487,6 +679,15 @@ class BackupSettings(models.Model):
     def __str__(self):
         return f"Configurações de Backup - Auto: {self.backup_enabled}"
 
+    @classmethod
+    def atual(cls):
+        """Configuração única do sistema, criada com os valores padrão se não existir."""
+        configuracao, criada = cls.objects.get_or_create(pk=1)
+        if criada:
+            # Os padrões ficam como texto na instância recém-criada (ex.: backup_time)
+            configuracao.refresh_from_db()
+        return configuracao
+
 
 class AnexoLocacao(models.Model):
     locacao = models.ForeignKey(Locacao_Obras_Equipes, related_name='anexos', on_delete=models.CASCADE)
@@ -494,6 +695,10 @@ class AnexoLocacao(models.Model):
     descricao = models.CharField(max_length=255, blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Vínculo com o objeto no S3, gravado pela migração dos arquivos locais
+    s3_anexo_id = models.CharField(max_length=100, blank=True, null=True)
+    s3_url = models.URLField(max_length=1000, blank=True, null=True)
+
     def __str__(self):
         return f"Anexo de {self.locacao.id} ({self.id})"
 
@@ -504,6 +709,10 @@ class AnexoDespesa(models.Model):
     descricao = models.CharField(max_length=255, blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Vínculo com o objeto no S3, gravado pela migração dos arquivos locais
+    s3_anexo_id = models.CharField(max_length=100, blank=True, null=True)
+    s3_url = models.URLField(max_length=1000, blank=True, null=True)
+
     def __str__(self):
         return f"Anexo de {self.despesa.id} ({self.id})"
 
@@ -560,6 +769,10 @@ class AnexoCompra(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     uploaded_by = models.ForeignKey('Usuario', on_delete=models.SET_NULL, null=True, blank=True)
     
+    # Vínculo com o objeto no S3, gravado pela migração dos arquivos locais
+    s3_anexo_id = models.CharField(max_length=100, blank=True, null=True)
+    s3_url = models.URLField(max_length=1000, blank=True, null=True)
+    
     class Meta:
         ordering = ['-uploaded_at']
         verbose_name = 'Anexo de Compra'
@@ -657,19 +870,31 @@ class TaskHistory(models.Model):
         ('migration', 'Migração'),
         ('deployment', 'Deploy'),
         ('maintenance', 'Manutenção'),
+        ('report', 'Relatório'),
         ('other', 'Outro'),
     ]
     
+    PRIORITY_CHOICES = [
+        ('low', 'Baixa'),
+        ('medium', 'Média'),
+        ('high', 'Alta'),
+        ('critical', 'Crítica'),
+    ]
+    
     task_id = models.CharField(max_length=100, unique=True)
     task_type = models.CharField(max_length=20, choices=TASK_TYPE_CHOICES)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=TASK_STATUS_CHOICES, default='pending')
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
+    estimated_duration = models.PositiveIntegerField(null=True, blank=True, help_text="Duração estimada em segundos")
+    # Cancelamento cooperativo: o worker que executa a tarefa para no próximo registro de progresso
+    cancel_requested = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
-    created_by = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='created_tasks')
+    created_by = models.ForeignKey(Usuario, on_delete=models.CASCADE, null=True, blank=True, related_name='created_tasks')
     assigned_to = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_tasks')
     progress_percentage = models.PositiveIntegerField(default=0)
     error_message = models.TextField(blank=True)
@@ -680,10 +905,19 @@ class TaskHistory(models.Model):
         indexes = [
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['task_type', 'status']),
+            # Janela das estatísticas (created_at >= início), sem filtro de status
+            models.Index(fields=['created_at']),
         ]
     
     def __str__(self):
         return f"{self.title} ({self.get_status_display()})"
+    
+    @property
+    def actual_duration(self):
+        """Duração da execução (timedelta), quando a tarefa já terminou."""
+        if self.started_at and self.completed_at:
+            return self.completed_at - self.started_at
+        return None
 
 
 class BackupLog(models.Model):
@@ -708,7 +942,7 @@ class BackupLog(models.Model):
     file_hash = models.CharField(max_length=64, blank=True)  # SHA256 hash
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
-    created_by = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='backups')
+    created_by = models.ForeignKey(Usuario, on_delete=models.CASCADE, null=True, blank=True, related_name='backups')  # Vazio nos backups agendados
     error_message = models.TextField(blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     is_duplicate = models.BooleanField(default=False)
@@ -726,6 +960,63 @@ class BackupLog(models.Model):
         return f"Backup {self.backup_id} ({self.get_status_display()})"
 
 
+class RegistroAlteracao(models.Model):
+    """
+    Diário de alterações usado pelos backups incrementais: uma linha por
+    gravação ou exclusão de registro (ver core/services/rastreio_alteracoes.py).
+    O incremental grava o estado atual de cada registro alterado desde o backup
+    anterior, ou a sua exclusão, se ele não existir mais.
+    """
+    modelo = models.CharField(max_length=100)  # app_label.model_name
+    objeto_id = models.CharField(max_length=64)
+    alterado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['alterado_em']),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo}:{self.objeto_id} em {self.alterado_em}"
+
+
+class BlocoBackup(models.Model):
+    """
+    Bloco do repositório deduplicado de backups (ver core/services/repositorio_backups.py):
+    trecho de um snapshot com limites definidos pelo conteúdo, gravado uma única
+    vez sob o seu SHA256, no disco ou no S3.
+    """
+    ARMAZENAMENTO_CHOICES = [
+        ('local', 'Local'),
+        ('s3', 'S3'),
+    ]
+
+    hash = models.CharField(max_length=64, unique=True)  # SHA256 do conteúdo original
+    tamanho = models.PositiveIntegerField()
+    tamanho_armazenado = models.PositiveIntegerField()  # Comprimido
+    armazenamento = models.CharField(max_length=10, choices=ARMAZENAMENTO_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Bloco {self.hash[:12]} ({self.tamanho} bytes)"
+
+
+class BlocoManifesto(models.Model):
+    """Posição de um bloco no snapshot de um backup: o manifesto do backup, em ordem."""
+    backup = models.ForeignKey(BackupLog, on_delete=models.CASCADE, related_name='blocos_manifesto')
+    ordem = models.PositiveIntegerField()
+    bloco = models.ForeignKey(BlocoBackup, on_delete=models.PROTECT, related_name='referencias')
+
+    class Meta:
+        ordering = ['backup', 'ordem']
+        constraints = [
+            models.UniqueConstraint(fields=['backup', 'ordem'], name='bloco_manifesto_ordem_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.backup_id}[{self.ordem}] -> {self.bloco_id}"
+
+
 class AnexoS3(models.Model):
     ANEXO_TYPE_CHOICES = [
         ('obra', 'Obra'),
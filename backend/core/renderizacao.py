@@ -0,0 +1,119 @@
+"""
+Renderização dos anexos embutidos nos relatórios em PDF.
+
+O módulo não importa o Django: as funções rodam nos processos do pool de
+renderização (core.utils), iniciados com 'spawn', que importam apenas este módulo.
+"""
+import base64
+from io import BytesIO
+
+try:
+    from weasyprint import HTML
+    WEASYPRINT_AVAILABLE = True
+except Exception:
+    WEASYPRINT_AVAILABLE = False
+
+try:
+    from PIL import Image
+    import fitz  # PyMuPDF
+    IMAGE_PROCESSING_AVAILABLE = True
+except ImportError:
+    IMAGE_PROCESSING_AVAILABLE = False
+
+try:
+    import docx
+    import openpyxl
+    OFFICE_PROCESSING_AVAILABLE = True
+except ImportError:
+    OFFICE_PROCESSING_AVAILABLE = False
+
+def docx_to_html(file_content):
+    """
+    Converts the content of a .docx file to a simple HTML string.
+    """
+    if not OFFICE_PROCESSING_AVAILABLE:
+        return "<html><body><p>DOCX processing library not available.</p></body></html>"
+    try:
+        document = docx.Document(BytesIO(file_content))
+        html = "<html><head><style>body { font-family: sans-serif; } table { border-collapse: collapse; width: 100%; } td, th { border: 1px solid #dddddd; text-align: left; padding: 8px; }</style></head><body>"
+        html += "<h1>Documento Word</h1>"
+        for para in document.paragraphs:
+            html += f"<p>{para.text}</p>"
+        for table in document.tables:
+            html += "<table>"
+            for row in table.rows:
+                html += "<tr>"
+                for cell in row.cells:
+                    html += f"<td>{cell.text}</td>"
+                html += "</tr>"
+            html += "</table><br>"
+        html += "</body></html>"
+        return html
+    except Exception as e:
+        return f"<html><body><p>Error converting DOCX: {e}</p></body></html>"
+
+def xlsx_to_html(file_content):
+    """
+    Converts the content of a .xlsx file to an HTML table string.
+    """
+    if not OFFICE_PROCESSING_AVAILABLE:
+        return "<html><body><p>XLSX processing library not available.</p></body></html>"
+    try:
+        workbook = openpyxl.load_workbook(BytesIO(file_content))
+        sheet = workbook.active
+        html = "<html><head><style>body { font-family: sans-serif; } table { border-collapse: collapse; width: 100%; } td, th { border: 1px solid #dddddd; text-align: left; padding: 8px; }</style></head><body>"
+        html += "<h1>Planilha Excel</h1>"
+        html += "<table>"
+        for row in sheet.iter_rows():
+            html += "<tr>"
+            for cell in row:
+                cell_value = cell.value if cell.value is not None else ""
+                html += f"<td>{cell_value}</td>"
+            html += "</tr>"
+        html += "</table>"
+        html += "</body></html>"
+        return html
+    except Exception as e:
+        return f"<html><body><p>Error converting XLSX: {e}</p></body></html>"
+# Parâmetros de renderização dos anexos; fazem parte da chave do cache de derivados
+PDF_RASTER_DPI = 150
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']
+
+
+def render_attachment_base64(file_content, file_extension):
+    """
+    Converte o conteúdo de um anexo na imagem base64 embutida nos relatórios:
+    imagens são reencodadas em JPEG; PDFs (e DOCX/XLSX convertidos para PDF)
+    têm a primeira página rasterizada em PNG.
+    """
+    pdf_bytes_for_conversion = None
+    img_base64 = None
+
+    if file_extension == 'pdf':
+        pdf_bytes_for_conversion = file_content
+    elif file_extension == 'docx' and OFFICE_PROCESSING_AVAILABLE:
+        html_content = docx_to_html(file_content)
+        pdf_bytes_for_conversion = HTML(string=html_content).write_pdf()
+    elif file_extension == 'xlsx' and OFFICE_PROCESSING_AVAILABLE:
+        html_content = xlsx_to_html(file_content)
+        pdf_bytes_for_conversion = HTML(string=html_content).write_pdf()
+    elif file_extension in IMAGE_EXTENSIONS:
+        img = Image.open(BytesIO(file_content))
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+        buffer = BytesIO()
+        img.save(buffer, format='JPEG') # Convert to JPEG for consistency
+        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    else:
+        raise Exception(f"File type '{file_extension}' is not supported for rendering in reports.")
+
+    if pdf_bytes_for_conversion:
+        pdf_doc = fitz.open(stream=pdf_bytes_for_conversion, filetype="pdf")
+        if len(pdf_doc) > 0:
+            page = pdf_doc.load_page(0)
+            pix = page.get_pixmap(dpi=PDF_RASTER_DPI)
+            img_bytes = pix.tobytes("png")
+            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+
+    return img_base64
+
@@ -5,11 +5,18 @@ from ..models import (
     Usuario, Obra, Funcionario, Equipe, Locacao_Obras_Equipes, Material,
     Compra, ItemCompra, Despesa_Extra, Ocorrencia_Funcionario, FotoObra,
     Backup, BackupSettings, AnexoLocacao, AnexoDespesa, ParcelaCompra,
-    AnexoCompra, ArquivoObra, TaskHistory, BackupLog, AnexoS3, BranchManagement
+    AnexoCompra, ArquivoObra, TaskHistory, BackupLog, AnexoS3, BranchManagement,
+    ObraCustoResumo
 )
 
+from ..services.ocupacao import buscar_conflito
+from ..services.miniaturas import tamanhos_miniatura
+from ..utils import IMAGE_EXTENSIONS
+from .service_serializers import SignedUrlListSerializer
+from django.urls import reverse
+
 # Service serializers will be defined below
-from django.db.models import Sum, Q
+from django.db.models import Sum
 from decimal import Decimal
 
 class UsuarioSerializer(serializers.ModelSerializer):
@@ -99,35 +106,27 @@ class ObraSerializer(serializers.ModelSerializer):
             'custo_total_realizado', 'custos_por_categoria'
         ]
 
+    def _get_custo_resumo(self, obj):
+        # Lê o resumo desnormalizado (ObraCustoResumo); se ainda não existir
+        # (obras anteriores à tabela), ele é calculado e gravado uma única vez.
+        try:
+            return obj.custo_resumo
+        except ObraCustoResumo.DoesNotExist:
+            obj.custo_resumo = ObraCustoResumo.recalcular(obj)
+            return obj.custo_resumo
+
     def get_custos_por_categoria(self, obj):
-        # obj is the Obra instance
-        custo_materiais = obj.compras.filter(tipo='COMPRA').aggregate(total=Sum('valor_total_liquido'))['total'] or Decimal('0.00')
-
-        # mao_de_obra: equipe or funcionario_locado is not null
-        custo_mao_de_obra = obj.locacao_obras_equipes_set.filter(
-            Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False)
-        ).aggregate(total=Sum('valor_pagamento'))['total'] or Decimal('0.00')
-
-        # servicos: servico_externo is not null and not empty
-        custo_servicos = obj.locacao_obras_equipes_set.filter(
-            servico_externo__isnull=False
-        ).exclude(
-            servico_externo__exact=''
-        ).aggregate(total=Sum('valor_pagamento'))['total'] or Decimal('0.00')
-
-        custo_despesas_extras = obj.despesas_extras.aggregate(total=Sum('valor'))['total'] or Decimal('0.00')
-
-        return {
-            'materiais': custo_materiais,
-            'mao_de_obra': custo_mao_de_obra,
-            'servicos': custo_servicos,
-            'despesas_extras': custo_despesas_extras
-        }
+        # Quando o queryset vem anotado (ObraCustoResumo.anotar_queryset), usa as
+        # anotações e evita qualquer consulta por linha.
+        if hasattr(obj, 'custo_materiais'):
+            return {
+                categoria: getattr(obj, f'custo_{categoria}')
+                for categoria in ObraCustoResumo.CATEGORIAS
+            }
+        return self._get_custo_resumo(obj).as_dict()
 
     def get_custo_total_realizado(self, obj):
-        # Reuse the calculation from get_custos_por_categoria
-        custos = self.get_custos_por_categoria(obj)
-        return custos['materiais'] + custos['mao_de_obra'] + custos['servicos'] + custos['despesas_extras']
+        return sum(self.get_custos_por_categoria(obj).values(), Decimal('0.00'))
 
 # Novo Serializer Básico para Funcionário
 class FuncionarioBasicSerializer(serializers.ModelSerializer):
@@ -186,14 +185,14 @@ class EquipeComMembrosBasicSerializer(serializers.ModelSerializer):
 class AnexoLocacaoSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnexoLocacao
-        fields = ['id', 'locacao', 'anexo', 'descricao', 'uploaded_at']
-        read_only_fields = ['uploaded_at']
+        fields = ['id', 'locacao', 'anexo', 'descricao', 'uploaded_at', 's3_anexo_id', 's3_url']
+        read_only_fields = ['uploaded_at', 's3_anexo_id', 's3_url']
 
 class AnexoDespesaSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnexoDespesa
-        fields = ['id', 'despesa', 'anexo', 'descricao', 'uploaded_at']
-        read_only_fields = ['uploaded_at']
+        fields = ['id', 'despesa', 'anexo', 'descricao', 'uploaded_at', 's3_anexo_id', 's3_url']
+        read_only_fields = ['uploaded_at', 's3_anexo_id', 's3_url']
 
 class LocacaoObrasEquipesSerializer(serializers.ModelSerializer):
     obra_nome = serializers.CharField(source='obra.nome_obra', read_only=True)
@@ -292,73 +291,74 @@ class LocacaoObrasEquipesSerializer(serializers.ModelSerializer):
              # This case should ideally be caught by field-level validation if 'required=True'
              pass # Or raise error if it's possible to reach here without it.
 
-        if funcionario_locado and data_locacao_inicio:
-            # Query for existing locações for this funcionário
-            conflicting_locacoes_qs = Locacao_Obras_Equipes.objects.filter(
-                funcionario_locado=funcionario_locado
+        # Conflitos são verificados no índice de ocupação (OcupacaoFuncionario), que cobre
+        # tanto funcionários locados individualmente quanto membros de equipes locadas.
+        if (funcionario_locado or equipe) and data_locacao_inicio:
+            if funcionario_locado:
+                funcionario_ids = [funcionario_locado.pk]
+            else:
+                funcionario_ids = list(equipe.membros.values_list('id', flat=True))
+
+            first_conflict = buscar_conflito(
+                funcionario_ids,
+                data_locacao_inicio,
+                data_locacao_fim,
+                excluir_locacao_id=self.instance.pk if self.instance else None
             )
 
-            if self.instance and self.instance.pk:
-                conflicting_locacoes_qs = conflicting_locacoes_qs.exclude(pk=self.instance.pk)
-
-            # Overlap conditions:
-            # An existing locacao conflicts if:
-            # (its start_date <= new_end_date OR new_end_date IS NULL) AND
-            # (its end_date >= new_start_date OR its end_date IS NULL)
-
-            # Determine effective data_locacao_fim for validation, considering model's save() behavior
-            # data_locacao_inicio is from validated_data or instance (it's required)
-            # data_locacao_fim is from validated_data or instance (could be None if not yet processed by model's save)
-
-            effective_data_locacao_fim = data_locacao_fim
-            if effective_data_locacao_fim is None or (data_locacao_inicio and effective_data_locacao_fim < data_locacao_inicio):
-                effective_data_locacao_fim = data_locacao_inicio
-
-            # All existing locações in the DB are assumed to have non-null data_locacao_fim
-            # due to model's save() and previous data migration.
-            # Thus, Q(data_locacao_fim__isnull=True) is no longer needed for existing records.
-            # The new locação (being validated) will also have a non-null data_locacao_fim after save.
-
-            # Simplified overlap condition:
-            # new_start <= existing_end AND new_end >= existing_start
-            if effective_data_locacao_fim: # Should always be true given the logic above
-                q_conditions = Q(data_locacao_inicio__lte=effective_data_locacao_fim) & \
-                               Q(data_locacao_fim__gte=data_locacao_inicio)
-                conflicting_locacoes_qs = conflicting_locacoes_qs.filter(q_conditions)
-            # The case where effective_data_locacao_fim is None should ideally not happen if data_locacao_inicio is present.
-            # If data_locacao_inicio is None (which shouldn't pass field validation), this whole block is skipped.
-
-            if conflicting_locacoes_qs.exists():
-                first_conflict = conflicting_locacoes_qs.first()
+            if first_conflict:
                 obra_conflito = first_conflict.obra.nome_obra if first_conflict.obra else "Obra Desconhecida"
-                msg = (
-                    f"Este funcionário já está locado na obra '{obra_conflito}' "
-                    f"de {first_conflict.data_locacao_inicio.strftime('%d/%m/%Y')} "
-                    f"até {first_conflict.data_locacao_fim.strftime('%d/%m/%Y') if first_conflict.data_locacao_fim else 'data indefinida'}."
-                    " Verifique as datas."
+                periodo = (
+                    f"de {first_conflict.data_inicio.strftime('%d/%m/%Y')} "
+                    f"até {first_conflict.data_fim.strftime('%d/%m/%Y')}."
                 )
+                if funcionario_locado:
+                    error_field = 'funcionario_locado'
+                    msg = f"Este funcionário já está locado na obra '{obra_conflito}' {periodo} Verifique as datas."
+                else:
+                    error_field = 'equipe'
+                    msg = (
+                        f"O membro '{first_conflict.funcionario.nome_completo}' desta equipe já está locado "
+                        f"na obra '{obra_conflito}' {periodo} Verifique as datas."
+                    )
 
-                # Restore the detailed error raising:
                 conflict_data_for_api = {
-                    'funcionario_locado': msg,
+                    error_field: msg,
                     'conflict_details': {
-                        'obra_id': first_conflict.obra.id if first_conflict.obra else None,
+                        'obra_id': first_conflict.obra_id,
                         'obra_nome': obra_conflito,
-                        'locacao_id': first_conflict.id,
-                        'data_inicio': first_conflict.data_locacao_inicio.isoformat(),
-                        'data_fim': first_conflict.data_locacao_fim.isoformat() if first_conflict.data_locacao_fim else None
+                        'locacao_id': first_conflict.locacao_id,
+                        'funcionario_id': first_conflict.funcionario_id,
+                        'funcionario_nome': first_conflict.funcionario.nome_completo,
+                        'data_inicio': first_conflict.data_inicio.isoformat(),
+                        'data_fim': first_conflict.data_fim.isoformat()
                     }
                 }
                 raise serializers.ValidationError(conflict_data_for_api)
         return data
 
 
+def urls_miniaturas(context, url):
+    """URLs das miniaturas (uma por tamanho) servidas pelo endpoint informado."""
+    request = context.get('request')
+    if request:
+        url = request.build_absolute_uri(url)
+    return {tamanho: f"{url}?size={tamanho}" for tamanho in tamanhos_miniatura()}
+
+
 class FotoObraSerializer(serializers.ModelSerializer):
+    miniaturas = serializers.SerializerMethodField()
+
     class Meta:
         model = FotoObra
-        fields = ['id', 'obra', 'imagem', 'descricao', 'uploaded_at']
+        fields = ['id', 'obra', 'imagem', 'miniaturas', 'descricao', 'uploaded_at']
         read_only_fields = ['uploaded_at']
 
+    def get_miniaturas(self, obj):
+        if not obj.imagem:
+            return None
+        return urls_miniaturas(self.context, reverse('fotoobra-miniatura', args=[obj.pk]))
+
     def validate_obra(self, value):
         # The 'value' is the Obra instance itself, as DRF handles the pk-to-instance conversion.
         # The check `Obra.objects.filter(pk=value.id).exists()` is redundant if the instance is already fetched.
@@ -461,11 +461,13 @@ class AnexoCompraSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = AnexoCompra
-        fields = ['id', 'compra', 'arquivo', 'arquivo_url', 'arquivo_nome', 'arquivo_tamanho', 'nome_original', 'tipo_arquivo', 'descricao', 'uploaded_at']
+        fields = ['id', 'compra', 'arquivo', 'arquivo_url', 'arquivo_nome', 'arquivo_tamanho', 'nome_original', 'tipo_arquivo', 'descricao', 'uploaded_at', 's3_anexo_id', 's3_url']
         extra_kwargs = {
             'uploaded_at': {'read_only': True},
             'nome_original': {'read_only': True},
-            'tipo_arquivo': {'read_only': True}
+            'tipo_arquivo': {'read_only': True},
+            's3_anexo_id': {'read_only': True},
+            's3_url': {'read_only': True},
         }
     
     def get_arquivo_url(self, obj):
@@ -482,6 +484,9 @@ class AnexoCompraSerializer(serializers.ModelSerializer):
         return None
     
     def get_arquivo_tamanho(self, obj):
+        # Tamanho gravado no upload: evita consultar o storage a cada linha da listagem
+        if obj.tamanho_arquivo:
+            return obj.tamanho_arquivo
         if obj.arquivo and hasattr(obj.arquivo, 'path'):
             try:
                 if os.path.exists(obj.arquivo.path):
@@ -495,12 +500,13 @@ class ArquivoObraSerializer(serializers.ModelSerializer):
     arquivo_url = serializers.SerializerMethodField()
     arquivo_nome = serializers.SerializerMethodField()
     arquivo_tamanho = serializers.SerializerMethodField()
+    miniaturas = serializers.SerializerMethodField()
     uploaded_by_name = serializers.CharField(source='uploaded_by.nome_completo', read_only=True)
 
     class Meta:
         model = ArquivoObra
         fields = [
-            'id', 'obra', 'arquivo', 'arquivo_url', 'arquivo_nome',
+            'id', 'obra', 'arquivo', 'arquivo_url', 'arquivo_nome', 'miniaturas',
             'arquivo_tamanho', 'nome_original', 'tipo_arquivo', 'categoria',
             'descricao', 'uploaded_at', 'uploaded_by_name', 's3_anexo_id', 's3_url'
         ]
@@ -511,9 +517,26 @@ class ArquivoObraSerializer(serializers.ModelSerializer):
             's3_anexo_id': {'read_only': True},
             's3_url': {'read_only': True},
         }
+        list_serializer_class = SignedUrlListSerializer
+
+    def prefetch_batch(self, arquivos):
+        """Gera as URLs assinadas de todos os arquivos da lista com uma única consulta ao AnexoS3."""
+        s3_service = self.context.get('s3_service')
+        if s3_service and s3_service.s3_available:
+            try:
+                self._signed_urls = s3_service.generate_signed_urls(
+                    [arquivo.s3_anexo_id for arquivo in arquivos if arquivo.s3_anexo_id]
+                )
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.error(f"Erro ao gerar URLs assinadas S3 em lote: {str(e)}")
 
     def get_arquivo_url(self, obj):
         # Priorizar S3 com URL assinada se disponível
+        signed_urls = getattr(self, '_signed_urls', {})
+        if obj.s3_anexo_id and obj.s3_anexo_id in signed_urls:
+            return signed_urls[obj.s3_anexo_id]
         if obj.s3_anexo_id:
             s3_service = self.context.get('s3_service')
             if s3_service and s3_service.s3_available:
@@ -547,6 +570,17 @@ class ArquivoObraSerializer(serializers.ModelSerializer):
         # Fallback final se nenhuma URL puder ser gerada
         return None
     
+    def get_miniaturas(self, obj):
+        # Só imagens têm miniaturas; as do S3 são servidas pelo preview do anexo
+        nome = obj.nome_original or (obj.arquivo.name if obj.arquivo else '')
+        if os.path.splitext(nome)[1].lower().lstrip('.') not in IMAGE_EXTENSIONS:
+            return None
+        if obj.s3_anexo_id:
+            return urls_miniaturas(self.context, reverse('anexo-s3-preview', args=[obj.s3_anexo_id]))
+        if obj.arquivo:
+            return urls_miniaturas(self.context, reverse('arquivoobra-miniatura', args=[obj.pk]))
+        return None
+
     def get_arquivo_nome(self, obj):
         # Usar nome_original se disponível, senão extrair do arquivo
         if obj.nome_original:
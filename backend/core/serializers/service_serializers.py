@@ -50,7 +50,7 @@ class TaskHistorySerializer(serializers.ModelSerializer):
     """
     Serializer para o modelo TaskHistory.
     """
-    created_by_name = serializers.CharField(source='created_by.username', read_only=True)
+    created_by_name = serializers.CharField(source='created_by.login', read_only=True)
     duration_seconds = serializers.SerializerMethodField()
     duration_formatted = serializers.SerializerMethodField()
     
@@ -58,13 +58,13 @@ class TaskHistorySerializer(serializers.ModelSerializer):
         model = TaskHistory
         fields = [
             'id', 'task_id', 'task_type', 'title', 'description', 'status', 'priority',
-            'progress_percentage', 'error_message', 'metadata', 'estimated_duration',
+            'progress_percentage', 'cancel_requested', 'error_message', 'metadata', 'estimated_duration',
             'actual_duration', 'duration_seconds', 'duration_formatted', 'started_at',
             'completed_at', 'created_by', 'created_by_name', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'task_id', 'actual_duration', 'duration_seconds', 'duration_formatted',
-            'started_at', 'completed_at', 'created_by', 'created_at', 'updated_at'
+            'cancel_requested', 'started_at', 'completed_at', 'created_by', 'created_at', 'updated_at'
         ]
     
     def get_duration_seconds(self, obj):
@@ -128,6 +128,19 @@ class TaskHistorySerializer(serializers.ModelSerializer):
         return value
 
 
+class SignedUrlListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer que deixa o serializer filho preparar a página inteira antes
+    de serializar os itens (ex.: gerar as URLs assinadas do S3 em lote), em vez
+    de uma consulta e uma assinatura por linha.
+    """
+
+    def to_representation(self, data):
+        itens = list(data.all() if hasattr(data, 'all') else data)
+        self.child.prefetch_batch(itens)
+        return super().to_representation(itens)
+
+
 class AnexoS3Serializer(serializers.ModelSerializer):
     uploaded_by_name = serializers.CharField(source='uploaded_by.get_full_name', read_only=True)
     file_size_mb = serializers.SerializerMethodField()
@@ -143,6 +156,20 @@ class AnexoS3Serializer(serializers.ModelSerializer):
             'uploaded_by_name', 'download_url', 'is_migrated', 'migration_date', 'metadata'
         ]
         read_only_fields = ['anexo_id', 'nome_s3', 'bucket_name', 's3_key', 's3_url', 'file_hash', 'uploaded_at', 'uploaded_by', 'is_migrated', 'migration_date']
+        list_serializer_class = SignedUrlListSerializer
+    
+    def prefetch_batch(self, anexos):
+        """Gera as URLs de download e busca os nomes das obras da lista de uma vez."""
+        s3_service = self.context.get('s3_service')
+        if s3_service:
+            try:
+                self._signed_urls = s3_service.generate_signed_urls(anexos)
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.error(f"Failed to generate signed URLs in batch: {e}")
+        obra_ids = {anexo.object_id for anexo in anexos if anexo.anexo_type == 'obra' and anexo.object_id}
+        self._obra_nomes = dict(Obra.objects.filter(id__in=obra_ids).values_list('id', 'nome_obra'))
     
     def get_file_size_mb(self, obj):
         """Retorna o tamanho do arquivo em MB."""
@@ -153,6 +180,9 @@ class AnexoS3Serializer(serializers.ModelSerializer):
     def get_related_object_name(self, obj):
         """Retorna o nome do objeto relacionado (ex: nome da obra)."""
         if obj.anexo_type == 'obra' and obj.object_id:
+            obra_nomes = getattr(self, '_obra_nomes', None)
+            if obra_nomes is not None:
+                return obra_nomes.get(obj.object_id, f"Obra ID {obj.object_id} (não encontrada)")
             try:
                 obra = Obra.objects.get(id=obj.object_id)
                 return obra.nome_obra
@@ -163,6 +193,9 @@ class AnexoS3Serializer(serializers.ModelSerializer):
     
     def get_download_url(self, obj):
         """Retorna URL de download temporária (se disponível)."""
+        signed_urls = getattr(self, '_signed_urls', {})
+        if str(obj.anexo_id) in signed_urls:
+            return signed_urls[str(obj.anexo_id)]
         s3_service = self.context.get('s3_service')
         if s3_service:
             try:
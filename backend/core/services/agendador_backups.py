@@ -0,0 +1,94 @@
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional
+from django.conf import settings
+from django.utils import timezone
+import logging
+
+from ..models import BackupLog, BackupSettings
+from .backup_service import BackupService
+
+logger = logging.getLogger(__name__)
+
+
+def _somar_meses(data: date, meses: int) -> date:
+    mes = data.month - 1 + meses
+    ano = data.year + mes // 12
+    mes = mes % 12 + 1
+    return date(ano, mes, min(data.day, calendar.monthrange(ano, mes)[1]))
+
+
+def proxima_data(frequencia: str, ultima: date) -> date:
+    """Primeira data em que o backup agendado pode rodar de novo, pela frequência."""
+    if frequencia == 'daily':
+        return ultima + timedelta(days=1)
+    if frequencia == 'monthly':
+        return _somar_meses(ultima, 1)
+    return ultima + timedelta(days=7)
+
+
+def horario_devido(configuracao: BackupSettings, ultimo: Optional[datetime], agora: datetime) -> Optional[datetime]:
+    """
+    Horário agendado que deve ser executado agora, se houver: o último
+    backup_time já passado, enquanto estiver dentro da janela de
+    BACKUP_SCHEDULE_WINDOW_MINUTES e se a frequência permitir depois do
+    último backup agendado. Fora da janela o backup espera o próximo horário,
+    para não rodar durante o expediente.
+    """
+    agora_local = timezone.localtime(agora)
+    data = agora_local.date()
+    if agora_local.time() < configuracao.backup_time:
+        data -= timedelta(days=1)
+    horario = timezone.make_aware(datetime.combine(data, configuracao.backup_time))
+
+    janela = timedelta(minutes=getattr(settings, 'BACKUP_SCHEDULE_WINDOW_MINUTES', 120))
+    if agora - horario >= janela:
+        return None
+    if ultimo is not None:
+        if data < proxima_data(configuracao.backup_frequency, timezone.localtime(ultimo).date()):
+            return None
+    return horario
+
+
+def executar_backup_agendado(agora: datetime = None) -> Optional[Dict[str, Any]]:
+    """
+    Executa o backup agendado, se devido, e aplica a retenção
+    (max_backups_to_keep). Cada execução fica registrada em um BackupLog com
+    metadata['scheduled_for'], inclusive as que falharem: uma falha não é
+    repetida antes do próximo horário.
+
+    Returns:
+        Resultado do backup (com o da retenção), ou None se não havia backup a executar
+    """
+    agora = agora or timezone.now()
+    configuracao = BackupSettings.atual()
+    if not configuracao.backup_enabled:
+        return None
+
+    anterior = BackupLog.objects.filter(metadata__has_key='scheduled_for').order_by('-created_at', '-id').first()
+    ultimo = datetime.fromisoformat(anterior.metadata['scheduled_for']) if anterior else None
+    horario = horario_devido(configuracao, ultimo, agora)
+    if horario is None:
+        return None
+
+    logger.info(f"Running scheduled backup for {horario.isoformat()}")
+    service = BackupService()
+    result = service.create_backup(
+        backup_type='full',
+        description=f"Backup agendado ({configuracao.get_backup_frequency_display().lower()})",
+        metadata={'scheduled_for': horario.isoformat()}
+    )
+    if not result['success']:
+        logger.error(f"Scheduled backup {result.get('backup_id')} failed: {result.get('error')}")
+        return result
+
+    # Retenção só depois de um backup bem-sucedido
+    retencao = service.prune_backups(configuracao.max_backups_to_keep)
+    backup_log = BackupLog.objects.get(backup_id=result['backup_id'])
+    backup_log.metadata['retention'] = {
+        chave: retencao.get(chave) for chave in ('success', 'deleted_count', 'removed_chunks', 'freed_bytes', 'error')
+        if chave in retencao
+    }
+    backup_log.save(update_fields=['metadata'])
+    result['retention'] = retencao
+    return result
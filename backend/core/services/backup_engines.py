@@ -0,0 +1,525 @@
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import pathlib
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management import call_command
+from django.db import connection, transaction
+import logging
+
+from .rastreio_alteracoes import alteracoes_desde
+
+logger = logging.getLogger(__name__)
+
+# Leitura/escrita dos dumps em blocos
+BACKUP_CHUNK_SIZE = 1024 * 1024
+
+# Registros lidos por consulta ao montar um backup incremental
+BACKUP_INCREMENTAL_LOTE = 500
+
+
+def _abrir_dump(path: str):
+    """Abre um dump para leitura, descomprimindo se for .gz."""
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _fora_de_transacao(operacao: str) -> None:
+    # Com uma transação aberta na conexão do Django, backup_step devolve
+    # SQLITE_BUSY indefinidamente
+    if connection.in_atomic_block:
+        raise RuntimeError(f'O {operacao} online do SQLite não pode ser executado dentro de uma transação')
+
+
+def verificar_cabecalho_sqlite(cabecalho: bytes) -> Optional[int]:
+    """
+    Confere os 100 bytes do cabeçalho de um banco SQLite.
+
+    Returns:
+        Tamanho do arquivo declarado no cabeçalho, ou None se o contador de
+        páginas não for confiável (bancos gravados por versões antigas)
+    """
+    if len(cabecalho) < 100 or not cabecalho.startswith(b'SQLite format 3\x00'):
+        raise ValueError('O arquivo não é um banco SQLite')
+    tamanho_pagina = int.from_bytes(cabecalho[16:18], 'big')
+    if tamanho_pagina == 1:
+        tamanho_pagina = 65536
+    if tamanho_pagina < 512 or tamanho_pagina & (tamanho_pagina - 1):
+        raise ValueError('Cabeçalho SQLite com tamanho de página inválido')
+    paginas = int.from_bytes(cabecalho[28:32], 'big')
+    # O contador de páginas só vale se o "version-valid-for" coincidir com o contador de alterações
+    if paginas and cabecalho[92:96] == cabecalho[24:28]:
+        return paginas * tamanho_pagina
+    return None
+
+
+def verificar_integridade_sqlite(path: str) -> str:
+    """PRAGMA integrity_check em um arquivo SQLite, aberto somente para leitura ('ok' se íntegro)."""
+    conn = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        linhas = [linha[0] for linha in conn.execute('PRAGMA integrity_check').fetchall()]
+    finally:
+        conn.close()
+    return 'ok' if linhas == ['ok'] else '; '.join(linhas[:10])
+
+
+def gravar_snapshot_verificado(blocos: Iterable[bytes], destino: Optional[str],
+                               hash_esperado: Optional[str] = None, comprimido: bool = False) -> Dict[str, Any]:
+    """
+    Grava em destino um snapshot SQLite recebido em blocos (arquivo local, S3 ou
+    repositório), descomprimindo se for gzip, e o confere durante a própria
+    transferência: o SHA256 dos bytes recebidos é calculado bloco a bloco e o
+    cabeçalho do SQLite é validado assim que chega, então um arquivo que não é
+    um banco interrompe o download no início e um snapshot truncado é detectado
+    pelo tamanho declarado no cabeçalho, sem reler o arquivo. Sem destino, só
+    confere (arquivo local que pode ser restaurado no lugar).
+
+    Returns:
+        Dict com path, tamanho e hash dos bytes recebidos
+    """
+    hash_sha256 = hashlib.sha256()
+    descompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if comprimido else None
+    cabecalho = b''
+    tamanho_esperado = None
+    tamanho = 0
+    saida = open(destino, 'wb') if destino else None
+    try:
+        for bloco in blocos:
+            hash_sha256.update(bloco)
+            dados = descompressor.decompress(bloco) if descompressor else bloco
+            if len(cabecalho) < 100:
+                cabecalho += dados[:100 - len(cabecalho)]
+                if len(cabecalho) == 100:
+                    tamanho_esperado = verificar_cabecalho_sqlite(cabecalho)
+            tamanho += len(dados)
+            if saida:
+                saida.write(dados)
+        if descompressor:
+            dados = descompressor.flush()
+            tamanho += len(dados)
+            if saida:
+                saida.write(dados)
+        if saida:
+            saida.close()
+
+        if len(cabecalho) < 100:
+            verificar_cabecalho_sqlite(cabecalho)
+        if hash_esperado and hash_sha256.hexdigest() != hash_esperado:
+            raise ValueError('Hash do backup não confere com o registrado')
+        if tamanho_esperado is not None and tamanho != tamanho_esperado:
+            raise ValueError(f'Snapshot incompleto: {tamanho} bytes, cabeçalho declara {tamanho_esperado}')
+    except Exception:
+        if saida:
+            saida.close()
+            if os.path.exists(destino):
+                os.remove(destino)
+        raise
+    finally:
+        # Interrompe a leitura da origem (ex.: corpo da resposta do S3) se parou no meio
+        if hasattr(blocos, 'close'):
+            blocos.close()
+    return {'path': destino, 'size': tamanho, 'hash': hash_sha256.hexdigest()}
+
+
+class _SaidaComHash:
+    """Arquivo de saída que calcula SHA256 e tamanho do que é gravado."""
+
+    def __init__(self, f):
+        self._f = f
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, dados) -> int:
+        self.hash.update(dados)
+        self.size += len(dados)
+        return self._f.write(dados)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+
+class ArquivoBackup:
+    """
+    Destino de um dump: comprime com gzip enquanto grava e calcula os hashes do
+    conteúdo original e do arquivo gravado, sem segunda leitura.
+
+    O gzip é gravado com mtime=0 e sem nome de arquivo, então o mesmo conteúdo
+    gera sempre os mesmos bytes (e o mesmo hash, usado para detectar duplicatas).
+    """
+
+    def __init__(self, path: str, compress: bool = True):
+        self.path = path
+        self.compress = compress
+        self._arquivo = open(path, 'wb')
+        self._saida = _SaidaComHash(self._arquivo)
+        self._gzip = gzip.GzipFile(
+            filename='', mode='wb', fileobj=self._saida, mtime=0,
+            compresslevel=getattr(settings, 'BACKUP_COMPRESSION_LEVEL', 6)
+        ) if compress else None
+        self.raw_hash = hashlib.sha256()
+        self.raw_size = 0
+
+    def write(self, dados) -> int:
+        self.raw_hash.update(dados)
+        self.raw_size += len(dados)
+        return (self._gzip or self._saida).write(dados)
+
+    def flush(self) -> None:
+        (self._gzip or self._saida).flush()
+
+    def close(self) -> Dict[str, Any]:
+        if self._gzip:
+            self._gzip.close()
+        self._arquivo.close()
+        return {
+            'path': self.path,
+            'file_size': self._saida.size,
+            'file_hash': self._saida.hash.hexdigest(),
+            'raw_size': self.raw_size,
+            'raw_hash': self.raw_hash.hexdigest(),
+            'compression': 'gzip' if self.compress else None,
+        }
+
+    def abort(self) -> None:
+        try:
+            if self._gzip:
+                self._gzip.close()
+            self._arquivo.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class SQLiteBackupEngine:
+    """
+    Snapshot consistente de um banco SQLite pela API de backup online do sqlite3.
+
+    As páginas são copiadas em passos de BACKUP_SQLITE_PAGES_PER_STEP, com uma
+    pausa entre eles para não segurar o lock de leitura; se outra conexão gravar
+    no meio da cópia, o SQLite reinicia o passo e o resultado continua íntegro.
+    A API precisa de um destino com acesso aleatório, então o snapshot vai para
+    um arquivo temporário e é comprimido em seguida, em blocos.
+    """
+
+    name = 'sqlite'
+    format = 'sqlite'
+    extension = '.sqlite'
+
+    def __init__(self):
+        self.pages_per_step = getattr(settings, 'BACKUP_SQLITE_PAGES_PER_STEP', 1024)
+        self.step_sleep = getattr(settings, 'BACKUP_SQLITE_STEP_SLEEP', 0.005)
+
+    def _snapshot(self, destino_path: str) -> None:
+        # Usa a conexão do Django na thread atual (funciona também com bancos em memória)
+        _fora_de_transacao('backup')
+        connection.ensure_connection()
+        destino = sqlite3.connect(destino_path)
+        try:
+            with destino:
+                connection.connection.backup(destino, pages=self.pages_per_step, sleep=self.step_sleep)
+        finally:
+            destino.close()
+
+    def dump(self, path: str, compress: bool = True) -> Dict[str, Any]:
+        """
+        Grava um snapshot do banco em path (path + '.gz' se comprimido).
+
+        Returns:
+            Dict com path, tamanhos e hashes do arquivo gerado
+        """
+        if not compress:
+            self._snapshot(path)
+            integridade = verificar_integridade_sqlite(path)
+            hash_sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b''):
+                    hash_sha256.update(chunk)
+            size = os.path.getsize(path)
+            return {
+                'path': path,
+                'file_size': size,
+                'file_hash': hash_sha256.hexdigest(),
+                'raw_size': size,
+                'raw_hash': hash_sha256.hexdigest(),
+                'compression': None,
+                'integrity_check': integridade,
+            }
+
+        fd, temp_path = tempfile.mkstemp(suffix='.sqlite', dir=os.path.dirname(path) or None)
+        os.close(fd)
+        saida = None
+        try:
+            self._snapshot(temp_path)
+            integridade = verificar_integridade_sqlite(temp_path)
+            saida = ArquivoBackup(f"{path}.gz")
+            with open(temp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b''):
+                    saida.write(chunk)
+            return {**saida.close(), 'integrity_check': integridade}
+        except Exception:
+            if saida:
+                saida.abort()
+            raise
+        finally:
+            os.remove(temp_path)
+
+    def _restaurar_de(self, path: str) -> None:
+        connection.ensure_connection()
+        origem = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            origem.backup(connection.connection)
+        finally:
+            origem.close()
+
+    def restore(self, path: str) -> None:
+        """
+        Restaura um snapshot no banco em uso pela mesma API de backup, no sentido
+        inverso. O destino fica bloqueado até o fim da cópia, então as outras
+        conexões nunca enxergam o banco pela metade (substituir o arquivo deixaria
+        as conexões abertas gravando no arquivo antigo e o -journal/-wal dele
+        seria aplicado sobre o novo). Snapshots sem compressão são lidos no lugar.
+        """
+        _fora_de_transacao('restore')
+        if not path.endswith('.gz'):
+            self._restaurar_de(path)
+            return
+        fd, temp_path = tempfile.mkstemp(suffix='.sqlite', dir=os.path.dirname(path) or None)
+        try:
+            with os.fdopen(fd, 'wb') as destino, _abrir_dump(path) as origem:
+                shutil.copyfileobj(origem, destino, BACKUP_CHUNK_SIZE)
+            self._restaurar_de(temp_path)
+        finally:
+            os.remove(temp_path)
+
+
+class PgDumpBackupEngine:
+    """
+    Dump lógico do PostgreSQL com pg_dump (SQL puro), lido do pipe em blocos e
+    comprimido enquanto é gravado; o dump nunca fica inteiro em memória.
+    """
+
+    name = 'pg_dump'
+    format = 'sql'
+    extension = '.sql'
+
+    def _comando(self, programa: str, *opcoes: str):
+        """Linha de comando e ambiente (senha) para pg_dump/psql no banco configurado."""
+        db = settings.DATABASES['default']
+        env = dict(os.environ)
+        if db.get('PASSWORD'):
+            env['PGPASSWORD'] = str(db['PASSWORD'])
+        comando = [programa, *opcoes, '--dbname', db['NAME']]
+        if db.get('HOST'):
+            comando += ['--host', str(db['HOST'])]
+        if db.get('PORT'):
+            comando += ['--port', str(db['PORT'])]
+        if db.get('USER'):
+            comando += ['--username', str(db['USER'])]
+        return comando, env
+
+    def dump(self, path: str, compress: bool = True) -> Dict[str, Any]:
+        # --clean: o dump remove as tabelas antes de recriá-las, para poder ser
+        # restaurado sobre o banco existente
+        comando, env = self._comando(
+            'pg_dump', '--no-owner', '--no-privileges', '--format=plain', '--clean', '--if-exists'
+        )
+
+        saida = ArquivoBackup(f"{path}.gz" if compress else path, compress=compress)
+        erros = tempfile.TemporaryFile()
+        try:
+            processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=erros, env=env)
+            for chunk in iter(lambda: processo.stdout.read(BACKUP_CHUNK_SIZE), b''):
+                saida.write(chunk)
+            processo.stdout.close()
+            if processo.wait() != 0:
+                erros.seek(0)
+                raise RuntimeError(f"pg_dump falhou: {erros.read().decode(errors='replace').strip()}")
+            return saida.close()
+        except Exception:
+            saida.abort()
+            raise
+        finally:
+            erros.close()
+
+    def restore(self, path: str) -> None:
+        """Aplica o dump com psql em uma única transação, descomprimindo em blocos."""
+        comando, env = self._comando('psql', '--quiet', '--single-transaction', '--set', 'ON_ERROR_STOP=1')
+        erros = tempfile.TemporaryFile()
+        try:
+            processo = subprocess.Popen(comando, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=erros, env=env)
+            try:
+                with _abrir_dump(path) as origem:
+                    shutil.copyfileobj(origem, processo.stdin, BACKUP_CHUNK_SIZE)
+            except BrokenPipeError:
+                # psql encerrou no primeiro erro; a mensagem vem do stderr abaixo
+                pass
+            finally:
+                try:
+                    processo.stdin.close()
+                except BrokenPipeError:
+                    pass
+            if processo.wait() != 0:
+                erros.seek(0)
+                raise RuntimeError(f"psql falhou: {erros.read().decode(errors='replace').strip()}")
+        finally:
+            erros.close()
+
+
+class _SaidaTexto:
+    """
+    Adapta a saída em texto dos serializers (e do stdout do call_command) para o
+    ArquivoBackup. O json.dump escreve token a token, então o texto é acumulado
+    e repassado em blocos.
+    """
+
+    def __init__(self, saida: ArquivoBackup, tamanho_bloco: int = 64 * 1024):
+        self._saida = saida
+        self._tamanho_bloco = tamanho_bloco
+        self._partes = []
+        self._tamanho = 0
+
+    def write(self, texto: str) -> None:
+        self._partes.append(texto)
+        self._tamanho += len(texto)
+        if self._tamanho >= self._tamanho_bloco:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._partes:
+            self._saida.write(''.join(self._partes).encode('utf-8'))
+            self._partes = []
+            self._tamanho = 0
+
+
+class DumpDataBackupEngine:
+    """
+    Dump lógico genérico com dumpdata (JSON), para bancos sem ferramenta nativa.
+    O dumpdata percorre as tabelas com iterator() e escreve objeto a objeto no
+    stream comprimido.
+    """
+
+    name = 'dumpdata'
+    format = 'json'
+    extension = '.json'
+
+    def dump(self, path: str, compress: bool = True) -> Dict[str, Any]:
+        saida = ArquivoBackup(f"{path}.gz" if compress else path, compress=compress)
+        try:
+            texto = _SaidaTexto(saida)
+            call_command('dumpdata', stdout=texto, format='json')
+            texto.flush()
+            return saida.close()
+        except Exception:
+            saida.abort()
+            raise
+
+    def restore(self, path: str) -> None:
+        """Esvazia o banco e carrega o dump (o loaddata lê .json.gz diretamente)."""
+        with transaction.atomic():
+            call_command('flush', interactive=False, verbosity=0)
+            call_command('loaddata', path, verbosity=0)
+
+
+class IncrementalBackupEngine:
+    """
+    Backup incremental: apenas os registros alterados desde o backup anterior da
+    cadeia, em JSON Lines comprimido.
+
+    A primeira linha identifica o incremental; cada linha seguinte é o estado
+    atual de um registro alterado (formato do serializer do Django) ou, se ele
+    não existe mais, {"model", "pk", "removido": true}. Aplicar o arquivo sobre
+    o backup anterior da cadeia reproduz o banco no momento deste backup.
+    """
+
+    name = 'incremental'
+    format = 'jsonl'
+    extension = '.jsonl'
+
+    def __init__(self, desde: datetime, base_backup_id: str):
+        self.desde = desde
+        self.base_backup_id = base_backup_id
+
+    def dump(self, path: str, compress: bool = True) -> Dict[str, Any]:
+        alterados = alteracoes_desde(self.desde)
+        saida = ArquivoBackup(f"{path}.gz" if compress else path, compress=compress)
+        texto = _SaidaTexto(saida)
+        totais = {'changed_rows': 0, 'deleted_rows': 0}
+        try:
+            texto.write(json.dumps({'incremental': {'base': self.base_backup_id, 'desde': self.desde.isoformat()}}) + '\n')
+            for label, pks in sorted(alterados.items()):
+                try:
+                    modelo = apps.get_model(label)
+                except LookupError:
+                    logger.warning(f"Modelo {label} do diário de alterações não existe mais; ignorado")
+                    continue
+                pks = sorted(pks)
+                for inicio in range(0, len(pks), BACKUP_INCREMENTAL_LOTE):
+                    lote = pks[inicio:inicio + BACKUP_INCREMENTAL_LOTE]
+                    objetos = list(modelo._base_manager.filter(pk__in=lote))
+                    serializers.serialize('jsonl', objetos, stream=texto)
+                    existentes = {str(obj.pk) for obj in objetos}
+                    removidos = [pk for pk in lote if pk not in existentes]
+                    for pk in removidos:
+                        texto.write(json.dumps({'model': label, 'pk': pk, 'removido': True}) + '\n')
+                    totais['changed_rows'] += len(objetos)
+                    totais['deleted_rows'] += len(removidos)
+            texto.flush()
+            resultado = saida.close()
+            resultado.update(totais)
+            return resultado
+        except Exception:
+            saida.abort()
+            raise
+
+
+def aplicar_incremental(path: str) -> Dict[str, int]:
+    """
+    Aplica um backup incremental sobre o banco, em uma transação.
+    As chaves estrangeiras são verificadas no commit, então a ordem das linhas
+    não importa.
+
+    Returns:
+        Quantidade de registros gravados e removidos
+    """
+    totais = {'changed_rows': 0, 'deleted_rows': 0}
+    with _abrir_dump(path) as arquivo, transaction.atomic():
+        cabecalho = json.loads(arquivo.readline() or b'{}')
+        if 'incremental' not in cabecalho:
+            raise ValueError('Arquivo não é um backup incremental')
+        for linha in arquivo:
+            if not linha.strip():
+                continue
+            registro = json.loads(linha)
+            if registro.get('removido'):
+                apps.get_model(registro['model'])._base_manager.filter(pk=registro['pk']).delete()
+                totais['deleted_rows'] += 1
+                continue
+            for objeto in serializers.deserialize('python', [registro]):
+                objeto.save()
+                totais['changed_rows'] += 1
+    return totais
+
+
+# Engines de backups completos, pelo nome gravado em BackupLog.metadata['engine']
+BACKUP_ENGINES = {
+    engine.name: engine for engine in (SQLiteBackupEngine, PgDumpBackupEngine, DumpDataBackupEngine)
+}
+
+
+def get_backup_engine(vendor: Optional[str] = None):
+    """Engine de backup adequado ao banco configurado."""
+    vendor = vendor or connection.vendor
+    if vendor == 'sqlite':
+        return SQLiteBackupEngine()
+    if vendor == 'postgresql' and shutil.which('pg_dump'):
+        return PgDumpBackupEngine()
+    return DumpDataBackupEngine()
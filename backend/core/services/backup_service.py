@@ -3,17 +3,26 @@ import hashlib
 import uuid
 import sqlite3
 import tempfile
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from django.conf import settings
+from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
-from django.core.management import call_command
-from django.db import connection
+from django.db import transaction
 import logging
 
-from ..models import BackupLog, TaskHistory
+from ..models import BackupLog, BackupSettings, TaskHistory, BlocoBackup, BlocoManifesto, Usuario, AnexoS3
+from ..utils import iter_file_chunks
 from .s3_service import S3Service
+from .backup_engines import (
+    BACKUP_ENGINES, BACKUP_CHUNK_SIZE, SQLiteBackupEngine, get_backup_engine, IncrementalBackupEngine,
+    aplicar_incremental, gravar_snapshot_verificado, verificar_integridade_sqlite,
+)
+from .executor_tarefas import registrar_tarefa, executar_tarefa
+from .rastreio_alteracoes import limpar_registros_ate, reconstruir_derivados
+from .repositorio_backups import RepositorioBackups
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +36,7 @@ class BackupService:
     def __init__(self):
         self.s3_service = S3Service()
         self.backup_dir = getattr(settings, 'BACKUP_DIR', '/tmp/backups')
+        self.repositorio = RepositorioBackups(self.s3_service)
         
         # Cria diretório de backup se não existir
         os.makedirs(self.backup_dir, exist_ok=True)
@@ -91,69 +101,210 @@ class BackupService:
                 'error': f"Error validating file: {str(e)}"
             }
     
-    def create_backup(self, 
-                     backup_type: str = 'manual',
-                     user_id: int = None,
-                     description: str = '') -> Dict[str, Any]:
+    def _margem_incremental(self) -> timedelta:
         """
-        Cria um backup do banco de dados atual.
-        
-        Args:
-            backup_type: Tipo do backup (manual, full, incremental)
-            user_id: ID do usuário que solicitou o backup
-            description: Descrição do backup
-        
-        Returns:
-            Dict com resultado da operação
+        Sobreposição entre backups consecutivos da cadeia: cobre transações que
+        começaram antes do backup anterior e só foram confirmadas depois dele.
+        Reaplicar um registro já presente não tem efeito.
+        """
+        return timedelta(seconds=getattr(settings, 'BACKUP_INCREMENTAL_OVERLAP_SECONDS', 300))
+
+    def _ultimo_backup_cadeia(self) -> Optional[Tuple[BackupLog, BackupLog]]:
         """
+        Backup anterior da cadeia atual e o backup completo que a inicia.
+        Incrementais sempre encadeiam no backup completo mais recente, criado
+        depois da última restauração: a restauração volta o banco (e o diário
+        de alterações) sem registrar o que mudou, então uma cadeia anterior a
+        ela não corresponde mais ao banco.
+        """
+        concluidos = BackupLog.objects.filter(status='completed', metadata__has_key='snapshot_at')
+        ultima_restauracao = BackupSettings.objects.filter(pk=1).values_list('last_restore_at', flat=True).first()
+        if ultima_restauracao:
+            concluidos = concluidos.filter(created_at__gt=ultima_restauracao)
+        base = concluidos.exclude(backup_type='incremental').order_by('-created_at', '-id').first()
+        if not base:
+            return None
+        anterior = concluidos.filter(
+            backup_type='incremental', metadata__base_backup_id=base.backup_id
+        ).order_by('-created_at', '-id').first()
+        return anterior or base, base
+
+    def _create_backup_records(self, backup_type: str, user_id: int, description: str, status: str,
+                               metadata: Optional[Dict[str, Any]] = None):
+        """Cria o BackupLog e a tarefa de histórico de um backup gerado pelo sistema."""
         backup_id = self._generate_backup_id()
-        
+        task_id = f"backup_{backup_id}_{uuid.uuid4().hex[:8]}"
+
         # Cria registro de log do backup
         backup_log = BackupLog.objects.create(
             backup_id=backup_id,
             backup_type=backup_type,
-            status='in_progress',
+            status=status,
             created_by_id=user_id,
             metadata={
                 'description': description,
-                'created_at': timezone.now().isoformat()
+                'created_at': timezone.now().isoformat(),
+                'task_id': task_id,
+                **(metadata or {})
             }
         )
-        
+
         # Cria tarefa de histórico
         task = TaskHistory.objects.create(
-            task_id=f"backup_{backup_id}_{uuid.uuid4().hex[:8]}",
+            task_id=task_id,
             task_type='backup',
             title=f"Backup {backup_type.title()}",
             description=f"Criando backup do tipo {backup_type}: {description}",
-            status='in_progress',
+            status=status,
+            priority='high',
             created_by_id=user_id,
             metadata={
                 'backup_id': backup_id,
-                'backup_type': backup_type
+                'backup_type': backup_type,
+                # Pendente: fica na fila do executor de tarefas
+                **({'handler': 'backup', 'params': {'backup_id': backup_id}} if status == 'pending' else {})
             }
         )
+        return backup_log, task
+
+    def create_backup(self, 
+                     backup_type: str = 'manual',
+                     user_id: int = None,
+                     description: str = '',
+                     metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Cria um backup do banco de dados atual, na própria chamada.
         
+        Args:
+            backup_type: Tipo do backup (manual, full, incremental)
+            user_id: ID do usuário que solicitou o backup (vazio nos agendados)
+            description: Descrição do backup
+            metadata: Dados adicionais gravados no BackupLog
+        
+        Returns:
+            Dict com resultado da operação
+        """
+        backup_log, task = self._create_backup_records(backup_type, user_id, description, 'in_progress', metadata)
+        return self._execute_backup(backup_log, task)
+
+    def submit_backup(self,
+                      backup_type: str = 'manual',
+                      user_id: int = None,
+                      description: str = '') -> Dict[str, Any]:
+        """
+        Registra um backup na fila do executor de tarefas (manage.py
+        executar_tarefas), sem bloquear a requisição. Com BACKUP_SYNC=True o
+        backup roda na própria chamada.
+        
+        Returns:
+            Dict com o backup_id e o task_id para acompanhamento
+        """
         try:
-            # Gera nome do arquivo de backup
-            backup_filename = f"{backup_id}.sqlite"
-            backup_path = os.path.join(self.backup_dir, backup_filename)
-            
-            # Cria backup usando Django
-            if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
-                # Para SQLite, copia o arquivo diretamente
-                db_path = settings.DATABASES['default']['NAME']
-                import shutil
-                shutil.copy2(db_path, backup_path)
-            else:
-                # Para outros bancos, usa dumpdata
-                with open(backup_path.replace('.sqlite', '.json'), 'w') as f:
-                    call_command('dumpdata', stdout=f, indent=2)
-                backup_path = backup_path.replace('.sqlite', '.json')
-            
-            # Calcula hash do arquivo
-            file_hash = self._calculate_file_hash(backup_path)
-            file_size = os.path.getsize(backup_path)
+            backup_log, task = self._create_backup_records(backup_type, user_id, description, 'pending')
+        except Exception as e:
+            logger.error(f"Error submitting backup: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+        if getattr(settings, 'BACKUP_SYNC', False):
+            result = self.run_backup(backup_log.backup_id)
+            result['task_id'] = task.task_id
+            return result
+
+        logger.info(f"Backup {backup_log.backup_id} queued")
+        return {
+            'success': True,
+            'backup_id': backup_log.backup_id,
+            'task_id': task.task_id,
+            'status': 'pending'
+        }
+
+    def run_backup(self, backup_id: str) -> Dict[str, Any]:
+        """
+        Executa um backup registrado por submit_backup.
+        
+        Returns:
+            Dict com resultado da operação
+        """
+        try:
+            backup_log = BackupLog.objects.get(backup_id=backup_id)
+            task = TaskHistory.objects.get(task_id=backup_log.metadata.get('task_id'))
+        except (BackupLog.DoesNotExist, TaskHistory.DoesNotExist):
+            return {'success': False, 'backup_id': backup_id, 'error': 'Backup not found'}
+
+        if backup_log.status != 'pending':
+            return {'success': False, 'backup_id': backup_id, 'error': f'Cannot run backup with status: {backup_log.status}'}
+
+        backup_log.status = 'in_progress'
+        backup_log.save(update_fields=['status'])
+        task.status = 'in_progress'
+        task.started_at = timezone.now()
+        task.save(update_fields=['status', 'started_at', 'updated_at'])
+        return self._execute_backup(backup_log, task)
+
+    def _execute_backup(self, backup_log: BackupLog, task: TaskHistory) -> Dict[str, Any]:
+        """Gera o dump, verifica duplicatas, envia ao S3 e atualiza os registros."""
+        backup_id = backup_log.backup_id
+        backup_type = backup_log.backup_type
+        user_id = backup_log.created_by_id
+        description = backup_log.metadata.get('description', '')
+        dump_temporario = None
+
+        try:
+            # Instante de referência do backup: o próximo incremental da cadeia
+            # captura o que foi alterado a partir dele
+            snapshot_at = timezone.now()
+            engine = None
+            if backup_type == 'incremental':
+                cadeia = self._ultimo_backup_cadeia()
+                if cadeia:
+                    anterior, base = cadeia
+                    desde = datetime.fromisoformat(anterior.metadata['snapshot_at']) - self._margem_incremental()
+                    engine = IncrementalBackupEngine(desde, base.backup_id)
+                    backup_log.metadata.update({
+                        'base_backup_id': base.backup_id,
+                        'parent_backup_id': anterior.backup_id,
+                        'changes_since': desde.isoformat()
+                    })
+                else:
+                    # Sem backup completo para encadear: este vira a base da cadeia
+                    logger.info(f"Backup {backup_id}: no full backup to chain to, creating a full backup")
+                    backup_log.backup_type = backup_type = 'full'
+            if engine is None:
+                # Snapshot online (SQLite) ou dump lógico (PostgreSQL), já comprimido
+                engine = get_backup_engine()
+
+            # Backups completos vão para o repositório deduplicado, que divide o
+            # dump sem compressão em blocos e comprime cada bloco novo
+            usar_repositorio = backup_type != 'incremental' and getattr(settings, 'BACKUP_REPOSITORY', True)
+            dump = engine.dump(
+                os.path.join(self.backup_dir, f"{backup_id}{engine.extension}"), compress=not usar_repositorio
+            )
+            backup_path = dump['path']
+            if usar_repositorio:
+                dump_temporario = backup_path
+            file_hash = dump['file_hash']
+            file_size = dump['file_size']
+            backup_log.metadata.update({
+                'engine': engine.name,
+                'format': engine.format,
+                'compression': dump['compression'],
+                'raw_size': dump['raw_size'],
+                'raw_hash': dump['raw_hash'],
+                'snapshot_at': snapshot_at.isoformat()
+            })
+            if 'integrity_check' in dump:
+                backup_log.metadata['integrity_check'] = dump['integrity_check']
+                if dump['integrity_check'] != 'ok':
+                    os.remove(backup_path)
+                    raise ValueError(f"Snapshot failed integrity check: {dump['integrity_check']}")
+            if backup_type == 'incremental':
+                backup_log.metadata.update({
+                    'changed_rows': dump['changed_rows'],
+                    'deleted_rows': dump['deleted_rows']
+                })
             
             # Verifica se já existe backup com mesmo hash
             existing_backup = BackupLog.objects.filter(
@@ -193,26 +344,21 @@ class BackupService:
                     'message': 'Backup is duplicate of existing backup'
                 }
             
-            # Upload para S3 se disponível
             s3_result = None
-            if self.s3_service.s3_available:
+            if usar_repositorio:
+                # Só os blocos que nenhum backup anterior gravou são enviados
+                repositorio = self.repositorio.armazenar(backup_log, backup_path)
+                os.remove(backup_path)
+                backup_path = ''
+                backup_log.metadata['repository'] = {
+                    chave: repositorio[chave] for chave in ('storage', 'chunks', 'new_chunks', 'stored_bytes')
+                }
+            elif self.s3_service.s3_available:
+                # Upload para S3 se disponível
                 with open(backup_path, 'rb') as f:
-                    # Cria um objeto similar ao UploadedFile
-                    class BackupFile:
-                        def __init__(self, file_path, content):
-                            self.name = os.path.basename(file_path)
-                            self.content_type = 'application/x-sqlite3'
-                            self._content = content
-                            self._size = len(content)
-                        
-                        def read(self):
-                            return self._content
-                        
-                        def seek(self, pos):
-                            pass
-                    
-                    file_content = f.read()
-                    backup_file = BackupFile(backup_path, file_content)
+                    # O arquivo é enviado em partes, sem ser carregado em memória
+                    backup_file = File(f, name=os.path.basename(backup_path))
+                    backup_file.content_type = 'application/gzip' if dump['compression'] else 'application/octet-stream'
                     
                     s3_result = self.s3_service.upload_file(
                         file=backup_file,
@@ -222,8 +368,10 @@ class BackupService:
                         metadata={
                             'backup_id': backup_id,
                             'backup_type': backup_type,
-                            'description': description
-                        }
+                            'description': description,
+                            'engine': engine.name
+                        },
+                        file_hash=file_hash
                     )
             
             # Atualiza registro do backup
@@ -248,10 +396,17 @@ class BackupService:
             task.metadata.update({
                 'file_size': file_size,
                 'file_hash': file_hash,
+                'engine': engine.name,
+                'repository': backup_log.metadata.get('repository'),
                 's3_uploaded': s3_result.get('success', False) if s3_result else False
             })
             task.save()
             
+            # Alterações anteriores a um backup completo não são mais necessárias
+            # para os incrementais (que sempre encadeiam no completo mais recente)
+            if backup_type != 'incremental':
+                limpar_registros_ate(snapshot_at - self._margem_incremental())
+            
             # Remove arquivo local se foi enviado para S3
             if s3_result and s3_result.get('success'):
                 os.remove(backup_path)
@@ -264,10 +419,15 @@ class BackupService:
                 'duplicate': False,
                 'file_size': file_size,
                 'file_hash': file_hash,
+                'engine': engine.name,
+                'repository': backup_log.metadata.get('repository'),
                 's3_uploaded': s3_result.get('success', False) if s3_result else False
             }
             
         except Exception as e:
+            if dump_temporario and os.path.exists(dump_temporario):
+                os.remove(dump_temporario)
+            
             # Atualiza registros com erro
             backup_log.status = 'failed'
             backup_log.error_message = str(e)
@@ -337,8 +497,8 @@ class BackupService:
                 for chunk in backup_file.chunks():
                     temp_file.write(chunk)
             
-            # Valida se é um arquivo SQLite válido
-            validation = self._validate_sqlite_file(temp_path)
+            # Valida se é um arquivo SQLite válido e íntegro
+            validation = self.verificar_snapshot_sqlite(temp_path)
             
             if not validation['valid']:
                 os.remove(temp_path)
@@ -418,7 +578,8 @@ class BackupService:
                         'backup_id': backup_id,
                         'description': description,
                         'validation': validation
-                    }
+                    },
+                    file_hash=file_hash
                 )
             
             # Atualiza registro do backup
@@ -428,7 +589,12 @@ class BackupService:
             backup_log.file_hash = file_hash
             backup_log.completed_at = timezone.now()
             backup_log.metadata.update({
-                'validation': validation
+                'validation': validation,
+                # Restaurável como um snapshot do SQLite, já verificado
+                'engine': SQLiteBackupEngine.name,
+                'format': SQLiteBackupEngine.format,
+                'compression': None,
+                'integrity_check': validation['integrity_check']
             })
             
             if s3_result and s3_result.get('success'):
@@ -583,4 +749,387 @@ class BackupService:
             return {
                 'success': False,
                 'error': str(e)
-            }
\ No newline at end of file
+            }
+    
+    def _cadeia_restauracao(self, backup: BackupLog) -> List[BackupLog]:
+        """Backups a aplicar para restaurar um backup: o completo e os incrementais até ele."""
+        cadeia = [backup]
+        while cadeia[-1].backup_type == 'incremental':
+            parent_id = cadeia[-1].metadata.get('parent_backup_id')
+            parent = BackupLog.objects.filter(backup_id=parent_id, status='completed').first()
+            if not parent:
+                raise ValueError(f"Backup {parent_id} da cadeia de {backup.backup_id} não encontrado")
+            cadeia.append(parent)
+        return list(reversed(cadeia))
+    
+    def _blocos_backup(self, origem: BackupLog) -> Tuple[Iterator[bytes], Optional[str]]:
+        """
+        Conteúdo de um backup em blocos, do repositório, do disco ou do S3, e o
+        hash esperado desses bytes (o repositório confere os próprios hashes).
+        """
+        repositorio = origem.metadata.get('repository')
+        if repositorio:
+            return self.repositorio.ler_snapshot(origem.backup_id, repositorio['storage']), None
+        if origem.file_path and os.path.exists(origem.file_path):
+            return iter_file_chunks(open(origem.file_path, 'rb'), chunk_size=BACKUP_CHUNK_SIZE), origem.file_hash
+        
+        anexo_id = origem.metadata.get('s3_anexo_id')
+        if not anexo_id:
+            raise FileNotFoundError(f"Arquivo do backup {origem.backup_id} não encontrado")
+        result = self.s3_service.open_stream(anexo_id)
+        if not result['success']:
+            raise FileNotFoundError(result['error'])
+        return result['stream'], origem.file_hash
+    
+    def _arquivo_backup(self, backup: BackupLog) -> Tuple[str, bool]:
+        """
+        Caminho local do arquivo de um backup, verificado. Backups no S3 ou no
+        repositório são transferidos em blocos para um arquivo temporário,
+        conferindo o hash durante a transferência; snapshots SQLite chegam já
+        descomprimidos e com o cabeçalho validado.
+        
+        Returns:
+            (caminho, temporário): arquivos baixados devem ser removidos após o uso
+        """
+        origem = backup.original_backup if backup.is_duplicate and backup.original_backup else backup
+        repositorio = origem.metadata.get('repository')
+        local = not repositorio and bool(origem.file_path) and os.path.exists(origem.file_path)
+        blocos, hash_esperado = self._blocos_backup(origem)
+        
+        if origem.metadata.get('engine') == 'sqlite':
+            comprimido = origem.metadata.get('compression') == 'gzip'
+            if local and not comprimido:
+                # Conferido no lugar e restaurado direto do arquivo
+                gravar_snapshot_verificado(blocos, None, hash_esperado)
+                return origem.file_path, False
+            temp_path = os.path.join(self.backup_dir, f"restore_{origem.backup_id}.sqlite")
+            gravar_snapshot_verificado(blocos, temp_path, hash_esperado, comprimido=comprimido)
+            return temp_path, True
+        
+        if local:
+            blocos.close()
+            return origem.file_path, False
+        
+        nome = f"{origem.backup_id}{BACKUP_ENGINES[origem.metadata['engine']].extension}" if repositorio \
+            else os.path.basename(origem.file_path) or origem.backup_id
+        temp_path = os.path.join(self.backup_dir, f"restore_{nome}")
+        hash_sha256 = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in blocos:
+                    hash_sha256.update(chunk)
+                    f.write(chunk)
+            if hash_esperado and hash_sha256.hexdigest() != hash_esperado:
+                raise ValueError(f"Hash do backup {origem.backup_id} não confere com o registrado")
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return temp_path, True
+    
+    def verificar_snapshot_sqlite(self, file_path: str, integridade_verificada: bool = False) -> Dict[str, Any]:
+        """
+        Valida um snapshot SQLite antes de restaurá-lo: estrutura
+        (_validate_sqlite_file) e, se o snapshot não foi verificado ao ser
+        gerado, PRAGMA integrity_check. Snapshots gerados pelo serviço passam
+        pelo integrity_check no worker de backups e, com o hash conferido na
+        transferência, não precisam repeti-lo.
+        
+        Returns:
+            Dict com o resultado da validação
+        """
+        validation = self._validate_sqlite_file(file_path)
+        if validation['valid'] and not integridade_verificada:
+            integridade = verificar_integridade_sqlite(file_path)
+            validation['integrity_check'] = integridade
+            if integridade != 'ok':
+                return {
+                    'valid': False,
+                    'error': f"Integrity check failed: {integridade}"
+                }
+        return validation
+    
+    def _registros_backup(self) -> Dict[Any, List[Dict[str, Any]]]:
+        """
+        Registros dos backups, dos seus arquivos no S3, do repositório de blocos
+        e do histórico de tarefas, antes de uma restauração.
+        """
+        registros = {modelo: list(modelo.objects.values()) for modelo in (BackupLog, BlocoBackup, BlocoManifesto, TaskHistory)}
+        registros[AnexoS3] = list(AnexoS3.objects.filter(anexo_type='backup').values())
+        return registros
+    
+    def _recolocar_registros_backup(self, registros: Dict[Any, List[Dict[str, Any]]]) -> None:
+        """
+        Recoloca os registros de backup após restaurar um snapshot, que traz as
+        tabelas como estavam no momento dele: sem isso, backups posteriores
+        sumiriam (com os registros dos seus arquivos no S3) e o índice do
+        repositório apontaria para blocos já coletados. Backups de usuários que
+        não existem no snapshot restaurado são descartados. O histórico de
+        tarefas também é mantido: inclui a tarefa da própria restauração e as
+        que outros workers estão executando.
+        """
+        usuarios = set(Usuario.objects.values_list('pk', flat=True))
+        usuarios.add(None)
+        backups = [registro for registro in registros[BackupLog] if registro['created_by_id'] in usuarios]
+        ids = {registro['id'] for registro in backups}
+        for registro in backups:
+            if registro['original_backup_id'] not in ids:
+                registro['original_backup_id'] = None
+        
+        with transaction.atomic():
+            BlocoManifesto.objects.all().delete()
+            BlocoBackup.objects.all().delete()
+            BackupLog.objects.all().delete()
+            BackupLog.objects.bulk_create([BackupLog(**registro) for registro in backups], batch_size=500)
+            # created_at tem auto_now_add, ignorado no insert
+            for registro in backups:
+                BackupLog.objects.filter(pk=registro['id']).update(created_at=registro['created_at'])
+            
+            anexos = [registro for registro in registros[AnexoS3] if registro['uploaded_by_id'] in usuarios]
+            AnexoS3.objects.filter(anexo_type='backup').delete()
+            AnexoS3.objects.bulk_create([AnexoS3(**registro) for registro in anexos], batch_size=500)
+            for registro in anexos:
+                AnexoS3.objects.filter(pk=registro['id']).update(uploaded_at=registro['uploaded_at'])
+            BlocoBackup.objects.bulk_create([BlocoBackup(**registro) for registro in registros[BlocoBackup]], batch_size=500)
+            BlocoManifesto.objects.bulk_create(
+                [BlocoManifesto(**registro) for registro in registros[BlocoManifesto] if registro['backup_id'] in ids],
+                batch_size=500
+            )
+            
+            # Tarefas de usuários ausentes no snapshot ficam sem usuário
+            tarefas = []
+            for registro in registros[TaskHistory]:
+                if registro['created_by_id'] not in usuarios:
+                    registro['created_by_id'] = None
+                if registro['assigned_to_id'] not in usuarios:
+                    registro['assigned_to_id'] = None
+                tarefas.append(TaskHistory(**registro))
+            TaskHistory.objects.all().delete()
+            TaskHistory.objects.bulk_create(tarefas, batch_size=500)
+            # created_at e updated_at são preenchidos no insert; o bulk_update grava os originais
+            for tarefa, registro in zip(tarefas, registros[TaskHistory]):
+                tarefa.created_at = registro['created_at']
+                tarefa.updated_at = registro['updated_at']
+            TaskHistory.objects.bulk_update(tarefas, ['created_at', 'updated_at'], batch_size=500)
+    
+    def registrar_restauracao(self) -> None:
+        """Marca a restauração do banco: o próximo backup começa uma nova cadeia."""
+        BackupSettings.atual()
+        BackupSettings.objects.filter(pk=1).update(last_restore_at=timezone.now())
+    
+    def submit_restore(self, backup_id: str, user_id: int = None) -> Dict[str, Any]:
+        """
+        Registra a restauração de um backup na fila do executor de tarefas: a
+        transferência e a aplicação da cadeia não cabem no tempo de uma
+        requisição. Com BACKUP_SYNC=True a restauração roda na própria chamada.
+        
+        Returns:
+            Dict com o backup_id e o task_id para acompanhamento
+        """
+        try:
+            backup = BackupLog.objects.get(backup_id=backup_id)
+        except BackupLog.DoesNotExist:
+            return {
+                'success': False,
+                'error': 'Backup not found'
+            }
+        if backup.status != 'completed':
+            return {
+                'success': False,
+                'error': f'Cannot restore backup with status: {backup.status}'
+            }
+        
+        task = TaskHistory.objects.create(
+            task_id=f"restore_{backup_id}_{uuid.uuid4().hex[:8]}",
+            task_type='backup',
+            title=f"Restauração do backup {backup_id}",
+            description=f"Restaurando o banco a partir do backup {backup_id}",
+            priority='critical',
+            created_by_id=user_id,
+            metadata={
+                'backup_id': backup_id,
+                'handler': 'restauracao_backup',
+                'params': {'backup_id': backup_id},
+            }
+        )
+        
+        if getattr(settings, 'BACKUP_SYNC', False):
+            TaskHistory.objects.filter(pk=task.pk).update(status='in_progress', started_at=timezone.now())
+            task.refresh_from_db()
+            result = executar_tarefa(task)
+            result['task_id'] = task.task_id
+            return result
+        
+        logger.info(f"Restore of backup {backup_id} queued")
+        return {
+            'success': True,
+            'backup_id': backup_id,
+            'task_id': task.task_id,
+            'status': 'pending'
+        }
+    
+    def restore_backup(self, backup_id: str) -> Dict[str, Any]:
+        """
+        Restaura o banco a partir de um backup. Para um incremental, restaura o
+        backup completo da cadeia e aplica os incrementais em ordem; as tabelas
+        derivadas (resumos, custos diários, ocupações) são reconstruídas ao final.
+        
+        Args:
+            backup_id: ID do backup
+        
+        Returns:
+            Dict com resultado da operação
+        """
+        try:
+            backup = BackupLog.objects.get(backup_id=backup_id)
+        except BackupLog.DoesNotExist:
+            return {
+                'success': False,
+                'error': 'Backup not found'
+            }
+        if backup.status != 'completed':
+            return {
+                'success': False,
+                'error': f'Cannot restore backup with status: {backup.status}'
+            }
+        
+        temporarios = []
+        try:
+            cadeia = self._cadeia_restauracao(backup)
+            engine_cls = BACKUP_ENGINES.get(cadeia[0].metadata.get('engine'))
+            if engine_cls is None:
+                raise ValueError(f"Backup {cadeia[0].backup_id} não pode ser restaurado por este serviço")
+            
+            # Arquivos resolvidos antes de restaurar: o backup completo substitui
+            # também os registros de BackupLog. Hash e cabeçalho do snapshot são
+            # conferidos durante a transferência; a validação da estrutura precisa
+            # do arquivo inteiro e roda em paralelo com a transferência dos incrementais
+            arquivos = []
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                verificacao = None
+                for item in cadeia:
+                    path, temporario = self._arquivo_backup(item)
+                    arquivos.append(path)
+                    if temporario:
+                        temporarios.append(path)
+                    if verificacao is None and engine_cls is SQLiteBackupEngine:
+                        origem = item.original_backup if item.is_duplicate and item.original_backup else item
+                        verificacao = executor.submit(
+                            self.verificar_snapshot_sqlite, path, origem.metadata.get('integrity_check') == 'ok'
+                        )
+                validation = verificacao.result() if verificacao else {'valid': True}
+            if not validation['valid']:
+                raise ValueError(f"Backup {cadeia[0].backup_id} inválido: {validation['error']}")
+            
+            registros = self._registros_backup()
+            engine_cls().restore(arquivos[0])
+            self._recolocar_registros_backup(registros)
+            totais = {'changed_rows': 0, 'deleted_rows': 0}
+            for path in arquivos[1:]:
+                for chave, valor in aplicar_incremental(path).items():
+                    totais[chave] += valor
+            if len(arquivos) > 1:
+                reconstruir_derivados()
+            
+            self.registrar_restauracao()
+            logger.info(f"Backup {backup_id} restored ({len(cadeia)} backups in chain)")
+            return {
+                'success': True,
+                'backup_id': backup_id,
+                'chain': [item.backup_id for item in cadeia],
+                'changed_rows': totais['changed_rows'],
+                'deleted_rows': totais['deleted_rows']
+            }
+            
+        except Exception as e:
+            logger.error(f"Error restoring backup {backup_id}: {str(e)}")
+            return {
+                'success': False,
+                'backup_id': backup_id,
+                'error': str(e)
+            }
+        finally:
+            for path in temporarios:
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def delete_backups(self, backup_ids: List[str]) -> Dict[str, Any]:
+        """
+        Exclui backups: arquivos locais, objetos no S3 (em lote), manifestos e
+        registros. Em seguida, coleta os blocos do repositório que ficaram sem
+        referência.
+        
+        Args:
+            backup_ids: IDs dos backups
+        
+        Returns:
+            Dict com o número de backups excluídos e o resultado da coleta
+        """
+        try:
+            backups = list(BackupLog.objects.filter(backup_id__in=backup_ids))
+            for backup in backups:
+                if backup.file_path and os.path.exists(backup.file_path):
+                    os.remove(backup.file_path)
+            
+            anexo_ids = [backup.metadata['s3_anexo_id'] for backup in backups if backup.metadata.get('s3_anexo_id')]
+            if anexo_ids:
+                result = self.s3_service.delete_files(anexo_ids)
+                if not result['success']:
+                    logger.warning(f"Some backup files could not be removed from S3: {result.get('failed') or result.get('error')}")
+            
+            self.repositorio.remover_manifestos(backups)
+            BackupLog.objects.filter(pk__in=[backup.pk for backup in backups]).delete()
+            coleta = self.repositorio.coletar_lixo()
+            
+            logger.info(f"Deleted {len(backups)} backups")
+            return {
+                'success': True,
+                'deleted_count': len(backups),
+                'removed_chunks': coleta['removed_chunks'],
+                'freed_bytes': coleta['freed_bytes']
+            }
+            
+        except Exception as e:
+            logger.error(f"Error deleting backups: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def prune_backups(self, max_backups: int) -> Dict[str, Any]:
+        """
+        Retenção: mantém os `max_backups` backups completos mais recentes com os
+        seus incrementais e exclui os anteriores. Originais de duplicatas mantidas
+        não são excluídos.
+        
+        Args:
+            max_backups: Número de backups completos a manter
+        
+        Returns:
+            Dict com o resultado de delete_backups
+        """
+        completos = BackupLog.objects.filter(status='completed').exclude(backup_type='incremental')
+        mantidos = list(completos.order_by('-created_at', '-id').values_list('created_at', flat=True)[:max_backups])
+        if max_backups < 1 or len(mantidos) < max_backups:
+            return {'success': True, 'deleted_count': 0, 'removed_chunks': 0, 'freed_bytes': 0}
+        
+        limite = mantidos[-1]
+        originais = BackupLog.objects.filter(
+            created_at__gte=limite, original_backup__isnull=False
+        ).values_list('original_backup_id', flat=True)
+        antigos = BackupLog.objects.filter(
+            created_at__lt=limite, status__in=['completed', 'failed']
+        ).exclude(pk__in=list(originais))
+        return self.delete_backups(list(antigos.values_list('backup_id', flat=True)))
+
+
+@registrar_tarefa('backup', exclusiva=True)
+def executar_backup(contexto, backup_id: str) -> Dict[str, Any]:
+    """Tarefa do executor: roda um backup registrado por submit_backup, um por vez."""
+    return BackupService().run_backup(backup_id)
+
+
+@registrar_tarefa('restauracao_backup', exclusiva=True)
+def executar_restauracao(contexto, backup_id: str) -> Dict[str, Any]:
+    """Tarefa do executor: restaura um backup pedido por submit_restore."""
+    return BackupService().restore_backup(backup_id)
@@ -0,0 +1,225 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, Q, Sum, DateField
+from django.db.models.functions import TruncWeek, TruncMonth
+from django.utils import timezone
+
+from ..models import Compra, Locacao_Obras_Equipes, Despesa_Extra, CustoDiarioObra
+
+ZERO = Decimal('0.00')
+GRANULARIDADES = ('dia', 'semana', 'mes')
+
+
+# ---------------------------------------------------------------------------
+# Origem dos valores de cada categoria: (queryset, campo de data, campo de valor)
+#
+# Mesma regra dos gráficos de custo diário: compras do tipo COMPRA pela data da
+# compra, locações ativas pela data de início e despesas extras pela data.
+# ---------------------------------------------------------------------------
+
+def _origens(categorias: Iterable[str]):
+    origens = {
+        'materiais': (Compra.objects.filter(tipo='COMPRA'), 'data_compra', 'valor_total_liquido'),
+        'mao_de_obra': (
+            Locacao_Obras_Equipes.objects.filter(
+                Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False),
+                status_locacao='ativa'
+            ),
+            'data_locacao_inicio', 'valor_pagamento'
+        ),
+        'servicos': (
+            Locacao_Obras_Equipes.objects.filter(
+                servico_externo__isnull=False, status_locacao='ativa'
+            ).exclude(servico_externo__exact=''),
+            'data_locacao_inicio', 'valor_pagamento'
+        ),
+        'despesas_extras': (Despesa_Extra.objects.all(), 'data', 'valor'),
+    }
+    return [(categoria, *origens[categoria]) for categoria in categorias]
+
+
+def _somar_por_obra_e_dia(categorias: Iterable[str],
+                          obra_ids: Optional[Iterable[int]] = None,
+                          dias: Optional[Iterable[date]] = None) -> Dict[Tuple[int, date], Dict[str, Decimal]]:
+    """
+    Uma consulta agrupada (obra, dia) por categoria.
+
+    Returns:
+        {(obra_id, dia): {categoria: valor}} apenas para os pares com movimento
+    """
+    valores = defaultdict(dict)
+    for categoria, queryset, campo_data, campo_valor in _origens(categorias):
+        if obra_ids is not None:
+            queryset = queryset.filter(obra_id__in=list(obra_ids))
+        if dias is not None:
+            queryset = queryset.filter(**{f'{campo_data}__in': list(dias)})
+        linhas = queryset.order_by().values('obra_id', campo_data).annotate(total=Sum(campo_valor))
+        for linha in linhas:
+            valores[(linha['obra_id'], linha[campo_data])][categoria] = linha['total'] or ZERO
+    return valores
+
+
+def atualizar_custos_diarios(chaves: Iterable[Tuple[int, date]],
+                             categorias: Iterable[str] = CustoDiarioObra.CATEGORIAS) -> None:
+    """
+    Recalcula as categorias informadas para os pares (obra_id, dia) afetados por uma escrita.
+
+    Os valores são obtidos com uma consulta agrupada por categoria e obra e gravados
+    com bulk_create/bulk_update; dias que ficam zerados em todas as categorias são
+    removidos, para que a tabela só tenha dias com movimento.
+    """
+    dias_por_obra = defaultdict(set)
+    for obra_id, dia in chaves:
+        if obra_id and dia:
+            dias_por_obra[obra_id].add(dia)
+    if not dias_por_obra:
+        return
+    categorias = tuple(categorias)
+
+    agora = timezone.now()
+    with transaction.atomic():
+        for obra_id, dias in dias_por_obra.items():
+            valores = _somar_por_obra_e_dia(categorias, obra_ids=[obra_id], dias=dias)
+            existentes = {
+                linha.data: linha
+                for linha in CustoDiarioObra.objects.select_for_update().filter(obra_id=obra_id, data__in=dias)
+            }
+
+            novas, alteradas, vazias = [], [], []
+            for dia in dias:
+                valores_dia = valores.get((obra_id, dia), {})
+                linha = existentes.get(dia)
+                if linha is None:
+                    if any(valores_dia.values()):
+                        novas.append(CustoDiarioObra(obra_id=obra_id, data=dia, **valores_dia))
+                    continue
+                for categoria in categorias:
+                    setattr(linha, categoria, valores_dia.get(categoria, ZERO))
+                # bulk_update não preenche o auto_now
+                linha.updated_at = agora
+                if linha.total:
+                    alteradas.append(linha)
+                else:
+                    vazias.append(linha.pk)
+
+            if novas:
+                CustoDiarioObra.objects.bulk_create(novas)
+            if alteradas:
+                CustoDiarioObra.objects.bulk_update(alteradas, list(categorias) + ['updated_at'])
+            if vazias:
+                CustoDiarioObra.objects.filter(pk__in=vazias).delete()
+
+
+def reconstruir_custos_diarios(obra_id: Optional[int] = None, batch_size: int = 1000) -> int:
+    """
+    Reconstrói o consolidado diário (de uma obra ou de todas) a partir das tabelas de origem.
+
+    Returns:
+        Quantidade de linhas criadas
+    """
+    obra_ids = [obra_id] if obra_id else None
+    valores = _somar_por_obra_e_dia(CustoDiarioObra.CATEGORIAS, obra_ids=obra_ids)
+    novas = [
+        CustoDiarioObra(obra_id=chave_obra, data=dia, **valores_dia)
+        for (chave_obra, dia), valores_dia in valores.items()
+        if any(valores_dia.values())
+    ]
+    with transaction.atomic():
+        linhas = CustoDiarioObra.objects.all()
+        if obra_id:
+            linhas = linhas.filter(obra_id=obra_id)
+        linhas.delete()
+        CustoDiarioObra.objects.bulk_create(novas, batch_size=batch_size)
+    return len(novas)
+
+
+def _inicio_periodo(dia: date, granularidade: str) -> date:
+    if granularidade == 'semana':
+        return dia - timedelta(days=dia.weekday())
+    if granularidade == 'mes':
+        return dia.replace(day=1)
+    return dia
+
+
+def _proximo_periodo(inicio: date, granularidade: str) -> date:
+    if granularidade == 'semana':
+        return inicio + timedelta(days=7)
+    if granularidade == 'mes':
+        return (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return inicio + timedelta(days=1)
+
+
+def contar_periodos(data_inicio: date, data_fim: date, granularidade: str) -> int:
+    """Quantidade de pontos que serie_temporal devolve para o período."""
+    if granularidade == 'semana':
+        return (_inicio_periodo(data_fim, 'semana') - _inicio_periodo(data_inicio, 'semana')).days // 7 + 1
+    if granularidade == 'mes':
+        return (data_fim.year - data_inicio.year) * 12 + data_fim.month - data_inicio.month + 1
+    return (data_fim - data_inicio).days + 1
+
+
+def serie_temporal(data_inicio: date,
+                   data_fim: date,
+                   granularidade: str = 'dia',
+                   obra_id: Optional[int] = None,
+                   series: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Série temporal de custos lida do consolidado diário, em uma única consulta.
+
+    Args:
+        data_inicio / data_fim: período (inclusivo)
+        granularidade: 'dia', 'semana' (semanas começando na segunda) ou 'mes'
+        obra_id: restringe a uma obra; sem ele soma todas as obras
+        series: categorias desejadas (padrão: todas)
+
+    Returns:
+        Dict com os parâmetros, 'pontos' (um por período, inclusive os sem custo,
+        com o valor de cada série e o total) e 'totais' do período inteiro
+    """
+    series = list(series or CustoDiarioObra.CATEGORIAS)
+
+    queryset = CustoDiarioObra.objects.filter(data__gte=data_inicio, data__lte=data_fim)
+    if obra_id:
+        queryset = queryset.filter(obra_id=obra_id)
+
+    if granularidade == 'semana':
+        periodo_expr = TruncWeek('data', output_field=DateField())
+    elif granularidade == 'mes':
+        periodo_expr = TruncMonth('data', output_field=DateField())
+    else:
+        periodo_expr = F('data')
+
+    linhas = queryset.annotate(periodo=periodo_expr).order_by().values('periodo').annotate(
+        **{f'total_{serie}': Sum(serie) for serie in series}
+    )
+    por_periodo = {linha['periodo']: linha for linha in linhas}
+
+    totais = {serie: ZERO for serie in series}
+    pontos = []
+    periodo = _inicio_periodo(data_inicio, granularidade)
+    while periodo <= data_fim:
+        linha = por_periodo.get(periodo, {})
+        ponto = {'periodo': periodo.isoformat()}
+        total_periodo = ZERO
+        for serie in series:
+            valor = linha.get(f'total_{serie}') or ZERO
+            ponto[serie] = valor
+            totais[serie] += valor
+            total_periodo += valor
+        ponto['total'] = total_periodo
+        pontos.append(ponto)
+        periodo = _proximo_periodo(periodo, granularidade)
+
+    return {
+        'inicio': data_inicio.isoformat(),
+        'fim': data_fim.isoformat(),
+        'granularidade': granularidade,
+        'obra_id': obra_id,
+        'series': series,
+        'pontos': pontos,
+        'totais': {**totais, 'total': sum(totais.values(), ZERO)},
+    }
@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+import threading
+import uuid
+from typing import Optional, Dict, Any
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Versão do formato dos derivados; incrementar invalida todo o cache
+DERIVADO_VERSION = 1
+
+
+class DerivadoCache:
+    """
+    Cache em disco de derivados de anexos (miniaturas/rasterizações em base64).
+
+    As chaves são endereçadas pelo conteúdo: hash do arquivo original mais os
+    parâmetros de renderização. O mtime de cada entrada marca o último uso e,
+    quando o tamanho total passa de max_bytes, as entradas menos usadas
+    recentemente são removidas até voltar a 90% do limite (LRU).
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # calculado sob demanda
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, **params) -> str:
+        """Chave do derivado: hash do conteúdo + parâmetros de renderização."""
+        payload = json.dumps({'hash': content_hash, 'v': DERIVADO_VERSION, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _scan(self):
+        entradas = []
+        for raiz, _, arquivos in os.walk(self.cache_dir):
+            for nome in arquivos:
+                path = os.path.join(raiz, nome)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entradas.append((stat.st_mtime, stat.st_size, path))
+        return entradas
+
+    def _ensure_total(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._scan())
+        return self._total_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='ascii') as f:
+                valor = f.read()
+            os.utime(path)  # marca o uso recente para a política LRU
+            return valor
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        except OSError as e:
+            logger.warning(f"Error reading derivative cache entry {key}: {str(e)}")
+            return None
+
+    def set(self, key: str, valor: str) -> None:
+        path = self._path(key)
+        dados = valor.encode('ascii')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(dados)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Error writing derivative cache entry {key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._ensure_total()
+            self._total_bytes += len(dados)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove as entradas usadas há mais tempo até ficar em 90% do limite."""
+        entradas = sorted(self._scan())
+        total = sum(size for _, size, _ in entradas)
+        alvo = int(self.max_bytes * 0.9)
+        for _, size, path in entradas:
+            if total <= alvo:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        self._total_bytes = total
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, path in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        entradas = self._scan()
+        return {
+            'entries': len(entradas),
+            'total_bytes': sum(size for _, size, _ in entradas),
+            'max_bytes': self.max_bytes,
+        }
+
+
+_caches: Dict[tuple, DerivadoCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_derivado_cache() -> DerivadoCache:
+    """Instância compartilhada do cache para o diretório configurado."""
+    cache_dir = getattr(settings, 'ATTACHMENT_CACHE_DIR', '/tmp/anexos_derivados')
+    max_bytes = getattr(settings, 'ATTACHMENT_CACHE_MAX_MB', 512) * 1024 * 1024
+    with _caches_lock:
+        cache = _caches.get((cache_dir, max_bytes))
+        if cache is None:
+            cache = _caches[(cache_dir, max_bytes)] = DerivadoCache(cache_dir, max_bytes)
+        return cache
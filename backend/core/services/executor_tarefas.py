@@ -0,0 +1,292 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from datetime import timedelta
+from importlib import import_module
+from typing import Dict, Any, Callable, List
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, IntegerField
+from django.utils import timezone
+import logging
+
+from ..models import TaskHistory
+
+logger = logging.getLogger(__name__)
+
+
+# Tarefas que o executor sabe rodar. Cada função recebe (contexto, **params),
+# com params vindos de metadata['params'] da tarefa, e retorna um dict com
+# 'success'; é registrada no módulo do serviço que a implementa.
+TAREFAS: Dict[str, Callable] = {}
+
+# Tarefas das quais só uma roda por vez, somando todos os workers
+TAREFAS_EXCLUSIVAS = set()
+
+# Módulos que registram tarefas, importados pelo executor e pelo TaskService
+MODULOS_TAREFAS = (
+    'core.services.backup_service',
+    'core.services.migracao_s3',
+    'core.services.relatorios_pdf',
+)
+
+# Ordem de execução das pendentes: prioridade e, dentro dela, a mais antiga
+ORDEM_PRIORIDADE = Case(
+    When(priority='critical', then=Value(0)),
+    When(priority='high', then=Value(1)),
+    When(priority='medium', then=Value(2)),
+    default=Value(3),
+    output_field=IntegerField(),
+)
+
+
+def registrar_tarefa(nome: str, exclusiva: bool = False):
+    """Decorator que registra uma função como tarefa do executor."""
+    def decorator(func):
+        TAREFAS[nome] = func
+        if exclusiva:
+            TAREFAS_EXCLUSIVAS.add(nome)
+        return func
+    return decorator
+
+
+def carregar_tarefas() -> Dict[str, Callable]:
+    for modulo in MODULOS_TAREFAS:
+        import_module(modulo)
+    return TAREFAS
+
+
+class TarefaCancelada(Exception):
+    """Levantada em ContextoTarefa.progresso quando o cancelamento foi pedido."""
+
+
+def _json(valor: Any) -> Any:
+    """Resultado da tarefa em tipos que o JSONField aceita (datas viram texto)."""
+    return json.loads(json.dumps(valor, cls=DjangoJSONEncoder))
+
+
+class ContextoTarefa:
+    """
+    O que a função da tarefa recebe do executor: o registro da tarefa, a escrita
+    periódica do progresso e a verificação do cancelamento, feitas na mesma
+    consulta a cada TASK_PROGRESS_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, task: TaskHistory):
+        self.task_id = task.task_id
+        self.pk = task.pk
+        self.user_id = task.created_by_id
+        self.metadata = dict(task.metadata)
+        self.intervalo = getattr(settings, 'TASK_PROGRESS_INTERVAL_SECONDS', 5)
+        self._ultima_escrita = time.monotonic()
+
+    def progresso(self, percentual: int, forcar: bool = False, **metadata) -> None:
+        """
+        Registra o progresso (0-100) e dados adicionais em metadata. Fora do
+        intervalo só guarda os dados para a próxima escrita.
+
+        Raises:
+            TarefaCancelada: se o cancelamento da tarefa foi pedido
+        """
+        self.metadata.update(metadata)
+        agora = time.monotonic()
+        if not forcar and agora - self._ultima_escrita < self.intervalo:
+            return
+        self._ultima_escrita = agora
+        atualizadas = TaskHistory.objects.filter(
+            pk=self.pk, status='in_progress', cancel_requested=False
+        ).update(
+            progress_percentage=max(0, min(int(percentual), 100)),
+            metadata=_json(self.metadata),
+            updated_at=timezone.now(),
+        )
+        if not atualizadas:
+            raise TarefaCancelada(self.task_id)
+
+    def verificar_cancelamento(self) -> None:
+        """Levanta TarefaCancelada se o cancelamento foi pedido, sem gravar progresso."""
+        if not TaskHistory.objects.filter(pk=self.pk, status='in_progress', cancel_requested=False).exists():
+            raise TarefaCancelada(self.task_id)
+
+
+def executar_tarefa(task: TaskHistory) -> Dict[str, Any]:
+    """
+    Executa uma tarefa já marcada como 'in_progress' e grava o status final.
+    Usada pelo executor e pelos serviços que rodam a tarefa na própria chamada
+    (modo síncrono dos testes).
+    """
+    contexto = ContextoTarefa(task)
+    handler = task.metadata['handler']
+    try:
+        resultado = TAREFAS[handler](contexto, **(task.metadata.get('params') or {}))
+    except TarefaCancelada:
+        TaskHistory.objects.filter(pk=task.pk, status='in_progress').update(
+            status='cancelled', completed_at=timezone.now(),
+            metadata=_json({**contexto.metadata, 'cancelled_at': timezone.now().isoformat()})
+        )
+        logger.info(f"Task {task.task_id} cancelled")
+        return {'success': False, 'error': 'Task cancelled'}
+    except Exception as e:
+        logger.error(f"Error executing task {task.task_id}: {str(e)}")
+        resultado = {'success': False, 'error': str(e)}
+
+    if not isinstance(resultado, dict):
+        resultado = {'success': False, 'error': 'Function returned non-success result'}
+    # Tarefas que gerenciam o próprio registro (ex.: backups) já o terão finalizado
+    if resultado.get('success'):
+        TaskHistory.objects.filter(pk=task.pk, status='in_progress').update(
+            status='completed', progress_percentage=100, completed_at=timezone.now(),
+            metadata=_json({**contexto.metadata, 'result': resultado})
+        )
+    else:
+        TaskHistory.objects.filter(pk=task.pk, status='in_progress').update(
+            status='failed', completed_at=timezone.now(),
+            error_message=resultado.get('error') or 'Unknown error',
+            metadata=_json({**contexto.metadata, 'result': resultado})
+        )
+    return resultado
+
+
+class ExecutorTarefas:
+    """
+    Executor persistente das tarefas registradas em TAREFAS, rodando fora do
+    servidor web (manage.py executar_tarefas).
+
+    A fila é a própria tabela TaskHistory: tarefas 'pending' com
+    metadata['handler'] são reivindicadas com lock de linha (SELECT ... FOR
+    UPDATE SKIP LOCKED), em ordem de prioridade, e executadas em um pool de
+    threads limitado. Vários processos podem rodar o executor sobre o mesmo
+    banco: cada tarefa é reivindicada por um só. Enquanto roda, a tarefa tem o
+    updated_at renovado a cada ciclo; uma tarefa 'in_progress' sem renovação
+    por TASK_STALE_SECONDS é de um worker que morreu e é marcada como falha.
+    """
+
+    def __init__(self, workers: int = None):
+        carregar_tarefas()
+        self.workers = max(1, workers or getattr(settings, 'TASK_EXECUTOR_WORKERS', 2))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tarefa')
+        self.em_execucao: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def reivindicar(self, limite: int) -> List[TaskHistory]:
+        """
+        Marca como 'in_progress' até `limite` tarefas pendentes, as de maior
+        prioridade primeiro, e as devolve.
+        """
+        if limite <= 0:
+            return []
+        agora = timezone.now()
+        reivindicadas = []
+        with transaction.atomic():
+            exclusivas_rodando = self._travar_exclusivas()
+            candidatas = TaskHistory.objects.select_for_update(skip_locked=True).filter(
+                status='pending', metadata__handler__in=list(TAREFAS)
+            ).exclude(
+                metadata__handler__in=list(exclusivas_rodando)
+            ).alias(ordem=ORDEM_PRIORIDADE).order_by('ordem', 'created_at', 'pk')[:limite]
+
+            for task in candidatas:
+                handler = task.metadata['handler']
+                if handler in TAREFAS_EXCLUSIVAS:
+                    if handler in exclusivas_rodando:
+                        continue
+                    exclusivas_rodando.add(handler)
+                # A condição no status também protege bancos sem lock de linha (SQLite)
+                if TaskHistory.objects.filter(pk=task.pk, status='pending').update(
+                    status='in_progress', started_at=agora, updated_at=agora
+                ):
+                    task.status = 'in_progress'
+                    task.started_at = agora
+                    reivindicadas.append(task)
+
+        for task in reivindicadas:
+            logger.info(f"Task {task.task_id} claimed by {self.worker_id} ({task.metadata['handler']}, {task.priority})")
+        return reivindicadas
+
+    def _travar_exclusivas(self) -> set:
+        """
+        Trava as linhas 'pending' e 'in_progress' de cada tarefa exclusiva e
+        devolve as que já estão rodando. Dentro da transação do reivindicar:
+        outro executor que queira reivindicar a mesma tarefa espera este commit
+        e então enxerga a tarefa já em execução.
+        """
+        rodando = set()
+        for handler in sorted(TAREFAS_EXCLUSIVAS):
+            status_tarefas = TaskHistory.objects.select_for_update().filter(
+                status__in=['pending', 'in_progress'], metadata__handler=handler
+            ).order_by('pk').values_list('status', flat=True)
+            if 'in_progress' in list(status_tarefas):
+                rodando.add(handler)
+        return rodando
+
+    def executar(self, task: TaskHistory) -> Dict[str, Any]:
+        """Executa uma tarefa já reivindicada e grava o status final."""
+        return executar_tarefa(task)
+
+    def _executar_no_worker(self, task: TaskHistory) -> None:
+        try:
+            self.executar(task)
+        finally:
+            with self._lock:
+                self.em_execucao.pop(task.pk, None)
+            # Cada thread do pool tem sua própria conexão com o banco
+            connection.close()
+
+    def marcar_abandonadas(self) -> int:
+        """Falha as tarefas 'in_progress' de workers que pararam de renovar o updated_at."""
+        limite = timezone.now() - timedelta(seconds=getattr(settings, 'TASK_STALE_SECONDS', 300))
+        abandonadas = TaskHistory.objects.filter(
+            status='in_progress', metadata__handler__in=list(TAREFAS), updated_at__lt=limite
+        ).exclude(pk__in=list(self.em_execucao))
+        count = abandonadas.update(
+            status='failed', completed_at=timezone.now(), error_message='Worker interrupted'
+        )
+        if count:
+            logger.warning(f"{count} tasks from stopped workers marked as failed")
+        return count
+
+    def renovar(self) -> List[int]:
+        """Renova o updated_at das tarefas em execução e devolve suas chaves."""
+        with self._lock:
+            rodando = list(self.em_execucao)
+        if rodando:
+            TaskHistory.objects.filter(pk__in=rodando, status='in_progress').update(updated_at=timezone.now())
+        return rodando
+
+    def ciclo(self) -> int:
+        """
+        Renova as tarefas em execução, marca as abandonadas e reivindica
+        tarefas para os workers livres. Retorna quantas foram iniciadas.
+        """
+        rodando = self.renovar()
+        self.marcar_abandonadas()
+
+        tarefas = self.reivindicar(self.workers - len(rodando))
+        for task in tarefas:
+            with self._lock:
+                self.em_execucao[task.pk] = self.pool.submit(self._executar_no_worker, task)
+        return len(tarefas)
+
+    def aguardar(self, intervalo: float = None) -> None:
+        """
+        Espera o fim das tarefas em execução, renovando-as a cada `intervalo`
+        segundos para que outros executores não as deem como abandonadas.
+        """
+        if intervalo is None:
+            intervalo = getattr(settings, 'TASK_EXECUTOR_INTERVAL_SECONDS', 5)
+        while True:
+            with self._lock:
+                futuros = list(self.em_execucao.values())
+            if not futuros:
+                return
+            wait(futuros, timeout=intervalo)
+            self.renovar()
+
+    def encerrar(self) -> None:
+        self.pool.shutdown(wait=True)
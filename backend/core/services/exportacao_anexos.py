@@ -0,0 +1,172 @@
+import os
+import zipfile
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Callable
+from django.utils import timezone
+import logging
+
+from ..models import ArquivoObra, FotoObra, AnexoCompra, AnexoLocacao, AnexoDespesa
+from ..utils import iter_file_chunks
+
+logger = logging.getLogger(__name__)
+
+# Formatos já comprimidos: gravados sem compressão (só gastaria CPU)
+EXTENSOES_SEM_COMPRESSAO = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.zip', '.rar', '.7z',
+    '.docx', '.xlsx', '.pptx', '.mp4', '.mov',
+}
+
+
+class _SaidaZip:
+    """
+    Destino sem seek para o zipfile: acumula o que foi escrito até ser
+    drenado pelo gerador. Sem seek, o zipfile grava tamanhos e CRC em data
+    descriptors após cada entrada, então nada precisa ser reescrito.
+    """
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def flush(self) -> None:
+        pass
+
+    def drenar(self) -> bytes:
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+
+def _data_zip(data) -> tuple:
+    if not data:
+        data = timezone.now()
+    if timezone.is_aware(data):
+        data = timezone.localtime(data)
+    return max(data, datetime(1980, 1, 1, tzinfo=data.tzinfo)).timetuple()[:6]
+
+
+def _abrir_arquivo(arquivo) -> Callable[[], Iterator[bytes]]:
+    def abrir():
+        return iter_file_chunks(arquivo.storage.open(arquivo.name, 'rb'))
+    return abrir
+
+
+def _abrir_s3(s3_service, anexo_id: str) -> Callable[[], Iterator[bytes]]:
+    def abrir():
+        result = s3_service.open_stream(anexo_id)
+        if not result['success']:
+            raise FileNotFoundError(result['error'])
+        return result['stream']
+    return abrir
+
+
+def listar_anexos_obra(obra_id: int, s3_service) -> List[Dict[str, Any]]:
+    """
+    Lista os anexos de uma obra para exportação: arquivos da obra, fotos e
+    anexos das compras, locações e despesas.
+
+    Returns:
+        Lista de entradas com o caminho no ZIP, a data e a função que abre o conteúdo
+    """
+    entradas = []
+
+    for arquivo in ArquivoObra.objects.filter(obra_id=obra_id).order_by('uploaded_at', 'pk'):
+        if arquivo.s3_anexo_id:
+            abrir = _abrir_s3(s3_service, arquivo.s3_anexo_id)
+        elif arquivo.arquivo:
+            abrir = _abrir_arquivo(arquivo.arquivo)
+        else:
+            continue
+        entradas.append({'nome': f"arquivos/{arquivo.nome_original}", 'data': arquivo.uploaded_at, 'abrir': abrir})
+
+    for foto in FotoObra.objects.filter(obra_id=obra_id).order_by('uploaded_at', 'pk'):
+        if foto.imagem:
+            entradas.append({
+                'nome': f"fotos/{os.path.basename(foto.imagem.name)}",
+                'data': foto.uploaded_at,
+                'abrir': _abrir_arquivo(foto.imagem),
+            })
+
+    for anexo in AnexoCompra.objects.filter(compra__obra_id=obra_id).order_by('compra_id', 'pk'):
+        if anexo.arquivo:
+            nome = anexo.nome_original or os.path.basename(anexo.arquivo.name)
+            entradas.append({
+                'nome': f"compras/compra_{anexo.compra_id}/{nome}",
+                'data': anexo.uploaded_at,
+                'abrir': _abrir_arquivo(anexo.arquivo),
+            })
+
+    for anexo in AnexoLocacao.objects.filter(locacao__obra_id=obra_id).order_by('locacao_id', 'pk'):
+        if anexo.anexo:
+            entradas.append({
+                'nome': f"locacoes/locacao_{anexo.locacao_id}/{os.path.basename(anexo.anexo.name)}",
+                'data': anexo.uploaded_at,
+                'abrir': _abrir_arquivo(anexo.anexo),
+            })
+
+    for anexo in AnexoDespesa.objects.filter(despesa__obra_id=obra_id).order_by('despesa_id', 'pk'):
+        if anexo.anexo:
+            entradas.append({
+                'nome': f"despesas/despesa_{anexo.despesa_id}/{os.path.basename(anexo.anexo.name)}",
+                'data': anexo.uploaded_at,
+                'abrir': _abrir_arquivo(anexo.anexo),
+            })
+
+    # Nomes repetidos dentro da mesma pasta recebem sufixo " (n)"
+    usados = set()
+    for entrada in entradas:
+        base, extensao = os.path.splitext(entrada['nome'])
+        nome, n = entrada['nome'], 1
+        while nome.lower() in usados:
+            n += 1
+            nome = f"{base} ({n}){extensao}"
+        usados.add(nome.lower())
+        entrada['nome'] = nome
+    return entradas
+
+
+def gerar_zip_anexos(entradas: List[Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Gera um ZIP em streaming com as entradas informadas.
+
+    Cada arquivo é lido do storage (ou do S3) em blocos e os bytes comprimidos
+    são entregues assim que produzidos, sem arquivo temporário nem o ZIP
+    inteiro em memória. Arquivos que não puderem ser abertos são listados em
+    ERROS.txt ao final do pacote.
+    """
+    saida = _SaidaZip()
+    erros = []
+    with zipfile.ZipFile(saida, mode='w', allowZip64=True) as zf:
+        for entrada in entradas:
+            try:
+                chunks = entrada['abrir']()
+            except Exception as e:
+                logger.warning(f"Anexo {entrada['nome']} não incluído na exportação: {str(e)}")
+                motivo = 'arquivo não encontrado' if isinstance(e, FileNotFoundError) else 'erro ao ler o arquivo'
+                erros.append(f"{entrada['nome']}: {motivo}")
+                continue
+
+            info = zipfile.ZipInfo(entrada['nome'], date_time=_data_zip(entrada['data']))
+            if os.path.splitext(entrada['nome'])[1].lower() in EXTENSOES_SEM_COMPRESSAO:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, mode='w', force_zip64=True) as destino:
+                for chunk in chunks:
+                    destino.write(chunk)
+                    dados = saida.drenar()
+                    if dados:
+                        yield dados
+
+        if erros:
+            zf.writestr('ERROS.txt', 'Arquivos não incluídos:\n' + '\n'.join(erros) + '\n')
+    # Restante da última entrada e o diretório central, gravados no fechamento
+    yield saida.drenar()
@@ -0,0 +1,212 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from django.db.models import Q
+
+from ..models import Locacao_Obras_Equipes
+
+UM_DIA = timedelta(days=1)
+
+
+def get_recurso_nome_folha(locacao_instance):
+    if locacao_instance.funcionario_locado:
+        return f"Funcionário: {locacao_instance.funcionario_locado.nome_completo}"
+    elif locacao_instance.equipe:
+        return f"Equipe: {locacao_instance.equipe.nome_equipe}"
+    elif locacao_instance.servico_externo:
+        return f"Serviço Externo: {locacao_instance.servico_externo}"
+    return "N/A"
+
+
+def get_locacoes_no_periodo(start_date: date, end_date: date, obra_id_filter: Optional[int] = None):
+    """
+    Locações ativas, com valor definido, que começam dentro do período do relatório.
+    """
+    filters = Q(
+        Q(data_locacao_inicio__gte=start_date) & Q(data_locacao_inicio__lte=end_date) &
+        (Q(data_pagamento__isnull=True) | Q(data_pagamento__lte=end_date)) & # Considera pagamentos previstos dentro ou após o período, ou não definidos
+        (Q(funcionario_locado__isnull=False) | Q(equipe__isnull=False) | (Q(servico_externo__isnull=False) & ~Q(servico_externo=''))) &
+        Q(status_locacao='ativa') &
+        Q(valor_pagamento__isnull=False) & Q(valor_pagamento__gt=Decimal('0.00'))
+    )
+    if obra_id_filter:
+        filters &= Q(obra_id=obra_id_filter)
+
+    return Locacao_Obras_Equipes.objects.filter(filters).select_related(
+        'obra', 'funcionario_locado', 'equipe'
+    ).order_by('obra__nome_obra', 'data_locacao_inicio')
+
+
+def atribuir_custos_por_dia(locacoes: Iterable[Locacao_Obras_Equipes],
+                            start_date: date,
+                            end_date: date) -> List[Tuple[date, List[Tuple[Locacao_Obras_Equipes, Decimal]]]]:
+    """
+    Distribui o custo de cada locação pelos dias do período.
+
+    Em vez de percorrer todas as locações para cada dia do período, cada locação
+    tem seu intervalo [inicio, fim] recortado uma única vez à janela do relatório
+    e emite diretamente os dias em que gera custo:
+      - 'diaria': o valor é atribuído a cada dia do intervalo recortado;
+      - 'metro' / 'empreitada': o valor inteiro é atribuído ao dia de início,
+        desde que ele esteja dentro do período.
+    Uma locação sem data_locacao_fim é considerada ativa até o fim do período.
+
+    Returns:
+        Lista ordenada por dia de (dia, [(locacao, valor_atribuido), ...]); dentro
+        de cada dia, as locações mantêm a ordem em que foram recebidas.
+    """
+    por_dia = defaultdict(list)
+    for locacao in locacoes:
+        valor = locacao.valor_pagamento or Decimal('0.00')
+        if valor <= Decimal('0.00'):
+            continue
+
+        inicio = locacao.data_locacao_inicio
+        fim = min(locacao.data_locacao_fim or end_date, end_date)
+
+        if locacao.tipo_pagamento == 'diaria':
+            dia = max(inicio, start_date)
+            while dia <= fim:
+                por_dia[dia].append((locacao, valor))
+                dia += UM_DIA
+        elif locacao.tipo_pagamento in ['metro', 'empreitada']:
+            if start_date <= inicio <= fim:
+                por_dia[inicio].append((locacao, valor))
+
+    return sorted(por_dia.items(), key=lambda item: item[0])
+
+
+def montar_folha_por_recurso(start_date: date, end_date: date, obra_id_filter: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Folha de pagamento agrupada por recurso e, dentro dele, por obra (usada no PDF).
+    """
+    locacoes = get_locacoes_no_periodo(start_date, end_date, obra_id_filter)
+
+    pagamentos_por_recurso = defaultdict(lambda: {
+        "recurso_nome": "",
+        "total_a_pagar_periodo": Decimal('0.00'),
+        "detalhes_por_obra": defaultdict(lambda: {
+            "obra_id": None,
+            "obra_nome": "",
+            "total_a_pagar_obra": Decimal('0.00'),
+            "locacoes_na_obra": [] # Stores {data_servico, tipo_pagamento, valor_atribuido, locacao_id}
+        })
+    })
+    grand_total_geral = Decimal('0.00')
+
+    # Dados fixos de cada locação, calculados uma única vez
+    info_locacoes = {}
+    for dia, atribuicoes in atribuir_custos_por_dia(locacoes, start_date, end_date):
+        data_servico = dia.isoformat()
+        for locacao, valor in atribuicoes:
+            info = info_locacoes.get(locacao.id)
+            if info is None:
+                info = info_locacoes[locacao.id] = {
+                    "recurso_nome": get_recurso_nome_folha(locacao),
+                    "obra_id": locacao.obra.id if locacao.obra else 0,
+                    "obra_nome": locacao.obra.nome_obra if locacao.obra else "Obra Desconhecida",
+                    "tipo_pagamento": locacao.get_tipo_pagamento_display(),
+                    "valor_atribuido": str(valor),
+                    "observacoes": locacao.observacoes or "",
+                }
+
+            recurso_data = pagamentos_por_recurso[info["recurso_nome"]]
+            recurso_data["recurso_nome"] = info["recurso_nome"]
+            recurso_data["total_a_pagar_periodo"] += valor
+
+            obra_details = recurso_data["detalhes_por_obra"][info["obra_id"]]
+            obra_details["obra_id"] = info["obra_id"]
+            obra_details["obra_nome"] = info["obra_nome"]
+            obra_details["total_a_pagar_obra"] += valor
+            obra_details["locacoes_na_obra"].append({
+                "locacao_id": locacao.id,
+                "data_servico": data_servico,
+                "tipo_pagamento": info["tipo_pagamento"],
+                "valor_atribuido": info["valor_atribuido"],
+                "observacoes": info["observacoes"]
+            })
+            grand_total_geral += valor
+
+    # Convert to list and format decimals as strings
+    final_recursos_list = []
+    for rec_nome, rec_data in sorted(pagamentos_por_recurso.items()):
+        rec_data["total_a_pagar_periodo"] = str(rec_data["total_a_pagar_periodo"])
+        obras_list = []
+        for ob_id, ob_data in sorted(rec_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
+            ob_data["total_a_pagar_obra"] = str(ob_data["total_a_pagar_obra"])
+            # Já emitidas em ordem de data pelo motor de atribuição
+            obras_list.append(ob_data)
+        rec_data["detalhes_por_obra"] = obras_list
+        final_recursos_list.append(rec_data)
+
+    return {
+        "periodo": {"inicio": start_date.isoformat(), "fim": end_date.isoformat()},
+        "recursos_pagamentos": final_recursos_list,
+        "total_geral_periodo": str(grand_total_geral)
+    }
+
+
+def montar_folha_por_obra(start_date: date, end_date: date, obra_id_filter: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Folha de pagamento agrupada por obra e, dentro dela, por dia (estrutura original / CSV).
+    """
+    locacoes = get_locacoes_no_periodo(start_date, end_date, obra_id_filter)
+
+    # Data structure: Obra -> Dia -> Locações
+    report_data_by_obra = {}
+    info_locacoes = {}
+    for dia, atribuicoes in atribuir_custos_por_dia(locacoes, start_date, end_date):
+        day_iso = dia.isoformat()
+        for locacao, valor in atribuicoes:
+            obra = locacao.obra
+            if not obra:
+                continue
+
+            info = info_locacoes.get(locacao.id)
+            if info is None:
+                info = info_locacoes[locacao.id] = {
+                    "locacao_id": locacao.id,
+                    "recurso_nome": get_recurso_nome_folha(locacao),
+                    "tipo_pagamento_display": locacao.get_tipo_pagamento_display(),
+                    "valor_diario_atribuido": str(valor),
+                    "valor_pagamento_total_locacao": str(locacao.valor_pagamento),
+                    "data_locacao_original_inicio": locacao.data_locacao_inicio.isoformat(),
+                    "data_locacao_original_fim": locacao.data_locacao_fim.isoformat() if locacao.data_locacao_fim else None,
+                    "data_pagamento_prevista": locacao.data_pagamento.isoformat() if locacao.data_pagamento else None,
+                    "observacoes": locacao.observacoes or ""
+                }
+
+            obra_entry = report_data_by_obra.get(obra.id)
+            if obra_entry is None:
+                obra_entry = report_data_by_obra[obra.id] = {
+                    "obra_id": obra.id, "obra_nome": obra.nome_obra,
+                    "dias": {}, "total_obra_periodo": Decimal('0.00')
+                }
+
+            day_data_dict = obra_entry["dias"].get(day_iso)
+            if day_data_dict is None:
+                day_data_dict = obra_entry["dias"][day_iso] = {
+                    "data": day_iso, "locacoes_no_dia": [], "total_dia_obra": Decimal('0.00')
+                }
+
+            day_data_dict["locacoes_no_dia"].append(dict(info))
+            day_data_dict["total_dia_obra"] += valor
+            obra_entry["total_obra_periodo"] += valor
+
+    final_report_list = []
+    for obra_data in sorted(report_data_by_obra.values(), key=lambda obra_item: obra_item["obra_nome"]):
+        dias_list = []
+        # Os dias já foram inseridos em ordem cronológica
+        for dia_info in obra_data["dias"].values():
+            dia_info["total_dia_obra"] = str(dia_info["total_dia_obra"])
+            dia_info["locacoes_no_dia"].sort(key=lambda x: x["recurso_nome"])
+            dias_list.append(dia_info)
+        final_report_list.append({
+            "obra_id": obra_data["obra_id"],
+            "obra_nome": obra_data["obra_nome"],
+            "dias": dias_list,
+            "total_obra_periodo": str(obra_data["total_obra_periodo"])
+        })
+    return final_report_list
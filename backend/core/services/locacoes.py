@@ -0,0 +1,83 @@
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Any, Iterable, List
+
+from django.db import transaction
+
+from ..models import Locacao_Obras_Equipes, AnexoLocacao, ObraCustoResumo
+from .ocupacao import sincronizar_ocupacoes
+from .custos_diarios import atualizar_custos_diarios
+from .rastreio_alteracoes import registrar_alteracoes
+
+LOCACOES_BATCH_SIZE = 500
+
+
+def criar_locacoes_diarias(validated_data: Dict[str, Any],
+                           anexos: Iterable = (),
+                           batch_size: int = LOCACOES_BATCH_SIZE) -> List[Locacao_Obras_Equipes]:
+    """
+    Cria uma locação por dia entre data_locacao_inicio e data_locacao_fim.
+
+    O recurso é precificado uma única vez (todas as linhas têm um dia, então o
+    valor automático é o mesmo para todas), as linhas são montadas em memória e
+    inseridas com bulk_create em lotes. Os anexos ficam na primeira locação.
+
+    Como bulk_create não chama save() nem dispara signals, o diário de
+    alterações dos backups, o resumo de custos da obra, o consolidado diário e
+    o índice de ocupação são atualizados explicitamente.
+
+    Returns:
+        Locações criadas, em ordem de data, com obra/equipe/funcionário,
+        membros da equipe e anexos já carregados para serialização.
+    """
+    dados = dict(validated_data)
+    dados.pop('anexos', None)
+
+    data_inicio = dados['data_locacao_inicio']
+    data_fim = dados.get('data_locacao_fim') or data_inicio
+    if data_fim < data_inicio:
+        data_fim = data_inicio
+
+    # Locação modelo (um dia) usada para precificar o recurso uma única vez
+    modelo = Locacao_Obras_Equipes(**{**dados, 'data_locacao_fim': data_inicio})
+    valor_informado = modelo.valor_pagamento
+    preco_automatico = valor_informado is None or valor_informado == Decimal('0.00')
+    if preco_automatico:
+        membros = list(modelo.equipe.membros.all()) if modelo.equipe else None
+        valor_dia = modelo.calcular_valor_pagamento(membros=membros)
+    else:
+        valor_dia = valor_informado
+
+    locacoes = []
+    dia = data_inicio
+    while dia <= data_fim:
+        locacao = Locacao_Obras_Equipes(**dados)
+        locacao.data_locacao_inicio = dia
+        locacao.data_locacao_fim = dia
+        locacao.valor_pagamento = valor_dia
+        # Mesmo comportamento de save(): valor calculado é considerado pago no dia
+        if preco_automatico and valor_dia > Decimal('0.00') and not locacao.data_pagamento:
+            locacao.data_pagamento = dia
+        locacoes.append(locacao)
+        dia += timedelta(days=1)
+
+    with transaction.atomic():
+        criadas = Locacao_Obras_Equipes.objects.bulk_create(locacoes, batch_size=batch_size)
+        registrar_alteracoes(Locacao_Obras_Equipes, [locacao.pk for locacao in criadas])
+
+        for anexo_file in anexos:
+            AnexoLocacao.objects.create(locacao=criadas[0], anexo=anexo_file, descricao=anexo_file.name)
+
+        ObraCustoResumo.atualizar(modelo.obra_id, ('mao_de_obra', 'servicos'))
+        atualizar_custos_diarios(
+            [(modelo.obra_id, locacao.data_locacao_inicio) for locacao in criadas],
+            ('mao_de_obra', 'servicos')
+        )
+        sincronizar_ocupacoes(criadas)
+
+    return list(
+        Locacao_Obras_Equipes.objects.filter(pk__in=[locacao.pk for locacao in criadas])
+        .select_related('obra', 'equipe', 'funcionario_locado')
+        .prefetch_related('anexos', 'equipe__membros')
+        .order_by('data_locacao_inicio', 'id')
+    )
@@ -0,0 +1,317 @@
+import os
+import uuid
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Optional, Dict, Any, List
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+import logging
+
+from ..models import AnexoS3, ArquivoObra, AnexoCompra, AnexoLocacao, AnexoDespesa, TaskHistory
+from .executor_tarefas import registrar_tarefa, TarefaCancelada
+from .s3_service import S3Service
+
+logger = logging.getLogger(__name__)
+
+
+# Modelos com arquivos locais a migrar: (modelo, campo do arquivo, anexo_type, campo do objeto pai).
+# Cada linha migrada é vinculada ao seu AnexoS3 pelas colunas s3_anexo_id/s3_url; o
+# AnexoS3 guarda a origem "Modelo:id" em metadata['origem'].
+ORIGENS_MIGRACAO = {
+    'obra': (ArquivoObra, 'arquivo', 'obra', 'obra_id'),
+    'compra': (AnexoCompra, 'arquivo', 'compra', 'compra_id'),
+    'locacao': (AnexoLocacao, 'anexo', 'locacao', 'locacao_id'),
+    'despesa': (AnexoDespesa, 'anexo', 'despesa', 'despesa_id'),
+}
+
+
+def _origem(instancia) -> str:
+    return f"{instancia.__class__.__name__}:{instancia.pk}"
+
+
+class MigracaoS3:
+    """
+    Migração dos arquivos locais (FileFields) para o S3, em paralelo e retomável.
+
+    Os arquivos são processados em lotes: hash e upload rodam em um pool de
+    threads (sem acesso ao banco) e, ao fim de cada lote, os registros AnexoS3 e
+    os vínculos são gravados em uma transação. A chave no S3 é derivada do hash
+    do conteúdo, então conteúdo repetido é enviado uma única vez, e uma nova
+    execução pula as linhas já vinculadas e reaproveita objetos já enviados.
+    O progresso fica em um TaskHistory do tipo 'migration'.
+    """
+
+    def __init__(self, s3_service, workers: int = 4, batch_size: int = 50):
+        self.s3_service = s3_service
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+    def _consultas(self, tipos: List[str], object_id: Optional[int]):
+        """(tipo, queryset) das linhas com arquivo local que ainda não foram vinculadas ao S3."""
+        for tipo in tipos:
+            modelo, campo, _, campo_pai = ORIGENS_MIGRACAO[tipo]
+            queryset = modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True}).filter(
+                Q(s3_anexo_id__isnull=True) | Q(s3_anexo_id='')
+            )
+            if object_id:
+                queryset = queryset.filter(**{campo_pai: object_id})
+            yield tipo, queryset.order_by('pk')
+
+    def _pendentes(self, tipos: List[str], object_id: Optional[int]):
+        """
+        Linhas pendentes, lidas em páginas de batch_size por pk: só a página
+        atual fica em memória, e as linhas vinculadas durante a leitura não
+        deslocam as páginas seguintes.
+        """
+        for tipo, queryset in self._consultas(tipos, object_id):
+            _, campo, anexo_type, campo_pai = ORIGENS_MIGRACAO[tipo]
+            ultimo = 0
+            while True:
+                pagina = list(queryset.filter(pk__gt=ultimo)[:self.batch_size])
+                if not pagina:
+                    break
+                ultimo = pagina[-1].pk
+                for instancia in pagina:
+                    yield {
+                        'instancia': instancia,
+                        'arquivo': getattr(instancia, campo),
+                        'anexo_type': anexo_type,
+                        'object_id': getattr(instancia, campo_pai),
+                    }
+
+    def _hash(self, item) -> None:
+        arquivo = item['arquivo']
+        with arquivo.storage.open(arquivo.name, 'rb') as f:
+            item['hash'], item['size'] = self.s3_service._hash_stream(f)
+
+    def _upload(self, item) -> None:
+        arquivo = item['arquivo']
+        content_type = item['content_type']
+        metadata = {'sha256': item['hash'], 'origem': _origem(item['instancia'])}
+        with arquivo.storage.open(arquivo.name, 'rb') as f:
+            uploaded_hash, _ = self.s3_service._upload_stream(f, item['s3_key'], content_type, metadata)
+        if uploaded_hash != item['hash']:
+            raise ValueError(f"Hash mismatch after upload: expected {item['hash']}, got {uploaded_hash}")
+
+    def _s3_key(self, item) -> str:
+        _, extensao = os.path.splitext(item['arquivo'].name)
+        return f"{item['anexo_type']}/migrated/{item['hash'][:2]}/{item['hash']}{extensao.lower()}"
+
+    def _executar(self, pool, funcao, itens) -> List[Dict[str, Any]]:
+        """Aplica funcao a cada item no pool; itens com erro recebem 'erro'."""
+        futures = [(item, pool.submit(funcao, item)) for item in itens]
+        for item, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                item['erro'] = str(e)
+        return [item for item in itens if 'erro' not in item]
+
+    def _processar_lote(self, pool, lote, user_id: int, dry_run: bool) -> Dict[str, int]:
+        validos = self._executar(pool, self._hash, lote)
+
+        # Objetos já existentes no bucket (de execuções anteriores ou uploads normais)
+        existentes = {}
+        for anexo in AnexoS3.objects.filter(file_hash__in={item['hash'] for item in validos}).exclude(bucket_name='local-development'):
+            existentes.setdefault(anexo.file_hash, anexo)
+
+        envios = {}
+        for item in validos:
+            item['content_type'] = mimetypes.guess_type(item['arquivo'].name)[0] or 'application/octet-stream'
+            existente = existentes.get(item['hash'])
+            if existente:
+                item['s3_key'] = existente.s3_key
+                item['bucket_name'] = existente.bucket_name
+                item['deduplicado'] = True
+            else:
+                item['s3_key'] = self._s3_key(item)
+                item['bucket_name'] = self.s3_service.bucket_name
+                item['deduplicado'] = item['hash'] in envios
+                envios.setdefault(item['hash'], item)
+
+        if dry_run:
+            return {
+                'migrated': len(validos),
+                'deduplicated': sum(1 for item in validos if item['deduplicado']),
+            }
+
+        self._executar(pool, self._upload, list(envios.values()))
+        for item in validos:
+            # Itens com conteúdo repetido no lote herdam o resultado do único envio
+            envio = envios.get(item['hash'])
+            if envio is not None and 'erro' in envio:
+                item['erro'] = envio['erro']
+        concluidos = [item for item in validos if 'erro' not in item]
+
+        agora = timezone.now()
+        region = self.s3_service.region
+        with transaction.atomic():
+            anexos = []
+            for item in concluidos:
+                instancia = item['instancia']
+                item['anexo_id'] = str(uuid.uuid4())
+                item['s3_url'] = f"https://{item['bucket_name']}.s3.{region}.amazonaws.com/{item['s3_key']}"
+                anexos.append(AnexoS3(
+                    anexo_id=item['anexo_id'],
+                    nome_original=getattr(instancia, 'nome_original', '') or os.path.basename(item['arquivo'].name),
+                    nome_s3=item['s3_key'].split('/')[-1],
+                    bucket_name=item['bucket_name'],
+                    s3_key=item['s3_key'],
+                    s3_url=item['s3_url'],
+                    content_type=item['content_type'],
+                    file_size=item['size'],
+                    file_hash=item['hash'],
+                    anexo_type=item['anexo_type'],
+                    object_id=item['object_id'],
+                    uploaded_by_id=getattr(instancia, 'uploaded_by_id', None) or user_id,
+                    is_migrated=True,
+                    migration_date=agora,
+                    metadata={'origem': _origem(instancia), 'local_path': item['arquivo'].name},
+                ))
+            AnexoS3.objects.bulk_create(anexos)
+
+            vinculadas = {}
+            for item in concluidos:
+                instancia = item['instancia']
+                instancia.s3_anexo_id = item['anexo_id']
+                instancia.s3_url = item['s3_url']
+                vinculadas.setdefault(type(instancia), []).append(instancia)
+            for modelo, instancias in vinculadas.items():
+                modelo.objects.bulk_update(instancias, ['s3_anexo_id', 's3_url'])
+
+        return {
+            'migrated': len(concluidos),
+            'deduplicated': sum(1 for item in concluidos if item['deduplicado']),
+        }
+
+    def run(self,
+            tipos: Optional[List[str]] = None,
+            object_id: Optional[int] = None,
+            user_id: int = None,
+            dry_run: bool = False,
+            contexto=None) -> Dict[str, Any]:
+        """
+        Migra os arquivos locais pendentes para o S3.
+
+        Args:
+            tipos: Origens a migrar (chaves de ORIGENS_MIGRACAO; padrão: todas)
+            object_id: Restringe aos anexos de um objeto pai (obra, compra, ...)
+            user_id: Usuário responsável (registro da tarefa e dono dos anexos sem uploader)
+            dry_run: Apenas calcula hashes e o que seria enviado, sem enviar nem gravar
+            contexto: ContextoTarefa, quando roda no executor de tarefas: o progresso
+                vai para a tarefa do executor, que também pode ser cancelada entre lotes
+
+        Returns:
+            Dict com resultado da migração
+        """
+        if not self.s3_service.s3_available:
+            return {
+                'success': False,
+                'error': 'S3 service not available for migration'
+            }
+
+        if not user_id:
+            return {
+                'success': False,
+                'error': 'Usuário responsável pela migração é obrigatório'
+            }
+
+        tipos = tipos or list(ORIGENS_MIGRACAO)
+        invalidos = [tipo for tipo in tipos if tipo not in ORIGENS_MIGRACAO]
+        if invalidos:
+            return {
+                'success': False,
+                'error': f"Tipo de anexo inválido: {', '.join(invalidos)}. Use: {', '.join(ORIGENS_MIGRACAO)}"
+            }
+
+        total = sum(queryset.count() for _, queryset in self._consultas(tipos, object_id))
+        metadata = {'tipos': tipos, 'object_id': object_id, 'dry_run': dry_run, 'total': total}
+        if contexto is None:
+            task = TaskHistory.objects.create(
+                task_id=f"migration_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}",
+                task_type='migration',
+                title="Migração de arquivos locais para o S3",
+                status='in_progress',
+                started_at=timezone.now(),
+                created_by_id=user_id,
+                metadata=metadata,
+            )
+        else:
+            contexto.progresso(0, forcar=True, **metadata)
+
+        totais = {'migrated': 0, 'deduplicated': 0}
+        falhas = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='migracao-s3') as pool:
+                pendentes = self._pendentes(tipos, object_id)
+                processados = 0
+                while True:
+                    lote = list(islice(pendentes, self.batch_size))
+                    if not lote:
+                        break
+                    resultado = self._processar_lote(pool, lote, user_id, dry_run)
+                    for chave in totais:
+                        totais[chave] += resultado[chave]
+                    falhas.extend(
+                        {'origem': _origem(item['instancia']), 'local_path': item['arquivo'].name, 'error': item['erro']}
+                        for item in lote if 'erro' in item
+                    )
+
+                    processados += len(lote)
+                    # Linhas incluídas depois da contagem podem passar do total
+                    progresso = min(int(processados * 100 / max(total, 1)), 100)
+                    parcial = {**totais, 'processed': processados, 'failed': len(falhas), 'failed_files': falhas[-100:]}
+                    if contexto is not None:
+                        # Lotes já gravados ficam; uma nova execução continua de onde parou
+                        contexto.progresso(progresso, **parcial)
+                        continue
+                    TaskHistory.objects.filter(pk=task.pk).update(
+                        progress_percentage=progresso,
+                        metadata={**task.metadata, **parcial},
+                        updated_at=timezone.now(),
+                    )
+        except TarefaCancelada:
+            logger.info(f"Migration {contexto.task_id} cancelled: {totais['migrated']} migrated")
+            raise
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            if contexto is not None:
+                return {'success': False, 'task_id': contexto.task_id, 'error': str(e)}
+            TaskHistory.objects.filter(pk=task.pk).update(
+                status='failed', error_message=str(e), completed_at=timezone.now()
+            )
+            return {
+                'success': False,
+                'task_id': task.task_id,
+                'error': str(e)
+            }
+
+        # No executor, o status final é gravado por ele
+        task_id = contexto.task_id if contexto is not None else task.task_id
+        if contexto is None:
+            TaskHistory.objects.filter(pk=task.pk).update(
+                status='completed', progress_percentage=100, completed_at=timezone.now()
+            )
+        logger.info(f"Migration {task_id}: {totais['migrated']} migrated, {len(falhas)} failed")
+        return {
+            'success': True,
+            'task_id': task_id,
+            'dry_run': dry_run,
+            'pending_count': total,
+            'migrated_count': totais['migrated'],
+            'deduplicated_count': totais['deduplicated'],
+            'failed_count': len(falhas),
+            'failed_files': falhas,
+        }
+
+
+@registrar_tarefa('migracao_s3', exclusiva=True)
+def executar_migracao(contexto, tipos: Optional[List[str]] = None, object_id: Optional[int] = None,
+                      dry_run: bool = False, workers: int = 4) -> Dict[str, Any]:
+    """Tarefa do executor: migração dos arquivos locais, cancelável entre lotes."""
+    return MigracaoS3(S3Service(), workers=workers).run(
+        tipos=tipos, object_id=object_id, user_id=contexto.user_id, dry_run=dry_run, contexto=contexto
+    )
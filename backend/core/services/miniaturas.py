@@ -0,0 +1,105 @@
+import os
+from io import BytesIO
+from typing import Optional, Dict, Iterable
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tamanhos fixos das miniaturas: nome -> maior lado em pixels
+MINIATURA_TAMANHOS = {
+    'sm': 160,
+    'md': 480,
+    'lg': 1280,
+}
+MINIATURA_TAMANHO_PADRAO = 'md'
+MINIATURA_QUALIDADE = 80
+
+
+def tamanhos_miniatura() -> Dict[str, int]:
+    return getattr(settings, 'THUMBNAIL_SIZES', MINIATURA_TAMANHOS)
+
+
+def formato_miniatura():
+    """
+    Formato de gravação das miniaturas: (formato PIL, content type, extensão).
+    WebP por padrão; JPEG quando configurado ou quando o Pillow não tem suporte a WebP.
+    """
+    formato = getattr(settings, 'THUMBNAIL_FORMAT', 'WEBP').upper()
+    if formato == 'WEBP' and features.check('webp'):
+        return 'WEBP', 'image/webp', '.webp'
+    return 'JPEG', 'image/jpeg', '.jpg'
+
+
+def caminho_miniatura(caminho_original: str, tamanho: str) -> str:
+    """Caminho da miniatura ao lado do original: <dir>/thumbs/<nome>_<tamanho>.<ext>."""
+    diretorio, nome = os.path.split(caminho_original)
+    base, _ = os.path.splitext(nome)
+    return '/'.join(parte for parte in (diretorio, 'thumbs', f"{base}_{tamanho}{formato_miniatura()[2]}") if parte)
+
+
+def gerar_miniatura(conteudo: bytes, tamanho: str) -> Optional[bytes]:
+    """
+    Reduz uma imagem para o tamanho pedido, aplicando a rotação do EXIF.
+
+    Returns:
+        Bytes da miniatura no formato configurado, ou None se o conteúdo não for uma imagem
+    """
+    lado = tamanhos_miniatura()[tamanho]
+    formato = formato_miniatura()[0]
+    try:
+        with Image.open(BytesIO(conteudo)) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((lado, lado))
+            if formato == 'JPEG' and img.mode != 'RGB':
+                img = img.convert('RGB')
+            elif img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+            saida = BytesIO()
+            img.save(saida, format=formato, quality=MINIATURA_QUALIDADE)
+            return saida.getvalue()
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Não foi possível gerar miniatura {tamanho}: {str(e)}")
+        return None
+
+
+def gerar_miniaturas_arquivo(arquivo, tamanhos: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    """
+    Gera no storage do campo as miniaturas que ainda não existem de um FileField/ImageField.
+    O original é lido uma única vez, e só se faltar alguma miniatura.
+
+    Args:
+        arquivo: FieldFile do original (ex.: FotoObra.imagem)
+        tamanhos: Tamanhos a gerar (padrão: todos)
+
+    Returns:
+        Dict tamanho -> caminho no storage das miniaturas disponíveis
+    """
+    if not arquivo:
+        return {}
+    storage = arquivo.storage
+    caminhos = {tamanho: caminho_miniatura(arquivo.name, tamanho) for tamanho in (tamanhos or tamanhos_miniatura())}
+    faltando = [tamanho for tamanho, caminho in caminhos.items() if not storage.exists(caminho)]
+    if not faltando:
+        return caminhos
+
+    with storage.open(arquivo.name, 'rb') as f:
+        conteudo = f.read()
+    for tamanho in faltando:
+        miniatura = gerar_miniatura(conteudo, tamanho)
+        if miniatura is None:
+            caminhos.pop(tamanho)
+            continue
+        salvo = storage.save(caminhos[tamanho], ContentFile(miniatura))
+        if salvo != caminhos[tamanho]:
+            # Gerada em paralelo por outra requisição: mantém a primeira
+            storage.delete(salvo)
+    return caminhos
+
+
+def url_miniatura_arquivo(arquivo, tamanho: str) -> Optional[str]:
+    """URL da miniatura de um FileField, gerando-a na primeira solicitação."""
+    caminho = gerar_miniaturas_arquivo(arquivo, [tamanho]).get(tamanho)
+    return arquivo.storage.url(caminho) if caminho else None
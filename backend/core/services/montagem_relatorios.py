@@ -0,0 +1,212 @@
+import os
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import Obra, Compra, Despesa_Extra, Locacao_Obras_Equipes, FotoObra, ArquivoObra
+from ..utils import process_attachments_for_pdf
+from .folha_pagamento import montar_folha_por_recurso
+from .relatorio_pagamento import get_locacoes_pagamento, montar_pagamento_locacoes, montar_pagamento_compras
+from .relatorios_pdf import RelatorioPDFErro, registrar_relatorio_pdf
+
+
+# Conteúdo dos relatórios PDF: cada função recebe (parametros, usuario) e
+# devolve template, contexto, CSS e nome do arquivo. As views usam as mesmas
+# funções na resposta síncrona; o executor de tarefas, nos jobs.
+
+
+@registrar_relatorio_pdf('obra')
+def montar_relatorio_obra(parametros, usuario=None):
+    """
+    Contexto do relatório PDF de uma obra. Parâmetros: obra_id e is_simple.
+    """
+    try:
+        obra_instance = Obra.objects.select_related('responsavel').get(pk=parametros.get('obra_id'))
+    except (Obra.DoesNotExist, ValueError, TypeError):
+        raise RelatorioPDFErro("Obra não encontrada")
+    is_simple_report = bool(parametros.get('is_simple', False))
+
+    compras = Compra.objects.filter(obra=obra_instance, tipo='COMPRA').prefetch_related('itens__material').order_by('data_compra', 'nota_fiscal')
+    despesas_extras = Despesa_Extra.objects.filter(obra=obra_instance).order_by('data')
+    locacoes = Locacao_Obras_Equipes.objects.filter(obra=obra_instance).select_related(
+        'equipe__lider',
+        'funcionario_locado'
+    ).prefetch_related(
+        'equipe__membros'
+    ).order_by('data_locacao_inicio')
+
+    # Fetch all attachments
+    fotos_qs = FotoObra.objects.filter(obra=obra_instance).order_by('uploaded_at')
+    arquivos_qs = ArquivoObra.objects.filter(obra=obra_instance).order_by('uploaded_at')
+
+    # Combine all attachments into a single list
+    all_attachments = list(fotos_qs) + list(arquivos_qs)
+
+    # Process attachments for embedding in the PDF
+    anexos_processados = process_attachments_for_pdf(all_attachments)
+
+    custo_total_materiais = sum(c.valor_total_liquido for c in compras if c.valor_total_liquido) or Decimal('0.00')
+    custo_total_despesas_extras = sum(de.valor for de in despesas_extras if de.valor) or Decimal('0.00')
+    custo_total_locacoes = sum(loc.valor_pagamento for loc in locacoes if loc.valor_pagamento) or Decimal('0.00')
+
+    custo_total_realizado = custo_total_materiais + custo_total_despesas_extras + custo_total_locacoes
+    balanco_financeiro = (obra_instance.orcamento_previsto or Decimal('0.00')) - custo_total_realizado
+
+    custo_por_m2 = Decimal('0.00')
+    if obra_instance.area_metragem and obra_instance.area_metragem > Decimal('0.01'):  # Mínimo de 0.01 m²
+        try:
+            custo_por_m2 = custo_total_realizado / obra_instance.area_metragem
+            if not custo_por_m2.is_finite() or custo_por_m2 > Decimal('999999.99'):
+                custo_por_m2 = Decimal('0.00')
+        except (ZeroDivisionError, InvalidOperation, OverflowError):
+            custo_por_m2 = Decimal('0.00')
+
+    # Categorize locacoes
+    locacoes_equipe = []
+    locacoes_funcionario = []
+    locacoes_servico = []
+    for loc in locacoes:
+        if loc.equipe:
+            locacoes_equipe.append(loc)
+        elif loc.funcionario_locado:
+            locacoes_funcionario.append(loc)
+        elif loc.servico_externo:
+            locacoes_servico.append(loc)
+
+    context = {
+        'obra': obra_instance,
+        'compras': compras,
+        'despesas_extras': despesas_extras,
+        'locacoes_equipe': locacoes_equipe,
+        'locacoes_funcionario': locacoes_funcionario,
+        'locacoes_servico': locacoes_servico,
+        'anexos_processados': anexos_processados,
+        'data_emissao': timezone.now(),
+        'custo_total_materiais': custo_total_materiais,
+        'custo_total_despesas_extras': custo_total_despesas_extras,
+        'custo_total_locacoes': custo_total_locacoes,
+        'custo_total_realizado': custo_total_realizado,
+        'balanco_financeiro': balanco_financeiro,
+        'custo_por_m2': custo_por_m2,
+        'MEDIA_ROOT': settings.MEDIA_ROOT,
+        'is_simple_report': is_simple_report,
+    }
+
+    # O template pode usar a flag 'is_simple_report' para mostrar/ocultar seções
+    clean_obra_nome = "".join([c if c.isalnum() else "_" for c in obra_instance.nome_obra])
+    return {
+        'template': 'relatorios/relatorio_obra.html',
+        'context': context,
+        'css_path': os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_obra.css'),
+        'filename': f'Relatorio_Obra_{clean_obra_nome}_{obra_instance.id}.pdf',
+    }
+
+
+@registrar_relatorio_pdf('pagamento')
+def montar_relatorio_pagamento(parametros, usuario=None):
+    """
+    Contexto do PDF de pagamentos (compras ou locações) do RelatorioPagamentoViewSet.
+    Parâmetros: start_date, end_date, tipo, filtro_locacao e obra_id.
+    """
+    try:
+        start_date = date.fromisoformat(parametros['start_date'])
+        end_date = date.fromisoformat(parametros['end_date'])
+    except (KeyError, TypeError, ValueError):
+        raise RelatorioPDFErro("Formato de data inválido. Use YYYY-MM-DD.")
+    start_date_str, end_date_str = parametros['start_date'], parametros['end_date']
+
+    if parametros.get('tipo') == 'compras':
+        compras_qs = Compra.objects.filter(
+            data_pagamento__range=[start_date, end_date],
+            tipo='COMPRA'
+        ).order_by('data_pagamento')
+        context = montar_pagamento_compras(compras_qs, start_date, end_date)
+        context['data_emissao'] = timezone.now()
+        return {
+            'template': 'relatorios/relatorio_pagamento_compras.html',
+            'context': context,
+            'css_path': os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_compras.css'),
+            'filename': f'relatorio_pagamento_compras_{start_date_str}_a_{end_date_str}.pdf',
+        }
+
+    if parametros.get('tipo') == 'locacoes':
+        locacoes = get_locacoes_pagamento(start_date, end_date, parametros.get('filtro_locacao'))
+        context = montar_pagamento_locacoes(locacoes, start_date, end_date)
+        context['data_emissao'] = timezone.now()
+        context['obra_filter_nome'] = None
+        if parametros.get('obra_id'):
+            try:
+                context['obra_filter_nome'] = Obra.objects.get(pk=int(parametros['obra_id'])).nome_obra
+            except (Obra.DoesNotExist, ValueError):
+                pass
+        return {
+            'template': 'relatorios/relatorio_pagamento_locacoes.html',
+            'context': context,
+            'css_path': os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_pagamento_locacoes.css'),
+            'filename': f'relatorio_pagamento_locacoes_{start_date_str}_a_{end_date_str}.pdf',
+        }
+
+    raise RelatorioPDFErro("Tipo de relatório inválido. Use 'compras' ou 'locacoes'.")
+
+
+@registrar_relatorio_pdf('pagamento_locacoes')
+def montar_relatorio_pagamento_locacoes(parametros, usuario=None):
+    """
+    Contexto do PDF de pagamento de locações. Parâmetros: start_date, end_date
+    (YYYY-MM-DD) e obra_id opcional.
+    """
+    try:
+        start_date_obj = date.fromisoformat(parametros['start_date'])
+        end_date_obj = date.fromisoformat(parametros['end_date'])
+    except (KeyError, TypeError, ValueError):
+        raise RelatorioPDFErro("Formato de data inválido. Use YYYY-MM-DD.")
+    obra_id_filter = parametros.get('obra_id')
+
+    context = montar_folha_por_recurso(start_date_obj, end_date_obj, obra_id_filter)
+    context['data_emissao'] = timezone.now()
+    context['start_date_filter'] = start_date_obj
+    context['end_date_filter'] = end_date_obj
+    if obra_id_filter:
+        context['obra_filter_nome'] = Obra.objects.filter(pk=obra_id_filter).values_list('nome_obra', flat=True).first()
+
+    return {
+        'template': 'relatorios/relatorio_pagamento_locacoes.html',
+        'context': context,
+        'css_path': os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_pagamento_locacoes.css'),
+        'filename': f"Relatorio_Pagamento_Locacoes_{parametros['start_date']}_a_{parametros['end_date']}.pdf",
+    }
+
+
+@registrar_relatorio_pdf('compras_lote')
+def montar_relatorio_compras_lote(parametros, usuario=None):
+    """
+    Contexto do PDF em lote de compras. Parâmetros: compra_ids.
+    """
+    compra_ids = parametros.get('compra_ids') or []
+    compras = Compra.objects.filter(id__in=compra_ids).prefetch_related(
+        'itens__material', 'parcelas', 'anexos'
+    )
+    if not compras.exists():
+        raise RelatorioPDFErro('Nenhuma compra encontrada com os IDs fornecidos')
+
+    # Preparar dados das compras com anexos processados
+    compras_data = []
+    for compra in compras:
+        anexos_processados = process_attachments_for_pdf(compra.anexos.all())
+        compras_data.append({
+            'compra': compra,
+            'anexos_processados': anexos_processados
+        })
+
+    return {
+        'template': 'relatorios/relatorio_compras_lote.html',
+        'context': {
+            'compras': compras,
+            'compras_data': compras_data,
+            'data_geracao': timezone.now(),
+            'usuario': usuario,
+        },
+        'css_path': os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_compras.css'),
+        'filename': f'Relatorio_Compras_Lote_{timezone.now().strftime("%Y%m%d_%H%M%S")}.pdf',
+    }
@@ -0,0 +1,200 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Any, Iterable, List, Optional
+
+from django.db import connection, transaction
+
+from ..models import Equipe, Locacao_Obras_Equipes, OcupacaoFuncionario
+
+
+def _membros_por_equipe(equipe_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """Membros de várias equipes em uma única consulta."""
+    membros = defaultdict(list)
+    equipe_ids = {equipe_id for equipe_id in equipe_ids if equipe_id}
+    if equipe_ids:
+        vinculos = Equipe.membros.through.objects.filter(
+            equipe_id__in=equipe_ids
+        ).values_list('equipe_id', 'funcionario_id')
+        for equipe_id, funcionario_id in vinculos:
+            membros[equipe_id].append(funcionario_id)
+    return membros
+
+
+def sincronizar_ocupacoes(locacoes: Iterable[Locacao_Obras_Equipes]) -> int:
+    """
+    Recria as linhas de ocupação das locações informadas.
+    Locações canceladas ou de serviço externo não ocupam ninguém.
+
+    Returns:
+        Quantidade de linhas de ocupação criadas
+    """
+    locacoes = [locacao for locacao in locacoes if locacao.pk]
+    if not locacoes:
+        return 0
+
+    membros = _membros_por_equipe(locacao.equipe_id for locacao in locacoes)
+
+    novas = []
+    for locacao in locacoes:
+        if locacao.status_locacao != 'ativa':
+            continue
+        data_fim = locacao.data_locacao_fim or locacao.data_locacao_inicio
+        if locacao.funcionario_locado_id:
+            funcionario_ids = [locacao.funcionario_locado_id]
+        elif locacao.equipe_id:
+            funcionario_ids = membros.get(locacao.equipe_id, [])
+        else:
+            continue
+        for funcionario_id in funcionario_ids:
+            novas.append(OcupacaoFuncionario(
+                funcionario_id=funcionario_id,
+                locacao_id=locacao.pk,
+                obra_id=locacao.obra_id,
+                equipe_id=locacao.equipe_id,
+                data_inicio=locacao.data_locacao_inicio,
+                data_fim=data_fim,
+            ))
+
+    with transaction.atomic():
+        OcupacaoFuncionario.objects.filter(locacao_id__in=[locacao.pk for locacao in locacoes]).delete()
+        OcupacaoFuncionario.objects.bulk_create(novas, batch_size=500)
+    return len(novas)
+
+
+def sincronizar_ocupacoes_equipe(equipe_id: int) -> int:
+    """Reindexa as locações de uma equipe após mudança nos membros."""
+    return sincronizar_ocupacoes(Locacao_Obras_Equipes.objects.filter(equipe_id=equipe_id))
+
+
+def reconstruir_ocupacoes(batch_size: int = 1000) -> int:
+    """Reconstrói o índice inteiro a partir das locações."""
+    total = 0
+    with transaction.atomic():
+        OcupacaoFuncionario.objects.all().delete()
+        lote = []
+        for locacao in Locacao_Obras_Equipes.objects.filter(status_locacao='ativa').iterator(chunk_size=batch_size):
+            lote.append(locacao)
+            if len(lote) >= batch_size:
+                total += sincronizar_ocupacoes(lote)
+                lote = []
+        total += sincronizar_ocupacoes(lote)
+    return total
+
+
+def _filtrar_sobreposicao(queryset, data_inicio: date, data_fim: date):
+    """
+    Ocupações que se sobrepõem a [data_inicio, data_fim].
+    No Postgres a condição é expressa como sobreposição de daterange, para que o
+    planner use o índice GiST; nos demais bancos usa o índice composto.
+    """
+    if connection.vendor == 'postgresql':
+        from django.db.models import F, Func, Value
+        from django.contrib.postgres.fields import DateRangeField
+        from psycopg2.extras import DateRange
+
+        return queryset.annotate(
+            periodo=Func(F('data_inicio'), F('data_fim'), Value('[]'), function='daterange', output_field=DateRangeField())
+        ).filter(periodo__overlap=DateRange(data_inicio, data_fim, '[]'))
+    return queryset.filter(data_inicio__lte=data_fim, data_fim__gte=data_inicio)
+
+
+def _serializar_conflito(ocupacao: OcupacaoFuncionario) -> Dict[str, Any]:
+    return {
+        'funcionario_id': ocupacao.funcionario_id,
+        'funcionario_nome': ocupacao.funcionario.nome_completo,
+        'obra_id': ocupacao.obra_id,
+        'obra_nome': ocupacao.obra.nome_obra,
+        'locacao_id': ocupacao.locacao_id,
+        'equipe_id': ocupacao.equipe_id,
+        'data_inicio': ocupacao.data_inicio.isoformat(),
+        'data_fim': ocupacao.data_fim.isoformat(),
+    }
+
+
+def verificar_conflitos(propostas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Verifica conflitos de várias alocações propostas de uma só vez.
+
+    Cada proposta tem 'funcionario_locado' ou 'equipe' (IDs), 'data_locacao_inicio',
+    'data_locacao_fim' (opcional) e 'locacao_id' (opcional, locação que está sendo
+    editada e não conta como conflito). Todas as ocupações relevantes são carregadas
+    em uma consulta e checadas em memória; sobreposições entre propostas do próprio
+    lote também são apontadas.
+
+    Returns:
+        Lista (na ordem das propostas) de dicts com 'indice', 'conflitos' e
+        'conflitos_no_lote'
+    """
+    membros = _membros_por_equipe(proposta.get('equipe') for proposta in propostas)
+
+    normalizadas = []
+    for proposta in propostas:
+        inicio = proposta['data_locacao_inicio']
+        fim = proposta.get('data_locacao_fim') or inicio
+        if fim < inicio:
+            fim = inicio
+        if proposta.get('funcionario_locado'):
+            funcionario_ids = {proposta['funcionario_locado']}
+        elif proposta.get('equipe'):
+            funcionario_ids = set(membros.get(proposta['equipe'], []))
+        else:
+            funcionario_ids = set()
+        normalizadas.append((funcionario_ids, inicio, fim, proposta.get('locacao_id')))
+
+    todos_funcionarios = set().union(*(n[0] for n in normalizadas)) if normalizadas else set()
+    ocupacoes_por_funcionario = defaultdict(list)
+    if todos_funcionarios:
+        menor_inicio = min(n[1] for n in normalizadas if n[0])
+        maior_fim = max(n[2] for n in normalizadas if n[0])
+        ocupacoes = _filtrar_sobreposicao(
+            OcupacaoFuncionario.objects.filter(funcionario_id__in=todos_funcionarios),
+            menor_inicio, maior_fim
+        ).select_related('funcionario', 'obra').order_by('data_inicio', 'locacao_id')
+        for ocupacao in ocupacoes:
+            ocupacoes_por_funcionario[ocupacao.funcionario_id].append(ocupacao)
+    inicios_por_funcionario = {
+        funcionario_id: [ocupacao.data_inicio for ocupacao in lista]
+        for funcionario_id, lista in ocupacoes_por_funcionario.items()
+    }
+
+    resultados = []
+    for indice, (funcionario_ids, inicio, fim, locacao_id) in enumerate(normalizadas):
+        conflitos = []
+        for funcionario_id in sorted(funcionario_ids):
+            lista = ocupacoes_por_funcionario.get(funcionario_id, [])
+            # Só as ocupações que começam até o fim da proposta podem sobrepor
+            limite = bisect_right(inicios_por_funcionario.get(funcionario_id, []), fim)
+            for ocupacao in lista[:limite]:
+                if ocupacao.data_fim >= inicio and ocupacao.locacao_id != locacao_id:
+                    conflitos.append(_serializar_conflito(ocupacao))
+
+        conflitos_no_lote = [
+            outro_indice
+            for outro_indice, (outros_ids, outro_inicio, outro_fim, _) in enumerate(normalizadas)
+            if outro_indice != indice and funcionario_ids & outros_ids
+            and outro_inicio <= fim and outro_fim >= inicio
+        ]
+        resultados.append({
+            'indice': indice,
+            'conflitos': conflitos,
+            'conflitos_no_lote': conflitos_no_lote,
+        })
+    return resultados
+
+
+def buscar_conflito(funcionario_ids: Iterable[int],
+                    data_inicio: date,
+                    data_fim: Optional[date] = None,
+                    excluir_locacao_id: Optional[int] = None) -> Optional[OcupacaoFuncionario]:
+    """Primeira ocupação que conflita com o período para algum dos funcionários."""
+    funcionario_ids = list(funcionario_ids)
+    if not funcionario_ids or not data_inicio:
+        return None
+    data_fim = data_fim if data_fim and data_fim >= data_inicio else data_inicio
+    queryset = _filtrar_sobreposicao(
+        OcupacaoFuncionario.objects.filter(funcionario_id__in=funcionario_ids), data_inicio, data_fim
+    )
+    if excluir_locacao_id:
+        queryset = queryset.exclude(locacao_id=excluir_locacao_id)
+    return queryset.select_related('funcionario', 'obra').order_by('data_inicio', 'locacao_id').first()
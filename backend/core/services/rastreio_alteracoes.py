@@ -0,0 +1,110 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Set
+from django.apps import apps
+from django.db.models.signals import post_save, post_delete, m2m_changed
+import logging
+
+from ..models import (
+    RegistroAlteracao, BackupLog, TaskHistory, Backup, BlocoBackup, BlocoManifesto,
+    ObraCustoResumo, CustoDiarioObra, OcupacaoFuncionario, Obra,
+)
+from .ocupacao import reconstruir_ocupacoes
+from .custos_diarios import reconstruir_custos_diarios
+
+logger = logging.getLogger(__name__)
+
+
+# Controle dos próprios backups e tarefas: não entram nos incrementais
+MODELOS_SEM_RASTREIO = (RegistroAlteracao, BackupLog, TaskHistory, Backup, BlocoBackup, BlocoManifesto)
+
+# Tabelas derivadas: mantidas por signals com bulk_create/update e reconstruídas
+# a partir das tabelas de origem depois de aplicar incrementais
+MODELOS_DERIVADOS = (ObraCustoResumo, CustoDiarioObra, OcupacaoFuncionario)
+
+
+def modelos_rastreados() -> List:
+    """Modelos do app core cujas alterações entram nos backups incrementais."""
+    ignorados = MODELOS_SEM_RASTREIO + MODELOS_DERIVADOS
+    return [
+        modelo for modelo in apps.get_app_config('core').get_models()
+        if modelo not in ignorados and not modelo._meta.proxy
+    ]
+
+
+def registrar_alteracoes(modelo, pks: Iterable) -> None:
+    """
+    Registra alterações feitas sem signals (bulk_create, queryset.update)
+    em modelos rastreados.
+    """
+    label = modelo._meta.label_lower
+    RegistroAlteracao.objects.bulk_create(
+        [RegistroAlteracao(modelo=label, objeto_id=str(pk)) for pk in pks if pk is not None],
+        batch_size=500
+    )
+
+
+def _registrar(sender, instance, **kwargs):
+    RegistroAlteracao.objects.create(modelo=sender._meta.label_lower, objeto_id=str(instance.pk))
+
+
+def _registrar_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Mudança em um ManyToMany altera o registro dono do campo (ex.: a Equipe em
+    equipe.membros). Pelo lado reverso (funcionario.equipes_membro), os donos
+    são os objetos em pk_set ou, no clear, os vínculos existentes antes dele.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _registrar(type(instance), instance)
+        return
+
+    if action == 'pre_clear':
+        campo_dono = next(f.attname for f in sender._meta.fields if f.related_model is model)
+        campo_instancia = next(f.attname for f in sender._meta.fields if f.related_model is type(instance))
+        pk_set = sender.objects.filter(**{campo_instancia: instance.pk}).values_list(campo_dono, flat=True)
+    elif action not in ('post_add', 'post_remove'):
+        return
+    registrar_alteracoes(model, list(pk_set or []))
+
+
+def conectar_rastreio() -> None:
+    """Conecta os signals do diário de alterações (chamado em core/signals.py)."""
+    for modelo in modelos_rastreados():
+        uid = f"rastreio_alteracoes_{modelo._meta.label_lower}"
+        post_save.connect(_registrar, sender=modelo, dispatch_uid=uid)
+        post_delete.connect(_registrar, sender=modelo, dispatch_uid=uid)
+        for campo in modelo._meta.local_many_to_many:
+            m2m_changed.connect(_registrar_m2m, sender=campo.remote_field.through, dispatch_uid=f"{uid}_{campo.name}")
+
+
+def alteracoes_desde(desde: datetime) -> Dict[str, Set[str]]:
+    """
+    Registros alterados a partir de um instante, por modelo (label -> pks).
+    Junta o diário de alterações com o updated_at dos modelos que o têm
+    (cobre queryset.update() que atualiza o campo).
+    """
+    alterados = defaultdict(set)
+    registros = RegistroAlteracao.objects.filter(alterado_em__gte=desde).values_list('modelo', 'objeto_id').distinct()
+    for label, objeto_id in registros.iterator(chunk_size=2000):
+        alterados[label].add(objeto_id)
+
+    for modelo in modelos_rastreados():
+        if any(campo.name == 'updated_at' for campo in modelo._meta.concrete_fields):
+            pks = modelo._base_manager.filter(updated_at__gte=desde).values_list('pk', flat=True)
+            alterados[modelo._meta.label_lower].update(str(pk) for pk in pks.iterator(chunk_size=2000))
+    return {label: pks for label, pks in alterados.items() if pks}
+
+
+def limpar_registros_ate(limite: datetime) -> int:
+    """Remove do diário as alterações já cobertas por um backup completo."""
+    removidos, _ = RegistroAlteracao.objects.filter(alterado_em__lt=limite).delete()
+    return removidos
+
+
+def reconstruir_derivados() -> None:
+    """Reconstrói as tabelas derivadas a partir das tabelas de origem."""
+    reconstruir_ocupacoes()
+    reconstruir_custos_diarios()
+    for obra_id in Obra.objects.values_list('pk', flat=True).iterator(chunk_size=500):
+        ObraCustoResumo.recalcular(obra_id)
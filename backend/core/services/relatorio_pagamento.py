@@ -0,0 +1,152 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Any, Optional
+
+from django.db.models import Q
+
+from ..models import Locacao_Obras_Equipes
+from ..serializers import ItemCompraSerializer
+from .folha_pagamento import get_recurso_nome_folha
+
+
+def get_locacoes_pagamento(start_date: date, end_date: date, filtro_locacao: Optional[str] = None):
+    """
+    Locações ativas pagas (ou iniciadas, sem data de pagamento) no período,
+    opcionalmente só serviços ou só funcionários e equipes.
+    """
+    date_filter = Q(data_pagamento__range=[start_date, end_date]) | \
+                  (Q(data_pagamento__isnull=True) & Q(data_locacao_inicio__range=[start_date, end_date]))
+
+    locacoes_qs = Locacao_Obras_Equipes.objects.filter(date_filter, status_locacao='ativa').select_related('obra', 'funcionario_locado', 'equipe')
+
+    if filtro_locacao == 'servicos':
+        locacoes_qs = locacoes_qs.filter(servico_externo__isnull=False).exclude(servico_externo__exact='')
+    elif filtro_locacao == 'funcionarios_e_equipes':
+        locacoes_qs = locacoes_qs.filter(Q(funcionario_locado__isnull=False) | Q(equipe__isnull=False))
+
+    return locacoes_qs
+
+
+def montar_pagamento_locacoes(locacoes, start_date: date, end_date: date) -> Dict[str, Any]:
+    """
+    Relatório de pagamento de locações, agrupado por recurso e, dentro dele, por obra.
+    """
+    pagamentos_por_recurso = defaultdict(lambda: {
+        "recurso_nome": "",
+        "total_a_pagar_periodo": Decimal('0.00'),
+        "detalhes_por_obra": defaultdict(lambda: {
+            "obra_id": None, "obra_nome": "",
+            "total_a_pagar_obra": Decimal('0.00'),
+            "locacoes_na_obra": []
+        })
+    })
+    grand_total_geral = Decimal('0.00')
+
+    for locacao in locacoes:
+        recurso_nome = get_recurso_nome_folha(locacao)
+        obra_nome = locacao.obra.nome_obra if locacao.obra else "Obra Desconhecida"
+        obra_id = locacao.obra.id if locacao.obra else 0
+        valor_pagamento = locacao.valor_pagamento or Decimal('0.00')
+
+        recurso_data = pagamentos_por_recurso[recurso_nome]
+        recurso_data["recurso_nome"] = recurso_nome
+        recurso_data["total_a_pagar_periodo"] += valor_pagamento
+
+        obra_details = recurso_data["detalhes_por_obra"][obra_id]
+        obra_details["obra_id"] = obra_id
+        obra_details["obra_nome"] = obra_nome
+        obra_details["total_a_pagar_obra"] += valor_pagamento
+
+        obra_details["locacoes_na_obra"].append({
+            "locacao_id": locacao.id,
+            "data_servico": locacao.data_pagamento if locacao.data_pagamento else locacao.data_locacao_inicio,
+            "tipo_pagamento": locacao.get_tipo_pagamento_display(),
+            "valor_atribuido": str(valor_pagamento),
+            "observacoes": locacao.observacoes or ""
+        })
+        grand_total_geral += valor_pagamento
+
+    final_recursos_list = []
+    for rec_nome, rec_data in sorted(pagamentos_por_recurso.items()):
+        rec_data["total_a_pagar_periodo"] = str(rec_data["total_a_pagar_periodo"])
+        obras_list = []
+        for ob_id, ob_data in sorted(rec_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
+            ob_data["total_a_pagar_obra"] = str(ob_data["total_a_pagar_obra"])
+            ob_data["locacoes_na_obra"].sort(key=lambda x: x["data_servico"])
+            obras_list.append(ob_data)
+        rec_data["detalhes_por_obra"] = obras_list
+        final_recursos_list.append(rec_data)
+
+    final_recursos_list.sort(key=lambda x: x["recurso_nome"])
+
+    return {
+        "periodo": {"inicio": start_date, "fim": end_date},
+        "recursos_pagamentos": final_recursos_list,
+        "total_geral_periodo": str(grand_total_geral)
+    }
+
+def montar_pagamento_compras(compras_qs, start_date: date, end_date: date) -> Dict[str, Any]:
+    """
+    Relatório de pagamento de compras, agrupado por fornecedor e, dentro dele, por obra.
+    """
+    pagamentos_por_fornecedor = defaultdict(lambda: {
+        "fornecedor_nome": "",
+        "total_a_pagar_periodo": Decimal('0.00'),
+        "detalhes_por_obra": defaultdict(lambda: {
+            "obra_id": None, "obra_nome": "",
+            "total_a_pagar_obra": Decimal('0.00'),
+            "compras_na_obra": []
+        })
+    })
+    grand_total_geral = Decimal('0.00')
+
+    compras_qs = compras_qs.select_related('obra').prefetch_related('itens__material')
+
+    for compra in compras_qs:
+        fornecedor_nome = compra.fornecedor or "Fornecedor não especificado"
+        obra_nome = compra.obra.nome_obra if compra.obra else "Obra Desconhecida"
+        obra_id = compra.obra.id if compra.obra else 0
+        valor_pagamento = compra.valor_total_liquido or Decimal('0.00')
+
+        fornecedor_data = pagamentos_por_fornecedor[fornecedor_nome]
+        fornecedor_data["fornecedor_nome"] = fornecedor_nome
+        fornecedor_data["total_a_pagar_periodo"] += valor_pagamento
+
+        obra_details = fornecedor_data["detalhes_por_obra"][obra_id]
+        obra_details["obra_id"] = obra_id
+        obra_details["obra_nome"] = obra_nome
+        obra_details["total_a_pagar_obra"] += valor_pagamento
+
+        items_serializer = ItemCompraSerializer(compra.itens.all(), many=True)
+
+        obra_details["compras_na_obra"].append({
+            "compra_id": compra.id,
+            "data_pagamento": compra.data_pagamento,
+            "nota_fiscal": compra.nota_fiscal,
+            "valor_total_liquido": str(valor_pagamento),
+            "observacoes": compra.observacoes or "",
+            "itens": items_serializer.data,
+            "forma_pagamento": compra.get_forma_pagamento_display(),
+            "numero_parcelas": compra.numero_parcelas,
+        })
+        grand_total_geral += valor_pagamento
+
+    final_fornecedores_list = []
+    for f_nome, f_data in sorted(pagamentos_por_fornecedor.items()):
+        f_data["total_a_pagar_periodo"] = str(f_data["total_a_pagar_periodo"])
+        obras_list = []
+        for o_id, o_data in sorted(f_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
+            o_data["total_a_pagar_obra"] = str(o_data["total_a_pagar_obra"])
+            o_data["compras_na_obra"].sort(key=lambda x: x["data_pagamento"] or date.min)
+            obras_list.append(o_data)
+        f_data["detalhes_por_obra"] = obras_list
+        final_fornecedores_list.append(f_data)
+
+    final_fornecedores_list.sort(key=lambda x: x["fornecedor_nome"])
+
+    return {
+        "periodo": {"inicio": start_date, "fim": end_date},
+        "fornecedores_pagamentos": final_fornecedores_list,
+        "total_geral_periodo": str(grand_total_geral)
+    }
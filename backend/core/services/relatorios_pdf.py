@@ -0,0 +1,270 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from importlib import import_module
+from typing import Dict, Any, Callable
+from django.conf import settings
+from django.utils import timezone
+import logging
+
+from ..models import TaskHistory
+from ..utils import render_pdf_bytes
+from .executor_tarefas import registrar_tarefa, executar_tarefa
+from .s3_service import S3Service, S3_DELETE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+# Relatórios disponíveis para geração em segundo plano.
+# Cada função recebe (parametros, usuario) e retorna um dict com 'template',
+# 'context', 'css_path' e 'filename'; é registrada em MODULOS_RELATORIOS.
+RELATORIOS_PDF: Dict[str, Callable] = {}
+
+# Módulos que registram relatórios, importados antes de criar ou gerar um job
+MODULOS_RELATORIOS = (
+    'core.services.montagem_relatorios',
+)
+
+
+def registrar_relatorio_pdf(tipo: str):
+    """Decorator que registra a função que monta o contexto de um relatório."""
+    def decorator(func):
+        RELATORIOS_PDF[tipo] = func
+        return func
+    return decorator
+
+
+def carregar_relatorios() -> Dict[str, Callable]:
+    for modulo in MODULOS_RELATORIOS:
+        import_module(modulo)
+    return RELATORIOS_PDF
+
+
+class RelatorioPDFErro(ValueError):
+    """Parâmetros inválidos para um relatório (mensagem exibida ao usuário)."""
+
+
+class RelatorioPDFService:
+    """
+    Fila de geração de relatórios PDF em segundo plano.
+
+    O job é registrado em TaskHistory (task_type 'report') com o handler
+    'relatorio_pdf' e roda no executor de tarefas (manage.py executar_tarefas),
+    fora do servidor web. O PDF resultante fica no S3, se disponível, ou em
+    PDF_REPORTS_DIR, até expirar. Com PDF_REPORTS_SYNC=True o job roda na
+    própria chamada de submit, o que permite testar o job inteiro no mesmo processo.
+    """
+
+    def __init__(self):
+        self.reports_dir = getattr(settings, 'PDF_REPORTS_DIR', '/tmp/relatorios_pdf')
+        self.ttl_hours = getattr(settings, 'PDF_REPORTS_TTL_HOURS', 24)
+        self.s3_service = S3Service()
+        self.prefixo_s3 = 'relatorios_pdf'
+        os.makedirs(self.reports_dir, exist_ok=True)
+
+    def _artifact_path(self, task_id: str) -> str:
+        return os.path.join(self.reports_dir, f"{task_id}.pdf")
+
+    def _artifact_key(self, task_id: str) -> str:
+        return f"{self.prefixo_s3}/{task_id}.pdf"
+
+    def _gravar_artefato(self, task_id: str, pdf_bytes: bytes) -> str:
+        """
+        Grava o PDF onde o servidor web consegue lê-lo: no S3, já que o executor
+        roda em outro serviço, ou no disco local quando o S3 não está configurado.
+        """
+        if self.s3_service.s3_available:
+            self.s3_service.s3_client.put_object(
+                Bucket=self.s3_service.bucket_name, Key=self._artifact_key(task_id), Body=pdf_bytes,
+                ContentType='application/pdf'
+            )
+            return 's3'
+        # Grava em arquivo temporário e renomeia, para nunca expor um PDF parcial
+        path = self._artifact_path(task_id)
+        temp_path = f"{path}.part"
+        with open(temp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(temp_path, path)
+        return 'local'
+
+    def _expirado(self, task: TaskHistory) -> bool:
+        return task.completed_at is None or task.completed_at < timezone.now() - timedelta(hours=self.ttl_hours)
+
+    def submit(self, tipo: str, parametros: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+        """
+        Registra um job de relatório na fila do executor de tarefas.
+
+        Args:
+            tipo: Relatório registrado em RELATORIOS_PDF
+            parametros: Parâmetros do relatório (JSON serializável)
+            user_id: ID do usuário que solicitou
+
+        Returns:
+            Dict com resultado da operação e o task_id do job
+        """
+        if tipo not in carregar_relatorios():
+            return {
+                'success': False,
+                'error': f"Tipo de relatório inválido: {tipo}. Use: {', '.join(sorted(RELATORIOS_PDF))}"
+            }
+
+        try:
+            self.cleanup_expired()
+
+            task_id = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+            task = TaskHistory.objects.create(
+                task_id=task_id,
+                task_type='report',
+                title=f"Relatório PDF: {tipo}",
+                status='pending',
+                priority='high',
+                created_by_id=user_id,
+                # Pendente: fica na fila do executor de tarefas
+                metadata={'relatorio': tipo, 'parametros': parametros, 'handler': 'relatorio_pdf', 'params': {}},
+            )
+
+            if getattr(settings, 'PDF_REPORTS_SYNC', False):
+                self.run_job(task)
+
+            logger.info(f"Report job submitted: {task_id} ({tipo})")
+            return {'success': True, 'task_id': task_id}
+
+        except Exception as e:
+            logger.error(f"Error submitting report job: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def run_job(self, task: TaskHistory) -> Dict[str, Any]:
+        """Executa um job pendente na própria chamada (PDF_REPORTS_SYNC)."""
+        agora = timezone.now()
+        if not TaskHistory.objects.filter(pk=task.pk, status='pending').update(
+            status='in_progress', started_at=agora, updated_at=agora
+        ):
+            return {'success': False, 'error': 'Task is not pending'}
+        task.status = 'in_progress'
+        return executar_tarefa(task)
+
+    def gerar(self, contexto) -> Dict[str, Any]:
+        """
+        Gera o PDF de um job: monta o contexto, renderiza e grava o arquivo.
+        O progresso gravado a cada etapa também renova a tarefa no executor.
+
+        Returns:
+            Dict com resultado da execução
+        """
+        inicio = time.monotonic()
+        tipo = contexto.metadata.get('relatorio')
+        task = TaskHistory.objects.select_related('created_by').get(pk=contexto.pk)
+        contexto.progresso(5, forcar=True)
+
+        relatorio = carregar_relatorios()[tipo](contexto.metadata.get('parametros') or {}, task.created_by)
+        contexto.progresso(30, forcar=True)
+
+        pdf_bytes = render_pdf_bytes(relatorio['template'], relatorio['context'], relatorio['css_path'])
+        contexto.progresso(80, forcar=True)
+
+        armazenamento = self._gravar_artefato(contexto.task_id, pdf_bytes)
+        contexto.metadata.update({
+            'filename': relatorio['filename'],
+            'size_bytes': len(pdf_bytes),
+            'storage': armazenamento,
+            'duration_seconds': round(time.monotonic() - inicio, 3),
+        })
+        logger.info(f"Report job completed: {contexto.task_id} ({len(pdf_bytes)} bytes, {armazenamento})")
+        return {'success': True, 'task_id': contexto.task_id, 'filename': relatorio['filename']}
+
+    def get_job(self, task_id: str) -> Dict[str, Any]:
+        """
+        Situação de um job de relatório, para polling pelo cliente.
+        """
+        try:
+            task = TaskHistory.objects.get(task_id=task_id, task_type='report')
+        except TaskHistory.DoesNotExist:
+            return {'success': False, 'error': 'Task not found'}
+
+        return {
+            'success': True,
+            'job': {
+                'task_id': task.task_id,
+                'relatorio': task.metadata.get('relatorio'),
+                'status': task.status,
+                'progress_percentage': task.progress_percentage,
+                'created_at': task.created_at,
+                'started_at': task.started_at,
+                'completed_at': task.completed_at,
+                'error_message': task.error_message,
+                'filename': task.metadata.get('filename'),
+                'size_bytes': task.metadata.get('size_bytes'),
+                'storage': task.metadata.get('storage'),
+                'pronto': task.status == 'completed' and self._artefato_disponivel(task),
+            }
+        }
+
+    def _artefato_disponivel(self, task: TaskHistory) -> bool:
+        if task.metadata.get('storage') == 's3':
+            return not self._expirado(task)
+        return os.path.exists(self._artifact_path(task.task_id))
+
+    def get_artifact(self, task_id: str) -> Dict[str, Any]:
+        """
+        Local do PDF gerado por um job concluído: 'path' no disco ou 'key' no S3.
+        """
+        result = self.get_job(task_id)
+        if not result['success']:
+            return result
+        job = result['job']
+        if job['status'] in ('pending', 'in_progress'):
+            return {'success': False, 'error': f"Relatório ainda não está pronto (status: {job['status']})", 'pending': True}
+        if job['status'] != 'completed':
+            return {'success': False, 'error': f"Relatório não foi gerado (status: {job['status']})"}
+        if not job['pronto']:
+            return {'success': False, 'error': 'Arquivo do relatório expirou ou foi removido'}
+        if job['storage'] == 's3':
+            return {'success': True, 'storage': 's3', 'key': self._artifact_key(task_id),
+                    'filename': job['filename'], 'size': job['size_bytes']}
+        return {'success': True, 'storage': 'local', 'path': self._artifact_path(task_id), 'filename': job['filename']}
+
+    def cleanup_expired(self) -> int:
+        """
+        Remove PDFs gerados há mais de PDF_REPORTS_TTL_HOURS horas, no disco e no S3.
+
+        Returns:
+            Quantidade de arquivos removidos
+        """
+        limite = time.time() - self.ttl_hours * 3600
+        removidos = 0
+        for nome in os.listdir(self.reports_dir):
+            path = os.path.join(self.reports_dir, nome)
+            try:
+                if os.path.getmtime(path) < limite:
+                    os.remove(path)
+                    removidos += 1
+            except OSError:
+                continue
+
+        if self.s3_service.s3_available:
+            expirados = list(TaskHistory.objects.filter(
+                task_type='report', status='completed', metadata__storage='s3',
+                completed_at__lt=timezone.now() - timedelta(hours=self.ttl_hours)
+            ))
+            for inicio in range(0, len(expirados), S3_DELETE_BATCH_SIZE):
+                lote = expirados[inicio:inicio + S3_DELETE_BATCH_SIZE]
+                self.s3_service.s3_client.delete_objects(
+                    Bucket=self.s3_service.bucket_name,
+                    Delete={'Objects': [{'Key': self._artifact_key(task.task_id)} for task in lote], 'Quiet': True}
+                )
+                for task in lote:
+                    # Sai da limpeza; get_job passa a informar o arquivo como removido
+                    task.metadata = {**task.metadata, 'storage': 'removido'}
+                    task.save(update_fields=['metadata'])
+                removidos += len(lote)
+        return removidos
+
+
+@registrar_tarefa('relatorio_pdf')
+def gerar_relatorio_pdf(contexto) -> Dict[str, Any]:
+    """Tarefa do executor: gera o PDF de um job criado por RelatorioPDFService.submit."""
+    return RelatorioPDFService().gerar(contexto)
@@ -0,0 +1,294 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+from django.conf import settings
+from django.utils import timezone
+from botocore.exceptions import BotoCoreError, ClientError
+import logging
+
+from ..models import BackupLog, BlocoBackup, BlocoManifesto
+from .s3_service import S3Service, S3_DELETE_BATCH_SIZE
+
+# Corte dos blocos em código nativo (FastCDC compilado), sem o laço em Python
+try:
+    from fastcdc.fastcdc_cy import fastcdc_cy
+    FASTCDC_AVAILABLE = True
+except ImportError:
+    FASTCDC_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+if not FASTCDC_AVAILABLE:
+    # Os cortes em Python não coincidem com os nativos: blocos gravados por um
+    # processo com o fastcdc não são reaproveitados por este
+    logger.warning("fastcdc not available; backup chunking falls back to pure Python")
+
+# Tabela do gear hash, derivada por SHA256: os mesmos cortes em qualquer processo
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], 'big') for i in range(256)]
+
+# Referências de manifesto gravadas por consulta
+BLOCOS_MANIFESTO_LOTE = 500
+
+# Gravação de blocos e coleta de lixo não se intercalam no processo: um bloco
+# reaproveitado por um backup em andamento ainda não tem referência no banco
+_repositorio_lock = threading.Lock()
+
+
+def _limites_bloco() -> Tuple[int, int, int]:
+    """Tamanho mínimo, máscara de corte e tamanho máximo dos blocos."""
+    bits = max(getattr(settings, 'BACKUP_CHUNK_AVG_SIZE', 1024 * 1024).bit_length() - 1, 8)
+    medio = 1 << bits
+    return medio // 4, medio - 1, medio * 4
+
+
+def _ponto_de_corte(dados: bytearray, minimo: int, maximo: int, mascara: int) -> int:
+    """
+    Fim do próximo bloco em dados (gear hash, como no FastCDC): o corte acontece
+    onde os últimos bytes zeram os bits da máscara, então uma inserção só muda os
+    blocos em volta dela. Os primeiros `minimo` bytes nem são examinados.
+
+    Com o fastcdc instalado o corte é calculado em código nativo; o laço em
+    Python, bem mais lento e segurando o GIL, fica só como alternativa. Os dois
+    cortam em pontos diferentes, então blocos gravados por um não são
+    reaproveitados pelo outro.
+    """
+    if FASTCDC_AVAILABLE:
+        return next(fastcdc_cy(dados, minimo, mascara + 1, maximo)).length
+    fim = min(len(dados), maximo)
+    if fim <= minimo:
+        return fim
+    gear = _GEAR
+    h = 0
+    posicao = minimo
+    for byte in dados[minimo:fim]:
+        h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+        posicao += 1
+        if not h & mascara:
+            return posicao
+    return fim
+
+
+def dividir_em_blocos(arquivo) -> Iterator[bytes]:
+    """Divide um arquivo em blocos definidos pelo conteúdo, lendo-o em partes."""
+    minimo, mascara, maximo = _limites_bloco()
+    buffer = bytearray()
+    fim_arquivo = False
+    while True:
+        while not fim_arquivo and len(buffer) < maximo:
+            dados = arquivo.read(maximo)
+            if dados:
+                buffer += dados
+            else:
+                fim_arquivo = True
+        if not buffer:
+            return
+        corte = _ponto_de_corte(buffer, minimo, maximo, mascara)
+        yield bytes(buffer[:corte])
+        del buffer[:corte]
+
+
+class RepositorioBackups:
+    """
+    Repositório deduplicado de snapshots. Cada snapshot é dividido em blocos
+    definidos pelo conteúdo; cada bloco é comprimido e gravado uma única vez sob
+    o seu hash (no S3, se disponível, ou em BACKUP_DIR/repositorio). O backup
+    guarda a lista ordenada dos blocos em BlocoManifesto, usada pela coleta de
+    lixo, e em um arquivo de manifesto ao lado dos blocos, que basta para
+    remontar o snapshot.
+    """
+
+    def __init__(self, s3_service: S3Service = None):
+        self.s3_service = s3_service or S3Service()
+        self.diretorio = os.path.join(getattr(settings, 'BACKUP_DIR', '/tmp/backups'), 'repositorio')
+        self.prefixo_s3 = 'backups/repositorio'
+
+    def _caminho(self, tipo: str, nome: str) -> str:
+        return os.path.join(self.diretorio, tipo, nome[:2], nome) if tipo == 'blocos' else \
+            os.path.join(self.diretorio, tipo, nome)
+
+    def _chave(self, tipo: str, nome: str) -> str:
+        return f"{self.prefixo_s3}/{tipo}/{nome[:2]}/{nome}" if tipo == 'blocos' else \
+            f"{self.prefixo_s3}/{tipo}/{nome}"
+
+    def _gravar(self, tipo: str, nome: str, dados: bytes, armazenamento: str) -> None:
+        if armazenamento == 's3':
+            self.s3_service.s3_client.put_object(
+                Bucket=self.s3_service.bucket_name, Key=self._chave(tipo, nome), Body=dados,
+                ContentType='application/octet-stream'
+            )
+            return
+        caminho = self._caminho(tipo, nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        # Grava e renomeia: um bloco nunca fica pela metade no caminho final
+        temp_path = f"{caminho}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(dados)
+        os.replace(temp_path, caminho)
+
+    def _ler(self, tipo: str, nome: str, armazenamento: str) -> bytes:
+        if armazenamento == 's3':
+            resposta = self.s3_service.s3_client.get_object(
+                Bucket=self.s3_service.bucket_name, Key=self._chave(tipo, nome)
+            )
+            return resposta['Body'].read()
+        with open(self._caminho(tipo, nome), 'rb') as f:
+            return f.read()
+
+    def armazenar(self, backup_log: BackupLog, path: str) -> Dict[str, Any]:
+        """
+        Grava um snapshot no repositório e o manifesto do backup. Só os blocos
+        que ainda não existem são comprimidos e enviados.
+
+        Returns:
+            Dict com o número de blocos, os blocos novos e os bytes gravados
+        """
+        armazenamento = 's3' if self.s3_service.s3_available else 'local'
+        nivel = getattr(settings, 'BACKUP_COMPRESSION_LEVEL', 6)
+        hash_total = hashlib.sha256()
+        entradas = []
+        novos = 0
+        bytes_gravados = 0
+
+        with _repositorio_lock:
+            try:
+                lote = []
+                with open(path, 'rb') as f:
+                    for dados in dividir_em_blocos(f):
+                        hash_total.update(dados)
+                        hash_bloco = hashlib.sha256(dados).hexdigest()
+                        bloco = BlocoBackup.objects.filter(hash=hash_bloco).first()
+                        if bloco is None:
+                            comprimido = zlib.compress(dados, nivel)
+                            self._gravar('blocos', hash_bloco, comprimido, armazenamento)
+                            bloco, criado = BlocoBackup.objects.get_or_create(hash=hash_bloco, defaults={
+                                'tamanho': len(dados),
+                                'tamanho_armazenado': len(comprimido),
+                                'armazenamento': armazenamento
+                            })
+                            if criado:
+                                novos += 1
+                                bytes_gravados += len(comprimido)
+                        lote.append(BlocoManifesto(backup=backup_log, ordem=len(entradas), bloco=bloco))
+                        entradas.append([bloco.hash, bloco.tamanho, bloco.armazenamento])
+                        if len(lote) >= BLOCOS_MANIFESTO_LOTE:
+                            BlocoManifesto.objects.bulk_create(lote)
+                            lote = []
+                BlocoManifesto.objects.bulk_create(lote)
+
+                manifesto = {
+                    'backup_id': backup_log.backup_id,
+                    'created_at': timezone.now().isoformat(),
+                    'raw_size': sum(entrada[1] for entrada in entradas),
+                    'raw_hash': hash_total.hexdigest(),
+                    'blocos': entradas,
+                }
+                self._gravar('manifestos', f"{backup_log.backup_id}.json",
+                             json.dumps(manifesto).encode('utf-8'), armazenamento)
+            except Exception:
+                # Blocos já gravados ficam sem referência e saem na próxima coleta
+                BlocoManifesto.objects.filter(backup=backup_log).delete()
+                raise
+
+        logger.info(f"Backup {backup_log.backup_id} stored in repository: "
+                    f"{len(entradas)} chunks, {novos} new, {bytes_gravados} bytes written")
+        return {
+            'storage': armazenamento,
+            'chunks': len(entradas),
+            'new_chunks': novos,
+            'stored_bytes': bytes_gravados,
+            'raw_size': manifesto['raw_size'],
+            'raw_hash': manifesto['raw_hash'],
+        }
+
+    def ler_manifesto(self, backup_id: str, armazenamento: str) -> Dict[str, Any]:
+        return json.loads(self._ler('manifestos', f"{backup_id}.json", armazenamento))
+
+    def ler_snapshot(self, backup_id: str, armazenamento: str) -> Iterator[bytes]:
+        """
+        Remonta o snapshot de um backup, bloco a bloco, conferindo o hash de cada
+        bloco e, ao final, o do snapshot inteiro. Usa apenas o manifesto e os
+        blocos, sem depender dos registros do banco.
+        """
+        manifesto = self.ler_manifesto(backup_id, armazenamento)
+        hash_total = hashlib.sha256()
+        for hash_bloco, tamanho, armazenamento_bloco in manifesto['blocos']:
+            dados = zlib.decompress(self._ler('blocos', hash_bloco, armazenamento_bloco))
+            if len(dados) != tamanho or hashlib.sha256(dados).hexdigest() != hash_bloco:
+                raise ValueError(f"Bloco {hash_bloco} do backup {backup_id} corrompido")
+            hash_total.update(dados)
+            yield dados
+        if hash_total.hexdigest() != manifesto['raw_hash']:
+            raise ValueError(f"Hash do backup {backup_id} não confere com o manifesto")
+
+    def _remover(self, itens: Iterable[Tuple[str, str, str]]) -> List[Tuple[str, str]]:
+        """
+        Remove objetos (tipo, nome, armazenamento) do disco ou do S3, em lotes
+        de delete_objects. Devolve os que falharam.
+        """
+        falhas = []
+        chaves = {}
+        for tipo, nome, armazenamento in itens:
+            if armazenamento == 's3':
+                chaves[self._chave(tipo, nome)] = (tipo, nome)
+                continue
+            try:
+                os.remove(self._caminho(tipo, nome))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove {tipo} {nome}: {str(e)}")
+                falhas.append((tipo, nome))
+
+        lista = sorted(chaves)
+        for inicio in range(0, len(lista), S3_DELETE_BATCH_SIZE):
+            lote = lista[inicio:inicio + S3_DELETE_BATCH_SIZE]
+            try:
+                resposta = self.s3_service.s3_client.delete_objects(
+                    Bucket=self.s3_service.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in lote], 'Quiet': True}
+                )
+                erros = [erro['Key'] for erro in resposta.get('Errors', [])]
+            except (ClientError, BotoCoreError) as e:
+                logger.warning(f"Failed to delete repository objects: {str(e)}")
+                erros = lote
+            falhas.extend(chaves[key] for key in erros)
+        return falhas
+
+    def remover_manifestos(self, backups: Iterable[BackupLog]) -> None:
+        """Remove os arquivos de manifesto de backups que serão excluídos."""
+        self._remover(
+            ('manifestos', f"{backup.backup_id}.json", backup.metadata['repository']['storage'])
+            for backup in backups if backup.metadata.get('repository')
+        )
+
+    def coletar_lixo(self) -> Dict[str, Any]:
+        """
+        Remove os blocos que nenhum manifesto referencia. Os registros saem
+        antes dos objetos: um backup de outro processo que tente referenciar um
+        bloco já coletado falha pela chave estrangeira, em vez de gerar um
+        manifesto apontando para um bloco apagado.
+        """
+        with _repositorio_lock:
+            orfaos = {
+                pk: (hash_bloco, armazenamento, tamanho)
+                for pk, hash_bloco, armazenamento, tamanho in BlocoBackup.objects.filter(
+                    referencias__isnull=True
+                ).values_list('pk', 'hash', 'armazenamento', 'tamanho_armazenado')
+            }
+            BlocoBackup.objects.filter(pk__in=list(orfaos), referencias__isnull=True).delete()
+            for pk in BlocoBackup.objects.filter(pk__in=list(orfaos)).values_list('pk', flat=True):
+                orfaos.pop(pk)
+            falhas = self._remover(('blocos', hash_bloco, armazenamento) for hash_bloco, armazenamento, _ in orfaos.values())
+
+        liberados = sum(tamanho for _, _, tamanho in orfaos.values())
+        if falhas:
+            logger.warning(f"Repository garbage collection: {len(falhas)} chunk objects could not be removed")
+        logger.info(f"Repository garbage collection: {len(orfaos)} chunks removed, {liberados} bytes freed")
+        return {
+            'removed_chunks': len(orfaos),
+            'freed_bytes': liberados,
+            'failed': len(falhas),
+        }
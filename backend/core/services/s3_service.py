@@ -1,19 +1,99 @@
-import os
+import re
+import base64
 import hashlib
+import itertools
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple, Union
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
 from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
 import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 import logging
 
 from ..models import AnexoS3
+from .miniaturas import caminho_miniatura, formato_miniatura, gerar_miniatura
 
 logger = logging.getLogger(__name__)
 
+# O S3 exige partes de no mínimo 5 MB (exceto a última) em uploads multipart
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+# Máximo de chaves por chamada delete_objects
+S3_DELETE_BATCH_SIZE = 1000
+# Salt do token que acompanha um upload direto (presigned POST) até a confirmação
+PRESIGNED_UPLOAD_SALT = 'core.s3.presigned-upload'
+
+
+_clients: Dict[tuple, Any] = {}
+_bucket_checks: Dict[str, Tuple[bool, float]] = {}
+_state_lock = threading.Lock()
+
+
+def get_shared_s3_client(access_key: str, secret_key: str, region: str):
+    """
+    Cliente boto3 único por credencial, compartilhado por todas as instâncias de
+    S3Service do processo (clientes boto3 são thread-safe e mantêm o pool de conexões).
+    """
+    chave = (access_key, secret_key, region)
+    with _state_lock:
+        client = _clients.get(chave)
+        if client is None:
+            # Configurações de timeout e retry
+            config = Config(
+                connect_timeout=getattr(settings, 'AWS_S3_CONNECT_TIMEOUT', 60),
+                read_timeout=getattr(settings, 'AWS_S3_READ_TIMEOUT', 300),
+                max_pool_connections=getattr(settings, 'AWS_S3_MAX_POOL_CONNECTIONS', 50),
+                retries=getattr(settings, 'AWS_S3_RETRIES', {
+                    'max_attempts': 3,
+                    'mode': 'adaptive'
+                })
+            )
+            client = _clients[chave] = boto3.client(
+                's3',
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+                config=config
+            )
+        return client
+
+
+def _bucket_available(client, bucket_name: str) -> bool:
+    """Teste de conectividade (head_bucket) com resultado em cache por TTL."""
+    agora = time.monotonic()
+    with _state_lock:
+        cached = _bucket_checks.get(bucket_name)
+    if cached and agora < cached[1]:
+        return cached[0]
+
+    try:
+        client.head_bucket(Bucket=bucket_name)
+        disponivel = True
+        ttl = getattr(settings, 'AWS_S3_HEALTH_CHECK_TTL', 300)
+        if not cached or not cached[0]:
+            logger.info(f"S3 service initialized successfully for bucket: {bucket_name}")
+    except (ClientError, BotoCoreError) as e:
+        disponivel = False
+        ttl = getattr(settings, 'AWS_S3_HEALTH_CHECK_FAILURE_TTL', 30)
+        logger.warning(f"S3 not available: {e}. Falling back to local storage.")
+
+    with _state_lock:
+        _bucket_checks[bucket_name] = (disponivel, agora + ttl)
+    return disponivel
+
+
+def reset_s3_state() -> None:
+    """Descarta os clientes e verificações em cache (ex.: após trocar credenciais)."""
+    with _state_lock:
+        _clients.clear()
+        _bucket_checks.clear()
+
 
 class S3Service:
     """
@@ -26,46 +106,123 @@ class S3Service:
         self.region = getattr(settings, 'AWS_S3_REGION_NAME', 'us-east-1')
         self.access_key = getattr(settings, 'AWS_ACCESS_KEY_ID', None)
         self.secret_key = getattr(settings, 'AWS_SECRET_ACCESS_KEY', None)
+        self.multipart_chunk_size = max(
+            getattr(settings, 'AWS_S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024), S3_MIN_PART_SIZE
+        )
         
-        # Configuração do cliente S3
+        # Cliente S3 compartilhado pelo processo; a disponibilidade do bucket é
+        # verificada sob demanda (ver s3_available), sem chamada de rede aqui
         self.s3_client = None
-        self.s3_available = False
+        self._s3_available_override = None
         
         if self.access_key and self.secret_key and self.bucket_name:
             try:
-                # Configurações de timeout e retry
-                from botocore.config import Config
-                config = Config(
-                    connect_timeout=getattr(settings, 'AWS_S3_CONNECT_TIMEOUT', 60),
-                    read_timeout=getattr(settings, 'AWS_S3_READ_TIMEOUT', 300),
-                    max_pool_connections=getattr(settings, 'AWS_S3_MAX_POOL_CONNECTIONS', 50),
-                    retries=getattr(settings, 'AWS_S3_RETRIES', {
-                        'max_attempts': 3,
-                        'mode': 'adaptive'
-                    })
-                )
-                
-                self.s3_client = boto3.client(
-                    's3',
-                    aws_access_key_id=self.access_key,
-                    aws_secret_access_key=self.secret_key,
-                    region_name=self.region,
-                    config=config
-                )
-                # Teste de conectividade
-                self.s3_client.head_bucket(Bucket=self.bucket_name)
-                self.s3_available = True
-                logger.info(f"S3 service initialized successfully for bucket: {self.bucket_name}")
-            except (ClientError, NoCredentialsError) as e:
+                self.s3_client = get_shared_s3_client(self.access_key, self.secret_key, self.region)
+            except (BotoCoreError, ValueError) as e:
                 logger.warning(f"S3 not available: {e}. Falling back to local storage.")
-                self.s3_available = False
         else:
             logger.info("S3 credentials not configured. Using local storage.")
     
+    @property
+    def s3_available(self) -> bool:
+        """
+        Indica se o bucket está acessível. O resultado do head_bucket é
+        compartilhado pelo processo e renovado a cada AWS_S3_HEALTH_CHECK_TTL
+        segundos (AWS_S3_HEALTH_CHECK_FAILURE_TTL após uma falha).
+        """
+        if self._s3_available_override is not None:
+            return self._s3_available_override
+        if self.s3_client is None:
+            return False
+        return _bucket_available(self.s3_client, self.bucket_name)
+    
+    @s3_available.setter
+    def s3_available(self, value: bool) -> None:
+        self._s3_available_override = value
+    
     def _generate_file_hash(self, file_content: bytes) -> str:
         """Gera hash SHA256 do conteúdo do arquivo."""
         return hashlib.sha256(file_content).hexdigest()
     
+    def _iter_chunks(self, file) -> Iterator[bytes]:
+        """Lê o arquivo em blocos do tamanho de uma parte do upload multipart."""
+        while True:
+            chunk = file.read(self.multipart_chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def _hash_stream(self, file) -> Tuple[str, int]:
+        """
+        Calcula hash SHA256 e tamanho de um arquivo lendo-o em blocos,
+        sem carregar o conteúdo inteiro em memória.
+        """
+        hash_sha256 = hashlib.sha256()
+        size = 0
+        file.seek(0)
+        for chunk in self._iter_chunks(file):
+            hash_sha256.update(chunk)
+            size += len(chunk)
+        file.seek(0)
+        return hash_sha256.hexdigest(), size
+
+    def _upload_stream(self, file, s3_key: str, content_type: str, s3_metadata: Dict[str, str]) -> Tuple[str, int]:
+        """
+        Envia um arquivo ao S3 em partes (multipart), calculando o SHA256 durante o envio.
+        Arquivos menores que uma parte vão em um único put_object. Em caso de erro o
+        upload multipart é abortado, para não deixar partes órfãs no bucket.
+
+        Returns:
+            Tupla (hash SHA256, tamanho) do conteúdo enviado
+        """
+        hash_sha256 = hashlib.sha256()
+        file.seek(0)
+        chunks = self._iter_chunks(file)
+        primeiro = next(chunks, b'')
+        segundo = next(chunks, None)
+
+        if segundo is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Body=primeiro,
+                ContentType=content_type,
+                Metadata=s3_metadata
+            )
+            hash_sha256.update(primeiro)
+            return hash_sha256.hexdigest(), len(primeiro)
+
+        upload_id = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            ContentType=content_type,
+            Metadata=s3_metadata
+        )['UploadId']
+        parts = []
+        size = 0
+        try:
+            for part_number, chunk in enumerate(itertools.chain([primeiro, segundo], chunks), start=1):
+                hash_sha256.update(chunk)
+                size += len(chunk)
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=s3_key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    Body=chunk
+                )
+                parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id)
+            raise
+        return hash_sha256.hexdigest(), size
+
     def _generate_s3_key(self, anexo_type: str, filename: str) -> str:
         """Gera chave única para o arquivo no S3."""
         timestamp = datetime.now().strftime('%Y/%m/%d')
@@ -73,32 +230,50 @@ class S3Service:
         safe_filename = filename.replace(' ', '_').replace('(', '').replace(')', '')
         return f"{anexo_type}/{timestamp}/{unique_id}_{safe_filename}"
     
+    def _anexo_info(self, anexo: AnexoS3) -> Dict[str, Any]:
+        """Resumo do anexo devolvido pelos métodos de upload."""
+        return {
+            'id': str(anexo.anexo_id),
+            'nome_original': anexo.nome_original,
+            'content_type': anexo.content_type,
+            'file_size': anexo.file_size,
+            'anexo_type': anexo.anexo_type,
+            'object_id': anexo.object_id,
+            'uploaded_by_id': anexo.uploaded_by_id,
+            'uploaded_at': anexo.uploaded_at.isoformat() if anexo.uploaded_at else None
+        }
+    
     def upload_file(self, 
                    file: UploadedFile, 
                    anexo_type: str, 
                    object_id: Optional[int] = None,
                    user_id: int = None,
-                   metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                   metadata: Optional[Dict[str, Any]] = None,
+                   file_hash: Optional[str] = None) -> Dict[str, Any]:
         """
         Faz upload de um arquivo para o S3 ou armazenamento local.
         
+        O arquivo é lido em blocos: o hash para detecção de duplicatas é calculado
+        sem carregar o conteúdo inteiro e o envio ao S3 é feito em partes (multipart).
+        
         Args:
-            file: Arquivo enviado pelo usuário
+            file: Arquivo enviado pelo usuário (qualquer objeto com read/seek)
             anexo_type: Tipo do anexo (obra, funcionario, compra, etc.)
             object_id: ID do objeto relacionado
             user_id: ID do usuário que fez o upload
             metadata: Metadados adicionais
+            file_hash: SHA256 já conhecido do arquivo (evita uma leitura extra)
         
         Returns:
             Dict com informações do arquivo enviado
         """
         try:
-            # Lê o conteúdo do arquivo
-            file_content = file.read()
-            file.seek(0)  # Reset file pointer
-            
-            # Gera hash do arquivo
-            file_hash = self._generate_file_hash(file_content)
+            # Gera hash do arquivo em blocos
+            if file_hash and getattr(file, 'size', None) is not None:
+                file_size = file.size
+            else:
+                file_hash, file_size = self._hash_stream(file)
+            content_type = getattr(file, 'content_type', None) or 'application/octet-stream'
             
             # Verifica se já existe um arquivo com o mesmo hash
             existing_anexo = AnexoS3.objects.filter(file_hash=file_hash).first()
@@ -109,16 +284,7 @@ class S3Service:
                     'anexo_id': existing_anexo.anexo_id,
                     'url': existing_anexo.s3_url,
                     'duplicate': True,
-                    'anexo': {
-                        'id': str(existing_anexo.anexo_id),
-                        'nome_original': existing_anexo.nome_original,
-                        'content_type': existing_anexo.content_type,
-                        'file_size': existing_anexo.file_size,
-                        'anexo_type': existing_anexo.anexo_type,
-                        'object_id': existing_anexo.object_id,
-                        'uploaded_by_id': existing_anexo.uploaded_by_id,
-                        'uploaded_at': existing_anexo.uploaded_at.isoformat() if existing_anexo.uploaded_at else None
-                    }
+                    'anexo': self._anexo_info(existing_anexo)
                 }
             
             anexo_id = str(uuid.uuid4())
@@ -132,20 +298,20 @@ class S3Service:
                     'anexo-id': anexo_id,
                     'anexo-type': anexo_type,
                     'original-filename': file.name,
-                    'uploaded-by': str(user_id) if user_id else 'unknown'
+                    'uploaded-by': str(user_id) if user_id else 'unknown',
+                    'sha256': file_hash
                 }
                 
                 if metadata:
                     s3_metadata.update({f'custom-{k}': str(v) for k, v in metadata.items()})
                 
-                # Upload do arquivo (sem ACL)
-                self.s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=s3_key,
-                    Body=file_content,
-                    ContentType=file.content_type or 'application/octet-stream',
-                    Metadata=s3_metadata
-                )
+                # Upload do arquivo em partes (sem ACL)
+                uploaded_hash, file_size = self._upload_stream(file, s3_key, content_type, s3_metadata)
+                file.seek(0)
+                if uploaded_hash != file_hash:
+                    # O conteúdo mudou entre o cálculo do hash e o envio
+                    self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
+                    raise ValueError(f"Hash mismatch after upload: expected {file_hash}, got {uploaded_hash}")
                 
                 # Gera URL do arquivo
                 s3_url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{s3_key}"
@@ -158,8 +324,8 @@ class S3Service:
                     bucket_name=self.bucket_name,
                     s3_key=s3_key,
                     s3_url=s3_url,
-                    content_type=file.content_type or 'application/octet-stream',
-                    file_size=len(file_content),
+                    content_type=content_type,
+                    file_size=file_size,
                     file_hash=file_hash,
                     anexo_type=anexo_type,
                     object_id=object_id,
@@ -174,16 +340,7 @@ class S3Service:
                 'anexo_id': anexo_id,
                 'url': anexo_s3.s3_url,
                 'duplicate': False,
-                'anexo': {
-                    'id': str(anexo_s3.anexo_id),
-                    'nome_original': anexo_s3.nome_original,
-                    'content_type': anexo_s3.content_type,
-                    'file_size': anexo_s3.file_size,
-                    'anexo_type': anexo_s3.anexo_type,
-                    'object_id': anexo_s3.object_id,
-                    'uploaded_by_id': anexo_s3.uploaded_by_id,
-                    'uploaded_at': anexo_s3.uploaded_at.isoformat() if anexo_s3.uploaded_at else None
-                }
+                'anexo': self._anexo_info(anexo_s3)
             }
             
             else:
@@ -202,8 +359,8 @@ class S3Service:
                     bucket_name='local-development',
                     s3_key=local_key,
                     s3_url=local_url,
-                    content_type=file.content_type or 'application/octet-stream',
-                    file_size=len(file_content),
+                    content_type=content_type,
+                    file_size=file_size,
                     file_hash=file_hash,
                     anexo_type=anexo_type,
                     object_id=object_id,
@@ -218,16 +375,7 @@ class S3Service:
                     'anexo_id': anexo_id,
                     'url': local_url,
                     'duplicate': False,
-                    'anexo': {
-                        'id': str(anexo_s3.anexo_id),
-                        'nome_original': anexo_s3.nome_original,
-                        'content_type': anexo_s3.content_type,
-                        'file_size': anexo_s3.file_size,
-                        'anexo_type': anexo_s3.anexo_type,
-                        'object_id': anexo_s3.object_id,
-                        'uploaded_by_id': anexo_s3.uploaded_by_id,
-                        'uploaded_at': anexo_s3.uploaded_at.isoformat() if anexo_s3.uploaded_at else None
-                    },
+                    'anexo': self._anexo_info(anexo_s3),
                     'local_fallback': True
                 }
                 
@@ -238,6 +386,257 @@ class S3Service:
                 'error': str(e)
             }
     
+    def create_presigned_upload(self,
+                                filename: str,
+                                content_type: str,
+                                anexo_type: str,
+                                object_id: Optional[int] = None,
+                                user_id: int = None,
+                                metadata: Optional[Dict[str, Any]] = None,
+                                file_hash: Optional[str] = None,
+                                max_size: Optional[int] = None,
+                                expiration: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Gera uma política de presigned POST para o navegador enviar o arquivo
+        direto ao S3, sem passar pelo servidor da aplicação.
+        
+        A política limita o tamanho (content-length-range) e fixa o Content-Type.
+        Se o SHA256 for informado, ele também entra na política (x-amz-checksum-sha256)
+        e o próprio S3 recusa um conteúdo diferente. O hash informado pelo cliente
+        nunca é usado para reaproveitar um anexo existente (isso daria acesso ao
+        arquivo de outro usuário a quem só conhece o hash): duplicatas são
+        detectadas em complete_presigned_upload, com o objeto já no S3. O token
+        devolvido deve ser enviado a complete_presigned_upload depois que o POST ao
+        S3 terminar.
+        
+        Args:
+            filename: Nome original do arquivo
+            content_type: Content-Type que o navegador vai enviar
+            anexo_type: Tipo do anexo (obra, funcionario, compra, etc.)
+            object_id: ID do objeto relacionado
+            user_id: ID do usuário que fará o upload
+            metadata: Metadados adicionais (gravados no AnexoS3 na confirmação)
+            file_hash: SHA256 (hex) do arquivo, calculado pelo navegador
+            max_size: Tamanho máximo aceito em bytes
+            expiration: Validade da política em segundos
+        
+        Returns:
+            Dict com url, fields e upload_token
+        """
+        if not self.s3_available:
+            return {
+                'success': False,
+                'error': 'S3 não está disponível para upload direto'
+            }
+
+        max_size = max_size or getattr(settings, 'AWS_S3_PRESIGNED_POST_MAX_SIZE', 500 * 1024 * 1024)
+        expiration = expiration or getattr(settings, 'AWS_S3_PRESIGNED_POST_EXPIRATION', 3600)
+        content_type = content_type or 'application/octet-stream'
+
+        try:
+            if file_hash:
+                file_hash = file_hash.lower()
+                checksum = base64.b64encode(bytes.fromhex(file_hash)).decode('ascii')
+                if len(file_hash) != 64:
+                    raise ValueError
+        except ValueError:
+            return {
+                'success': False,
+                'error': 'file_hash deve ser um SHA256 em hexadecimal'
+            }
+
+        anexo_id = str(uuid.uuid4())
+        s3_key = self._generate_s3_key(anexo_type, filename)
+        upload_token = signing.dumps({
+            'anexo_id': anexo_id,
+            'bucket': self.bucket_name,
+            's3_key': s3_key,
+            'nome_original': filename,
+            'content_type': content_type,
+            'anexo_type': anexo_type,
+            'object_id': object_id,
+            'user_id': user_id,
+            'file_hash': file_hash,
+            'max_size': max_size,
+            'metadata': metadata or {},
+        }, salt=PRESIGNED_UPLOAD_SALT, compress=True)
+
+        try:
+            fields = {
+                'Content-Type': content_type,
+                'x-amz-meta-anexo-id': anexo_id,
+                'x-amz-meta-uploaded-by': str(user_id) if user_id else 'unknown',
+            }
+            conditions = [
+                ['content-length-range', 1, max_size],
+                {'Content-Type': content_type},
+                {'x-amz-meta-anexo-id': anexo_id},
+                {'x-amz-meta-uploaded-by': fields['x-amz-meta-uploaded-by']},
+            ]
+            if file_hash:
+                fields['x-amz-meta-sha256'] = file_hash
+                fields['x-amz-checksum-algorithm'] = 'SHA256'
+                fields['x-amz-checksum-sha256'] = checksum
+                conditions += [
+                    {'x-amz-meta-sha256': file_hash},
+                    {'x-amz-checksum-algorithm': 'SHA256'},
+                    {'x-amz-checksum-sha256': checksum},
+                ]
+
+            presigned = self.s3_client.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=expiration
+            )
+
+            return {
+                'success': True,
+                'anexo_id': anexo_id,
+                'url': presigned['url'],
+                'fields': presigned['fields'],
+                'upload_token': upload_token,
+                'max_size': max_size,
+                'expires_in': expiration
+            }
+
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Error generating presigned POST: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def complete_presigned_upload(self, upload_token: str, user_id: int = None) -> Dict[str, Any]:
+        """
+        Confirma um upload direto ao S3 e cria o registro AnexoS3.
+        
+        O objeto é verificado com um HEAD (existência, tamanho, Content-Type e, se o
+        hash foi informado na política, o checksum SHA256 calculado pelo S3). Sem
+        esse checksum, o conteúdo é lido do S3 em blocos para calcular o hash usado
+        na verificação e na detecção de duplicatas. Objetos reprovados são removidos
+        do bucket. Confirmações repetidas devolvem o mesmo anexo.
+        
+        Args:
+            upload_token: Token devolvido por create_presigned_upload
+            user_id: ID do usuário que confirma (deve ser o mesmo da política)
+        
+        Returns:
+            Dict com informações do arquivo, no mesmo formato de upload_file, e em
+            'upload' os dados da política (tipo, objeto, nome e metadados informados)
+        """
+        try:
+            # Tolerância para um upload iniciado perto do fim da validade da política
+            dados = signing.loads(upload_token, salt=PRESIGNED_UPLOAD_SALT,
+                                  max_age=getattr(settings, 'AWS_S3_PRESIGNED_POST_EXPIRATION', 3600) * 2)
+        except signing.SignatureExpired:
+            return {'success': False, 'error': 'Token de upload expirado'}
+        except signing.BadSignature:
+            return {'success': False, 'error': 'Token de upload inválido'}
+
+        if dados['user_id'] != user_id:
+            return {'success': False, 'error': 'Token de upload pertence a outro usuário'}
+        upload = {chave: dados[chave] for chave in ('anexo_type', 'object_id', 'nome_original', 'metadata')}
+
+        anexo_existente = AnexoS3.objects.filter(anexo_id=dados['anexo_id']).first()
+        if anexo_existente:
+            return {
+                'success': True,
+                'anexo_id': anexo_existente.anexo_id,
+                'url': anexo_existente.s3_url,
+                'duplicate': False,
+                'anexo': self._anexo_info(anexo_existente),
+                'upload': upload
+            }
+
+        if not self.s3_available:
+            return {'success': False, 'error': 'S3 não está disponível'}
+
+        bucket, s3_key = dados['bucket'], dados['s3_key']
+        try:
+            try:
+                head = self.s3_client.head_object(Bucket=bucket, Key=s3_key, ChecksumMode='ENABLED')
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                    return {'success': False, 'error': 'Arquivo não encontrado no S3; o upload não foi concluído'}
+                raise
+
+            file_size = head['ContentLength']
+            erro = None
+            if file_size > dados['max_size']:
+                erro = f"Arquivo maior que o permitido ({file_size} > {dados['max_size']} bytes)"
+            elif head.get('ContentType') != dados['content_type']:
+                erro = f"Content-Type divergente: esperado {dados['content_type']}, recebido {head.get('ContentType')}"
+            elif head.get('Metadata', {}).get('anexo-id') != dados['anexo_id']:
+                erro = 'Objeto no S3 não corresponde ao token de upload'
+
+            file_hash = dados['file_hash']
+            checksum = head.get('ChecksumSHA256')
+            if not erro and file_hash and checksum:
+                # Checksum calculado pelo próprio S3 no recebimento: sem reler o conteúdo
+                if checksum != base64.b64encode(bytes.fromhex(file_hash)).decode('ascii'):
+                    erro = 'Hash SHA256 do objeto não confere'
+            elif not erro:
+                body = self.s3_client.get_object(Bucket=bucket, Key=s3_key)['Body']
+                hash_sha256 = hashlib.sha256()
+                for chunk in body.iter_chunks(self.multipart_chunk_size):
+                    hash_sha256.update(chunk)
+                if file_hash and hash_sha256.hexdigest() != file_hash:
+                    erro = 'Hash SHA256 do objeto não confere'
+                file_hash = hash_sha256.hexdigest()
+
+            if erro:
+                self.s3_client.delete_object(Bucket=bucket, Key=s3_key)
+                return {'success': False, 'error': erro}
+
+            # Conteúdo já existente (hash conferido com o objeto no S3): descarta a cópia enviada
+            existing_anexo = AnexoS3.objects.filter(file_hash=file_hash).first()
+            if existing_anexo:
+                self.s3_client.delete_object(Bucket=bucket, Key=s3_key)
+                logger.info(f"File with hash {file_hash} already exists. Discarding direct upload {s3_key}.")
+                return {
+                    'success': True,
+                    'anexo_id': existing_anexo.anexo_id,
+                    'url': existing_anexo.s3_url,
+                    'duplicate': True,
+                    'anexo': self._anexo_info(existing_anexo),
+                    'upload': upload
+                }
+
+            anexo_s3 = AnexoS3.objects.create(
+                anexo_id=dados['anexo_id'],
+                nome_original=dados['nome_original'],
+                nome_s3=s3_key.split('/')[-1],
+                bucket_name=bucket,
+                s3_key=s3_key,
+                s3_url=f"https://{bucket}.s3.{self.region}.amazonaws.com/{s3_key}",
+                content_type=dados['content_type'],
+                file_size=file_size,
+                file_hash=file_hash,
+                anexo_type=dados['anexo_type'],
+                object_id=dados['object_id'],
+                uploaded_by_id=user_id,
+                metadata=dados['metadata']
+            )
+            logger.info(f"Direct upload confirmed: {s3_key}")
+
+            return {
+                'success': True,
+                'anexo_id': anexo_s3.anexo_id,
+                'url': anexo_s3.s3_url,
+                'duplicate': False,
+                'anexo': self._anexo_info(anexo_s3),
+                'upload': upload
+            }
+
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Error confirming direct upload {s3_key}: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
     def get_storage_info(self) -> Dict[str, Any]:
         """
         Obtém informações sobre o armazenamento S3.
@@ -286,6 +685,89 @@ class S3Service:
                 'error': str(e)
             }
     
+    def _signed_url_cache_timeout(self, expiration: int) -> int:
+        """
+        Por quanto tempo uma URL assinada pode ser reaproveitada: até
+        SIGNED_URL_CACHE_SECONDS (50 min), deixando sempre ao menos 1/6 da
+        validade para quem a recebe.
+        """
+        return min(getattr(settings, 'SIGNED_URL_CACHE_SECONDS', 3000), expiration * 5 // 6)
+
+    def _sign(self, anexo: AnexoS3, expiration: int) -> str:
+        # Determina a disposição do conteúdo com base no tipo de arquivo
+        content_type = anexo.content_type.lower() if anexo.content_type else ''
+        is_viewable = content_type.startswith('image/') or content_type == 'application/pdf'
+        disposition = 'inline' if is_viewable else 'attachment'
+
+        # Adiciona o nome do arquivo à disposição para uma experiência de download melhor
+        # A sanitização do nome do arquivo é importante para evitar problemas com caracteres especiais.
+        # Usando aspas duplas para nomes de arquivos que podem conter espaços.
+        sanitized_filename = re.sub(r'[^a-zA-Z0-9_.-]', '_', anexo.nome_original)
+
+        params = {
+            'Bucket': anexo.bucket_name,
+            'Key': anexo.s3_key,
+            'ResponseContentDisposition': f'{disposition}; filename="{sanitized_filename}"'
+        }
+
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params=params,
+            ExpiresIn=expiration
+        )
+
+    def generate_signed_urls(self, anexos: Iterable[Union[str, AnexoS3]], expiration: int = 3600) -> Dict[str, str]:
+        """
+        Gera URLs assinadas para vários anexos de uma vez.
+        
+        URLs ainda reaproveitáveis vêm do cache; os registros AnexoS3 que faltam
+        são buscados em uma única consulta e as novas URLs são gravadas no cache
+        em lote.
+        
+        Args:
+            anexos: IDs de anexos ou instâncias de AnexoS3 já carregadas
+            expiration: Tempo de expiração em segundos (padrão: 1 hora)
+        
+        Returns:
+            Dict {anexo_id: url}; anexos inexistentes ficam de fora
+        """
+        instancias = {}
+        ids = []
+        for anexo in anexos:
+            if isinstance(anexo, AnexoS3):
+                instancias[str(anexo.anexo_id)] = anexo
+                ids.append(str(anexo.anexo_id))
+            elif anexo:
+                ids.append(str(anexo))
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+
+        if not self.s3_available:
+            # Fallback para desenvolvimento local: URL local mockada, sem expiração
+            faltantes = [anexo_id for anexo_id in ids if anexo_id not in instancias]
+            instancias.update({a.anexo_id: a for a in AnexoS3.objects.filter(anexo_id__in=faltantes)})
+            return {anexo_id: instancias[anexo_id].s3_url for anexo_id in ids if anexo_id in instancias}
+
+        chaves = {anexo_id: f"s3_signed_url:{anexo_id}:{expiration}" for anexo_id in ids}
+        em_cache = cache.get_many(chaves.values())
+        urls = {anexo_id: em_cache[chave] for anexo_id, chave in chaves.items() if chave in em_cache}
+
+        faltantes = [anexo_id for anexo_id in ids if anexo_id not in urls and anexo_id not in instancias]
+        if faltantes:
+            instancias.update({a.anexo_id: a for a in AnexoS3.objects.filter(anexo_id__in=faltantes)})
+
+        novas = {}
+        for anexo_id in ids:
+            if anexo_id in urls or anexo_id not in instancias:
+                continue
+            urls[anexo_id] = novas[chaves[anexo_id]] = self._sign(instancias[anexo_id], expiration)
+
+        timeout = self._signed_url_cache_timeout(expiration)
+        if novas and timeout > 0:
+            cache.set_many(novas, timeout=timeout)
+        return urls
+
     def generate_signed_url(self, anexo_id: str, expiration: int = 3600) -> Dict[str, Any]:
         """
         Gera uma URL assinada para acesso temporário ao arquivo no S3, com
@@ -299,51 +781,28 @@ class S3Service:
             Dict com a URL assinada ou erro
         """
         try:
-            anexo = AnexoS3.objects.get(anexo_id=anexo_id)
+            urls = self.generate_signed_urls([anexo_id], expiration=expiration)
+            if anexo_id not in urls:
+                return {
+                    'success': False,
+                    'error': 'Anexo not found'
+                }
             
             if self.s3_available:
-                # Determina a disposição do conteúdo com base no tipo de arquivo
-                content_type = anexo.content_type.lower() if anexo.content_type else ''
-                is_viewable = content_type.startswith('image/') or content_type == 'application/pdf'
-                disposition = 'inline' if is_viewable else 'attachment'
-
-                # Adiciona o nome do arquivo à disposição para uma experiência de download melhor
-                # A sanitização do nome do arquivo é importante para evitar problemas com caracteres especiais.
-                # Usando aspas duplas para nomes de arquivos que podem conter espaços.
-                import re
-                sanitized_filename = re.sub(r'[^a-zA-Z0-9_.-]', '_', anexo.nome_original)
-
-                params = {
-                    'Bucket': anexo.bucket_name,
-                    'Key': anexo.s3_key,
-                    'ResponseContentDisposition': f'{disposition}; filename="{sanitized_filename}"'
-                }
-
-                signed_url = self.s3_client.generate_presigned_url(
-                    'get_object',
-                    Params=params,
-                    ExpiresIn=expiration
-                )
-                
                 return {
                     'success': True,
-                    'signed_url': signed_url,
+                    'signed_url': urls[anexo_id],
                     'expires_in': expiration
                 }
             else:
                 # Fallback para desenvolvimento local
                 return {
                     'success': True,
-                    'signed_url': anexo.s3_url, # Retorna a URL local mockada
+                    'signed_url': urls[anexo_id], # Retorna a URL local mockada
                     'expires_in': -1, # Indica que não expira
                     'local_fallback': True
                 }
                 
-        except AnexoS3.DoesNotExist:
-            return {
-                'success': False,
-                'error': 'Anexo not found'
-            }
         except Exception as e:
             logger.error(f"Error generating signed URL for anexo_id {anexo_id}: {str(e)}")
             return {
@@ -351,58 +810,74 @@ class S3Service:
                 'error': str(e)
             }
     
-    def download_file(self, anexo_id: str) -> Dict[str, Any]:
+    def _mock_content(self, anexo: AnexoS3) -> bytes:
+        """Conteúdo simulado para desenvolvimento sem S3, conforme o tipo do arquivo."""
+        if anexo.content_type and anexo.content_type.startswith('image/'):
+            if anexo.content_type == 'image/jpeg' or anexo.content_type == 'image/jpg':
+                # Para JPEG, retorna um JPEG mínimo válido
+                mock_content = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\'\" \x0c\x0c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x08\x01\x01\x00\x00?\x00\xaa\xff\xd9'
+            elif anexo.content_type == 'image/png':
+                # Para PNG, retorna um pixel transparente PNG
+                mock_content = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\nIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00IEND\xaeB`\x82'
+            else:
+                # Para outros tipos de imagem, usar JPEG como padrão
+                mock_content = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\'\" \x0c\x0c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x08\x01\x01\x00\x00?\x00\xaa\xff\xd9'
+        elif anexo.content_type and anexo.content_type == 'application/pdf':
+            # Para PDFs, retorna um PDF mínimo válido
+            mock_content = b'%PDF-1.4\n1 0 obj\n<<\n/Type /Catalog\n/Pages 2 0 R\n>>\nendobj\n2 0 obj\n<<\n/Type /Pages\n/Kids [3 0 R]\n/Count 1\n>>\nendobj\n3 0 obj\n<<\n/Type /Page\n/Parent 2 0 R\n/MediaBox [0 0 612 792]\n>>\nendobj\nxref\n0 4\n0000000000 65535 f \n0000000009 00000 n \n0000000074 00000 n \n0000000120 00000 n \ntrailer\n<<\n/Size 4\n/Root 1 0 R\n>>\nstartxref\n179\n%%EOF'
+        else:
+            # Para outros tipos, retorna texto simples
+            mock_content = f"Mock content for file: {anexo.nome_original}".encode('utf-8')
+        return mock_content
+
+    def open_stream(self, anexo_id: str, byte_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
         """
-        Baixa um arquivo do S3.
+        Abre um arquivo do S3 para leitura em blocos, sem carregá-lo em memória.
         
         Args:
             anexo_id: ID do anexo
+            byte_range: Intervalo (inicio, fim) inclusivo a ser lido, ou None para o arquivo inteiro
         
         Returns:
-            Dict com o conteúdo do arquivo ou erro
+            Dict com o iterador de blocos ('stream'), tamanho total, intervalo
+            efetivamente aplicado e os dados do anexo, ou erro
         """
         try:
             anexo = AnexoS3.objects.get(anexo_id=anexo_id)
             
             if self.s3_available:
-                response = self.s3_client.get_object(
-                    Bucket=anexo.bucket_name,
-                    Key=anexo.s3_key
-                )
+                params = {'Bucket': anexo.bucket_name, 'Key': anexo.s3_key}
+                if byte_range:
+                    params['Range'] = f'bytes={byte_range[0]}-{byte_range[1]}'
+                body = self.s3_client.get_object(**params)['Body']
+                
+                def stream():
+                    try:
+                        yield from body.iter_chunks(chunk_size=64 * 1024)
+                    finally:
+                        body.close()
                 
                 return {
                     'success': True,
-                    'content': response['Body'].read(),
+                    'stream': stream(),
+                    'size': anexo.file_size,
+                    'byte_range': byte_range,
                     'content_type': anexo.content_type,
-                    'filename': anexo.nome_original
+                    'filename': anexo.nome_original,
+                    'etag': anexo.file_hash
                 }
             else:
-                # Mock para desenvolvimento - simula conteúdo de arquivo
+                # Mock para desenvolvimento - o conteúdo simulado não respeita o intervalo
                 logger.info(f"S3 not available, returning mock content for {anexo_id}")
-                
-                # Gera conteúdo mock baseado no tipo de arquivo
-                if anexo.content_type and anexo.content_type.startswith('image/'):
-                    if anexo.content_type == 'image/jpeg' or anexo.content_type == 'image/jpg':
-                        # Para JPEG, retorna um JPEG mínimo válido
-                        mock_content = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\'\" \x0c\x0c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x08\x01\x01\x00\x00?\x00\xaa\xff\xd9'
-                    elif anexo.content_type == 'image/png':
-                        # Para PNG, retorna um pixel transparente PNG
-                        mock_content = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\nIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00IEND\xaeB`\x82'
-                    else:
-                        # Para outros tipos de imagem, usar JPEG como padrão
-                        mock_content = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\'\" \x0c\x0c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x08\x01\x01\x00\x00?\x00\xaa\xff\xd9'
-                elif anexo.content_type and anexo.content_type == 'application/pdf':
-                    # Para PDFs, retorna um PDF mínimo válido
-                    mock_content = b'%PDF-1.4\n1 0 obj\n<<\n/Type /Catalog\n/Pages 2 0 R\n>>\nendobj\n2 0 obj\n<<\n/Type /Pages\n/Kids [3 0 R]\n/Count 1\n>>\nendobj\n3 0 obj\n<<\n/Type /Page\n/Parent 2 0 R\n/MediaBox [0 0 612 792]\n>>\nendobj\nxref\n0 4\n0000000000 65535 f \n0000000009 00000 n \n0000000074 00000 n \n0000000120 00000 n \ntrailer\n<<\n/Size 4\n/Root 1 0 R\n>>\nstartxref\n179\n%%EOF'
-                else:
-                    # Para outros tipos, retorna texto simples
-                    mock_content = f"Mock content for file: {anexo.nome_original}".encode('utf-8')
-                
+                mock_content = self._mock_content(anexo)
                 return {
                     'success': True,
-                    'content': mock_content,
+                    'stream': iter([mock_content]),
+                    'size': len(mock_content),
+                    'byte_range': None,
                     'content_type': anexo.content_type or 'application/octet-stream',
-                    'filename': anexo.nome_original
+                    'filename': anexo.nome_original,
+                    'etag': anexo.file_hash
                 }
                 
         except AnexoS3.DoesNotExist:
@@ -411,121 +886,246 @@ class S3Service:
                 'error': 'Anexo not found'
             }
         except Exception as e:
-            logger.error(f"Error downloading file: {str(e)}")
+            logger.error(f"Error opening file stream: {str(e)}")
             return {
                 'success': False,
                 'error': str(e)
             }
     
-    def delete_file(self, anexo_id: str) -> Dict[str, Any]:
+    def get_thumbnail(self, anexo_id: str, tamanho: str) -> Dict[str, Any]:
         """
-        Deleta um arquivo do S3 e remove o registro do banco.
+        Obtém a miniatura de uma imagem, gerando-a na primeira solicitação.
+        
+        A miniatura é gravada no S3 ao lado do original (<dir>/thumbs/) e a chave
+        fica registrada em metadata['thumbnails'] do anexo; as solicitações
+        seguintes leem apenas a miniatura.
         
         Args:
-            anexo_id: ID do anexo
+            anexo_id: ID do anexo (imagem)
+            tamanho: Nome do tamanho (ver MINIATURA_TAMANHOS)
         
         Returns:
-            Dict com resultado da operação
+            Dict com o conteúdo da miniatura, content_type e etag, ou erro
         """
         try:
             anexo = AnexoS3.objects.get(anexo_id=anexo_id)
+            _, content_type, _ = formato_miniatura()
+            etag = f"{anexo.file_hash}-{tamanho}"
+            miniaturas = anexo.metadata.get('thumbnails', {}) if isinstance(anexo.metadata, dict) else {}
+            
+            if self.s3_available and tamanho in miniaturas:
+                try:
+                    body = self.s3_client.get_object(Bucket=anexo.bucket_name, Key=miniaturas[tamanho])['Body']
+                    return {'success': True, 'content': body.read(), 'content_type': content_type, 'etag': etag}
+                except ClientError as e:
+                    # Miniatura removida do bucket: gera novamente
+                    logger.warning(f"Thumbnail {miniaturas[tamanho]} not readable, regenerating: {str(e)}")
+            
+            original = self.open_stream(anexo_id)
+            if not original['success']:
+                return original
+            miniatura = gerar_miniatura(b''.join(original['stream']), tamanho)
+            if miniatura is None:
+                return {'success': False, 'error': 'Não foi possível gerar a miniatura da imagem'}
             
             if self.s3_available:
-                # Remove do S3
-                self.s3_client.delete_object(
+                s3_key = caminho_miniatura(anexo.s3_key, tamanho)
+                self.s3_client.put_object(
                     Bucket=anexo.bucket_name,
-                    Key=anexo.s3_key
+                    Key=s3_key,
+                    Body=miniatura,
+                    ContentType=content_type,
+                    CacheControl='public, max-age=31536000, immutable',
+                    Metadata={'anexo-id': anexo.anexo_id, 'thumbnail-size': tamanho}
                 )
-                logger.info(f"File deleted from S3: {anexo.s3_key}")
-            
-            # Remove do banco de dados
-            anexo.delete()
-            
-            return {
-                'success': True,
-                'message': 'File deleted successfully'
-            }
+                metadata = anexo.metadata if isinstance(anexo.metadata, dict) else {}
+                metadata['thumbnails'] = {**miniaturas, tamanho: s3_key}
+                AnexoS3.objects.filter(pk=anexo.pk).update(metadata=metadata)
             
+            return {'success': True, 'content': miniatura, 'content_type': content_type, 'etag': etag}
+        
         except AnexoS3.DoesNotExist:
             return {
                 'success': False,
                 'error': 'Anexo not found'
             }
         except Exception as e:
-            logger.error(f"Error deleting file: {str(e)}")
+            logger.error(f"Error generating thumbnail: {str(e)}")
             return {
                 'success': False,
                 'error': str(e)
             }
     
-    def migrate_local_files(self, local_directory: str) -> Dict[str, Any]:
+    def download_file(self, anexo_id: str) -> Dict[str, Any]:
         """
-        Migra arquivos locais para o S3.
+        Baixa um arquivo do S3.
+        
+        Para arquivos grandes prefira open_stream, que não carrega o conteúdo em memória.
         
         Args:
-            local_directory: Diretório local com os arquivos
+            anexo_id: ID do anexo
         
         Returns:
-            Dict com resultado da migração
+            Dict com o conteúdo do arquivo ou erro
         """
-        if not self.s3_available:
-            return {
-                'success': False,
-                'error': 'S3 service not available for migration'
-            }
+        result = self.open_stream(anexo_id)
+        if not result['success']:
+            return result
+        return {
+            'success': True,
+            'content': b''.join(result['stream']),
+            'content_type': result['content_type'],
+            'filename': result['filename']
+        }
+    
+    def delete_files(self, anexo_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Deleta vários arquivos do S3 e seus registros AnexoS3.
+        
+        As chaves são agrupadas por bucket em chamadas delete_objects de até
+        S3_DELETE_BATCH_SIZE chaves. Objetos compartilhados com registros que
+        continuam existindo (mesmo hash/chave, ex.: uploads deduplicados ou
+        migrados) são mantidos no bucket. Os registros são removidos em uma única
+        consulta; os que tiveram falha na remoção do objeto são mantidos, para
+        nova tentativa.
         
+        Args:
+            anexo_ids: IDs dos anexos
+        
+        Returns:
+            Dict com contagens e as falhas por chave
+        """
+        anexo_ids = list(dict.fromkeys(str(anexo_id) for anexo_id in anexo_ids if anexo_id))
         try:
-            migrated_files = []
-            failed_files = []
+            anexos = list(AnexoS3.objects.filter(anexo_id__in=anexo_ids))
+            encontrados = {anexo.anexo_id for anexo in anexos}
+            nao_encontrados = [anexo_id for anexo_id in anexo_ids if anexo_id not in encontrados]
+            
+            # Objetos ainda referenciados por registros que não serão removidos
+            compartilhados = set(
+                AnexoS3.objects.filter(file_hash__in={anexo.file_hash for anexo in anexos})
+                .exclude(anexo_id__in=encontrados)
+                .values_list('bucket_name', 's3_key')
+            )
+            
+            por_bucket = {}
+            miniaturas = set()
+            if self.s3_available:
+                for anexo in anexos:
+                    chave = (anexo.bucket_name, anexo.s3_key)
+                    if anexo.bucket_name != 'local-development' and chave not in compartilhados:
+                        keys = por_bucket.setdefault(anexo.bucket_name, set())
+                        keys.add(anexo.s3_key)
+                        # Miniaturas geradas para o original saem junto com ele
+                        metadata = anexo.metadata if isinstance(anexo.metadata, dict) else {}
+                        for key in metadata.get('thumbnails', {}).values():
+                            keys.add(key)
+                            miniaturas.add((anexo.bucket_name, key))
             
-            for root, dirs, files in os.walk(local_directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
+            falhas = {}
+            removidos = 0
+            for bucket, keys in por_bucket.items():
+                keys = sorted(keys)
+                for inicio in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+                    lote = keys[inicio:inicio + S3_DELETE_BATCH_SIZE]
                     try:
-                        with open(file_path, 'rb') as f:
-                            file_content = f.read()
-                        
-                        # Gera chave S3
-                        s3_key = self._generate_s3_key('migrated', file)
-                        
-                        # Upload para S3
-                        self.s3_client.put_object(
-                            Bucket=self.bucket_name,
-                            Key=s3_key,
-                            Body=file_content
+                        response = self.s3_client.delete_objects(
+                            Bucket=bucket,
+                            Delete={'Objects': [{'Key': key} for key in lote], 'Quiet': True}
                         )
-                        
-                        migrated_files.append({
-                            'local_path': file_path,
-                            's3_key': s3_key,
-                            'size': len(file_content)
-                        })
-                        
-                        logger.info(f"Migrated file: {file_path} -> {s3_key}")
-                        
-                    except Exception as e:
-                        failed_files.append({
-                            'local_path': file_path,
-                            'error': str(e)
-                        })
-                        logger.error(f"Failed to migrate file {file_path}: {e}")
+                        erros = response.get('Errors', [])
+                    except (ClientError, BotoCoreError) as e:
+                        erros = [{'Key': key, 'Code': 'RequestError', 'Message': str(e)} for key in lote]
+                    for erro in erros:
+                        if (bucket, erro['Key']) in miniaturas:
+                            logger.warning(f"Failed to delete thumbnail {erro['Key']}: {erro.get('Message')}")
+                            continue
+                        falhas[(bucket, erro['Key'])] = f"{erro.get('Code')}: {erro.get('Message')}"
+                    removidos += sum(
+                        1 for key in lote if (bucket, key) not in miniaturas and (bucket, key) not in falhas
+                    )
+            
+            mantidos = [anexo for anexo in anexos if (anexo.bucket_name, anexo.s3_key) in falhas]
+            apagar = [anexo.pk for anexo in anexos if (anexo.bucket_name, anexo.s3_key) not in falhas]
+            AnexoS3.objects.filter(pk__in=apagar).delete()
+            logger.info(f"Bulk delete: {len(apagar)} records, {removidos} S3 objects, {len(falhas)} failures")
             
             return {
-                'success': True,
-                'migrated_count': len(migrated_files),
-                'failed_count': len(failed_files),
-                'migrated_files': migrated_files,
-                'failed_files': failed_files
+                'success': not falhas and not nao_encontrados,
+                'deleted_count': len(apagar),
+                'deleted_objects': removidos,
+                'shared_objects': len({(a.bucket_name, a.s3_key) for a in anexos} & compartilhados),
+                'not_found': nao_encontrados,
+                'failed': [
+                    {'anexo_id': anexo.anexo_id, 'key': anexo.s3_key, 'error': falhas[(anexo.bucket_name, anexo.s3_key)]}
+                    for anexo in mantidos
+                ]
             }
             
         except Exception as e:
-            logger.error(f"Error during migration: {str(e)}")
+            logger.error(f"Error deleting files: {str(e)}")
             return {
                 'success': False,
                 'error': str(e)
             }
     
+    def delete_file(self, anexo_id: str) -> Dict[str, Any]:
+        """
+        Deleta um arquivo do S3 e remove o registro do banco.
+        
+        Args:
+            anexo_id: ID do anexo
+        
+        Returns:
+            Dict com resultado da operação
+        """
+        result = self.delete_files([anexo_id])
+        if result.get('not_found'):
+            return {
+                'success': False,
+                'error': 'Anexo not found'
+            }
+        if result.get('failed'):
+            return {
+                'success': False,
+                'error': result['failed'][0]['error']
+            }
+        if not result['success']:
+            return result
+        return {
+            'success': True,
+            'message': 'File deleted successfully'
+        }
+    
+    def migrate_local_files_to_s3(self,
+                                  anexo_type: Optional[str] = None,
+                                  object_id: Optional[int] = None,
+                                  user_id: int = None,
+                                  workers: int = 4,
+                                  dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Migra os arquivos locais dos anexos (obra, compra, locação, despesa) para o S3,
+        criando os registros AnexoS3 e vinculando as linhas de origem.
+        
+        Args:
+            anexo_type: Restringe a um tipo de anexo ('obra', 'compra', 'locacao', 'despesa')
+            object_id: Restringe aos anexos de um objeto (ex.: ID da obra)
+            user_id: ID do usuário que solicitou a migração
+            workers: Threads para hash e upload
+            dry_run: Apenas simula a migração
+        
+        Returns:
+            Dict com resultado da migração
+        """
+        from .migracao_s3 import MigracaoS3
+        
+        return MigracaoS3(self, workers=workers).run(
+            tipos=[anexo_type] if anexo_type else None,
+            object_id=object_id,
+            user_id=user_id,
+            dry_run=dry_run
+        )
+    
     def get_file_info(self, anexo_id: str) -> Dict[str, Any]:
         """
         Obtém informações detalhadas sobre um arquivo.
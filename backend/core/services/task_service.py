@@ -4,18 +4,38 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List, Callable
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
 from django.core.exceptions import ValidationError
 import logging
 
 from ..models import TaskHistory
+from .executor_tarefas import carregar_tarefas
 
 logger = logging.getLogger(__name__)
 
 
+# Duração da execução, calculada no banco
+DURACAO_TAREFA = ExpressionWrapper(F('completed_at') - F('started_at'), output_field=DurationField())
+CONCLUIDAS_COM_DURACAO = Q(status='completed', started_at__isnull=False, completed_at__isnull=False)
+
+# Períodos da série de get_task_statistics
+PERIODOS_ESTATISTICAS = {
+    'day': TruncDay,
+    'hour': TruncHour,
+}
+
+
+def _segundos(duracao: Optional[timedelta]) -> Optional[int]:
+    return int(duracao.total_seconds()) if duracao is not None else None
+
+
 class TaskService:
     """
     Serviço para gerenciar tarefas e histórico do sistema.
     Permite criar, atualizar, monitorar e executar tarefas com rastreamento completo.
+    Tarefas criadas com um handler registrado (executor_tarefas.TAREFAS) ficam
+    na fila e rodam no executor (manage.py executar_tarefas), fora da requisição.
     """
     
     # Status válidos para tarefas
@@ -41,9 +61,6 @@ class TaskService:
         'custom'        # Tarefas customizadas
     ]
     
-    def __init__(self):
-        self._running_tasks = {}  # Cache de tarefas em execução
-    
     def create_task(self,
                    task_type: str,
                    title: str,
@@ -51,7 +68,9 @@ class TaskService:
                    user_id: int = None,
                    metadata: Dict[str, Any] = None,
                    estimated_duration: int = None,
-                   priority: str = 'medium') -> Dict[str, Any]:
+                   priority: str = 'medium',
+                   handler: str = None,
+                   params: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Cria uma nova tarefa.
         
@@ -63,6 +82,8 @@ class TaskService:
             metadata: Dados adicionais da tarefa
             estimated_duration: Duração estimada em segundos
             priority: Prioridade (low, medium, high, critical)
+            handler: Tarefa registrada no executor que vai rodar esta tarefa
+            params: Argumentos do handler (JSON serializável)
         
         Returns:
             Dict com resultado da operação
@@ -75,6 +96,12 @@ class TaskService:
             if priority not in ['low', 'medium', 'high', 'critical']:
                 priority = 'medium'
             
+            metadata = dict(metadata or {})
+            if handler:
+                if handler not in carregar_tarefas():
+                    raise ValidationError(f"Invalid task handler: {handler}")
+                metadata.update({'handler': handler, 'params': params or {}})
+            
             # Gera ID único para a tarefa
             task_id = f"{task_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
             
@@ -86,7 +113,7 @@ class TaskService:
                 description=description,
                 status='pending',
                 created_by_id=user_id,
-                metadata=metadata or {},
+                metadata=metadata,
                 estimated_duration=estimated_duration,
                 priority=priority
             )
@@ -162,11 +189,6 @@ class TaskService:
                 if not task.started_at:
                     task.started_at = now
                 task.completed_at = now
-                
-                # Calcula duração real
-                if task.started_at:
-                    duration = (now - task.started_at).total_seconds()
-                    task.actual_duration = int(duration)
             
             # Atualiza metadados
             if metadata_update:
@@ -177,10 +199,6 @@ class TaskService:
             
             task.save()
             
-            # Remove do cache se concluída
-            if status in ['completed', 'failed', 'cancelled'] and task_id in self._running_tasks:
-                del self._running_tasks[task_id]
-            
             logger.info(f"Task {task_id} status updated: {old_status} -> {status}")
             
             return {
@@ -214,7 +232,7 @@ class TaskService:
             Dict com informações da tarefa
         """
         try:
-            task = TaskHistory.objects.get(task_id=task_id)
+            task = TaskHistory.objects.select_related('created_by').get(task_id=task_id)
             
             return {
                 'success': True,
@@ -231,8 +249,8 @@ class TaskService:
                     'started_at': task.started_at,
                     'completed_at': task.completed_at,
                     'estimated_duration': task.estimated_duration,
-                    'actual_duration': task.actual_duration,
-                    'created_by': task.created_by.username if task.created_by else None,
+                    'actual_duration': _segundos(task.actual_duration),
+                    'created_by': task.created_by.login if task.created_by else None,
                     'error_message': task.error_message,
                     'metadata': task.metadata
                 }
@@ -274,7 +292,7 @@ class TaskService:
             Dict com lista de tarefas
         """
         try:
-            queryset = TaskHistory.objects.all()
+            queryset = TaskHistory.objects.select_related('created_by')
             
             # Aplica filtros
             if task_type:
@@ -311,8 +329,8 @@ class TaskService:
                     'started_at': task.started_at,
                     'completed_at': task.completed_at,
                     'estimated_duration': task.estimated_duration,
-                    'actual_duration': task.actual_duration,
-                    'created_by': task.created_by.username if task.created_by else None,
+                    'actual_duration': _segundos(task.actual_duration),
+                    'created_by': task.created_by.login if task.created_by else None,
                     'error_message': task.error_message
                 })
             
@@ -340,7 +358,7 @@ class TaskService:
             Dict com tarefas em execução
         """
         try:
-            running_tasks = TaskHistory.objects.filter(
+            running_tasks = TaskHistory.objects.select_related('created_by').filter(
                 status='in_progress'
             ).order_by('-started_at')
             
@@ -361,7 +379,7 @@ class TaskService:
                     'started_at': task.started_at,
                     'elapsed_time': elapsed_time,
                     'estimated_duration': task.estimated_duration,
-                    'created_by': task.created_by.username if task.created_by else None
+                    'created_by': task.created_by.login if task.created_by else None
                 })
             
             return {
@@ -379,7 +397,9 @@ class TaskService:
     
     def cancel_task(self, task_id: str, reason: str = '') -> Dict[str, Any]:
         """
-        Cancela uma tarefa.
+        Cancela uma tarefa. Uma tarefa pendente sai da fila na hora; uma que
+        já roda no executor recebe o pedido de cancelamento e para no próximo
+        registro de progresso (o status passa a 'cancelled' quando ela parar).
         
         Args:
             task_id: ID da tarefa
@@ -397,13 +417,48 @@ class TaskService:
                     'error': f'Cannot cancel task with status: {task.status}'
                 }
             
-            # Atualiza status para cancelado
+            error_message = f'Cancelled: {reason}' if reason else 'Cancelled by user'
+            now = timezone.now()
+            
+            # Condicional no status: a tarefa pode ter sido reivindicada por um worker agora
+            if task.status == 'pending' and TaskHistory.objects.filter(pk=task.pk, status='pending').update(
+                status='cancelled',
+                cancel_requested=True,
+                completed_at=now,
+                updated_at=now,
+                error_message=error_message,
+                metadata={**task.metadata, 'cancelled_at': now.isoformat(), 'cancel_reason': reason}
+            ):
+                logger.info(f"Task {task_id} cancelled: {reason}")
+                return {
+                    'success': True,
+                    'task_id': task_id,
+                    'old_status': 'pending',
+                    'new_status': 'cancelled',
+                    'progress': task.progress_percentage
+                }
+            
+            if task.metadata.get('handler'):
+                TaskHistory.objects.filter(pk=task.pk, status='in_progress').update(
+                    cancel_requested=True, error_message=error_message, updated_at=now
+                )
+                logger.info(f"Task {task_id} cancellation requested: {reason}")
+                return {
+                    'success': True,
+                    'task_id': task_id,
+                    'old_status': 'in_progress',
+                    'new_status': 'in_progress',
+                    'cancel_requested': True,
+                    'progress': task.progress_percentage
+                }
+            
+            # Tarefas que rodam fora do executor não verificam o pedido
             result = self.update_task_status(
                 task_id=task_id,
                 status='cancelled',
-                error_message=f'Cancelled: {reason}' if reason else 'Cancelled by user',
+                error_message=error_message,
                 metadata_update={
-                    'cancelled_at': timezone.now().isoformat(),
+                    'cancelled_at': now.isoformat(),
                     'cancel_reason': reason
                 }
             )
@@ -428,19 +483,27 @@ class TaskService:
     def get_task_statistics(self, 
                            days: int = 30,
                            task_type: str = None,
-                           user_id: int = None) -> Dict[str, Any]:
+                           user_id: int = None,
+                           bucket: str = None) -> Dict[str, Any]:
         """
-        Obtém estatísticas das tarefas.
+        Obtém estatísticas das tarefas. Contagens por status e por tipo e a
+        duração das concluídas (completed_at - started_at) saem de uma única
+        consulta com agregação condicional; a série por período, se pedida,
+        de uma segunda consulta agrupada.
         
         Args:
             days: Número de dias para análise
             task_type: Filtrar por tipo de tarefa
             user_id: Filtrar por usuário
+            bucket: Série por período para gráficos ('day' ou 'hour')
         
         Returns:
             Dict com estatísticas
         """
         try:
+            if bucket and bucket not in PERIODOS_ESTATISTICAS:
+                raise ValidationError(f"Invalid bucket: {bucket}. Use: {', '.join(PERIODOS_ESTATISTICAS)}")
+            
             # Data de início para análise
             start_date = timezone.now() - timedelta(days=days)
             
@@ -452,61 +515,69 @@ class TaskService:
             if user_id:
                 queryset = queryset.filter(created_by_id=user_id)
             
+            task_types = list(dict.fromkeys(self.VALID_TASK_TYPES + [tipo for tipo, _ in TaskHistory.TASK_TYPE_CHOICES]))
+            agregados = {'total': Count('pk')}
+            agregados.update({f'status_{status}': Count('pk', filter=Q(status=status)) for status in self.VALID_STATUSES})
+            agregados.update({f'type_{tipo}': Count('pk', filter=Q(task_type=tipo)) for tipo in task_types})
+            agregados.update({
+                'avg_duration': Avg(DURACAO_TAREFA, filter=CONCLUIDAS_COM_DURACAO),
+                'min_duration': Min(DURACAO_TAREFA, filter=CONCLUIDAS_COM_DURACAO),
+                'max_duration': Max(DURACAO_TAREFA, filter=CONCLUIDAS_COM_DURACAO),
+                'total_duration': Sum(DURACAO_TAREFA, filter=CONCLUIDAS_COM_DURACAO),
+            })
+            totais = queryset.aggregate(**agregados)
+            
             # Estatísticas por status
-            status_stats = {}
-            for status in self.VALID_STATUSES:
-                count = queryset.filter(status=status).count()
-                status_stats[status] = count
+            status_stats = {status: totais[f'status_{status}'] for status in self.VALID_STATUSES}
             
             # Estatísticas por tipo
-            type_stats = {}
-            for task_type_stat in self.VALID_TASK_TYPES:
-                count = queryset.filter(task_type=task_type_stat).count()
-                if count > 0:
-                    type_stats[task_type_stat] = count
-            
-            # Estatísticas de duração
-            completed_tasks = queryset.filter(
-                status='completed',
-                actual_duration__isnull=False
-            )
+            type_stats = {tipo: totais[f'type_{tipo}'] for tipo in task_types if totais[f'type_{tipo}']}
             
+            # Estatísticas de duração, em segundos
             duration_stats = {
-                'avg_duration': 0,
-                'min_duration': 0,
-                'max_duration': 0,
-                'total_duration': 0
+                chave: round(totais[chave].total_seconds(), 3) if totais[chave] is not None else 0
+                for chave in ('avg_duration', 'min_duration', 'max_duration', 'total_duration')
             }
             
-            if completed_tasks.exists():
-                durations = [task.actual_duration for task in completed_tasks]
-                duration_stats = {
-                    'avg_duration': sum(durations) / len(durations),
-                    'min_duration': min(durations),
-                    'max_duration': max(durations),
-                    'total_duration': sum(durations)
-                }
-            
             # Taxa de sucesso
-            total_finished = queryset.filter(
-                status__in=['completed', 'failed', 'cancelled']
-            ).count()
+            total_finished = status_stats['completed'] + status_stats['failed'] + status_stats['cancelled']
             
             success_rate = 0
             if total_finished > 0:
-                completed_count = queryset.filter(status='completed').count()
-                success_rate = (completed_count / total_finished) * 100
+                success_rate = (status_stats['completed'] / total_finished) * 100
             
-            return {
+            result = {
                 'success': True,
                 'period_days': days,
-                'total_tasks': queryset.count(),
+                'total_tasks': totais['total'],
                 'status_distribution': status_stats,
                 'type_distribution': type_stats,
                 'duration_statistics': duration_stats,
                 'success_rate': round(success_rate, 2)
             }
             
+            if bucket:
+                result['bucket'] = bucket
+                result['series'] = [
+                    {
+                        'period': linha['periodo'],
+                        'total': linha['total'],
+                        'completed': linha['completed'],
+                        'failed': linha['failed'],
+                        'avg_duration': round(linha['avg_duration'].total_seconds(), 3) if linha['avg_duration'] is not None else None
+                    }
+                    for linha in queryset.order_by().annotate(
+                        periodo=PERIODOS_ESTATISTICAS[bucket]('created_at')
+                    ).values('periodo').annotate(
+                        total=Count('pk'),
+                        completed=Count('pk', filter=Q(status='completed')),
+                        failed=Count('pk', filter=Q(status='failed')),
+                        avg_duration=Avg(DURACAO_TAREFA, filter=CONCLUIDAS_COM_DURACAO)
+                    ).order_by('periodo')
+                ]
+            
+            return result
+            
         except Exception as e:
             logger.error(f"Error getting task statistics: {str(e)}")
             return {
@@ -557,7 +628,9 @@ class TaskService:
                                   *args,
                                   **kwargs) -> Dict[str, Any]:
         """
-        Executa uma função com rastreamento automático de tarefa.
+        Executa uma função com rastreamento automático de tarefa, na própria
+        chamada. Para rodar fora da requisição, crie a tarefa com um handler
+        registrado no executor (create_task(handler=...)).
         
         Args:
             task_id: ID da tarefa
@@ -1,8 +1,12 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.db.models import Sum
+from django.utils import timezone
 from decimal import Decimal
-from .models import ItemCompra, Compra
+from .models import ItemCompra, Compra, Obra, Locacao_Obras_Equipes, Despesa_Extra, ObraCustoResumo, Equipe
+from .services.ocupacao import sincronizar_ocupacoes, sincronizar_ocupacoes_equipe
+from .services.custos_diarios import atualizar_custos_diarios
+from .services.rastreio_alteracoes import conectar_rastreio
 
 
 @receiver(post_save, sender=ItemCompra)
@@ -24,7 +28,8 @@ def update_compra_totals_on_item_save(sender, instance, **kwargs):
     # Salvar a compra sem chamar os signals novamente para evitar recursão
     Compra.objects.filter(id=compra.id).update(
         valor_total_bruto=total_bruto,
-        valor_total_liquido=total_bruto - compra.desconto
+        valor_total_liquido=total_bruto - compra.desconto,
+        updated_at=timezone.now()
     )
 
 
@@ -47,5 +52,143 @@ def update_compra_totals_on_item_delete(sender, instance, **kwargs):
     # Salvar a compra sem chamar os signals novamente para evitar recursão
     Compra.objects.filter(id=compra.id).update(
         valor_total_bruto=total_bruto,
-        valor_total_liquido=total_bruto - compra.desconto
-    )
\ No newline at end of file
+        valor_total_liquido=total_bruto - compra.desconto,
+        updated_at=timezone.now()
+    )
+
+# ---------------------------------------------------------------------------
+# Resumo de custos por obra (ObraCustoResumo)
+#
+# Cada escrita recalcula apenas as categorias afetadas da(s) obra(s) envolvidas.
+# Em updates que trocam a obra de um registro, a obra anterior também é
+# atualizada (capturada no pre_save).
+# ---------------------------------------------------------------------------
+
+CATEGORIAS_POR_MODELO = {
+    Compra: ('materiais',),
+    Locacao_Obras_Equipes: ('mao_de_obra', 'servicos'),
+    Despesa_Extra: ('despesas_extras',),
+}
+
+
+def _atualizar_resumos(obra_ids, categorias):
+    for obra_id in {obra_id for obra_id in obra_ids if obra_id}:
+        ObraCustoResumo.atualizar(obra_id, categorias)
+
+
+@receiver(post_save, sender=Obra)
+def criar_resumo_custos_obra(sender, instance, created, raw=False, **kwargs):
+    """
+    Cria o resumo (zerado) junto com a obra.
+    """
+    if created and not raw:
+        # Usa obra_id (e não obra=instance) para não preencher o cache reverso
+        # instance.custo_resumo com um resumo que logo ficará desatualizado.
+        ObraCustoResumo.objects.get_or_create(obra_id=instance.pk)
+
+
+# Campo de data que define o dia de cada registro no consolidado diário (CustoDiarioObra)
+CAMPO_DATA_POR_MODELO = {
+    Compra: 'data_compra',
+    Locacao_Obras_Equipes: 'data_locacao_inicio',
+    Despesa_Extra: 'data',
+}
+
+
+@receiver(pre_save, sender=Compra)
+@receiver(pre_save, sender=Locacao_Obras_Equipes)
+@receiver(pre_save, sender=Despesa_Extra)
+def guardar_obra_anterior(sender, instance, raw=False, **kwargs):
+    """
+    Guarda a obra e a data originais do registro para que uma troca de obra
+    (ou de dia) atualize os dois lados.
+    """
+    instance._obra_id_anterior = None
+    instance._data_anterior = None
+    if instance.pk and not raw:
+        anterior = sender.objects.filter(pk=instance.pk).values_list(
+            'obra_id', CAMPO_DATA_POR_MODELO[sender]
+        ).first()
+        if anterior:
+            instance._obra_id_anterior, instance._data_anterior = anterior
+
+
+@receiver(post_save, sender=Compra)
+@receiver(post_save, sender=Locacao_Obras_Equipes)
+@receiver(post_save, sender=Despesa_Extra)
+def atualizar_resumo_custos_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    obra_id_anterior = getattr(instance, '_obra_id_anterior', None)
+    categorias = CATEGORIAS_POR_MODELO[sender]
+    _atualizar_resumos([instance.obra_id, obra_id_anterior], categorias)
+    atualizar_custos_diarios([
+        (instance.obra_id, getattr(instance, CAMPO_DATA_POR_MODELO[sender])),
+        (obra_id_anterior, getattr(instance, '_data_anterior', None)),
+    ], categorias)
+
+
+@receiver(post_delete, sender=Compra)
+@receiver(post_delete, sender=Locacao_Obras_Equipes)
+@receiver(post_delete, sender=Despesa_Extra)
+def atualizar_resumo_custos_on_delete(sender, instance, **kwargs):
+    categorias = CATEGORIAS_POR_MODELO[sender]
+    _atualizar_resumos([instance.obra_id], categorias)
+    atualizar_custos_diarios([(instance.obra_id, getattr(instance, CAMPO_DATA_POR_MODELO[sender]))], categorias)
+
+
+@receiver(post_save, sender=ItemCompra)
+@receiver(post_delete, sender=ItemCompra)
+def atualizar_resumo_custos_on_item_change(sender, instance, raw=False, **kwargs):
+    """
+    Os totais da compra são atualizados via queryset.update() pelos handlers acima
+    (sem disparar signals da Compra), então o resumo e o consolidado diário são
+    atualizados aqui.
+    """
+    if raw:
+        return
+    compra = Compra.objects.filter(pk=instance.compra_id).values_list('obra_id', 'data_compra').first()
+    if not compra:
+        return
+    _atualizar_resumos([compra[0]], ('materiais',))
+    atualizar_custos_diarios([compra], ('materiais',))
+
+
+# ---------------------------------------------------------------------------
+# Índice de ocupação de funcionários (OcupacaoFuncionario)
+# ---------------------------------------------------------------------------
+
+@receiver(post_save, sender=Locacao_Obras_Equipes)
+def atualizar_ocupacoes_on_locacao_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizar_ocupacoes([instance])
+
+
+@receiver(m2m_changed, sender=Equipe.membros.through)
+def atualizar_ocupacoes_on_membros_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Mudanças nos membros de uma equipe alteram quem está ocupado pelas locações dela.
+    No lado reverso (funcionario.equipes_membro), pk_set contém IDs de equipes.
+    """
+    if reverse and action == 'pre_clear':
+        instance._equipes_antes_clear = list(instance.equipes_membro.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        equipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        equipe_ids = getattr(instance, '_equipes_antes_clear', [])
+    else:
+        equipe_ids = list(pk_set or [])
+
+    for equipe_id in equipe_ids:
+        sincronizar_ocupacoes_equipe(equipe_id)
+
+
+# ---------------------------------------------------------------------------
+# Diário de alterações dos backups incrementais (RegistroAlteracao)
+# ---------------------------------------------------------------------------
+
+conectar_rastreio()
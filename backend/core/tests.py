@@ -1,14 +1,58 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from decimal import Decimal
-from .models import Obra, Compra, Material, ItemCompra, Usuario, Funcionario, Locacao_Obras_Equipes, Equipe
+from .models import Obra, Compra, Material, ItemCompra, Usuario, Funcionario, Locacao_Obras_Equipes, Equipe, Despesa_Extra, ObraCustoResumo, OcupacaoFuncionario, CustoDiarioObra, TaskHistory, AnexoS3, AnexoCompra, ArquivoObra, AnexoDespesa, FotoObra, AnexoLocacao, BackupLog, BlocoBackup, BlocoManifesto, BackupSettings, Backup
 from django.utils import timezone
 from datetime import date, timedelta, datetime # Added datetime explicitly for strptime
 from rest_framework.exceptions import ValidationError
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase, APIRequestFactory, force_authenticate
 from rest_framework import status
 from django.urls import reverse
 import datetime as dt # For datetime.date usage if not directly importing date
 
+from io import StringIO, BytesIO
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import Future
+from unittest import mock
+from types import SimpleNamespace
+import hashlib
+import zipfile
+import random
+import gzip
+import json
+import sqlite3
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from botocore.response import StreamingBody
+from django.core.cache import cache
+from botocore.exceptions import ClientError, EndpointConnectionError
+from PIL import Image
+
+from .services.folha_pagamento import atribuir_custos_por_dia, montar_folha_por_recurso, montar_folha_por_obra
+from .services.custos_diarios import reconstruir_custos_diarios
+from .services.derivados_cache import DerivadoCache
+from .services.miniaturas import caminho_miniatura
+from .services.s3_service import S3Service, reset_s3_state
+from .utils import parse_range_header
+from . import utils as core_utils
+from .services.backup_engines import SQLiteBackupEngine, DumpDataBackupEngine, gravar_snapshot_verificado
+from .views.views import BackupViewSet as BackupViewSetLegado
+from .services.backup_service import BackupService
+from .services import repositorio_backups
+from .services.repositorio_backups import dividir_em_blocos
+from .services.agendador_backups import horario_devido, executar_backup_agendado
+from .services.executor_tarefas import ExecutorTarefas, registrar_tarefa
+from .services.task_service import TaskService
+from .services.relatorios_pdf import RelatorioPDFService
+
 
 # LocacaoObrasEquipesSerializer and ObraSerializer are imported lower down where used by specific test classes.
 
@@ -161,6 +205,1874 @@ class ObraSerializerTests(TestCase):
         self.assertEqual(serializer.data['custo_total_realizado'], expected_total_locacoes)
     # ... (other ObraSerializerTests methods remain unchanged) ...
 
+class ObraCustoResumoTests(TestCase):
+    def setUp(self):
+        self.obra = Obra.objects.create(nome_obra="Obra Resumo", endereco_completo="Rua Resumo, 1", cidade="Resumópolis", status="Em Andamento")
+        self.outra_obra = Obra.objects.create(nome_obra="Outra Obra", endereco_completo="Rua Outra, 2", cidade="Resumópolis", status="Em Andamento")
+        self.material = Material.objects.create(nome="Material Resumo", unidade_medida="un")
+        self.funcionario = Funcionario.objects.create(nome_completo="Func Resumo", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+
+    def _resumo(self, obra):
+        return ObraCustoResumo.objects.get(obra=obra)
+
+    def test_resumo_atualizado_em_escritas_e_exclusoes(self):
+        compra = Compra.objects.create(obra=self.obra, data_compra=date(2024, 5, 1))
+        item = ItemCompra.objects.create(compra=compra, material=self.material, quantidade=Decimal('2.000'), valor_unitario=Decimal('50.00'))
+        Compra.objects.create(obra=self.obra, data_compra=date(2024, 5, 1), tipo='ORCAMENTO', valor_total_bruto=Decimal('999.00'))
+        Locacao_Obras_Equipes.objects.create(obra=self.obra, funcionario_locado=self.funcionario, data_locacao_inicio=date(2024, 5, 2), valor_pagamento=Decimal('200.00'))
+        servico = Locacao_Obras_Equipes.objects.create(obra=self.obra, servico_externo="Pintura", data_locacao_inicio=date(2024, 5, 2), valor_pagamento=Decimal('300.00'))
+        Despesa_Extra.objects.create(obra=self.obra, descricao="Almoço", valor=Decimal('40.00'), data=date(2024, 5, 2), categoria='Alimentação')
+
+        resumo = self._resumo(self.obra)
+        self.assertEqual(resumo.materiais, Decimal('100.00'))
+        self.assertEqual(resumo.mao_de_obra, Decimal('200.00'))
+        self.assertEqual(resumo.servicos, Decimal('300.00'))
+        self.assertEqual(resumo.despesas_extras, Decimal('40.00'))
+
+        item.delete()
+        servico.obra = self.outra_obra
+        servico.save()
+
+        self.assertEqual(self._resumo(self.obra).materiais, Decimal('0.00'))
+        self.assertEqual(self._resumo(self.obra).servicos, Decimal('0.00'))
+        self.assertEqual(self._resumo(self.outra_obra).servicos, Decimal('300.00'))
+
+    def test_serializer_le_do_resumo(self):
+        Despesa_Extra.objects.create(obra=self.obra, descricao="Frete", valor=Decimal('75.00'), data=date(2024, 5, 2), categoria='Transporte')
+        ObraCustoResumo.objects.filter(obra=self.obra).delete()
+
+        data = ObraSerializer(instance=Obra.objects.get(pk=self.obra.pk)).data
+        self.assertEqual(data['custos_por_categoria']['despesas_extras'], Decimal('75.00'))
+        self.assertEqual(data['custo_total_realizado'], Decimal('75.00'))
+        self.assertTrue(ObraCustoResumo.objects.filter(obra=self.obra).exists())
+
+    def test_comando_recalcular_custos_obras(self):
+        Despesa_Extra.objects.create(obra=self.obra, descricao="Frete", valor=Decimal('75.00'), data=date(2024, 5, 2), categoria='Transporte')
+        ObraCustoResumo.objects.filter(obra=self.obra).update(despesas_extras=Decimal('1.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('recalcular_custos_obras', '--verificar', stdout=StringIO())
+
+        call_command('recalcular_custos_obras', stdout=StringIO())
+        self.assertEqual(self._resumo(self.obra).despesas_extras, Decimal('75.00'))
+        call_command('recalcular_custos_obras', '--verificar', stdout=StringIO())
+
+class ObraListCustosAnotadosTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='obracustosadmin', password='password', nome_completo='Admin Custos', nivel_acesso='admin')
+        cls.funcionario = Funcionario.objects.create(nome_completo="Func Custos", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+
+    def _criar_obra_com_custos(self, indice):
+        obra = Obra.objects.create(nome_obra=f"Obra Custos {indice}", endereco_completo=".", cidade=".", status="Em Andamento")
+        Compra.objects.create(obra=obra, data_compra=date(2024, 5, 1), valor_total_bruto=Decimal('100.00'))
+        Locacao_Obras_Equipes.objects.create(obra=obra, funcionario_locado=self.funcionario, data_locacao_inicio=date(2024, 5, 2), valor_pagamento=Decimal('20.00'))
+        Locacao_Obras_Equipes.objects.create(obra=obra, servico_externo="Pintura", data_locacao_inicio=date(2024, 5, 2), valor_pagamento=Decimal('30.00'))
+        Despesa_Extra.objects.create(obra=obra, descricao="Almoço", valor=Decimal('5.00'), data=date(2024, 5, 2), categoria='Alimentação')
+        # Resumos ausentes não podem gerar consultas por linha na listagem
+        ObraCustoResumo.objects.filter(obra=obra).delete()
+        return obra
+
+    def test_listagem_usa_numero_fixo_de_consultas(self):
+        url = reverse('obra-list')
+        self._criar_obra_com_custos(0)
+        with self.assertNumQueries(2):  # COUNT da paginação + SELECT anotado
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for indice in range(1, 8):
+            self._criar_obra_com_custos(indice)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        obra_data = response.json()['results'][0]
+        self.assertEqual(Decimal(obra_data['custos_por_categoria']['materiais']), Decimal('100.00'))
+        self.assertEqual(Decimal(obra_data['custos_por_categoria']['mao_de_obra']), Decimal('20.00'))
+        self.assertEqual(Decimal(obra_data['custos_por_categoria']['servicos']), Decimal('30.00'))
+        self.assertEqual(Decimal(obra_data['custos_por_categoria']['despesas_extras']), Decimal('5.00'))
+        self.assertEqual(Decimal(obra_data['custo_total_realizado']), Decimal('155.00'))
+
+class FolhaPagamentoAtribuicaoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.obra = Obra.objects.create(nome_obra="Obra Folha", endereco_completo=".", cidade=".", status="Em Andamento")
+        cls.funcionario = Funcionario.objects.create(nome_completo="Func Folha", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+        cls.diaria = Locacao_Obras_Equipes.objects.create(obra=cls.obra, funcionario_locado=cls.funcionario, tipo_pagamento='diaria', data_locacao_inicio=date(2024, 6, 4), data_locacao_fim=date(2024, 6, 7), valor_pagamento=Decimal('100.00'))
+        cls.empreitada = Locacao_Obras_Equipes.objects.create(obra=cls.obra, servico_externo="Telhado", tipo_pagamento='empreitada', data_locacao_inicio=date(2024, 6, 2), data_locacao_fim=date(2024, 6, 3), valor_pagamento=Decimal('500.00'))
+        # Começa antes do período: fica fora do relatório
+        Locacao_Obras_Equipes.objects.create(obra=cls.obra, funcionario_locado=cls.funcionario, tipo_pagamento='diaria', data_locacao_inicio=date(2024, 5, 30), data_locacao_fim=date(2024, 6, 2), valor_pagamento=Decimal('70.00'))
+        cls.inicio = date(2024, 6, 1)
+        cls.fim = date(2024, 6, 5)
+
+    def test_atribuir_custos_por_dia_recorta_intervalos(self):
+        atribuicoes = atribuir_custos_por_dia([self.diaria, self.empreitada], self.inicio, self.fim)
+        self.assertEqual(
+            [(dia, [(loc.id, valor) for loc, valor in itens]) for dia, itens in atribuicoes],
+            [
+                (date(2024, 6, 2), [(self.empreitada.id, Decimal('500.00'))]),
+                (date(2024, 6, 4), [(self.diaria.id, Decimal('100.00'))]),
+                (date(2024, 6, 5), [(self.diaria.id, Decimal('100.00'))]),
+            ]
+        )
+
+    def test_folha_por_recurso(self):
+        folha = montar_folha_por_recurso(self.inicio, self.fim)
+        self.assertEqual(folha['total_geral_periodo'], '700.00')
+        recursos = {r['recurso_nome']: r for r in folha['recursos_pagamentos']}
+        funcionario = recursos["Funcionário: Func Folha"]
+        self.assertEqual(funcionario['total_a_pagar_periodo'], '200.00')
+        self.assertEqual(
+            [l['data_servico'] for l in funcionario['detalhes_por_obra'][0]['locacoes_na_obra']],
+            ['2024-06-04', '2024-06-05']
+        )
+        self.assertEqual(recursos["Serviço Externo: Telhado"]['total_a_pagar_periodo'], '500.00')
+
+    def test_folha_por_obra(self):
+        folha = montar_folha_por_obra(self.inicio, self.fim, self.obra.id)
+        self.assertEqual(len(folha), 1)
+        self.assertEqual(folha[0]['total_obra_periodo'], '700.00')
+        self.assertEqual([d['data'] for d in folha[0]['dias']], ['2024-06-02', '2024-06-04', '2024-06-05'])
+        self.assertEqual(folha[0]['dias'][0]['locacoes_no_dia'][0]['valor_diario_atribuido'], '500.00')
+
+class LocacaoCriacaoMultiDiasAPITests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='multidiasadmin', password='password', nome_completo='Admin Multi Dias', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra Multi Dias", endereco_completo=".", cidade=".", status="Em Andamento")
+        cls.membro1 = Funcionario.objects.create(nome_completo="Membro Um", cargo="Pedreiro", data_contratacao=date(2024, 1, 1), valor_diaria_padrao=Decimal('150.00'))
+        cls.membro2 = Funcionario.objects.create(nome_completo="Membro Dois", cargo="Servente", data_contratacao=date(2024, 1, 1), valor_diaria_padrao=Decimal('100.00'))
+        cls.equipe = Equipe.objects.create(nome_equipe="Equipe Multi Dias")
+        cls.equipe.membros.set([cls.membro1, cls.membro2])
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+
+    def test_cria_uma_locacao_por_dia_precificando_uma_vez(self):
+        payload = {
+            'obra': self.obra.id, 'equipe': self.equipe.id, 'tipo_pagamento': 'diaria',
+            'data_locacao_inicio': '2024-07-01', 'data_locacao_fim': '2024-07-20',
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('locacao_obras_equipes-list'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        # Número de consultas não cresce com a quantidade de dias
+        self.assertLess(len(queries), 30)
+
+        self.assertEqual(len(response.data), 20)
+        self.assertEqual(response.data[0]['data_locacao_inicio'], '2024-07-01')
+        self.assertEqual(response.data[-1]['data_locacao_fim'], '2024-07-20')
+        self.assertEqual(response.data[3]['data_pagamento'], '2024-07-04')
+        self.assertTrue(all(Decimal(item['valor_pagamento']) == Decimal('250.00') for item in response.data))
+        self.assertEqual(ObraCustoResumo.objects.get(obra=self.obra).mao_de_obra, Decimal('5000.00'))
+        self.assertEqual(CustoDiarioObra.objects.filter(obra=self.obra, mao_de_obra=Decimal('250.00')).count(), 20)
+
+class OcupacaoFuncionarioTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='ocupacaoadmin', password='password', nome_completo='Admin Ocupação', nivel_acesso='admin')
+        cls.obra1 = Obra.objects.create(nome_obra="Obra Ocupação 1", endereco_completo=".", cidade=".", status="Em Andamento")
+        cls.obra2 = Obra.objects.create(nome_obra="Obra Ocupação 2", endereco_completo=".", cidade=".", status="Em Andamento")
+        cls.membro = Funcionario.objects.create(nome_completo="Membro Ocupado", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+        cls.avulso = Funcionario.objects.create(nome_completo="Funcionário Avulso", cargo="Servente", data_contratacao=date(2024, 1, 1))
+        cls.equipe = Equipe.objects.create(nome_equipe="Equipe Ocupação")
+        cls.equipe.membros.add(cls.membro)
+        cls.locacao_equipe = Locacao_Obras_Equipes.objects.create(obra=cls.obra1, equipe=cls.equipe, data_locacao_inicio=date(2024, 8, 5), data_locacao_fim=date(2024, 8, 9), valor_pagamento=Decimal('100.00'))
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+
+    def test_membro_de_equipe_locada_gera_conflito(self):
+        data = {'obra': self.obra2.id, 'funcionario_locado': self.membro.id, 'data_locacao_inicio': '2024-08-07', 'data_locacao_fim': '2024-08-07', 'tipo_pagamento': 'diaria', 'valor_pagamento': '50.00'}
+        serializer = LocacaoObrasEquipesSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['conflict_details']['locacao_id'], str(self.locacao_equipe.id))
+
+    def test_indice_acompanha_membros_e_cancelamento(self):
+        self.equipe.membros.add(self.avulso)
+        self.assertTrue(OcupacaoFuncionario.objects.filter(funcionario=self.avulso, locacao=self.locacao_equipe).exists())
+        self.equipe.membros.remove(self.avulso)
+        self.assertFalse(OcupacaoFuncionario.objects.filter(funcionario=self.avulso).exists())
+
+        self.locacao_equipe.status_locacao = 'cancelada'
+        self.locacao_equipe.save()
+        self.assertFalse(OcupacaoFuncionario.objects.filter(locacao=self.locacao_equipe).exists())
+
+    def test_verificar_conflitos_em_lote(self):
+        url = reverse('locacao_obras_equipes-verificar-conflitos')
+        payload = {'locacoes': [
+            {'funcionario_locado': self.membro.id, 'data_locacao_inicio': '2024-08-09'},
+            {'funcionario_locado': self.avulso.id, 'data_locacao_inicio': '2024-08-12', 'data_locacao_fim': '2024-08-13'},
+            {'equipe': self.equipe.id, 'data_locacao_inicio': '2024-08-12', 'locacao_id': None},
+            {'funcionario_locado': self.avulso.id, 'data_locacao_inicio': '2024-08-13'},
+        ]}
+        with self.assertNumQueries(2):  # membros das equipes + ocupações do período
+            response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        resultados = response.data['resultados']
+        self.assertEqual([c['locacao_id'] for c in resultados[0]['conflitos']], [self.locacao_equipe.id])
+        self.assertEqual(resultados[1]['conflitos'], [])
+        self.assertEqual(resultados[1]['conflitos_no_lote'], [3])
+        self.assertEqual(resultados[2]['conflitos'], [])
+        self.assertTrue(response.data['possui_conflitos'])
+
+    def test_verificar_conflitos_payload_invalido(self):
+        url = reverse('locacao_obras_equipes-verificar-conflitos')
+        response = self.client.post(url, {'locacoes': [{'funcionario_locado': self.membro.id, 'data_locacao_inicio': 'ontem'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class CustoDiarioObraTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='custodiarioadmin', password='password', nome_completo='Admin Custo Diário', nivel_acesso='admin')
+        cls.funcionario = Funcionario.objects.create(nome_completo="Func Diário", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+        cls.material = Material.objects.create(nome="Material Diário", unidade_medida="un")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+        self.obra = Obra.objects.create(nome_obra="Obra Diária", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def _dia(self, dia):
+        return CustoDiarioObra.objects.filter(obra=self.obra, data=dia).first()
+
+    def test_consolidado_atualizado_em_escritas_e_exclusoes(self):
+        compra = Compra.objects.create(obra=self.obra, data_compra=date(2024, 6, 3))
+        ItemCompra.objects.create(compra=compra, material=self.material, quantidade=Decimal('2.000'), valor_unitario=Decimal('50.00'))
+        locacao = Locacao_Obras_Equipes.objects.create(obra=self.obra, funcionario_locado=self.funcionario, data_locacao_inicio=date(2024, 6, 4), valor_pagamento=Decimal('200.00'))
+        despesa = Despesa_Extra.objects.create(obra=self.obra, descricao="Almoço", valor=Decimal('40.00'), data=date(2024, 6, 4), categoria='Alimentação')
+
+        self.assertEqual(self._dia(date(2024, 6, 3)).materiais, Decimal('100.00'))
+        self.assertEqual(self._dia(date(2024, 6, 4)).mao_de_obra, Decimal('200.00'))
+        self.assertEqual(self._dia(date(2024, 6, 4)).despesas_extras, Decimal('40.00'))
+
+        # Linhas recalculadas têm o updated_at renovado
+        antigo = timezone.now() - timedelta(days=1)
+        CustoDiarioObra.objects.filter(obra=self.obra).update(updated_at=antigo)
+        despesa.valor = Decimal('45.00')
+        despesa.save()
+        self.assertGreater(self._dia(date(2024, 6, 4)).updated_at, antigo)
+        self.assertEqual(self._dia(date(2024, 6, 3)).updated_at, antigo)
+        despesa.valor = Decimal('40.00')
+
+        # Troca de dia atualiza o dia antigo e o novo
+        despesa.data = date(2024, 6, 5)
+        despesa.save()
+        self.assertEqual(self._dia(date(2024, 6, 4)).despesas_extras, Decimal('0.00'))
+        self.assertEqual(self._dia(date(2024, 6, 5)).despesas_extras, Decimal('40.00'))
+
+        # Dias que ficam zerados são removidos
+        compra.delete()
+        locacao.status_locacao = 'cancelada'
+        locacao.save()
+        self.assertIsNone(self._dia(date(2024, 6, 3)))
+        self.assertIsNone(self._dia(date(2024, 6, 4)))
+
+        # A reconstrução a partir das tabelas de origem chega ao mesmo estado
+        antes = list(CustoDiarioObra.objects.filter(obra=self.obra).values_list('data', 'despesas_extras'))
+        reconstruir_custos_diarios(self.obra.id)
+        self.assertEqual(list(CustoDiarioObra.objects.filter(obra=self.obra).values_list('data', 'despesas_extras')), antes)
+
+    def test_criacao_em_lote_de_locacoes_atualiza_consolidado(self):
+        response = self.client.post(reverse('locacao_obras_equipes-list'), {
+            'obra': self.obra.id, 'servico_externo': 'Pintura', 'tipo_pagamento': 'diaria',
+            'valor_pagamento': '30.00', 'data_locacao_inicio': '2024-06-03', 'data_locacao_fim': '2024-06-05',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(
+            list(CustoDiarioObra.objects.filter(obra=self.obra).values_list('data', 'servicos')),
+            [(date(2024, 6, d), Decimal('30.00')) for d in (3, 4, 5)]
+        )
+
+    def test_serie_temporal_por_semana_com_varias_series(self):
+        Compra.objects.create(obra=self.obra, data_compra=date(2024, 6, 3), valor_total_bruto=Decimal('100.00'))
+        Locacao_Obras_Equipes.objects.create(obra=self.obra, servico_externo="Pintura", data_locacao_inicio=date(2024, 6, 12), valor_pagamento=Decimal('30.00'))
+        outra_obra = Obra.objects.create(nome_obra="Outra Diária", endereco_completo=".", cidade=".", status="Em Andamento")
+        Compra.objects.create(obra=outra_obra, data_compra=date(2024, 6, 4), valor_total_bruto=Decimal('7.00'))
+
+        url = reverse('custos-serie-temporal')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {
+                'data_inicio': '2024-06-01', 'data_fim': '2024-06-20', 'granularidade': 'semana',
+                'obra_id': self.obra.id, 'series': 'materiais,servicos',
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['series'], ['materiais', 'servicos'])
+        self.assertEqual([ponto['periodo'] for ponto in data['pontos']], ['2024-05-27', '2024-06-03', '2024-06-10', '2024-06-17'])
+        self.assertEqual(Decimal(str(data['pontos'][1]['materiais'])), Decimal('100.00'))
+        self.assertEqual(Decimal(str(data['pontos'][2]['servicos'])), Decimal('30.00'))
+        self.assertEqual(Decimal(str(data['pontos'][3]['total'])), Decimal('0.00'))
+        self.assertEqual(Decimal(str(data['totais']['total'])), Decimal('130.00'))
+
+        response = self.client.get(url, {'data_inicio': '2024-06-01', 'data_fim': '2024-06-30', 'granularidade': 'mes'})
+        self.assertEqual(Decimal(str(response.json()['pontos'][0]['materiais'])), Decimal('107.00'))
+
+        response = self.client.get(url, {'data_inicio': '2024-06-01', 'data_fim': '2024-06-30', 'granularidade': 'ano'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'data_inicio': '2024-06-01', 'data_fim': '2024-06-30', 'series': 'lucro'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Períodos longos demais para a granularidade são recusados
+        with override_settings(COST_SERIES_MAX_PERIODS=10):
+            response = self.client.get(url, {'data_inicio': '2024-06-01', 'data_fim': '2024-06-30'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.get(url, {'data_inicio': '2024-06-01', 'data_fim': '2024-06-30', 'granularidade': 'semana'})
+            self.assertEqual(len(response.json()['pontos']), 5)
+
+    def test_historico_custos_inclui_locacoes(self):
+        Compra.objects.create(obra=self.obra, data_compra=date(2024, 6, 3), valor_total_bruto=Decimal('100.00'))
+        Locacao_Obras_Equipes.objects.create(obra=self.obra, funcionario_locado=self.funcionario, data_locacao_inicio=date(2024, 6, 4), valor_pagamento=Decimal('200.00'))
+        Despesa_Extra.objects.create(obra=self.obra, descricao="Almoço", valor=Decimal('40.00'), data=date(2024, 7, 1), categoria='Alimentação')
+
+        response = self.client.get(reverse('obra-historico-custos', args=[self.obra.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([item['mes'] for item in data], ['2024-06', '2024-07'])
+        self.assertEqual(Decimal(str(data[0]['total_custo_locacoes'])), Decimal('200.00'))
+        self.assertEqual(Decimal(str(data[0]['total_geral_mes'])), Decimal('300.00'))
+        self.assertEqual(Decimal(str(data[1]['total_custo_despesas'])), Decimal('40.00'))
+
+
+class RelatorioPDFJobTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='relatoriopdfadmin', password='password', nome_completo='Admin Relatórios', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra PDF", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+        self.reports_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.reports_dir.cleanup)
+        settings_override = override_settings(PDF_REPORTS_SYNC=True, PDF_REPORTS_DIR=self.reports_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @mock.patch('core.services.relatorios_pdf.render_pdf_bytes', return_value=b'%PDF-1.4 relatorio')
+    def test_job_concluido_com_progresso_e_download(self, render):
+        response = self.client.post(reverse('relatorio-pdf-job-list'), {
+            'tipo': 'pagamento_locacoes',
+            'parametros': {'start_date': '2024-06-01', 'end_date': '2024-06-30'},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        job = response.data['job']
+        self.assertEqual(job['status'], 'completed')
+        self.assertTrue(job['pronto'])
+        self.assertEqual(render.call_args[0][0], 'relatorios/relatorio_pagamento_locacoes.html')
+
+        task = TaskHistory.objects.get(task_id=job['task_id'])
+        self.assertEqual(task.task_type, 'report')
+        self.assertEqual(task.progress_percentage, 100)
+        self.assertEqual(task.metadata['size_bytes'], len(b'%PDF-1.4 relatorio'))
+
+        response = self.client.get(reverse('relatorio-pdf-job-download', args=[job['task_id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 relatorio')
+        self.assertIn('Relatorio_Pagamento_Locacoes_2024-06-01_a_2024-06-30.pdf', response['Content-Disposition'])
+
+    @mock.patch('core.services.relatorios_pdf.render_pdf_bytes', return_value=b'%PDF-1.4 obra')
+    def test_endpoint_existente_enfileira_por_padrao(self, render):
+        response = self.client.get(reverse('gerar-pdf-obra', args=[self.obra.id]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['download_url'], reverse('relatorio-pdf-job-download', args=[response.data['task_id']]))
+
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.data['job']['status'], 'completed')
+        self.assertTrue(response.data['job']['filename'].startswith('Relatorio_Obra_Obra_PDF'))
+
+    @mock.patch('core.views.views.generate_pdf_response', return_value=HttpResponse(b'%PDF-1.4 sincrono', content_type='application/pdf'))
+    def test_async_false_gera_na_requisicao(self, generate):
+        response = self.client.get(reverse('gerar-pdf-obra', args=[self.obra.id]), {'async': 'false'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'%PDF-1.4 sincrono')
+        self.assertEqual(generate.call_args[0][0], 'relatorios/relatorio_obra.html')
+        self.assertFalse(TaskHistory.objects.filter(task_type='report').exists())
+
+    @mock.patch('core.services.relatorios_pdf.render_pdf_bytes', return_value=b'%PDF-1.4 pagamento')
+    def test_relatorio_de_pagamento_compras_e_locacoes(self, render):
+        Compra.objects.create(obra=self.obra, fornecedor='Fornecedor A', data_compra=date(2024, 6, 3),
+                              data_pagamento=date(2024, 6, 10), valor_total_bruto=Decimal('150.00'), tipo='COMPRA')
+        for tipo in ('compras', 'locacoes'):
+            response = self.client.post(reverse('relatorio-pdf-job-list'), {
+                'tipo': 'pagamento',
+                'parametros': {'start_date': '2024-06-01', 'end_date': '2024-06-30', 'tipo': tipo},
+            }, format='json')
+            self.assertEqual(response.data['job']['status'], 'completed', response.data)
+
+        compras, locacoes = [chamada[0][1] for chamada in render.call_args_list]
+        self.assertEqual(compras['total_geral_periodo'], '150.00')
+        self.assertEqual(compras['fornecedores_pagamentos'][0]['fornecedor_nome'], 'Fornecedor A')
+        self.assertEqual(locacoes['recursos_pagamentos'], [])
+
+    @mock.patch('core.services.relatorios_pdf.render_pdf_bytes', return_value=b'%PDF-1.4 executor')
+    def test_job_roda_no_executor_e_fica_no_s3(self, render):
+        cliente = S3EmMemoria()
+        service = S3Service()
+        service.s3_client = cliente
+        service.s3_available = True
+        service.bucket_name = 'bucket-teste'
+        patcher = mock.patch('core.services.relatorios_pdf.S3Service', return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with override_settings(PDF_REPORTS_SYNC=False):
+            response = self.client.get(reverse('gerar-pdf-obra', args=[self.obra.id]))
+        task_id = response.data['task_id']
+        self.assertEqual(TaskHistory.objects.get(task_id=task_id).status, 'pending')
+        response = self.client.get(reverse('relatorio-pdf-job-download', args=[task_id]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        executor = ExecutorTarefas(workers=1)
+        self.addCleanup(executor.encerrar)
+        [task] = executor.reivindicar(1)
+        self.assertTrue(executor.executar(task)['success'])
+
+        self.assertEqual(cliente.objetos[f'relatorios_pdf/{task_id}.pdf']['body'], b'%PDF-1.4 executor')
+        response = self.client.get(reverse('relatorio-pdf-job-download', args=[task_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 executor')
+
+        # Depois do prazo o PDF sai do S3 e o job deixa de estar pronto
+        TaskHistory.objects.filter(task_id=task_id).update(completed_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(RelatorioPDFService().cleanup_expired(), 1)
+        self.assertEqual(cliente.objetos, {})
+        self.assertFalse(RelatorioPDFService().get_job(task_id)['job']['pronto'])
+
+    @mock.patch('core.services.relatorios_pdf.render_pdf_bytes', side_effect=RuntimeError('WeasyPrint indisponível'))
+    def test_job_com_falha_registra_erro(self, render):
+        response = self.client.post(reverse('relatorio-pdf-job-list'), {
+            'tipo': 'obra', 'parametros': {'obra_id': self.obra.id},
+        }, format='json')
+        job = response.data['job']
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('WeasyPrint indisponível', job['error_message'])
+
+        response = self.client.get(reverse('relatorio-pdf-job-download', args=[job['task_id']]))
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        response = self.client.post(reverse('relatorio-pdf-job-list'), {'tipo': 'inexistente'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DerivadoCacheTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_lru_remove_entradas_menos_usadas(self):
+        cache = DerivadoCache(self.cache_dir.name, max_bytes=250)
+        chaves = [DerivadoCache.make_key(f'hash{i}', ext='png', dpi=150) for i in range(3)]
+        cache.set(chaves[0], 'a' * 100)
+        cache.set(chaves[1], 'b' * 100)
+        # Uso recente da primeira entrada: a segunda passa a ser a mais antiga
+        antigo = time.time() - 60
+        os.utime(cache._path(chaves[1]), (antigo, antigo))
+        self.assertEqual(cache.get(chaves[0]), 'a' * 100)
+
+        cache.set(chaves[2], 'c' * 100)
+        self.assertIsNone(cache.get(chaves[1]))
+        self.assertEqual(cache.get(chaves[0]), 'a' * 100)
+        self.assertEqual(cache.get(chaves[2]), 'c' * 100)
+        self.assertLessEqual(cache.stats()['total_bytes'], 250)
+        self.assertNotEqual(chaves[0], DerivadoCache.make_key('hash0', ext='png', dpi=300))
+
+    def test_relatorio_reaproveita_derivado(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, format='PNG')
+        anexo = SimpleNamespace(id=1, descricao='Foto', imagem=ContentFile(buffer.getvalue(), name='foto.png'))
+
+        with override_settings(ATTACHMENT_CACHE_DIR=self.cache_dir.name), \
+                mock.patch.object(core_utils, 'WEASYPRINT_AVAILABLE', True), \
+                mock.patch.object(core_utils, 'render_attachment_base64', wraps=core_utils.render_attachment_base64) as render:
+            primeiro = core_utils.process_attachments_for_pdf([anexo])
+            segundo = core_utils.process_attachments_for_pdf([anexo])
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(primeiro, segundo)
+        self.assertEqual(primeiro[0]['nome'], 'foto.png')
+
+
+class ProcessamentoParaleloAnexosTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_processamento_paralelo_preserva_ordem(self):
+        anexos = []
+        for i, cor in enumerate(['red', 'green', 'blue', 'white', 'black']):
+            buffer = BytesIO()
+            Image.new('RGB', (4 + i, 4), cor).save(buffer, format='PNG')
+            anexos.append(SimpleNamespace(id=i, descricao=cor, imagem=ContentFile(buffer.getvalue(), name=f'{cor}.png')))
+        anexos.insert(2, SimpleNamespace(id=99, descricao='', imagem=ContentFile(b'texto', name='notas.txt')))
+
+        with override_settings(ATTACHMENT_CACHE_DIR=self.cache_dir.name, ATTACHMENT_MAX_IN_FLIGHT=3), \
+                mock.patch.object(core_utils, 'WEASYPRINT_AVAILABLE', True):
+            with override_settings(ATTACHMENT_RENDER_WORKERS=0), self.assertLogs('core.utils', level='WARNING') as logs:
+                sequencial = core_utils.process_attachments_for_pdf(anexos)
+            core_utils.get_derivado_cache().clear()
+            with override_settings(ATTACHMENT_RENDER_WORKERS=2):
+                paralelo = core_utils.process_attachments_for_pdf(anexos)
+        self.addCleanup(core_utils._discard_render_pool)
+        self.assertIsNotNone(core_utils._render_pool)
+        self.assertEqual(core_utils._render_pool._mp_context.get_start_method(), 'spawn')
+
+        self.assertEqual([a['nome'] for a in paralelo], ['red.png', 'green.png', 'notas.txt', 'blue.png', 'white.png', 'black.png'])
+        self.assertEqual(paralelo, sequencial)
+        # O anexo sem renderização vira placeholder, com o erro no log
+        self.assertIn('notas.txt', logs.output[0])
+
+
+class S3EmMemoria:
+    """Substituto local do cliente S3 (put/multipart) usado nos testes de upload."""
+
+    def __init__(self, falhar_na_parte=None):
+        self.objetos = {}
+        self.ranges = []
+        self.assinaturas = 0
+        self.lotes_exclusao = []
+        self.chaves_com_erro = set()
+        self.politicas = []
+        self.uploads = {}
+        self.abortados = []
+        self.falhar_na_parte = falhar_na_parte
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objetos[Key] = {'body': Body, 'metadata': kwargs.get('Metadata', {}), 'content_type': kwargs.get('ContentType')}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objetos:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        objeto = self.objetos[Key]
+        return {'ContentLength': len(objeto['body']), 'ContentType': objeto.get('content_type'), 'Metadata': objeto['metadata']}
+
+    def delete_object(self, Bucket, Key):
+        self.objetos.pop(Key, None)
+
+    def generate_presigned_post(self, Bucket, Key, Fields, Conditions, ExpiresIn):
+        self.politicas.append({'key': Key, 'conditions': Conditions, 'expires_in': ExpiresIn})
+        return {'url': f"https://{Bucket}.s3.local/", 'fields': {**Fields, 'key': Key, 'policy': 'politica'}}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {'key': Key, 'parts': {}, 'metadata': kwargs.get('Metadata', {})}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        if PartNumber == self.falhar_na_parte:
+            raise RuntimeError('conexão perdida')
+        self.uploads[UploadId]['parts'][PartNumber] = Body
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId)
+        corpo = b''.join(upload['parts'][parte['PartNumber']] for parte in MultipartUpload['Parts'])
+        self.objetos[Key] = {'body': corpo, 'metadata': upload['metadata'], 'parts': len(MultipartUpload['Parts'])}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        self.abortados.append(Key)
+
+    def delete_objects(self, Bucket, Delete):
+        self.lotes_exclusao.append([obj['Key'] for obj in Delete['Objects']])
+        erros = []
+        for obj in Delete['Objects']:
+            if obj['Key'] in self.chaves_com_erro:
+                erros.append({'Key': obj['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+            else:
+                self.objetos.pop(obj['Key'], None)
+        return {'Errors': erros} if erros else {}
+
+    def generate_presigned_url(self, operacao, Params, ExpiresIn):
+        self.assinaturas += 1
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?expira={ExpiresIn}&n={self.assinaturas}"
+
+    def get_object(self, Bucket, Key, Range=None):
+        corpo = self.objetos[Key]['body']
+        self.ranges.append(Range)
+        if Range:
+            inicio, fim = (int(v) for v in Range[len('bytes='):].split('-'))
+            corpo = corpo[inicio:fim + 1]
+        return {'Body': StreamingBody(BytesIO(corpo), len(corpo))}
+
+
+class S3UploadStreamingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Usuario.objects.create_user(login='uploads3', password='password', nome_completo='Upload S3', nivel_acesso='admin')
+
+    def _service(self, cliente):
+        service = S3Service()
+        service.s3_client = cliente
+        service.s3_available = True
+        service.bucket_name = 'bucket-teste'
+        service.multipart_chunk_size = 8
+        return service
+
+    def test_upload_multipart_em_blocos_com_hash(self):
+        cliente = S3EmMemoria()
+        service = self._service(cliente)
+        conteudo = b'0123456789' * 3
+        leituras = []
+
+        class ArquivoMonitorado(BytesIO):
+            name = 'planta.pdf'
+            content_type = 'application/pdf'
+
+            def read(self, *args):
+                leituras.append(args)
+                return super().read(*args)
+
+        arquivo = ArquivoMonitorado(conteudo)
+
+        result = service.upload_file(arquivo, 'obra', user_id=self.user.id)
+        self.assertTrue(result['success'], result)
+        self.assertFalse(result['duplicate'])
+        self.assertTrue(leituras)
+        self.assertTrue(all(args and args[0] == 8 for args in leituras))
+
+        anexo = AnexoS3.objects.get(anexo_id=result['anexo_id'])
+        self.assertEqual(anexo.file_hash, hashlib.sha256(conteudo).hexdigest())
+        self.assertEqual(anexo.file_size, len(conteudo))
+        objeto = cliente.objetos[anexo.s3_key]
+        self.assertEqual(objeto['body'], conteudo)
+        self.assertEqual(objeto['parts'], 4)
+        self.assertEqual(objeto['metadata']['sha256'], anexo.file_hash)
+
+        duplicado = service.upload_file(SimpleUploadedFile('copia.pdf', conteudo), 'obra', user_id=self.user.id)
+        self.assertTrue(duplicado['duplicate'])
+        self.assertEqual(duplicado['anexo_id'], anexo.anexo_id)
+        self.assertEqual(len(cliente.objetos), 1)
+
+    def test_arquivo_pequeno_usa_put_object(self):
+        cliente = S3EmMemoria()
+        result = self._service(cliente).upload_file(SimpleUploadedFile('nota.txt', b'curto'), 'compra', user_id=self.user.id)
+        self.assertTrue(result['success'])
+        self.assertEqual(list(cliente.objetos.values())[0]['body'], b'curto')
+
+    def test_falha_no_envio_aborta_multipart(self):
+        cliente = S3EmMemoria(falhar_na_parte=2)
+        result = self._service(cliente).upload_file(SimpleUploadedFile('grande.bin', b'x' * 20), 'obra', user_id=self.user.id)
+        self.assertFalse(result['success'])
+        self.assertEqual(len(cliente.abortados), 1)
+        self.assertFalse(cliente.uploads)
+        self.assertFalse(AnexoS3.objects.exists())
+
+
+class DownloadStreamingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='downloadadmin', password='password', nome_completo='Admin Downloads', nivel_acesso='admin')
+        cls.conteudo = bytes(range(100))
+        cls.anexo = AnexoS3.objects.create(
+            anexo_id='anexo-planta', nome_original='planta.pdf', nome_s3='planta.pdf', bucket_name='bucket-teste',
+            s3_key='obra/planta.pdf', s3_url='https://bucket-teste/obra/planta.pdf', content_type='application/pdf',
+            file_size=len(cls.conteudo), file_hash=hashlib.sha256(cls.conteudo).hexdigest(), anexo_type='obra',
+            uploaded_by=cls.admin_user,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+        self.cliente_s3 = S3EmMemoria()
+        self.cliente_s3.objetos['obra/planta.pdf'] = {'body': self.conteudo}
+        service = S3Service()
+        service.s3_client = self.cliente_s3
+        service.s3_available = True
+        patcher = mock.patch('core.views.service_views.S3Service', return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse('anexo-s3-download', args=[self.anexo.anexo_id])
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range_header('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=50-500', 100), (50, 99))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range_header('items=0-1', 100))
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=100-', 100)
+
+    def test_download_completo_em_streaming(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.conteudo)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{self.anexo.file_hash}"')
+        self.assertEqual(self.cliente_s3.ranges, [None])
+
+    def test_download_parcial_e_revalidacao(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.conteudo[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(self.cliente_s3.ranges, ['bytes=10-19'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.anexo.file_hash}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=200-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+        self.assertEqual(self.cliente_s3.ranges, ['bytes=10-19'])
+
+    def test_download_anexo_compra_com_range(self):
+        obra = Obra.objects.create(nome_obra="Obra Anexos", endereco_completo=".", cidade=".", status="Em Andamento")
+        compra = Compra.objects.create(obra=obra, data_compra=date(2024, 6, 3), fornecedor='Fornecedor', valor_total_bruto=Decimal('10.00'))
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            anexo = AnexoCompra.objects.create(compra=compra, arquivo=ContentFile(self.conteudo, name='nota.pdf'), nome_original='nota.pdf')
+            url = reverse('anexocompra-download', args=[anexo.id])
+
+            response = self.client.get(url, HTTP_RANGE='bytes=-5')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(response.streaming_content), self.conteudo[-5:])
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class URLsAssinadasEmLoteTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='urlsadmin', password='password', nome_completo='Admin URLs', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra URLs", endereco_completo=".", cidade=".", status="Em Andamento")
+        for i in range(6):
+            anexo = AnexoS3.objects.create(
+                anexo_id=f'anexo-{i}', nome_original=f'foto {i}.jpg', nome_s3=f'foto{i}.jpg', bucket_name='bucket-teste',
+                s3_key=f'obra/foto{i}.jpg', s3_url=f'https://bucket-teste/obra/foto{i}.jpg', content_type='image/jpeg',
+                file_size=10, file_hash=f'{i:064d}', anexo_type='obra', object_id=cls.obra.id, uploaded_by=cls.admin_user,
+            )
+            ArquivoObra.objects.create(
+                obra=cls.obra, nome_original=anexo.nome_original, s3_anexo_id=anexo.anexo_id,
+                s3_url=anexo.s3_url, uploaded_by=cls.admin_user,
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_authenticate(user=self.admin_user)
+        self.cliente_s3 = S3EmMemoria()
+        service = S3Service()
+        service.s3_client = self.cliente_s3
+        service.s3_available = True
+        for alvo in ('core.views.views.S3Service', 'core.views.service_views.S3Service'):
+            patcher = mock.patch(alvo, return_value=service)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _listar_arquivos(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('arquivoobra-list'), {'obra': self.obra.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        dados = response.data['results'] if isinstance(response.data, dict) else response.data
+        return dados, queries
+
+    def test_listagem_assina_em_lote_e_reaproveita_cache(self):
+        dados, queries = self._listar_arquivos()
+        self.assertEqual(len(dados), 6)
+        self.assertTrue(all('s3.local' in item['arquivo_url'] for item in dados))
+        self.assertEqual(self.cliente_s3.assinaturas, 6)
+        consultas_anexo = [q for q in queries.captured_queries if 'core_anexos3' in q['sql']]
+        self.assertEqual(len(consultas_anexo), 1)
+
+        segunda, queries = self._listar_arquivos()
+        self.assertEqual(self.cliente_s3.assinaturas, 6)
+        self.assertEqual([item['arquivo_url'] for item in segunda], [item['arquivo_url'] for item in dados])
+        self.assertFalse([q for q in queries.captured_queries if 'core_anexos3' in q['sql']])
+
+    def test_listagem_anexos_s3_sem_consulta_por_linha(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('anexo-s3-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        dados = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual(len(dados), 6)
+        self.assertTrue(all(item['related_object_name'] == 'Obra URLs' for item in dados))
+        self.assertTrue(all('s3.local' in item['download_url'] for item in dados))
+        self.assertLessEqual(len(queries), 6)
+
+
+@override_settings(AWS_ACCESS_KEY_ID='chave', AWS_SECRET_ACCESS_KEY='segredo', AWS_STORAGE_BUCKET_NAME='bucket-teste',
+                   AWS_S3_HEALTH_CHECK_TTL=300, AWS_S3_HEALTH_CHECK_FAILURE_TTL=30)
+class S3ClienteCompartilhadoTests(TestCase):
+    def setUp(self):
+        reset_s3_state()
+        self.addCleanup(reset_s3_state)
+        patcher = mock.patch('core.services.s3_service.boto3.client')
+        self.boto_client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cliente_unico_e_verificacao_preguicosa(self):
+        servicos = [S3Service() for _ in range(3)]
+        self.assertEqual(self.boto_client.call_count, 1)
+        cliente = self.boto_client.return_value
+        self.assertTrue(all(servico.s3_client is cliente for servico in servicos))
+        cliente.head_bucket.assert_not_called()
+
+        self.assertTrue(servicos[0].s3_available)
+        self.assertTrue(servicos[1].s3_available)
+        self.assertEqual(cliente.head_bucket.call_count, 1)
+
+        with mock.patch('core.services.s3_service.time.monotonic', return_value=time.monotonic() + 301):
+            self.assertTrue(S3Service().s3_available)
+        self.assertEqual(cliente.head_bucket.call_count, 2)
+
+    def test_falha_fica_em_cache_por_ttl_menor(self):
+        cliente = self.boto_client.return_value
+        cliente.head_bucket.side_effect = EndpointConnectionError(endpoint_url='https://s3')
+        self.assertFalse(S3Service().s3_available)
+        self.assertFalse(S3Service().s3_available)
+        self.assertEqual(cliente.head_bucket.call_count, 1)
+
+        cliente.head_bucket.side_effect = None
+        with mock.patch('core.services.s3_service.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertTrue(S3Service().s3_available)
+
+
+class MigracaoArquivosS3Tests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_superuser(login='migracaoadmin', password='password', nome_completo='Admin Migração')
+        cls.obra = Obra.objects.create(nome_obra="Obra Migração", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.cliente_s3 = S3EmMemoria()
+        service = S3Service()
+        service.s3_client = self.cliente_s3
+        service.s3_available = True
+        service.bucket_name = 'bucket-teste'
+        self.service = service
+        patcher = mock.patch('core.management.commands.migrar_arquivos_s3.S3Service', return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.arquivo_obra = ArquivoObra.objects.create(obra=self.obra, arquivo=ContentFile(b'planta baixa', name='planta.pdf'))
+        compra = Compra.objects.create(obra=self.obra, data_compra=date(2024, 6, 3), fornecedor='Fornecedor', valor_total_bruto=Decimal('10.00'))
+        self.anexo_compra = AnexoCompra.objects.create(compra=compra, arquivo=ContentFile(b'nota fiscal', name='nota.pdf'), nome_original='nota.pdf')
+        despesa = Despesa_Extra.objects.create(obra=self.obra, descricao="Cópia", valor=Decimal('5.00'), data=date(2024, 6, 3), categoria='Outros')
+        # Mesmo conteúdo da planta: deve reaproveitar o objeto já enviado
+        self.anexo_despesa = AnexoDespesa.objects.create(despesa=despesa, anexo=ContentFile(b'planta baixa', name='copia.pdf'))
+
+    def test_migra_vincula_e_retoma_sem_reenviar(self):
+        out = StringIO()
+        call_command('migrar_arquivos_s3', '--workers', '2', '--lote', '2', stdout=out)
+        self.assertIn('3 de 3 arquivos migrados', out.getvalue())
+        self.assertEqual(len(self.cliente_s3.objetos), 2)
+
+        self.arquivo_obra.refresh_from_db()
+        anexo_obra = AnexoS3.objects.get(anexo_id=self.arquivo_obra.s3_anexo_id)
+        self.assertEqual(anexo_obra.file_hash, hashlib.sha256(b'planta baixa').hexdigest())
+        self.assertEqual(self.cliente_s3.objetos[anexo_obra.s3_key]['body'], b'planta baixa')
+        self.assertTrue(anexo_obra.is_migrated)
+
+        anexo_despesa = AnexoS3.objects.get(metadata__origem=f'AnexoDespesa:{self.anexo_despesa.pk}')
+        self.assertEqual((anexo_despesa.anexo_type, anexo_despesa.object_id), ('despesa', self.anexo_despesa.despesa_id))
+        self.assertEqual(anexo_despesa.s3_key, anexo_obra.s3_key)
+        anexo_compra = AnexoS3.objects.get(metadata__origem=f'AnexoCompra:{self.anexo_compra.pk}')
+        self.assertEqual(anexo_compra.nome_original, 'nota.pdf')
+        # Todas as origens ficam vinculadas ao seu objeto no S3
+        for linha, anexo in ((self.anexo_despesa, anexo_despesa), (self.anexo_compra, anexo_compra)):
+            linha.refresh_from_db()
+            self.assertEqual((linha.s3_anexo_id, linha.s3_url), (anexo.anexo_id, anexo.s3_url))
+
+        task = TaskHistory.objects.get(task_type='migration')
+        self.assertEqual(task.status, 'completed')
+        self.assertEqual(task.metadata['migrated'], 3)
+
+        out = StringIO()
+        call_command('migrar_arquivos_s3', stdout=out)
+        self.assertIn('0 de 0 arquivos migrados', out.getvalue())
+        self.assertEqual(AnexoS3.objects.count(), 3)
+
+    def test_falha_de_envio_fica_pendente_para_nova_execucao(self):
+        self.cliente_s3.put_object = mock.Mock(side_effect=RuntimeError('sem conexão'))
+        err = StringIO()
+        call_command('migrar_arquivos_s3', '--tipo', 'compra', stdout=StringIO(), stderr=err)
+        self.assertIn('sem conexão', err.getvalue())
+        self.assertFalse(AnexoS3.objects.exists())
+
+        del self.cliente_s3.put_object
+        out = StringIO()
+        call_command('migrar_arquivos_s3', '--tipo', 'compra', stdout=out)
+        self.assertIn('1 de 1 arquivos migrados', out.getvalue())
+
+
+class MigracaoS3ExecutorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_superuser(login='migracaoexecutor', password='password', nome_completo='Admin Migração Executor')
+        cls.obra = Obra.objects.create(nome_obra="Obra Migração Executor", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        service = S3Service()
+        service.s3_client = S3EmMemoria()
+        service.s3_available = True
+        service.bucket_name = 'bucket-teste'
+        self.service = service
+        self.arquivo_obra = ArquivoObra.objects.create(obra=self.obra, arquivo=ContentFile(b'planta baixa', name='planta.pdf'))
+
+    def test_endpoint_enfileira_migracao_para_o_executor(self):
+        client = APIClient()
+        client.force_authenticate(user=self.admin_user)
+        with mock.patch('core.services.migracao_s3.S3Service', return_value=self.service):
+            response = client.post('/api/anexos-s3/migrate_to_s3/', {'anexo_type': 'obra'})
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertFalse(AnexoS3.objects.exists())
+
+            executor = ExecutorTarefas(workers=1)
+            self.addCleanup(executor.encerrar)
+            [task] = executor.reivindicar(1)
+            self.assertEqual(task.task_id, response.data['task_id'])
+            executor.executar(task)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.progress_percentage, task.created_by), ('completed', 100, self.admin_user))
+        self.assertEqual(task.metadata['result']['migrated_count'], 1)
+        self.arquivo_obra.refresh_from_db()
+        self.assertTrue(self.arquivo_obra.s3_anexo_id)
+
+
+class ExclusaoEmLoteS3Tests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = Usuario.objects.create_user(login='exclusaoadmin', password='password', nome_completo='Admin Exclusão', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra Exclusão", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin_user)
+        self.cliente_s3 = S3EmMemoria()
+        self.service = S3Service()
+        self.service.s3_client = self.cliente_s3
+        self.service.s3_available = True
+        patcher = mock.patch('core.views.views.S3Service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _anexo(self, indice, hash_=None, key=None):
+        key = key or f'obra/arquivo{indice}.pdf'
+        self.cliente_s3.objetos[key] = {'body': b'x'}
+        return AnexoS3.objects.create(
+            anexo_id=f'exclusao-{indice}', nome_original=f'arquivo{indice}.pdf', nome_s3=key.split('/')[-1],
+            bucket_name='bucket-teste', s3_key=key, s3_url=f'https://bucket-teste/{key}', content_type='application/pdf',
+            file_size=1, file_hash=hash_ or f'{indice:064d}', anexo_type='obra', object_id=self.obra.id, uploaded_by=self.admin_user,
+        )
+
+    @mock.patch('core.services.s3_service.S3_DELETE_BATCH_SIZE', 2)
+    def test_delete_files_em_lotes_com_falhas_por_chave(self):
+        anexos = [self._anexo(i) for i in range(5)]
+        self.cliente_s3.chaves_com_erro.add(anexos[3].s3_key)
+
+        result = self.service.delete_files([anexo.anexo_id for anexo in anexos] + ['inexistente'])
+        self.assertEqual([len(lote) for lote in self.cliente_s3.lotes_exclusao], [2, 2, 1])
+        self.assertEqual(result['deleted_count'], 4)
+        self.assertEqual(result['deleted_objects'], 4)
+        self.assertEqual(result['not_found'], ['inexistente'])
+        self.assertEqual([falha['anexo_id'] for falha in result['failed']], [anexos[3].anexo_id])
+        self.assertEqual(list(AnexoS3.objects.values_list('anexo_id', flat=True)), [anexos[3].anexo_id])
+
+    def test_objeto_compartilhado_pelo_hash_e_mantido(self):
+        original = self._anexo(1)
+        copia = self._anexo(2, hash_=original.file_hash, key=original.s3_key)
+
+        result = self.service.delete_files([copia.anexo_id])
+        self.assertEqual(result['deleted_count'], 1)
+        self.assertEqual(result['shared_objects'], 1)
+        self.assertFalse(self.cliente_s3.lotes_exclusao)
+        self.assertIn(original.s3_key, self.cliente_s3.objetos)
+
+    def test_bulk_delete_de_arquivos_da_obra(self):
+        anexos = [self._anexo(i) for i in range(3)]
+        arquivos = [
+            ArquivoObra.objects.create(obra=self.obra, nome_original=a.nome_original, s3_anexo_id=a.anexo_id, s3_url=a.s3_url)
+            for a in anexos
+        ]
+        # Upload deduplicado: outro arquivo aponta para o mesmo anexo e não é excluído
+        ArquivoObra.objects.create(obra=self.obra, nome_original='copia.pdf', s3_anexo_id=anexos[0].anexo_id, s3_url=anexos[0].s3_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('arquivoobra-bulk-delete'), {'arquivo_ids': [a.id for a in arquivos]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['deleted_count'], 3)
+        self.assertEqual(response.data['s3']['deleted_objects'], 2)
+        self.assertEqual(len(self.cliente_s3.lotes_exclusao), 1)
+        self.assertEqual(list(AnexoS3.objects.values_list('anexo_id', flat=True)), [anexos[0].anexo_id])
+        self.assertEqual(ArquivoObra.objects.count(), 1)
+        self.assertLess(len(queries), 15)
+
+
+class UploadDiretoS3Tests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Usuario.objects.create_user(login='uploaddireto', password='password', nome_completo='Upload Direto', nivel_acesso='admin')
+        cls.outro = Usuario.objects.create_user(login='uploaddireto2', password='password', nome_completo='Outro Usuário', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra Upload Direto", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        self.cliente_s3 = S3EmMemoria()
+        self.service = S3Service()
+        self.service.s3_client = self.cliente_s3
+        self.service.s3_available = True
+        self.service.bucket_name = 'bucket-teste'
+        patcher = mock.patch('core.views.views.S3Service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _enviar_ao_s3(self, politica, conteudo):
+        """Simula o POST do navegador direto ao bucket."""
+        campos = politica['fields']
+        metadata = {k[len('x-amz-meta-'):]: v for k, v in campos.items() if k.startswith('x-amz-meta-')}
+        self.cliente_s3.put_object('bucket-teste', campos['key'], conteudo, ContentType=campos['Content-Type'], Metadata=metadata)
+
+    def test_upload_direto_de_arquivo_da_obra(self):
+        conteudo = b'%PDF-1.4 planta baixa'
+        response = self.client.post(reverse('arquivoobra-presigned-upload'), {
+            'obra': self.obra.id, 'filename': 'planta.pdf', 'content_type': 'application/pdf', 'categoria': 'documento',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        politica = response.data
+        condicoes = self.cliente_s3.politicas[0]['conditions']
+        self.assertIn(['content-length-range', 1, 500 * 1024 * 1024], condicoes)
+        self.assertIn({'Content-Type': 'application/pdf'}, condicoes)
+        self.assertFalse(AnexoS3.objects.exists())
+
+        # Confirmar antes do envio falha sem criar registros
+        response = self.client.post(reverse('arquivoobra-complete-upload'), {'upload_token': politica['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self._enviar_ao_s3(politica, conteudo)
+        response = self.client.post(reverse('arquivoobra-complete-upload'), {'upload_token': politica['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        arquivo = ArquivoObra.objects.get()
+        self.assertEqual((arquivo.obra_id, arquivo.categoria, arquivo.tamanho_arquivo), (self.obra.id, 'documento', len(conteudo)))
+        anexo = AnexoS3.objects.get(anexo_id=arquivo.s3_anexo_id)
+        self.assertEqual(anexo.file_hash, hashlib.sha256(conteudo).hexdigest())
+
+        # Confirmação repetida não duplica os registros
+        response = self.client.post(reverse('arquivoobra-complete-upload'), {'upload_token': politica['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ArquivoObra.objects.count(), 1)
+
+    def test_confirmacao_rejeita_objeto_divergente_e_outro_usuario(self):
+        result = self.service.create_presigned_upload('foto.png', 'image/png', 'obra', self.obra.id, user_id=self.user.id)
+        self._enviar_ao_s3({**result, 'fields': {**result['fields'], 'Content-Type': 'text/html'}}, b'<html>')
+
+        self.assertFalse(self.service.complete_presigned_upload(result['upload_token'], user_id=self.outro.id)['success'])
+        self.assertFalse(self.service.complete_presigned_upload(result['upload_token'] + 'x', user_id=self.user.id)['success'])
+
+        falha = self.service.complete_presigned_upload(result['upload_token'], user_id=self.user.id)
+        self.assertFalse(falha['success'])
+        self.assertIn('Content-Type', falha['error'])
+        self.assertNotIn(result['fields']['key'], self.cliente_s3.objetos)
+        self.assertFalse(AnexoS3.objects.exists())
+
+    def test_hash_informado_entra_na_politica_e_detecta_duplicata(self):
+        conteudo = b'planilha de custos'
+        file_hash = hashlib.sha256(conteudo).hexdigest()
+        result = self.service.create_presigned_upload('custos.xlsx', 'application/vnd.ms-excel', 'obra', self.obra.id,
+                                                       user_id=self.user.id, file_hash=file_hash)
+        self.assertEqual(result['fields']['x-amz-meta-sha256'], file_hash)
+        self.assertIn({'x-amz-checksum-algorithm': 'SHA256'}, self.cliente_s3.politicas[0]['conditions'])
+
+        self._enviar_ao_s3(result, b'conteudo trocado')
+        falha = self.service.complete_presigned_upload(result['upload_token'], user_id=self.user.id)
+        self.assertFalse(falha['success'])
+
+        result = self.service.create_presigned_upload('custos.xlsx', 'application/vnd.ms-excel', 'obra', self.obra.id,
+                                                      user_id=self.user.id, file_hash=file_hash)
+        self._enviar_ao_s3(result, conteudo)
+        original = self.service.complete_presigned_upload(result['upload_token'], user_id=self.user.id)
+        self.assertTrue(original['success'], original)
+
+        # Conhecer o hash não basta: a política não revela o anexo e confirmar sem enviar falha
+        repetido = self.service.create_presigned_upload('copia.xlsx', 'application/vnd.ms-excel', 'obra', self.obra.id,
+                                                        user_id=self.outro.id, file_hash=file_hash)
+        self.assertNotIn('anexo', repetido)
+        self.assertNotIn('duplicate', repetido)
+        self.assertIn('fields', repetido)
+        self.assertFalse(self.service.complete_presigned_upload(repetido['upload_token'], user_id=self.outro.id)['success'])
+
+        # Com o conteúdo enviado, a duplicata é detectada e a cópia descartada
+        self._enviar_ao_s3(repetido, conteudo)
+        confirmado = self.service.complete_presigned_upload(repetido['upload_token'], user_id=self.outro.id)
+        self.assertTrue(confirmado['duplicate'])
+        self.assertEqual(confirmado['anexo_id'], original['anexo_id'])
+        self.assertNotIn(repetido['fields']['key'], self.cliente_s3.objetos)
+        self.assertEqual(AnexoS3.objects.count(), 1)
+
+
+def _imagem(largura, altura, formato='JPEG', orientacao=None):
+    saida = BytesIO()
+    img = Image.new('RGB', (largura, altura), (200, 30, 30))
+    exif = Image.Exif()
+    if orientacao:
+        exif[0x0112] = orientacao
+    img.save(saida, format=formato, exif=exif)
+    return saida.getvalue()
+
+
+class MiniaturasTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Usuario.objects.create_user(login='miniaturas', password='password', nome_completo='Miniaturas', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Obra Fotos", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_upload_de_foto_gera_miniaturas_rotacionadas(self):
+        # Foto "deitada" com orientação EXIF 6 (girar 90°): a miniatura sai em pé
+        imagem = SimpleUploadedFile('foto.jpg', _imagem(400, 200, orientacao=6), content_type='image/jpeg')
+        response = self.client.post(reverse('fotoobra-list'), {'obra': self.obra.id, 'imagem': imagem}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(set(response.data['miniaturas']), {'sm', 'md', 'lg'})
+
+        foto = FotoObra.objects.get()
+        storage = foto.imagem.storage
+        caminho_sm = caminho_miniatura(foto.imagem.name, 'sm')
+        self.assertTrue(caminho_sm.endswith('_sm.webp'))
+        with storage.open(caminho_sm) as f, Image.open(f) as miniatura:
+            self.assertEqual((miniatura.format, miniatura.size), ('WEBP', (80, 160)))
+        with storage.open(caminho_miniatura(foto.imagem.name, 'lg')) as f, Image.open(f) as miniatura:
+            self.assertEqual(miniatura.size, (200, 400))  # não amplia imagens menores
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(response.data['miniaturas']['sm'])
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response['Location'], storage.url(caminho_sm))
+
+    def test_miniatura_gerada_sob_demanda(self):
+        foto = FotoObra.objects.create(obra=self.obra, imagem=ContentFile(_imagem(1000, 500, formato='PNG'), name='antiga.png'))
+        caminho_md = caminho_miniatura(foto.imagem.name, 'md')
+        self.assertFalse(foto.imagem.storage.exists(caminho_md))
+
+        response = self.client.get(reverse('fotoobra-miniatura', args=[foto.pk]), {'size': 'md'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertTrue(foto.imagem.storage.exists(caminho_md))
+        self.assertFalse(foto.imagem.storage.exists(caminho_miniatura(foto.imagem.name, 'sm')))
+
+        response = self.client.get(reverse('fotoobra-miniatura', args=[foto.pk]), {'size': 'xl'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_preview_do_anexo_s3_com_tamanho(self):
+        conteudo = _imagem(640, 480, formato='PNG')
+        anexo = AnexoS3.objects.create(
+            anexo_id='anexo-foto', nome_original='fachada.png', nome_s3='fachada.png', bucket_name='bucket-teste',
+            s3_key='obra/fachada.png', s3_url='https://bucket-teste/obra/fachada.png', content_type='image/png',
+            file_size=len(conteudo), file_hash=hashlib.sha256(conteudo).hexdigest(), anexo_type='obra', uploaded_by=self.user,
+        )
+        cliente_s3 = S3EmMemoria()
+        cliente_s3.objetos[anexo.s3_key] = {'body': conteudo, 'metadata': {}}
+        service = S3Service()
+        service.s3_client = cliente_s3
+        service.s3_available = True
+        with mock.patch('core.views.service_views.S3Service', return_value=service):
+            url = reverse('anexo-s3-preview', args=[anexo.anexo_id])
+            response = self.client.get(url, {'size': 'sm'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            with Image.open(BytesIO(b''.join(response.streaming_content))) as miniatura:
+                self.assertEqual(miniatura.size, (160, 120))
+
+            anexo.refresh_from_db()
+            chave = anexo.metadata['thumbnails']['sm']
+            self.assertEqual(chave, 'obra/thumbs/fachada_sm.webp')
+            self.assertIn(chave, cliente_s3.objetos)
+
+            # Segunda solicitação lê só a miniatura; com o ETag, nem isso
+            cliente_s3.objetos[anexo.s3_key]['body'] = b'original inacessivel'
+            response = self.client.get(url, {'size': 'sm'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(url, {'size': 'sm'}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            self.assertTrue(service.delete_files([anexo.anexo_id])['success'])
+            self.assertNotIn(chave, cliente_s3.objetos)
+
+
+class ExportacaoAnexosObraTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Usuario.objects.create_user(login='exportazip', password='password', nome_completo='Exporta ZIP', nivel_acesso='admin')
+        cls.obra = Obra.objects.create(nome_obra="Residencial Água Viva", endereco_completo=".", cidade=".", status="Em Andamento")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.cliente_s3 = S3EmMemoria()
+        service = S3Service()
+        service.s3_client = self.cliente_s3
+        service.s3_available = True
+        patcher = mock.patch('core.views.views.S3Service', return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_zip_em_streaming_com_todos_os_anexos(self):
+        grande = os.urandom(700 * 1024)
+        ArquivoObra.objects.create(obra=self.obra, nome_original='medicao.bin', arquivo=ContentFile(grande, name='medicao.bin'))
+        ArquivoObra.objects.create(obra=self.obra, nome_original='medicao.bin', arquivo=ContentFile(b'segunda', name='medicao.bin'))
+        self.cliente_s3.objetos['obra/projeto.pdf'] = {'body': b'%PDF projeto'}
+        AnexoS3.objects.create(
+            anexo_id='anexo-projeto', nome_original='projeto.pdf', nome_s3='projeto.pdf', bucket_name='bucket-teste',
+            s3_key='obra/projeto.pdf', s3_url='https://bucket-teste/obra/projeto.pdf', content_type='application/pdf',
+            file_size=12, file_hash='f' * 64, anexo_type='obra', object_id=self.obra.id, uploaded_by=self.user,
+        )
+        ArquivoObra.objects.create(obra=self.obra, nome_original='projeto.pdf', s3_anexo_id='anexo-projeto')
+        FotoObra.objects.create(obra=self.obra, imagem=ContentFile(b'jpeg', name='fachada.jpg'))
+        compra = Compra.objects.create(obra=self.obra, data_compra=timezone.now().date())
+        AnexoCompra.objects.create(compra=compra, nome_original='nota.pdf', arquivo=ContentFile(b'nota', name='nota.pdf'))
+        locacao = Locacao_Obras_Equipes.objects.create(obra=self.obra, servico_externo='Pintura', data_locacao_inicio=timezone.now().date())
+        AnexoLocacao.objects.create(locacao=locacao, anexo=ContentFile(b'contrato', name='contrato.txt'))
+        despesa = Despesa_Extra.objects.create(obra=self.obra, descricao='Frete', valor=Decimal('10.00'), data=date(2024, 5, 2), categoria='Transporte')
+        perdido = AnexoDespesa.objects.create(despesa=despesa, anexo=ContentFile(b'recibo', name='recibo.txt'))
+        perdido.anexo.storage.delete(perdido.anexo.name)
+
+        response = self.client.get(reverse('obra-anexos-zip', args=[self.obra.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('anexos_residencial-agua-viva.zip', response['Content-Disposition'])
+
+        blocos = list(response.streaming_content)
+        self.assertGreater(len(blocos), 5)
+        self.assertLess(max(len(bloco) for bloco in blocos), 200 * 1024)  # nunca o pacote inteiro em memória
+
+        with zipfile.ZipFile(BytesIO(b''.join(blocos))) as zf:
+            self.assertIsNone(zf.testzip())
+            nomes = zf.namelist()
+            self.assertEqual(zf.read('arquivos/medicao.bin'), grande)
+            self.assertEqual(zf.read('arquivos/medicao (2).bin'), b'segunda')
+            self.assertEqual(zf.read('arquivos/projeto.pdf'), b'%PDF projeto')
+            self.assertEqual(zf.getinfo('arquivos/projeto.pdf').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.read(f'compras/compra_{compra.id}/nota.pdf'), b'nota')
+            self.assertTrue(any(nome.startswith('fotos/') for nome in nomes))
+            self.assertTrue(any(nome.startswith(f'locacoes/locacao_{locacao.id}/') for nome in nomes))
+            erros = zf.read('ERROS.txt').decode()
+            self.assertIn(f'despesas/despesa_{despesa.id}/', erros)
+            self.assertNotIn('/tmp', erros)
+
+    def test_obra_sem_anexos(self):
+        response = self.client.get(reverse('obra-anexos-zip', args=[self.obra.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@registrar_tarefa('teste_etapas')
+def _tarefa_em_etapas(contexto, etapas, cancelar_na=None, falhar=False):
+    for etapa in range(etapas):
+        if etapa == cancelar_na:
+            # Como se o cancelamento viesse de outra requisição
+            TaskService().cancel_task(contexto.task_id, reason='pedido')
+        contexto.progresso(int(etapa * 100 / etapas), forcar=True, etapa=etapa)
+    if falhar:
+        raise RuntimeError('falhou na etapa final')
+    return {'success': True, 'etapas': etapas}
+
+
+@registrar_tarefa('teste_exclusiva', exclusiva=True)
+def _tarefa_exclusiva(contexto):
+    return {'success': True}
+
+
+class ExecutorTarefasTests(TestCase):
+    def setUp(self):
+        self.service = TaskService()
+        self.executor = ExecutorTarefas(workers=2)
+        self.addCleanup(self.executor.encerrar)
+
+    def _tarefa(self, priority='medium', **params):
+        result = self.service.create_task('custom', 'Etapas', priority=priority, handler='teste_etapas',
+                                          params={'etapas': 3, **params})
+        self.assertTrue(result['success'], result)
+        return result['task_id']
+
+    def test_reivindica_por_prioridade_uma_unica_vez(self):
+        baixa = self._tarefa('low')
+        media = self._tarefa('medium')
+        critica = self._tarefa('critical')
+        TaskHistory.objects.create(task_id='sem_handler', task_type='other', title='Manual')
+
+        self.assertEqual([t.task_id for t in self.executor.reivindicar(2)], [critica, media])
+        self.assertEqual([t.task_id for t in self.executor.reivindicar(2)], [baixa])
+        self.assertEqual(self.executor.reivindicar(2), [])
+        self.assertEqual(TaskHistory.objects.get(task_id='sem_handler').status, 'pending')
+        self.assertFalse(self.service.create_task('custom', 'X', handler='inexistente')['success'])
+
+    def test_executa_com_progresso_e_resultado(self):
+        task_id = self._tarefa()
+        [task] = self.executor.reivindicar(1)
+        self.assertTrue(self.executor.executar(task)['success'])
+
+        task = TaskHistory.objects.get(task_id=task_id)
+        self.assertEqual((task.status, task.progress_percentage), ('completed', 100))
+        self.assertEqual(task.metadata['etapa'], 2)
+        self.assertEqual(task.metadata['result'], {'success': True, 'etapas': 3})
+        self.assertIsNotNone(task.actual_duration)
+        self.assertEqual(self.service.get_task(task_id)['task']['actual_duration'], 0)
+
+    def test_falha_registra_erro(self):
+        task_id = self._tarefa(falhar=True)
+        [task] = self.executor.reivindicar(1)
+        self.assertFalse(self.executor.executar(task)['success'])
+
+        task = TaskHistory.objects.get(task_id=task_id)
+        self.assertEqual((task.status, task.error_message), ('failed', 'falhou na etapa final'))
+
+    def test_cancelamento_cooperativo(self):
+        pendente = self._tarefa()
+        self.assertEqual(self.service.cancel_task(pendente)['new_status'], 'cancelled')
+        self.assertEqual(self.executor.reivindicar(1), [])
+
+        em_execucao = self._tarefa(cancelar_na=1)
+        [task] = self.executor.reivindicar(1)
+        self.assertEqual(self.executor.executar(task)['error'], 'Task cancelled')
+
+        task = TaskHistory.objects.get(task_id=em_execucao)
+        self.assertEqual((task.status, task.error_message), ('cancelled', 'Cancelled: pedido'))
+        # Parou na primeira verificação depois do pedido
+        self.assertEqual((task.metadata['etapa'], task.progress_percentage), (1, 0))
+
+    @override_settings(TASK_STALE_SECONDS=60)
+    def test_tarefa_de_worker_parado_falha(self):
+        task_id = self._tarefa()
+        self.executor.reivindicar(1)
+        TaskHistory.objects.filter(task_id=task_id).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+        outro_worker = ExecutorTarefas(workers=1)
+        self.addCleanup(outro_worker.encerrar)
+        self.assertEqual(outro_worker.marcar_abandonadas(), 1)
+        self.assertEqual(TaskHistory.objects.get(task_id=task_id).status, 'failed')
+
+    def test_exclusiva_rodando_em_outro_executor_nao_e_reivindicada(self):
+        ids = [self.service.create_task('custom', 'Exclusiva', handler='teste_exclusiva')['task_id'] for _ in range(2)]
+        [task] = self.executor.reivindicar(2)
+        self.assertEqual(task.task_id, ids[0])
+
+        outro_worker = ExecutorTarefas(workers=1)
+        self.addCleanup(outro_worker.encerrar)
+        self.assertEqual(outro_worker.reivindicar(1), [])
+        self.executor.executar(task)
+        self.assertEqual([t.task_id for t in outro_worker.reivindicar(1)], [ids[1]])
+
+    def test_aguardar_renova_as_tarefas_em_execucao(self):
+        task_id = self._tarefa()
+        [task] = self.executor.reivindicar(1)
+        antigo = timezone.now() - timedelta(hours=1)
+        TaskHistory.objects.filter(pk=task.pk).update(updated_at=antigo)
+
+        # Tarefa longa que não escreve progresso (como o backup)
+        futuro = Future()
+        self.executor.em_execucao[task.pk] = futuro
+
+        def terminar():
+            self.executor.em_execucao.pop(task.pk)
+            futuro.set_result(None)
+        threading.Timer(0.2, terminar).start()
+        self.executor.aguardar(intervalo=0.05)
+
+        self.assertGreater(TaskHistory.objects.get(task_id=task_id).updated_at, antigo)
+
+
+class EstatisticasTarefasTests(APITestCase):
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='tarefasadmin', password='password', nome_completo='Tarefas Admin', nivel_acesso='admin')
+        self.client.force_authenticate(user=self.user)
+        inicio = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        for indice, (status_tarefa, tipo, duracao) in enumerate([
+            ('completed', 'backup', 10), ('completed', 'backup', 30), ('failed', 'report', 5),
+            ('cancelled', 'migration', None), ('pending', 'report', None),
+        ]):
+            TaskHistory.objects.create(
+                task_id=f'estatistica_{indice}', task_type=tipo, title='Tarefa', status=status_tarefa,
+                started_at=inicio if duracao else None,
+                completed_at=inicio + timedelta(seconds=duracao) if duracao else None,
+            )
+        # As duas últimas na hora seguinte
+        TaskHistory.objects.filter(task_id__in=['estatistica_3', 'estatistica_4']).update(created_at=inicio + timedelta(hours=1))
+        TaskHistory.objects.exclude(task_id__in=['estatistica_3', 'estatistica_4']).update(created_at=inicio)
+
+    def test_estatisticas_em_uma_consulta(self):
+        with self.assertNumQueries(1):
+            result = TaskService().get_task_statistics(days=1)
+
+        self.assertEqual(result['total_tasks'], 5)
+        self.assertEqual(result['status_distribution']['completed'], 2)
+        self.assertEqual(result['status_distribution']['pending'], 1)
+        self.assertEqual(result['type_distribution'], {'backup': 2, 'migration': 1, 'report': 2})
+        self.assertEqual(result['duration_statistics'], {
+            'avg_duration': 20.0, 'min_duration': 10.0, 'max_duration': 30.0, 'total_duration': 40.0
+        })
+        self.assertEqual(result['success_rate'], 50.0)
+        self.assertNotIn('series', result)
+
+    def test_serie_por_hora_no_endpoint(self):
+        response = self.client.get('/api/tasks/statistics/', {'days': 1, 'bucket': 'hour'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        serie = response.data['series']
+        self.assertEqual([(p['total'], p['completed'], p['failed']) for p in serie], [(3, 2, 1), (2, 0, 0)])
+        self.assertEqual(serie[0]['avg_duration'], 20.0)
+        self.assertIsNone(serie[1]['avg_duration'])
+
+        response = self.client.get('/api/tasks/statistics/', {'bucket': 'minute'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(BACKUP_CHUNK_AVG_SIZE=4096)
+class DivisaoBlocosTests(TestCase):
+    def test_blocos_definidos_pelo_conteudo_resistem_a_deslocamento(self):
+        dados = random.Random(42).randbytes(256 * 1024)
+        blocos = list(dividir_em_blocos(BytesIO(dados)))
+        deslocados = list(dividir_em_blocos(BytesIO(b'novo registro' + dados)))
+
+        self.assertEqual(b''.join(blocos), dados)
+        self.assertTrue(all(1024 <= len(bloco) <= 16384 for bloco in blocos[:-1]))
+        # Uma inserção no início só muda os primeiros blocos
+        self.assertGreater(len(set(blocos) & set(deslocados)), len(blocos) - 3)
+
+    def test_corte_em_python_sem_fastcdc(self):
+        dados = random.Random(7).randbytes(64 * 1024)
+        with mock.patch.object(repositorio_backups, 'FASTCDC_AVAILABLE', False):
+            blocos = list(dividir_em_blocos(BytesIO(dados)))
+        self.assertEqual(b''.join(blocos), dados)
+        self.assertTrue(all(1024 <= len(bloco) <= 16384 for bloco in blocos[:-1]))
+
+    def test_insercao_de_um_byte_so_muda_os_blocos_vizinhos(self):
+        dados = random.Random(3).randbytes(256 * 1024)
+        alterados = dados[:128 * 1024] + b'x' + dados[128 * 1024:]
+        for nativo in (True, False):
+            with self.subTest(nativo=nativo), \
+                    mock.patch.object(repositorio_backups, 'FASTCDC_AVAILABLE', nativo and repositorio_backups.FASTCDC_AVAILABLE):
+                blocos = list(dividir_em_blocos(BytesIO(dados)))
+                novos = [bloco for bloco in dividir_em_blocos(BytesIO(alterados)) if bloco not in set(blocos)]
+                self.assertGreater(len(blocos), 20)
+                # Muda o bloco com a inserção e, no máximo, o seguinte
+                self.assertLessEqual(len(novos), 2)
+
+
+class BackupEnginesTests(APITransactionTestCase):
+    # Sem a transação do TestCase: o backup online do SQLite não roda dentro de uma
+    # transação aberta na mesma conexão
+
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='backupadmin', password='password', nome_completo='Backup Admin', nivel_acesso='admin')
+        self.obra = Obra.objects.create(nome_obra="Edifício Backup", endereco_completo=".", cidade=".", status="Em Andamento")
+        self.client.force_authenticate(user=self.user)
+        backup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(backup_dir.cleanup)
+        self.backup_dir = backup_dir.name
+        settings_override = override_settings(BACKUP_DIR=self.backup_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _sha256(self, dados):
+        return hashlib.sha256(dados).hexdigest()
+
+    def test_snapshot_sqlite_comprimido_e_integro(self):
+        resultado = SQLiteBackupEngine().dump(os.path.join(self.backup_dir, 'snapshot.sqlite'))
+
+        self.assertEqual(resultado['path'], os.path.join(self.backup_dir, 'snapshot.sqlite.gz'))
+        self.assertEqual(resultado['compression'], 'gzip')
+        with open(resultado['path'], 'rb') as f:
+            comprimido = f.read()
+        self.assertEqual(resultado['file_hash'], self._sha256(comprimido))
+        self.assertEqual(resultado['file_size'], len(comprimido))
+        banco = gzip.decompress(comprimido)
+        self.assertEqual(resultado['raw_hash'], self._sha256(banco))
+        self.assertLess(resultado['file_size'], resultado['raw_size'])
+
+        restaurado = os.path.join(self.backup_dir, 'restaurado.sqlite')
+        with open(restaurado, 'wb') as f:
+            f.write(banco)
+        conn = sqlite3.connect(restaurado)
+        try:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], 'ok')
+            nomes = [row[0] for row in conn.execute("SELECT nome_obra FROM core_obra")]
+        finally:
+            conn.close()
+        self.assertIn("Edifício Backup", nomes)
+        # Só o .gz fica no diretório (o snapshot temporário é removido)
+        self.assertEqual(sorted(os.listdir(self.backup_dir)), ['restaurado.sqlite', 'snapshot.sqlite.gz'])
+
+    def test_dumpdata_gravado_comprimido(self):
+        resultado = DumpDataBackupEngine().dump(os.path.join(self.backup_dir, 'dump.json'))
+
+        with open(resultado['path'], 'rb') as f:
+            objetos = json.loads(gzip.decompress(f.read()))
+        obras = [obj['fields']['nome_obra'] for obj in objetos if obj['model'] == 'core.obra']
+        self.assertEqual(obras, ["Edifício Backup"])
+
+    @override_settings(BACKUP_REPOSITORY=False)
+    def test_create_backup_registra_engine_e_hash(self):
+        resultado = BackupService().create_backup(user_id=self.user.id, description='teste')
+
+        self.assertTrue(resultado['success'])
+        self.assertEqual(resultado['engine'], 'sqlite')
+        backup = BackupLog.objects.get(backup_id=resultado['backup_id'])
+        self.assertEqual(backup.status, 'completed')
+        self.assertTrue(backup.file_path.endswith('.sqlite.gz'))
+        with open(backup.file_path, 'rb') as f:
+            self.assertEqual(backup.file_hash, self._sha256(f.read()))
+        self.assertEqual(backup.metadata['compression'], 'gzip')
+        self.assertEqual(TaskHistory.objects.get(task_id=backup.metadata['task_id']).status, 'completed')
+
+    def test_endpoint_agenda_backup_em_segundo_plano(self):
+        response = self.client.post('/api/service-backups/create_backup/', {'description': 'noturno'})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        backup_id = response.data['backup_id']
+        self.assertEqual(BackupLog.objects.get(backup_id=backup_id).status, 'pending')
+        task = TaskHistory.objects.get(task_id=response.data['task_id'])
+        self.assertEqual((task.status, task.priority), ('pending', 'high'))
+        self.assertEqual(task.metadata['params'], {'backup_id': backup_id})
+
+        # O que o executor de tarefas roda
+        executor = ExecutorTarefas(workers=1)
+        self.addCleanup(executor.encerrar)
+        [task] = executor.reivindicar(1)
+        self.assertTrue(executor.executar(task)['success'])
+        self.assertEqual(BackupLog.objects.get(backup_id=backup_id).status, 'completed')
+        self.assertEqual(TaskHistory.objects.get(pk=task.pk).status, 'completed')
+        self.assertFalse(BackupService().run_backup(backup_id)['success'])
+
+
+class BackupIncrementalTests(APITransactionTestCase):
+    # Como em BackupEnginesTests: o backup online do SQLite não roda dentro da
+    # transação do TestCase
+
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='incrementaladmin', password='password', nome_completo='Incremental Admin', nivel_acesso='admin')
+        self.obra = Obra.objects.create(nome_obra="Edifício Backup", endereco_completo=".", cidade=".", status="Em Andamento")
+        self.client.force_authenticate(user=self.user)
+        backup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(backup_dir.cleanup)
+        self.backup_dir = backup_dir.name
+        settings_override = override_settings(BACKUP_DIR=self.backup_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_incrementais_encadeados_e_restauracao_da_cadeia(self):
+        service = BackupService()
+        completo = service.create_backup(backup_type='full', user_id=self.user.id)
+        self.assertTrue(completo['success'])
+
+        self.obra.nome_obra = "Edifício Backup II"
+        self.obra.save()
+        temporaria = Obra.objects.create(nome_obra="Obra Temporária", endereco_completo=".", cidade=".", status="Planejada")
+        pedreiro = Funcionario.objects.create(nome_completo="Pedreiro", cargo="Pedreiro", data_contratacao=date(2024, 1, 1))
+        equipe = Equipe.objects.create(nome_equipe="Equipe Backup")
+        equipe.membros.add(pedreiro)
+
+        primeiro = service.create_backup(backup_type='incremental', user_id=self.user.id)
+        self.assertTrue(primeiro['success'])
+        primeiro_log = BackupLog.objects.get(backup_id=primeiro['backup_id'])
+        self.assertEqual(primeiro_log.backup_type, 'incremental')
+        self.assertEqual(primeiro_log.metadata['parent_backup_id'], completo['backup_id'])
+        self.assertTrue(primeiro_log.file_path.endswith('.jsonl.gz'))
+        self.assertGreaterEqual(primeiro_log.metadata['changed_rows'], 4)
+
+        temporaria.delete()
+        segundo = service.create_backup(backup_type='incremental', user_id=self.user.id)
+        segundo_log = BackupLog.objects.get(backup_id=segundo['backup_id'])
+        self.assertEqual(segundo_log.metadata['parent_backup_id'], primeiro['backup_id'])
+        self.assertEqual(segundo_log.metadata['base_backup_id'], completo['backup_id'])
+        self.assertGreaterEqual(segundo_log.metadata['deleted_rows'], 1)
+
+        # Alterações posteriores ao último incremental são desfeitas pela restauração
+        Obra.objects.create(nome_obra="Obra Posterior", endereco_completo=".", cidade=".", status="Planejada")
+        equipe.membros.clear()
+
+        response = self.client.post(f'/api/service-backups/{segundo_log.pk}/restore/')
+
+        # A restauração fica na fila do executor de tarefas
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        self.assertEqual(Obra.objects.filter(nome_obra="Obra Posterior").count(), 1)
+        executor = ExecutorTarefas(workers=1)
+        self.addCleanup(executor.encerrar)
+        [task] = executor.reivindicar(1)
+        self.assertEqual(task.task_id, response.data['task_id'])
+        pedida_em = task.created_at
+        resultado = executor.executar(task)
+
+        self.assertEqual(resultado['chain'], [completo['backup_id'], primeiro['backup_id'], segundo['backup_id']])
+        # O histórico de tarefas sobrevive à restauração, com a tarefa da própria restauração
+        task = TaskHistory.objects.get(task_id=response.data['task_id'])
+        self.assertEqual((task.status, task.created_by_id, task.created_at), ('completed', self.user.id, pedida_em))
+        self.assertEqual(TaskHistory.objects.get(task_id=BackupLog.objects.get(backup_id=segundo['backup_id']).metadata['task_id']).status, 'completed')
+        self.assertEqual(
+            sorted(Obra.objects.values_list('nome_obra', flat=True)),
+            ["Edifício Backup II"]
+        )
+        self.assertEqual(list(Equipe.objects.get(nome_equipe="Equipe Backup").membros.all()), [pedreiro])
+        self.assertTrue(ObraCustoResumo.objects.filter(obra_id=self.obra.pk).exists())
+
+    def test_incremental_depois_de_restaurar_inicia_nova_cadeia(self):
+        service = BackupService()
+        antigo = service.create_backup(backup_type='full', user_id=self.user.id)
+        self.obra.nome_obra = "Edifício Backup II"
+        self.obra.save()
+        recente = service.create_backup(backup_type='full', user_id=self.user.id)
+        self.assertTrue(service.restore_backup(antigo['backup_id'])['success'])
+        self.assertEqual(Obra.objects.get().nome_obra, "Edifício Backup")
+
+        # O banco voltou sem passar pelo diário: encadear no completo mais recente perderia a volta
+        depois = service.create_backup(backup_type='incremental', user_id=self.user.id)
+        depois_log = BackupLog.objects.get(backup_id=depois['backup_id'])
+        self.assertEqual(depois_log.backup_type, 'full')
+        self.assertTrue(BackupLog.objects.filter(backup_id=recente['backup_id']).exists())
+
+        Obra.objects.create(nome_obra="Obra Nova", endereco_completo=".", cidade=".", status="Planejada")
+        incremental = service.create_backup(backup_type='incremental', user_id=self.user.id)
+        incremental_log = BackupLog.objects.get(backup_id=incremental['backup_id'])
+        self.assertEqual(incremental_log.metadata['base_backup_id'], depois['backup_id'])
+
+        Obra.objects.all().delete()
+        self.assertTrue(service.restore_backup(incremental['backup_id'])['success'])
+        self.assertEqual(sorted(Obra.objects.values_list('nome_obra', flat=True)), ["Edifício Backup", "Obra Nova"])
+
+    def test_incremental_sem_completo_gera_backup_completo(self):
+        resultado = BackupService().create_backup(backup_type='incremental', user_id=self.user.id)
+
+        backup = BackupLog.objects.get(backup_id=resultado['backup_id'])
+        self.assertEqual(backup.backup_type, 'full')
+        self.assertEqual(backup.metadata['engine'], 'sqlite')
+
+
+class RepositorioBackupsTests(APITransactionTestCase):
+    # Como em BackupEnginesTests: o backup online do SQLite não roda dentro da
+    # transação do TestCase
+
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='repositorioadmin', password='password', nome_completo='Repositorio Admin', nivel_acesso='admin')
+        self.obra = Obra.objects.create(nome_obra="Edifício Backup", endereco_completo=".", cidade=".", status="Em Andamento")
+        self.client.force_authenticate(user=self.user)
+        backup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(backup_dir.cleanup)
+        self.backup_dir = backup_dir.name
+        settings_override = override_settings(BACKUP_DIR=self.backup_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @override_settings(BACKUP_CHUNK_AVG_SIZE=16 * 1024)
+    def test_repositorio_deduplica_snapshots_e_coleta_blocos_na_retencao(self):
+        Obra.objects.bulk_create([
+            Obra(nome_obra=f"Obra {i}", endereco_completo=f"Rua {i} " * 40, cidade=".", status="Planejada")
+            for i in range(3000)
+        ])
+        service = BackupService()
+        primeiro = service.create_backup(backup_type='full', user_id=self.user.id)
+        self.assertTrue(primeiro['success'])
+        primeiro_log = BackupLog.objects.get(backup_id=primeiro['backup_id'])
+        self.assertEqual(primeiro_log.file_path, '')
+        self.assertEqual(primeiro_log.metadata['repository']['new_chunks'], BlocoBackup.objects.count())
+
+        self.obra.nome_obra = "Edifício Backup II"
+        self.obra.save()
+        segundo = service.create_backup(backup_type='full', user_id=self.user.id)
+        repositorio = BackupLog.objects.get(backup_id=segundo['backup_id']).metadata['repository']
+        # Só os blocos em volta das páginas alteradas são gravados de novo
+        self.assertGreater(repositorio['chunks'], 4)
+        self.assertLess(repositorio['new_chunks'], repositorio['chunks'] / 2)
+
+        # O primeiro snapshot é remontado a partir dos blocos
+        with self.settings(BACKUP_SYNC=True):
+            response = self.client.post(f'/api/service-backups/{primeiro_log.pk}/restore/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertTrue(Obra.objects.filter(nome_obra="Edifício Backup").exists())
+        self.assertFalse(Obra.objects.filter(nome_obra="Edifício Backup II").exists())
+
+        # Os registros de backup e o índice do repositório sobrevivem à restauração
+        self.assertEqual(BackupLog.objects.filter(status='completed').count(), 2)
+        self.assertEqual(BlocoManifesto.objects.count(), primeiro_log.metadata['repository']['chunks'] + repositorio['chunks'])
+
+        self.obra.refresh_from_db()
+        self.obra.nome_obra = "Edifício Backup III"
+        self.obra.save()
+        terceiro = service.create_backup(backup_type='full', user_id=self.user.id)
+        exclusivos = set(BlocoManifesto.objects.filter(backup__backup_id=primeiro['backup_id']).values_list('bloco__hash', flat=True))
+        exclusivos -= set(BlocoManifesto.objects.filter(backup__backup_id=terceiro['backup_id']).values_list('bloco__hash', flat=True))
+        self.assertTrue(exclusivos)
+
+        resultado = service.prune_backups(1)
+
+        self.assertTrue(resultado['success'], resultado)
+        self.assertEqual(resultado['deleted_count'], 2)
+        self.assertEqual(list(BackupLog.objects.values_list('backup_id', flat=True)), [terceiro['backup_id']])
+        self.assertGreaterEqual(resultado['removed_chunks'], len(exclusivos))
+        self.assertFalse(BlocoBackup.objects.filter(hash__in=exclusivos).exists())
+        self.assertFalse(BlocoBackup.objects.filter(referencias__isnull=True).exists())
+        diretorio_blocos = os.path.join(self.backup_dir, 'repositorio', 'blocos')
+        gravados = {nome for _, _, nomes in os.walk(diretorio_blocos) for nome in nomes}
+        self.assertEqual(gravados, set(BlocoBackup.objects.values_list('hash', flat=True)))
+        self.assertEqual(os.listdir(os.path.join(self.backup_dir, 'repositorio', 'manifestos')), [f"{terceiro['backup_id']}.json"])
+
+
+class RestauracaoBackupTests(APITransactionTestCase):
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='restauraadmin', password='password', nome_completo='Restaura Admin', nivel_acesso='admin')
+        self.client.force_authenticate(user=self.user)
+        Obra.objects.create(nome_obra="Obra Original", endereco_completo=".", cidade=".", status="Em Andamento")
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = diretorio.name
+        settings_override = override_settings(BASE_DIR=self.diretorio, BACKUP_DIR=self.diretorio, BACKUP_REPOSITORY=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_arquivo_invalido_interrompe_transferencia_no_cabecalho(self):
+        lidos = []
+
+        def blocos():
+            for bloco in (b'nao e um banco' * 10, b'resto' * 100):
+                lidos.append(bloco)
+                yield bloco
+
+        destino = os.path.join(self.diretorio, 'invalido.sqlite')
+        with self.assertRaisesMessage(ValueError, 'não é um banco SQLite'):
+            gravar_snapshot_verificado(blocos(), destino)
+        self.assertEqual(len(lidos), 1)
+        self.assertFalse(os.path.exists(destino))
+
+        snapshot = SQLiteBackupEngine().dump(os.path.join(self.diretorio, 'inteiro.sqlite'), compress=False)
+        self.assertEqual(snapshot['integrity_check'], 'ok')
+        with open(snapshot['path'], 'rb') as f:
+            dados = f.read()
+        with self.assertRaisesMessage(ValueError, 'Snapshot incompleto'):
+            gravar_snapshot_verificado(iter([dados[:len(dados) // 2]]), destino)
+
+    def test_restauracao_do_s3_em_streaming_confere_hash(self):
+        cliente = S3EmMemoria()
+        service = BackupService()
+        service.s3_service.s3_client = cliente
+        service.s3_service.s3_available = True
+        service.s3_service.bucket_name = 'bucket-teste'
+        resultado = service.create_backup(backup_type='full', user_id=self.user.id)
+        self.assertTrue(resultado['s3_uploaded'], resultado)
+        backup = BackupLog.objects.get(backup_id=resultado['backup_id'])
+        self.assertEqual(backup.metadata['integrity_check'], 'ok')
+        self.assertFalse(os.path.exists(backup.file_path))
+        Obra.objects.create(nome_obra="Obra Posterior", endereco_completo=".", cidade=".", status="Planejada")
+
+        restaurado = service.restore_backup(backup.backup_id)
+
+        self.assertTrue(restaurado['success'], restaurado)
+        self.assertEqual(list(Obra.objects.values_list('nome_obra', flat=True)), ["Obra Original"])
+        self.assertEqual([nome for nome in os.listdir(self.diretorio) if nome.startswith('restore_')], [])
+
+        # Objeto alterado no bucket: a restauração falha sem tocar no banco
+        Obra.objects.create(nome_obra="Obra Posterior", endereco_completo=".", cidade=".", status="Planejada")
+        objeto = cliente.objetos[AnexoS3.objects.get(anexo_id=backup.metadata['s3_anexo_id']).s3_key]
+        objeto['body'] = objeto['body'][:-1] + bytes([objeto['body'][-1] ^ 1])
+        falha = service.restore_backup(backup.backup_id)
+        self.assertFalse(falha['success'])
+        self.assertEqual(Obra.objects.count(), 2)
+
+    def test_endpoint_legado_valida_antes_de_restaurar(self):
+        restaurar = BackupViewSetLegado.as_view({'post': 'restore'})
+        backups_dir = os.path.join(self.diretorio, 'backups')
+        os.makedirs(backups_dir)
+        SQLiteBackupEngine().dump(os.path.join(backups_dir, 'valido.sql'), compress=False)
+        valido = Backup.objects.create(filename='valido.sql')
+        with open(os.path.join(backups_dir, 'corrompido.sql'), 'wb') as f:
+            f.write(b'SQLite format 3\x00' + b'\x00' * 200)
+        corrompido = Backup.objects.create(filename='corrompido.sql')
+        Obra.objects.create(nome_obra="Obra Posterior", endereco_completo=".", cidade=".", status="Planejada")
+
+        request = APIRequestFactory().post(f'/api/backups/{corrompido.pk}/restore/')
+        force_authenticate(request, user=self.user)
+        response = restaurar(request, pk=corrompido.pk)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Obra.objects.count(), 2)
+        # O snapshot de segurança de uma restauração recusada é descartado
+        self.assertEqual(sorted(os.listdir(backups_dir)), ['corrompido.sql', 'valido.sql'])
+
+        request = APIRequestFactory().post(f'/api/backups/{valido.pk}/restore/')
+        force_authenticate(request, user=self.user)
+        response = restaurar(request, pk=valido.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(list(Obra.objects.values_list('nome_obra', flat=True)), ["Obra Original"])
+        self.assertTrue(Backup.objects.filter(tipo='automatico').exists())
+
+
+class BackupAgendadoTests(APITransactionTestCase):
+    def setUp(self):
+        self.user = Usuario.objects.create_user(login='agendaadmin', password='password', nome_completo='Agenda Admin', nivel_acesso='admin')
+        backup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(backup_dir.cleanup)
+        settings_override = override_settings(BACKUP_DIR=backup_dir.name, BACKUP_SCHEDULE_WINDOW_MINUTES=120)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_horario_devido_respeita_janela_e_frequencia(self):
+        configuracao = BackupSettings(backup_time=datetime.strptime('02:00', '%H:%M').time(), backup_frequency='weekly')
+
+        self.assertEqual(horario_devido(configuracao, None, self._local(2026, 3, 10, 2, 30)), self._local(2026, 3, 10, 2, 0))
+        # Fora da janela: espera o horário do dia seguinte
+        self.assertIsNone(horario_devido(configuracao, None, self._local(2026, 3, 10, 9, 0)))
+        self.assertIsNone(horario_devido(configuracao, None, self._local(2026, 3, 10, 1, 59)))
+        ultimo = self._local(2026, 3, 5, 2, 0)
+        self.assertIsNone(horario_devido(configuracao, ultimo, self._local(2026, 3, 11, 2, 5)))
+        self.assertIsNotNone(horario_devido(configuracao, ultimo, self._local(2026, 3, 12, 2, 5)))
+
+        configuracao.backup_frequency = 'monthly'
+        ultimo = self._local(2026, 1, 31, 2, 0)
+        self.assertIsNone(horario_devido(configuracao, ultimo, self._local(2026, 2, 27, 2, 5)))
+        self.assertIsNotNone(horario_devido(configuracao, ultimo, self._local(2026, 2, 28, 2, 5)))
+
+    def test_execucao_agendada_registra_backup_e_aplica_retencao(self):
+        antigo = BackupService().create_backup(backup_type='full', user_id=self.user.id)
+        Obra.objects.create(nome_obra="Obra Noturna", endereco_completo=".", cidade=".", status="Planejada")
+        configuracao = BackupSettings.atual()
+        configuracao.backup_frequency = 'daily'
+        configuracao.max_backups_to_keep = 1
+        configuracao.save()
+        agora = timezone.localtime().replace(hour=2, minute=10, second=0, microsecond=0)
+
+        resultado = executar_backup_agendado(agora)
+
+        self.assertTrue(resultado['success'], resultado)
+        backup = BackupLog.objects.get(backup_id=resultado['backup_id'])
+        self.assertIsNone(backup.created_by)
+        self.assertEqual(backup.backup_type, 'full')
+        self.assertEqual(backup.metadata['scheduled_for'], agora.replace(minute=0).isoformat())
+        self.assertEqual(backup.metadata['retention']['deleted_count'], 1)
+        self.assertFalse(BackupLog.objects.filter(backup_id=antigo['backup_id']).exists())
+        # O mesmo horário não roda duas vezes; o do dia seguinte, sim
+        self.assertIsNone(executar_backup_agendado(agora + timedelta(minutes=5)))
+        self.assertIsNotNone(executar_backup_agendado(agora + timedelta(days=1)))
+
+        configuracao.backup_enabled = False
+        configuracao.save()
+        self.assertIsNone(executar_backup_agendado(agora + timedelta(days=2)))
+
+
 class LocacaoTransferAPITests(APITestCase): # Changed to APITestCase for consistency
     @classmethod
     def setUpTestData(cls): # Changed to setUpTestData
@@ -8,13 +8,13 @@ from .views import (
     ParcelaCompraViewSet, AnexoCompraViewSet, ArquivoObraViewSet,
     FuncionarioDetailView, EquipeDetailView, MaterialDetailAPIView,
     RelatorioFinanceiroObraView, RelatorioGeralComprasView, DashboardStatsView,
-    RelatorioDesempenhoEquipeView, RelatorioCustoGeralView, ObraHistoricoCustosView,
+    RelatorioDesempenhoEquipeView, RelatorioCustoGeralView, ObraHistoricoCustosView, CustosSerieTemporalView,
     ObraCustosPorCategoriaView, RelatorioFolhaPagamentoViewSet, RelatorioPagamentoMateriaisViewSet,
     GerarRelatorioPDFObraView, GerarRelatorioPagamentoLocacoesPDFView, LocacaoSemanalView,
     RecursosMaisUtilizadosSemanaView, ObraCustosPorMaterialView, ObraCustosPorCategoriaMaterialView,
     media_test_view
 )
-from .views.service_views import BackupViewSet as NewBackupViewSet, TaskViewSet, AnexoS3ViewSet
+from .views.service_views import BackupViewSet as NewBackupViewSet, TaskViewSet, AnexoS3ViewSet, RelatorioPDFJobViewSet
 from .health_views import health_check
 from .health import database_status
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -38,6 +38,7 @@ router.register(r'backup-settings', BackupSettingsViewSet, basename='backupsetti
 router.register(r'service-backups', NewBackupViewSet, basename='service-backup')
 router.register(r'tasks', TaskViewSet, basename='task')
 router.register(r'anexos-s3', AnexoS3ViewSet, basename='anexo-s3')
+router.register(r'relatorios-pdf', RelatorioPDFJobViewSet, basename='relatorio-pdf-job')
 router.register(r'parcelas-compra', ParcelaCompraViewSet)
 router.register(r'anexos-compra', AnexoCompraViewSet)
 router.register(r'arquivos-obra', ArquivoObraViewSet)
@@ -56,6 +57,7 @@ urlpatterns = [
     path('relatorios/dashboard-stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
     path('relatorios/desempenho-equipe/', RelatorioDesempenhoEquipeView.as_view(), name='relatorio-desempenho-equipe'),
     path('relatorios/custo-geral/', RelatorioCustoGeralView.as_view(), name='relatorio-custo-geral'),
+    path('custos/serie-temporal/', CustosSerieTemporalView.as_view(), name='custos-serie-temporal'),
     path('obras/<int:pk>/historico-custos/', ObraHistoricoCustosView.as_view(), name='obra-historico-custos'),
     path('obras/<int:pk>/custos-por-categoria/', ObraCustosPorCategoriaView.as_view(), name='obra-custos-por-categoria'),
     path('relatorios/folha-pagamento/', RelatorioFolhaPagamentoViewSet.as_view({'get': 'generate_report'}), name='relatorio-folha-pagamento'),
@@ -1,8 +1,14 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseNotModified
 from django.template.loader import render_to_string
 from django.conf import settings
 import os
 import base64
+import hashlib
+import multiprocessing
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 
 # Handle weasyprint import gracefully
@@ -20,63 +26,33 @@ try:
 except ImportError as e:
     IMAGE_PROCESSING_AVAILABLE = False
 
-# Handle office file processing imports
-try:
-    import docx
-    import openpyxl
-    OFFICE_PROCESSING_AVAILABLE = True
-except ImportError:
-    OFFICE_PROCESSING_AVAILABLE = False
+from . import renderizacao
+from .renderizacao import (
+    docx_to_html, xlsx_to_html, render_attachment_base64, PDF_RASTER_DPI, IMAGE_EXTENSIONS,
+)
 
+logger = logging.getLogger(__name__)
 
-def docx_to_html(file_content):
-    """
-    Converts the content of a .docx file to a simple HTML string.
-    """
-    if not OFFICE_PROCESSING_AVAILABLE:
-        return "<html><body><p>DOCX processing library not available.</p></body></html>"
-    try:
-        document = docx.Document(BytesIO(file_content))
-        html = "<html><head><style>body { font-family: sans-serif; } table { border-collapse: collapse; width: 100%; } td, th { border: 1px solid #dddddd; text-align: left; padding: 8px; }</style></head><body>"
-        html += "<h1>Documento Word</h1>"
-        for para in document.paragraphs:
-            html += f"<p>{para.text}</p>"
-        for table in document.tables:
-            html += "<table>"
-            for row in table.rows:
-                html += "<tr>"
-                for cell in row.cells:
-                    html += f"<td>{cell.text}</td>"
-                html += "</tr>"
-            html += "</table><br>"
-        html += "</body></html>"
-        return html
-    except Exception as e:
-        return f"<html><body><p>Error converting DOCX: {e}</p></body></html>"
 
-def xlsx_to_html(file_content):
+def render_pdf_bytes(template_name, context, css_path):
     """
-    Converts the content of a .xlsx file to an HTML table string.
+    Renderiza um template HTML em PDF e retorna os bytes do arquivo.
+    Usado tanto pelas respostas síncronas quanto pelos jobs de relatório em segundo plano.
     """
-    if not OFFICE_PROCESSING_AVAILABLE:
-        return "<html><body><p>XLSX processing library not available.</p></body></html>"
+    if not WEASYPRINT_AVAILABLE:
+        raise RuntimeError("PDF generation is not available. WeasyPrint could not be loaded.")
+
+    html_string = render_to_string(template_name, context)
+
     try:
-        workbook = openpyxl.load_workbook(BytesIO(file_content))
-        sheet = workbook.active
-        html = "<html><head><style>body { font-family: sans-serif; } table { border-collapse: collapse; width: 100%; } td, th { border: 1px solid #dddddd; text-align: left; padding: 8px; }</style></head><body>"
-        html += "<h1>Planilha Excel</h1>"
-        html += "<table>"
-        for row in sheet.iter_rows():
-            html += "<tr>"
-            for cell in row:
-                cell_value = cell.value if cell.value is not None else ""
-                html += f"<td>{cell_value}</td>"
-            html += "</tr>"
-        html += "</table>"
-        html += "</body></html>"
-        return html
-    except Exception as e:
-        return f"<html><body><p>Error converting XLSX: {e}</p></body></html>"
+        css_string = open(css_path, 'r').read()
+        css = CSS(string=css_string)
+    except FileNotFoundError:
+        css = None
+
+    html = HTML(string=html_string, base_url=settings.STATIC_ROOT)
+    return html.write_pdf(stylesheets=[css] if css else None)
+
 
 def generate_pdf_response(template_name, context, css_path, filename):
     """
@@ -84,27 +60,126 @@ def generate_pdf_response(template_name, context, css_path, filename):
     """
     if not WEASYPRINT_AVAILABLE:
         return HttpResponse("PDF generation is not available. WeasyPrint could not be loaded.", status=500)
-    
-    html_string = render_to_string(template_name, context)
-    
-    try:
-        css_string = open(css_path, 'r').read()
-        css = CSS(string=css_string)
-    except FileNotFoundError:
-        css = None
 
     try:
-        html = HTML(string=html_string, base_url=settings.STATIC_ROOT)
-        pdf_file = html.write_pdf(stylesheets=[css] if css else None)
-        
+        pdf_file = render_pdf_bytes(template_name, context, css_path)
+
         response = HttpResponse(pdf_file, content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
+
         return response
     except Exception as e:
         return HttpResponse(f"Error generating PDF: {str(e)}", status=500)
 
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range_header(range_header, size):
+    """
+    Interpreta um cabeçalho HTTP Range de intervalo único ("bytes=0-99",
+    "bytes=100-" ou "bytes=-100").
+
+    Returns:
+        Tupla (inicio, fim) inclusiva, ou None quando o cabeçalho deve ser
+        ignorado (ausente, mal formado ou com múltiplos intervalos)
+
+    Raises:
+        ValueError: intervalo fora do tamanho do arquivo (responder 416)
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    inicio, separador, fim = range_header[len('bytes='):].strip().partition('-')
+    if not separador or not (inicio or fim) or not all(v == '' or v.isdigit() for v in (inicio, fim)):
+        return None
+    if size <= 0:
+        raise ValueError("Range not satisfiable")
+
+    if inicio == '':
+        sufixo = int(fim)
+        if sufixo == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - sufixo, 0), size - 1
+
+    inicio = int(inicio)
+    if inicio >= size:
+        raise ValueError("Range not satisfiable")
+    fim = min(int(fim), size - 1) if fim else size - 1
+    if inicio > fim:
+        return None
+    return inicio, fim
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    valores = [valor.strip() for valor in if_none_match.split(',')]
+    return etag in valores or f'W/{etag}' in valores
+
+
+def conditional_range_request(request, size, etag=None):
+    """
+    Avalia If-None-Match e Range de um download.
+
+    Returns:
+        Tupla (resposta, intervalo): resposta é um 304/416 a ser devolvido
+        diretamente (ou None) e intervalo o (inicio, fim) solicitado (ou None)
+    """
+    etag = f'"{etag}"' if etag else None
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response, None
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if not range_header or size is None or (if_range and if_range != etag):
+        return None, None
+    try:
+        return None, parse_range_header(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response, None
+
+
+def iter_file_chunks(file, byte_range=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Lê um arquivo aberto em blocos (opcionalmente só o intervalo pedido) e o fecha ao final."""
+    try:
+        restante = None
+        if byte_range:
+            file.seek(byte_range[0])
+            restante = byte_range[1] - byte_range[0] + 1
+        while restante is None or restante > 0:
+            dados = file.read(chunk_size if restante is None else min(chunk_size, restante))
+            if not dados:
+                break
+            if restante is not None:
+                restante -= len(dados)
+            yield dados
+    finally:
+        file.close()
+
+
+def streaming_file_response(chunks, size, content_type, filename, byte_range=None, etag=None, disposition='attachment'):
+    """
+    Monta um StreamingHttpResponse para um download, com suporte a 206 Partial Content.
+    """
+    response = StreamingHttpResponse(chunks, content_type=content_type, status=206 if byte_range else 200)
+    if byte_range:
+        response['Content-Range'] = f'bytes {byte_range[0]}-{byte_range[1]}/{size}'
+        response['Content-Length'] = str(byte_range[1] - byte_range[0] + 1)
+    elif size is not None:
+        response['Content-Length'] = str(size)
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = f'"{etag}"'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return response
+
+
 def _create_placeholder_image(nome_arquivo, error_message):
     """Creates a placeholder image with an error message."""
     img_base64 = None
@@ -137,97 +212,216 @@ def _create_placeholder_image(nome_arquivo, error_message):
         img.save(buffer, format='PNG')
         img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
     except Exception as placeholder_error:
-        print(f"Critical error creating placeholder image: {placeholder_error}")
+        logger.error(f"Critical error creating placeholder image: {placeholder_error}")
 
     return img_base64
 
 from .services.s3_service import S3Service
-from .models import ArquivoObra
+from .services.derivados_cache import get_derivado_cache
+from .models import ArquivoObra, AnexoS3
+
+
+def _derivative_cache_key(content_hash, file_extension):
+    return get_derivado_cache().make_key(content_hash, ext=file_extension, dpi=PDF_RASTER_DPI)
+
+
+_fetch_pool = None
+_render_pool = None
+_pools_lock = threading.Lock()
+
+
+def _get_fetch_pool():
+    """Pool de threads para downloads do S3 (I/O), compartilhado pelo processo."""
+    global _fetch_pool
+    with _pools_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ATTACHMENT_FETCH_WORKERS', 8),
+                thread_name_prefix='anexo-download'
+            )
+        return _fetch_pool
+
+
+def _get_render_pool():
+    """
+    Pool de processos para a renderização (CPU). Retorna None quando
+    ATTACHMENT_RENDER_WORKERS é 0, caso em que a renderização roda no próprio processo.
+
+    Os workers são iniciados com 'spawn': o pool é criado dentro de um worker
+    do gunicorn com threads (inclusive as de download) rodando, e um fork
+    herdaria locks em estado indefinido e a memória do processo inteiro. Os
+    workers importam só core.renderizacao, que não depende do Django.
+    """
+    global _render_pool
+    workers = getattr(settings, 'ATTACHMENT_RENDER_WORKERS', 2)
+    if workers <= 0:
+        return None
+    with _pools_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _render_pool
+
+
+def _discard_render_pool():
+    global _render_pool
+    with _pools_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+            _render_pool = None
+
+
+def _fetch_s3_content(s3_service, bucket_name, s3_key):
+    response = s3_service.s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+    return response['Body'].read()
+
+
+def _render_items(itens):
+    """Renderiza os itens do lote que ainda não têm derivado, em paralelo quando há mais de um."""
+    pendentes = [item for item in itens if item['img_base64'] is None and item['erro'] is None]
+    pool = _get_render_pool() if len(pendentes) > 1 else None
+
+    if pool is not None:
+        try:
+            futures = [
+                (item, pool.submit(renderizacao.render_attachment_base64, item['content'], item['ext']))
+                for item in pendentes
+            ]
+        except BrokenProcessPool:
+            _discard_render_pool()
+            futures = []
+            pool = None
+        for item, future in futures:
+            try:
+                item['img_base64'] = future.result()
+            except BrokenProcessPool as e:
+                # Um worker morreu (ex.: falta de memória); recria o pool no próximo lote
+                _discard_render_pool()
+                item['erro'] = e
+            except Exception as e:
+                item['erro'] = e
+
+    if pool is None:
+        for item in pendentes:
+            try:
+                item['img_base64'] = render_attachment_base64(item['content'], item['ext'])
+            except Exception as e:
+                item['erro'] = e
+
 
 def process_attachments_for_pdf(attachments):
     """
     Processes various attachment types for inclusion in a PDF.
     Handles both local and S3-backed files.
+
+    Os derivados (base64) ficam no cache de derivados, endereçado pelo hash do
+    conteúdo: para anexos no S3 o hash já gravado em AnexoS3 permite reaproveitar
+    o derivado sem baixar o arquivo; para arquivos locais o hash é calculado
+    sobre o conteúdo lido.
+
+    Os anexos são processados em lotes de ATTACHMENT_MAX_IN_FLIGHT itens, o que
+    limita quantos arquivos ficam em memória ao mesmo tempo: os downloads do lote
+    rodam em um pool de threads e a renderização em um pool de processos. A
+    ordem de saída é a mesma da entrada.
     """
     if not IMAGE_PROCESSING_AVAILABLE or not WEASYPRINT_AVAILABLE:
         # If the core libraries aren't available, we can't do anything.
         return []
     
+    attachments = list(attachments)
     processed_attachments = []
     s3_service = S3Service() # Instantiate once
-    
-    for anexo in attachments:
-        img_base64 = None
-        nome_arquivo = "Unknown"
-        descricao_anexo = ""
-        file_content = None
+    cache = get_derivado_cache()
+    max_in_flight = max(1, getattr(settings, 'ATTACHMENT_MAX_IN_FLIGHT', 8))
 
-        try:
-            # Check if it's an S3-backed ArquivoObra
-            if isinstance(anexo, ArquivoObra) and anexo.s3_anexo_id and s3_service.s3_available:
-                nome_arquivo = anexo.nome_original
-                descricao_anexo = anexo.descricao or ""
-
-                download_result = s3_service.download_file(anexo.s3_anexo_id)
-                if download_result.get('success'):
-                    file_content = download_result.get('content')
+    # Hash e localização dos anexos S3 em uma única consulta; as threads de
+    # download não acessam o banco
+    s3_ids = [
+        anexo.s3_anexo_id for anexo in attachments
+        if isinstance(anexo, ArquivoObra) and anexo.s3_anexo_id
+    ]
+    s3_anexos = {
+        linha['anexo_id']: linha
+        for linha in AnexoS3.objects.filter(anexo_id__in=s3_ids).values('anexo_id', 'file_hash', 'bucket_name', 's3_key')
+    } if s3_ids and s3_service.s3_available else {}
+
+    for inicio in range(0, len(attachments), max_in_flight):
+        itens = []
+        downloads = []
+
+        for anexo in attachments[inicio:inicio + max_in_flight]:
+            item = {
+                'anexo': anexo, 'nome': "Unknown", 'descricao': "", 'ext': '',
+                'content': None, 'cache_key': None, 'img_base64': None, 'cache_hit': False, 'erro': None,
+            }
+            try:
+                # Check if it's an S3-backed ArquivoObra
+                if isinstance(anexo, ArquivoObra) and anexo.s3_anexo_id and s3_service.s3_available:
+                    item['nome'] = anexo.nome_original
+                    item['descricao'] = anexo.descricao or ""
+                    item['ext'] = item['nome'].lower().split('.')[-1] if item['nome'] else ''
+
+                    anexo_s3 = s3_anexos.get(anexo.s3_anexo_id)
+                    if anexo_s3 is None:
+                        raise Exception("S3 download failed: Anexo not found")
+                    if anexo_s3['file_hash']:
+                        item['cache_key'] = _derivative_cache_key(anexo_s3['file_hash'], item['ext'])
+                        item['img_base64'] = cache.get(item['cache_key'])
+                        item['cache_hit'] = item['img_base64'] is not None
+
+                    if item['img_base64'] is None:
+                        downloads.append((item, _get_fetch_pool().submit(
+                            _fetch_s3_content, s3_service, anexo_s3['bucket_name'], anexo_s3['s3_key']
+                        )))
+
+                # Fallback to local file field for other attachment types
                 else:
-                    raise Exception(f"S3 download failed: {download_result.get('error')}")
+                    file_field = getattr(anexo, 'arquivo', getattr(anexo, 'anexo', getattr(anexo, 'imagem', None)))
+                    if not file_field:
+                        continue
+                    item['nome'] = getattr(anexo, 'nome_original', os.path.basename(file_field.name))
+                    item['descricao'] = getattr(anexo, 'descricao', '') or ""
+                    item['ext'] = item['nome'].lower().split('.')[-1] if item['nome'] else ''
+                    file_field.seek(0)
+                    item['content'] = file_field.read()
+                    file_field.seek(0)
 
-            # Fallback to local file field for other attachment types
-            else:
-                file_field = getattr(anexo, 'arquivo', getattr(anexo, 'anexo', getattr(anexo, 'imagem', None)))
-                if not file_field:
-                    continue
-                nome_arquivo = getattr(anexo, 'nome_original', os.path.basename(file_field.name))
-                descricao_anexo = getattr(anexo, 'descricao', '') or ""
-                file_field.seek(0)
-                file_content = file_field.read()
-                file_field.seek(0)
-
-            if not file_content:
-                raise Exception("File content is empty or could not be read.")
-
-            file_extension = nome_arquivo.lower().split('.')[-1] if nome_arquivo else ''
-            
-            pdf_bytes_for_conversion = None
-
-            if file_extension == 'pdf':
-                pdf_bytes_for_conversion = file_content
-            elif file_extension == 'docx' and OFFICE_PROCESSING_AVAILABLE:
-                html_content = docx_to_html(file_content)
-                pdf_bytes_for_conversion = HTML(string=html_content).write_pdf()
-            elif file_extension == 'xlsx' and OFFICE_PROCESSING_AVAILABLE:
-                html_content = xlsx_to_html(file_content)
-                pdf_bytes_for_conversion = HTML(string=html_content).write_pdf()
-            elif file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']:
-                img = Image.open(BytesIO(file_content))
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                buffer = BytesIO()
-                img.save(buffer, format='JPEG') # Convert to JPEG for consistency
-                img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            else:
-                raise Exception(f"File type '{file_extension}' is not supported for rendering in reports.")
-
-            if pdf_bytes_for_conversion:
-                pdf_doc = fitz.open(stream=pdf_bytes_for_conversion, filetype="pdf")
-                if len(pdf_doc) > 0:
-                    page = pdf_doc.load_page(0)
-                    pix = page.get_pixmap(dpi=150)
-                    img_bytes = pix.tobytes("png")
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-
-        except Exception as e:
-            print(f"Error processing attachment ID {getattr(anexo, 'id', 'N/A')} ({nome_arquivo}): {e}")
-            img_base64 = _create_placeholder_image(nome_arquivo, e)
-
-        if img_base64:
-            processed_attachments.append({
-                'nome': nome_arquivo,
-                'descricao': descricao_anexo,
-                'is_image': True,
-                'base64_data': img_base64
-            })
+                    if item['content']:
+                        item['cache_key'] = _derivative_cache_key(hashlib.sha256(item['content']).hexdigest(), item['ext'])
+                        item['img_base64'] = cache.get(item['cache_key'])
+                        item['cache_hit'] = item['img_base64'] is not None
+            except Exception as e:
+                item['erro'] = e
+            itens.append(item)
+
+        for item, future in downloads:
+            try:
+                item['content'] = future.result()
+            except Exception as e:
+                item['erro'] = Exception(f"S3 download failed: {e}")
+
+        for item in itens:
+            if item['img_base64'] is None and item['erro'] is None and not item['content']:
+                item['erro'] = Exception("File content is empty or could not be read.")
+
+        _render_items(itens)
+
+        for item in itens:
+            img_base64 = item['img_base64']
+            item['content'] = None
+            if item['erro'] is not None:
+                logger.warning(f"Error processing attachment ID {getattr(item['anexo'], 'id', 'N/A')} ({item['nome']}): {item['erro']}")
+                img_base64 = _create_placeholder_image(item['nome'], item['erro'])
+            elif img_base64 and item['cache_key'] and not item['cache_hit']:
+                cache.set(item['cache_key'], img_base64)
+
+            if img_base64:
+                processed_attachments.append({
+                    'nome': item['nome'],
+                    'descricao': item['descricao'],
+                    'is_image': True,
+                    'base64_data': img_base64
+                })
     
-    return processed_attachments
\ No newline at end of file
+    return processed_attachments
@@ -1,10 +1,11 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.views import APIView
-from django.http import Http404
+from django.http import Http404, FileResponse
 from django.core.files.uploadedfile import UploadedFile
+import os
 import logging
 
 from ..models import BackupLog, TaskHistory, AnexoS3, ArquivoObra
@@ -13,7 +14,10 @@ from ..serializers.service_serializers import AnexoS3Serializer
 from ..services.backup_service import BackupService
 from ..services.task_service import TaskService
 from ..services.s3_service import S3Service
+from ..services.relatorios_pdf import RelatorioPDFService
 from ..permissions import IsNivelAdmin, IsNivelGerente
+from ..services.miniaturas import tamanhos_miniatura, formato_miniatura
+from ..utils import conditional_range_request, streaming_file_response, STREAM_CHUNK_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +40,7 @@ class BackupViewSet(viewsets.ModelViewSet):
         Inject S3Service instance into serializer context.
         """
         context = super().get_serializer_context()
-        context['s3_service'] = self.s3_service
+        context['s3_service'] = self.backup_service.s3_service
         return context
 
     def get_queryset(self):
@@ -58,6 +62,21 @@ class BackupViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def destroy(self, request, *args, **kwargs):
+        """
+        Exclui um backup com os seus arquivos; blocos do repositório que nenhum
+        outro backup usa são removidos.
+        """
+        backup = self.get_object()
+        result = self.backup_service.delete_backups([backup.backup_id])
+        
+        if result['success']:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response({
+            'success': False,
+            'error': result['error']
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
     @action(detail=False, methods=['post'])
     def create_backup(self, request):
         """
@@ -68,20 +87,30 @@ class BackupViewSet(viewsets.ModelViewSet):
         user_id = request.user.id if request.user.is_authenticated else None
         
         try:
-            result = self.backup_service.create_backup(
+            # O backup roda no worker de backups; o cliente acompanha pelo task_id
+            result = self.backup_service.submit_backup(
                 backup_type=backup_type,
                 user_id=user_id,
                 description=description
             )
             
-            if result['success']:
+            if result['success'] and result.get('status') == 'pending':
+                return Response({
+                    'success': True,
+                    'message': 'Backup agendado',
+                    'backup_id': result['backup_id'],
+                    'task_id': result['task_id'],
+                    'status': 'pending'
+                }, status=status.HTTP_202_ACCEPTED)
+            elif result['success']:
                 return Response({
                     'success': True,
                     'message': 'Backup criado com sucesso',
                     'backup_id': result['backup_id'],
                     'duplicate': result.get('duplicate', False),
                     'file_size': result.get('file_size'),
-                    's3_uploaded': result.get('s3_uploaded', False)
+                    's3_uploaded': result.get('s3_uploaded', False),
+                    'task_id': result.get('task_id')
                 }, status=status.HTTP_201_CREATED)
             else:
                 return Response({
@@ -200,6 +229,53 @@ class BackupViewSet(viewsets.ModelViewSet):
                 'success': False,
                 'error': 'Erro interno do servidor'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """
+        Restaura o banco a partir de um backup (para incrementais, a cadeia inteira).
+        """
+        user_id = request.user.id if request.user.is_authenticated else None
+        try:
+            backup = self.get_object()
+            # A restauração roda no executor de tarefas; o cliente acompanha pelo task_id
+            result = self.backup_service.submit_restore(backup.backup_id, user_id=user_id)
+            
+            if result['success'] and result.get('status') == 'pending':
+                return Response({
+                    'success': True,
+                    'message': 'Restauração agendada',
+                    'backup_id': result['backup_id'],
+                    'task_id': result['task_id'],
+                    'status': 'pending'
+                }, status=status.HTTP_202_ACCEPTED)
+            elif result['success']:
+                return Response({
+                    'success': True,
+                    'message': 'Backup restaurado com sucesso',
+                    'backup_id': result['backup_id'],
+                    'chain': result['chain'],
+                    'changed_rows': result['changed_rows'],
+                    'deleted_rows': result['deleted_rows'],
+                    'task_id': result.get('task_id')
+                }, status=status.HTTP_200_OK)
+            else:
+                return Response({
+                    'success': False,
+                    'error': result['error']
+                }, status=status.HTTP_400_BAD_REQUEST)
+                
+        except Http404:
+            return Response({
+                'success': False,
+                'error': 'Backup não encontrado'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            logger.error(f"Error in restore view: {str(e)}")
+            return Response({
+                'success': False,
+                'error': 'Erro interno do servidor'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class TaskViewSet(viewsets.ModelViewSet):
@@ -390,17 +466,20 @@ class TaskViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """
-        Obtém estatísticas das tarefas.
+        Obtém estatísticas das tarefas; com bucket=day ou bucket=hour, inclui
+        a série por período para gráficos.
         """
         days = int(request.query_params.get('days', 30))
         task_type = request.query_params.get('task_type')
         user_id = request.query_params.get('user_id')
+        bucket = request.query_params.get('bucket')
         
         try:
             result = self.task_service.get_task_statistics(
                 days=days,
                 task_type=task_type,
-                user_id=int(user_id) if user_id else None
+                user_id=int(user_id) if user_id else None,
+                bucket=bucket
             )
             
             if result['success']:
@@ -448,7 +527,7 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
     """
     ViewSet para gerenciar anexos no S3.
     """
-    queryset = AnexoS3.objects.all().order_by('-uploaded_at')
+    queryset = AnexoS3.objects.select_related('uploaded_by').order_by('-uploaded_at')
     serializer_class = AnexoS3Serializer
     permission_classes = [IsNivelAdmin | IsNivelGerente]
     parser_classes = [MultiPartParser, FormParser]
@@ -627,6 +706,66 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
                 'error': 'Erro interno do servidor'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def presigned_upload(self, request):
+        """
+        Gera uma política de presigned POST para o navegador enviar o arquivo
+        direto ao S3. Após o envio, o cliente chama complete_upload com o upload_token.
+        """
+        filename = request.data.get('filename')
+        if not filename:
+            return Response({
+                'success': False,
+                'error': 'filename é obrigatório'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        object_id = request.data.get('object_id')
+        try:
+            object_id = int(object_id) if object_id else None
+        except (TypeError, ValueError):
+            return Response({
+                'success': False,
+                'error': 'object_id deve ser um número válido'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = self.s3_service.create_presigned_upload(
+            filename=filename,
+            content_type=request.data.get('content_type'),
+            anexo_type=request.data.get('anexo_type', 'general'),
+            object_id=object_id,
+            user_id=request.user.id,
+            metadata=request.data.get('metadata') or {},
+            file_hash=request.data.get('file_hash')
+        )
+        
+        if result['success']:
+            return Response(result, status=status.HTTP_201_CREATED)
+        return Response({
+            'success': False,
+            'error': result['error']
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def complete_upload(self, request):
+        """
+        Confirma um upload feito direto ao S3 e cria o registro do anexo.
+        """
+        upload_token = request.data.get('upload_token')
+        if not upload_token:
+            return Response({
+                'success': False,
+                'error': 'upload_token é obrigatório'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = self.s3_service.complete_presigned_upload(upload_token, user_id=request.user.id)
+        
+        if result['success']:
+            return Response(result, status=status.HTTP_201_CREATED)
+        return Response({
+            'success': False,
+            'error': result['error']
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
     @action(detail=True, methods=['get'])
     def download(self, request, anexo_id=None):
         """
@@ -635,17 +774,18 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
         try:
             anexo = self.get_object()
             
-            result = self.s3_service.download_file(anexo_id=str(anexo.anexo_id))
+            # If-None-Match / Range: revalidação e leitura parcial sem baixar o arquivo inteiro
+            early_response, byte_range = conditional_range_request(request, anexo.file_size, anexo.file_hash)
+            if early_response is not None:
+                return early_response
+            
+            result = self.s3_service.open_stream(str(anexo.anexo_id), byte_range)
             
             if result['success']:
-                from django.http import HttpResponse
-                
-                response = HttpResponse(
-                    result['content'],
-                    content_type=result['content_type']
+                return streaming_file_response(
+                    result['stream'], result['size'], result['content_type'], result['filename'],
+                    byte_range=result['byte_range'], etag=result['etag']
                 )
-                response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
-                return response
             else:
                 return Response({
                     'success': False,
@@ -668,6 +808,8 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
     def preview(self, request, anexo_id=None):
         """
         Endpoint público para preview de imagens (sem autenticação).
+        Com ?size=sm|md|lg devolve a miniatura no tamanho pedido, gerada na
+        primeira solicitação, em vez do original.
         """
         try:
             anexo = self.get_object()
@@ -679,18 +821,46 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
                     'error': 'Arquivo não é uma imagem'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            result = self.s3_service.download_file(anexo_id=str(anexo.anexo_id))
-            
-            if result['success']:
-                from django.http import HttpResponse
+            tamanho = request.query_params.get('size')
+            if tamanho:
+                if tamanho not in tamanhos_miniatura():
+                    return Response({
+                        'success': False,
+                        'error': f"Tamanho inválido. Opções: {', '.join(tamanhos_miniatura())}"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                
+                early_response, _ = conditional_range_request(request, None, f"{anexo.file_hash}-{tamanho}")
+                if early_response is not None:
+                    return early_response
+                
+                result = self.s3_service.get_thumbnail(str(anexo.anexo_id), tamanho)
+                if not result['success']:
+                    return Response({
+                        'success': False,
+                        'error': result['error']
+                    }, status=status.HTTP_400_BAD_REQUEST)
                 
-                response = HttpResponse(
-                    result['content'],
-                    content_type=result['content_type']
+                base, _ = os.path.splitext(anexo.nome_original)
+                _, _, extensao = formato_miniatura()
+                response = streaming_file_response(
+                    [result['content']], len(result['content']), result['content_type'], f"{base}_{tamanho}{extensao}",
+                    etag=result['etag'], disposition='inline'
                 )
-                # Para preview, não forçar download
-                response['Content-Disposition'] = f'inline; filename="{result["filename"]}"'
+                response['Cache-Control'] = 'public, max-age=86400'
                 return response
+            
+            early_response, byte_range = conditional_range_request(request, anexo.file_size, anexo.file_hash)
+            if early_response is not None:
+                return early_response
+            
+            result = self.s3_service.open_stream(str(anexo.anexo_id), byte_range)
+            
+            if result['success']:
+                # Para preview, não forçar download
+                return streaming_file_response(
+                    result['stream'], result['size'], result['content_type'], result['filename'],
+                    byte_range=result['byte_range'], etag=result['etag'], disposition='inline'
+                )
             else:
                 return Response({
                     'success': False,
@@ -776,7 +946,8 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def migrate_to_s3(self, request):
         """
-        Migra anexos locais para o S3.
+        Migra anexos locais para o S3. A migração entra na fila do executor de
+        tarefas; o cliente acompanha (e pode cancelar) pelo task_id.
         """
         anexo_type = request.data.get('anexo_type')
         object_id = request.data.get('object_id')
@@ -787,14 +958,23 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
             if object_id:
                 object_id = int(object_id)
             
-            result = self.s3_service.migrate_local_files_to_s3(
-                anexo_type=anexo_type,
-                object_id=object_id,
-                user_id=user_id
+            result = TaskService().create_task(
+                task_type='migration',
+                title="Migração de arquivos locais para o S3",
+                user_id=user_id,
+                handler='migracao_s3',
+                params={
+                    'tipos': [anexo_type] if anexo_type else None,
+                    'object_id': object_id
+                }
             )
             
             if result['success']:
-                return Response(result, status=status.HTTP_200_OK)
+                return Response({
+                    'success': True,
+                    'task_id': result['task_id'],
+                    'status': 'pending'
+                }, status=status.HTTP_202_ACCEPTED)
             else:
                 return Response({
                     'success': False,
@@ -909,4 +1089,68 @@ class AnexoS3ViewSet(viewsets.ModelViewSet):
             return Response({
                 'success': False,
                 'error': 'Erro interno do servidor'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class RelatorioPDFJobViewSet(viewsets.ViewSet):
+    """
+    Jobs de relatório PDF gerados em segundo plano.
+
+    POST {"tipo": ..., "parametros": {...}} cria o job (202); GET <task_id>/
+    informa status e progresso; GET <task_id>/download/ devolve o PDF quando pronto.
+    """
+    permission_classes = [IsNivelAdmin | IsNivelGerente]
+    lookup_field = 'task_id'
+    lookup_value_regex = '[^/]+'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.relatorio_service = RelatorioPDFService()
+
+    def create(self, request):
+        tipo = request.data.get('tipo')
+        parametros = request.data.get('parametros') or {}
+        if not tipo:
+            return Response({
+                'success': False,
+                'error': 'Campo obrigatório: tipo'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(parametros, dict):
+            return Response({
+                'success': False,
+                'error': 'parametros deve ser um objeto'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        result = self.relatorio_service.submit(tipo, parametros, request.user.id)
+        if not result['success']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.relatorio_service.get_job(result['task_id']), status=status.HTTP_202_ACCEPTED)
+
+    def retrieve(self, request, task_id=None):
+        result = self.relatorio_service.get_job(task_id)
+        if not result['success']:
+            return Response(result, status=status.HTTP_404_NOT_FOUND)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, task_id=None):
+        result = self.relatorio_service.get_artifact(task_id)
+        if not result['success']:
+            if result['error'] == 'Task not found':
+                return Response(result, status=status.HTTP_404_NOT_FOUND)
+            # Ainda em execução: o cliente deve continuar consultando o status
+            return Response(result, status=status.HTTP_409_CONFLICT if result.get('pending') else status.HTTP_410_GONE)
+
+        if result['storage'] == 's3':
+            s3_service = self.relatorio_service.s3_service
+            objeto = s3_service.s3_client.get_object(Bucket=s3_service.bucket_name, Key=result['key'])
+            return streaming_file_response(
+                objeto['Body'].iter_chunks(STREAM_CHUNK_SIZE), result['size'],
+                'application/pdf', result['filename']
+            )
+        return FileResponse(
+            open(result['path'], 'rb'),
+            as_attachment=True,
+            filename=result['filename'],
+            content_type='application/pdf'
+        )
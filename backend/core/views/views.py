@@ -1,17 +1,20 @@
 from rest_framework import viewsets, status, filters, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.db.models import Q, Sum, F, Case, When, Value, IntegerField
 import json
+import hashlib
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from django.db import transaction
 from rest_framework.decorators import action
 from django.utils import timezone
+from django.utils.text import slugify
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
@@ -20,11 +23,13 @@ from django.views import View
 # For this merge, keeping existing imports from backup unless clearly redundant and conflicting.
 
 # PDF Generation Specific Imports
-from django.http import HttpResponse, Http404 # Http404 added, HttpResponse was present
-from django.template.loader import render_to_string # Was present
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse, Http404 # Http404 added, HttpResponse was present
+from django.urls import reverse
 from django.conf import settings
 import os
-from ..utils import generate_pdf_response, process_attachments_for_pdf
+from ..utils import generate_pdf_response, process_attachments_for_pdf, conditional_range_request, streaming_file_response, iter_file_chunks
+from ..services.exportacao_anexos import listar_anexos_obra, gerar_zip_anexos
+from ..services.miniaturas import MINIATURA_TAMANHO_PADRAO, tamanhos_miniatura, gerar_miniaturas_arquivo, url_miniatura_arquivo
 # from weasyprint import HTML  # Removido para otimizar memória
 # from weasyprint.fonts import FontConfiguration # Optional - Removido para otimizar memória
 
@@ -32,7 +37,7 @@ from ..models import (
     Usuario, Obra, Funcionario, Equipe, Locacao_Obras_Equipes, Material,
     Compra, Despesa_Extra, Ocorrencia_Funcionario, ItemCompra, FotoObra,
     Backup, BackupSettings, AnexoLocacao, AnexoDespesa, ParcelaCompra,
-    AnexoCompra, ArquivoObra
+    AnexoCompra, ArquivoObra, ObraCustoResumo, CustoDiarioObra
 )
 from ..serializers import (
     UsuarioSerializer, ObraSerializer, FuncionarioSerializer, EquipeSerializer,
@@ -46,10 +51,50 @@ from ..serializers import (
 )
 from ..permissions import IsNivelAdmin, IsNivelGerente
 from ..services.s3_service import S3Service
+from ..services.locacoes import criar_locacoes_diarias
+from ..services.ocupacao import verificar_conflitos as verificar_conflitos_ocupacao
+from ..services.relatorio_pagamento import get_locacoes_pagamento, montar_pagamento_locacoes, montar_pagamento_compras
+from ..services.custos_diarios import serie_temporal, contar_periodos, GRANULARIDADES as GRANULARIDADES_SERIE
+from ..services.relatorios_pdf import RelatorioPDFService
+from ..services.montagem_relatorios import (
+    montar_relatorio_obra, montar_relatorio_pagamento, montar_relatorio_pagamento_locacoes, montar_relatorio_compras_lote
+)
+from ..services.backup_engines import SQLiteBackupEngine
+from ..services.backup_service import BackupService
+from ..services.rastreio_alteracoes import registrar_alteracoes
 
 # Import health check functions
 from ..health import health_check, database_status
 
+def solicitou_relatorio_sincrono(request):
+    """
+    Relatórios PDF são gerados em segundo plano, no executor de tarefas; só com
+    "async=false" (query string ou corpo) o PDF é gerado na própria requisição.
+    """
+    valor = request.query_params.get('async')
+    if valor is None and request.method == 'POST':
+        valor = request.data.get('async')
+    return str(valor).lower() in ('false', '0')
+
+
+def enfileirar_relatorio_pdf(request, tipo, parametros):
+    """Envia o relatório para a fila e responde 202 com as URLs de acompanhamento."""
+    result = RelatorioPDFService().submit(tipo, parametros, request.user.id)
+    if not result['success']:
+        return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+    task_id = result['task_id']
+    return Response({
+        'task_id': task_id,
+        'status': 'pending',
+        'status_url': reverse('relatorio-pdf-job-detail', args=[task_id]),
+        'download_url': reverse('relatorio-pdf-job-download', args=[task_id]),
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def responder_relatorio_pdf(relatorio):
+    return generate_pdf_response(relatorio['template'], relatorio['context'], relatorio['css_path'], relatorio['filename'])
+
+
 class CreateUsuarioView(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -95,6 +140,13 @@ class ObraViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = Obra.objects.select_related('responsavel').all().order_by('id')
+
+        # Na listagem os custos vêm anotados por subconsultas (uma única consulta SQL);
+        # nas demais ações o serializer lê o resumo (ObraCustoResumo).
+        if self.action == 'list':
+            queryset = ObraCustoResumo.anotar_queryset(queryset)
+        else:
+            queryset = queryset.select_related('custo_resumo')
         
         # Filtering based on query parameters
         search_query = self.request.query_params.get('search', None)
@@ -114,10 +166,28 @@ class ObraViewSet(viewsets.ModelViewSet):
         if not query:
             return Response({'error': 'Query parameter "q" is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        obras = Obra.objects.filter(nome_obra__icontains=query)
+        obras = ObraCustoResumo.anotar_queryset(
+            Obra.objects.select_related('responsavel').filter(nome_obra__icontains=query)
+        )
         serializer = self.get_serializer(obras, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], url_path='anexos-zip')
+    def anexos_zip(self, request, pk=None):
+        """
+        Baixa um ZIP com todos os anexos da obra (arquivos, fotos e anexos de
+        compras, locações e despesas), montado em streaming.
+        """
+        obra = self.get_object()
+        entradas = listar_anexos_obra(obra.pk, S3Service())
+        if not entradas:
+            return Response({'error': 'Esta obra não possui anexos'}, status=status.HTTP_404_NOT_FOUND)
+
+        nome = slugify(obra.nome_obra) or f'obra-{obra.pk}'
+        response = StreamingHttpResponse(gerar_zip_anexos(entradas), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="anexos_{nome}.zip"'
+        return response
+
     @action(detail=True, methods=['get'], url_path='materiais-detalhes')
     def materiais_detalhes(self, request, pk=None):
         obra = self.get_object()
@@ -322,41 +392,9 @@ class LocacaoObrasEquipesViewSet(viewsets.ModelViewSet):
 
         anexos_data = request.FILES.getlist('anexos')
         print("Anexos data:", anexos_data)
-        validated_data = serializer.validated_data
-        
-        # Remove 'anexos' from validated_data if it's there, as it's not a model field
-        validated_data.pop('anexos', None)
 
-        data_inicio = validated_data['data_locacao_inicio']
-        data_fim = validated_data.get('data_locacao_fim', data_inicio)
-
-        created_locacoes = []
-        with transaction.atomic():
-            # Create the first locacao
-            first_locacao_data = validated_data.copy()
-            if data_inicio != data_fim:
-                first_locacao_data['data_locacao_fim'] = data_inicio
-
-            locacao = Locacao_Obras_Equipes.objects.create(**first_locacao_data)
-            print("Created locacao:", locacao)
-            created_locacoes.append(locacao)
-
-            # Save attachments for the first locacao
-            for anexo_file in anexos_data:
-                anexo = AnexoLocacao.objects.create(locacao=locacao, anexo=anexo_file, descricao=anexo_file.name)
-                print("Created anexo:", anexo)
-
-            # Create remaining locacoes for multi-day rentals
-            if data_inicio != data_fim:
-                current_date = data_inicio + timedelta(days=1)
-                while current_date <= data_fim:
-                    daily_data = validated_data.copy()
-                    daily_data['data_locacao_inicio'] = current_date
-                    daily_data['data_locacao_fim'] = current_date
-                    locacao = Locacao_Obras_Equipes.objects.create(**daily_data)
-                    print("Created multi-day locacao:", locacao)
-                    created_locacoes.append(locacao)
-                    current_date += timedelta(days=1)
+        # Locações de vários dias são divididas em uma locação por dia (inserção em lote)
+        created_locacoes = criar_locacoes_diarias(serializer.validated_data, anexos=anexos_data)
         
         response_serializer = self.get_serializer(created_locacoes, many=True)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -482,6 +520,43 @@ class LocacaoObrasEquipesViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({"error": f"Erro interno no servidor: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='verificar-conflitos')
+    def verificar_conflitos(self, request):
+        """
+        Valida várias alocações propostas em uma única chamada (ex.: grade semanal).
+        Corpo: {"locacoes": [{"funcionario_locado"|"equipe", "data_locacao_inicio",
+        "data_locacao_fim"?, "locacao_id"?}, ...]}
+        """
+        propostas_data = request.data.get('locacoes') if isinstance(request.data, dict) else request.data
+        if not isinstance(propostas_data, list) or not propostas_data:
+            return Response({"error": "Envie uma lista não vazia em 'locacoes'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        propostas = []
+        for indice, item in enumerate(propostas_data):
+            if not isinstance(item, dict):
+                return Response({"error": f"Item {indice} inválido."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                data_inicio = date.fromisoformat(str(item.get('data_locacao_inicio')))
+                data_fim = date.fromisoformat(str(item['data_locacao_fim'])) if item.get('data_locacao_fim') else None
+                propostas.append({
+                    'funcionario_locado': int(item['funcionario_locado']) if item.get('funcionario_locado') else None,
+                    'equipe': int(item['equipe']) if item.get('equipe') else None,
+                    'data_locacao_inicio': data_inicio,
+                    'data_locacao_fim': data_fim,
+                    'locacao_id': int(item['locacao_id']) if item.get('locacao_id') else None,
+                })
+            except (TypeError, ValueError):
+                return Response(
+                    {"error": f"Item {indice}: datas devem estar no formato YYYY-MM-DD e IDs devem ser inteiros."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        resultados = verificar_conflitos_ocupacao(propostas)
+        return Response({
+            'resultados': resultados,
+            'possui_conflitos': any(r['conflitos'] or r['conflitos_no_lote'] for r in resultados),
+        })
+
     @action(detail=False, methods=['get'], url_path='custo_diario_chart')
     def custo_diario_chart(self, request):
         from calendar import monthrange
@@ -511,48 +586,29 @@ class LocacaoObrasEquipesViewSet(viewsets.ModelViewSet):
             end_date = timezone.now().date()
             start_date = end_date - timedelta(days=29)
 
-        locacoes_qs = Locacao_Obras_Equipes.objects.filter(
-            data_locacao_inicio__gte=start_date,
-            data_locacao_inicio__lte=end_date,
-            status_locacao='ativa'
-        )
-
+        obra_id = None
         if obra_id_str:
             try:
                 obra_id = int(obra_id_str)
-                locacoes_qs = locacoes_qs.filter(obra_id=obra_id)
             except ValueError:
                 return Response({"error": "ID de obra inválido."}, status=status.HTTP_400_BAD_REQUEST)
 
-        print(f"DEBUG: Custo Diário Chart - Filtro_tipo: {filtro_tipo}")
-        print(f"DEBUG: Custo Diário Chart - Queryset antes do filtro: {locacoes_qs.count()}")
-
         if filtro_tipo == 'equipe_funcionario':
-            locacoes_qs = locacoes_qs.filter(Q(equipe__isnull=False) | Q(funcionario_locado__isnull=False))
+            series = ['mao_de_obra']
         elif filtro_tipo == 'servico_externo':
-            locacoes_qs = locacoes_qs.filter(servico_externo__isnull=False).exclude(servico_externo__exact='')
-
-        print(f"DEBUG: Custo Diário Chart - Queryset depois do filtro: {locacoes_qs.count()}")
-        for loc in locacoes_qs:
-            print(f"  - Loc ID: {loc.id}, Servico: {loc.servico_externo}, Valor: {loc.valor_pagamento}")
-
-        daily_costs_db = locacoes_qs.values('data_locacao_inicio').annotate(
-            total_cost_for_day=Sum('valor_pagamento')
-        ).order_by('data_locacao_inicio')
-        costs_by_date_map = {
-            item['data_locacao_inicio']: item['total_cost_for_day']
-            for item in daily_costs_db
-        }
-        result_data = []
-        current_date = start_date
-        while current_date <= end_date:
-            cost = costs_by_date_map.get(current_date, Decimal('0.00'))
-            result_data.append({
-                "date": current_date.isoformat(),
-                "total_cost": cost,
-                "has_locacoes": cost > 0
-            })
-            current_date += timedelta(days=1)
+            series = ['servicos']
+        else:
+            series = ['mao_de_obra', 'servicos']
+
+        serie = serie_temporal(start_date, end_date, 'dia', obra_id=obra_id, series=series)
+        result_data = [
+            {
+                "date": ponto['periodo'],
+                "total_cost": ponto['total'],
+                "has_locacoes": ponto['total'] > 0
+            }
+            for ponto in serie['pontos']
+        ]
         return Response(result_data)
 
     @action(detail=True, methods=['post'])
@@ -771,43 +827,35 @@ class CompraViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='custo_diario_chart')
     def custo_diario_chart(self, request):
-        today = timezone.now().date()
-        start_date = today - timedelta(days=29)
+        # Período opcional (start_date/end_date); padrão: últimos 30 dias
+        start_date_str = request.query_params.get('start_date')
+        end_date_str = request.query_params.get('end_date')
         obra_id_str = request.query_params.get('obra_id')
 
-        compras_qs = Compra.objects.filter(
-            data_compra__gte=start_date,
-            data_compra__lte=today,
-            tipo='COMPRA'
-        )
+        try:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else timezone.now().date()
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else end_date - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'Formato inválido para datas (esperado YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date > end_date:
+            return Response({'error': 'A start_date não pode ser posterior à end_date.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        obra_id = None
         if obra_id_str:
             try:
                 obra_id = int(obra_id_str)
-                compras_qs = compras_qs.filter(obra_id=obra_id)
             except ValueError:
                 return Response({"error": "ID de obra inválido."}, status=status.HTTP_400_BAD_REQUEST)
 
-        daily_costs_db = compras_qs.values('data_compra').annotate(
-            total_cost_for_day=Sum('valor_total_liquido')
-        ).order_by('data_compra')
-
-        costs_by_date_map = {
-            item['data_compra']: item['total_cost_for_day']
-            for item in daily_costs_db
-        }
-
-        result_data = []
-        current_date = start_date
-        while current_date <= today:
-            cost = costs_by_date_map.get(current_date, Decimal('0.00'))
-            result_data.append({
-                "date": current_date.isoformat(),
-                "total_cost": cost,
-                "has_compras": cost > 0
-            })
-            current_date += timedelta(days=1)
-
+        serie = serie_temporal(start_date, end_date, 'dia', obra_id=obra_id, series=['materiais'])
+        result_data = [
+            {
+                "date": ponto['periodo'],
+                "total_cost": ponto['materiais'],
+                "has_compras": ponto['materiais'] > 0
+            }
+            for ponto in serie['pontos']
+        ]
         return Response(result_data)
 
     def update(self, request, *args, **kwargs):
@@ -891,7 +939,8 @@ class CompraViewSet(viewsets.ModelViewSet):
                         valor_total_item=valor_total_item,
                         categoria_uso=item.categoria_uso
                     ))
-                ItemCompra.objects.bulk_create(items_to_create)
+                criados = ItemCompra.objects.bulk_create(items_to_create)
+                registrar_alteracoes(ItemCompra, [item.pk for item in criados])
 
                 # After creating items, manually calculate totals and save again.
                 from django.db.models import Sum
@@ -922,56 +971,9 @@ class CompraViewSet(viewsets.ModelViewSet):
     def bulk_pdf(self, request):
         """
         Gera PDF em lote para múltiplas compras selecionadas.
+        O PDF é gerado em segundo plano (ver relatorios-pdf/); com "async": false, na requisição.
         """
-        compra_ids = request.data.get('compra_ids', [])
-        
-        if not compra_ids:
-            return Response(
-                {'error': 'Lista de IDs de compras é obrigatória'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            compras = Compra.objects.filter(id__in=compra_ids).prefetch_related(
-                'itens__material', 'parcelas', 'anexos'
-            )
-            
-            if not compras.exists():
-                return Response(
-                    {'error': 'Nenhuma compra encontrada com os IDs fornecidos'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            # Preparar dados das compras com anexos processados
-            compras_data = []
-            for compra in compras:
-                anexos_processados = process_anexos_for_pdf(compra.anexos.all())
-                compras_data.append({
-                    'compra': compra,
-                    'anexos_processados': anexos_processados
-                })
-            
-            # Renderizar o template HTML
-            html_content = render_to_string('relatorios/relatorio_compras_lote.html', {
-                'compras': compras,
-                'compras_data': compras_data,
-                'data_geracao': timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-            })
-            
-            # Gerar PDF usando WeasyPrint
-            pdf_file = HTML(string=html_content, base_url=request.build_absolute_uri()).write_pdf()
-            
-            # Criar resposta HTTP com o PDF
-            response = HttpResponse(pdf_file, content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="relatorio_compras_lote_{timezone.now().strftime("%Y%m%d_%H%M%S")}.pdf"'
-            
-            return response
-            
-        except Exception as e:
-            return Response(
-                {'error': f'Erro ao gerar PDF: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        return gerar_pdf_compras_lote(request)
 
 
 class HealthCheckView(APIView):
@@ -1025,19 +1027,6 @@ class HealthCheckView(APIView):
 class RelatorioPagamentoViewSet(viewsets.ViewSet):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
 
-    def _get_locacoes(self, start_date, end_date, filtro_locacao):
-        date_filter = Q(data_pagamento__range=[start_date, end_date]) | \
-                      (Q(data_pagamento__isnull=True) & Q(data_locacao_inicio__range=[start_date, end_date]))
-
-        locacoes_qs = Locacao_Obras_Equipes.objects.filter(date_filter, status_locacao='ativa').select_related('obra', 'funcionario_locado', 'equipe')
-
-        if filtro_locacao == 'servicos':
-            locacoes_qs = locacoes_qs.filter(servico_externo__isnull=False).exclude(servico_externo__exact='')
-        elif filtro_locacao == 'funcionarios_e_equipes':
-            locacoes_qs = locacoes_qs.filter(Q(funcionario_locado__isnull=False) | Q(equipe__isnull=False))
-
-        return locacoes_qs
-
     @action(detail=False, methods=['get'], url_path='pre-check')
     def pre_check(self, request):
         start_date_str = request.query_params.get('start_date')
@@ -1064,7 +1053,7 @@ class RelatorioPagamentoViewSet(viewsets.ViewSet):
             compras = Compra.objects.filter(data_pagamento__range=[start_date, end_date], tipo='COMPRA')
             dates_with_entries = set(compras.values_list('data_pagamento', flat=True))
         elif tipo == 'locacoes':
-            locacoes = self._get_locacoes(start_date, end_date, filtro_locacao)
+            locacoes = get_locacoes_pagamento(start_date, end_date, filtro_locacao)
             for loc in locacoes:
                 the_date = loc.data_pagamento if loc.data_pagamento else loc.data_locacao_inicio
                 if start_date <= the_date <= end_date:
@@ -1076,123 +1065,6 @@ class RelatorioPagamentoViewSet(viewsets.ViewSet):
 
         return Response({'dias_sem_registros': dias_sem_registros})
 
-    def _get_locacoes_report_data(self, locacoes, start_date, end_date):
-        pagamentos_por_recurso = defaultdict(lambda: {
-            "recurso_nome": "",
-            "total_a_pagar_periodo": Decimal('0.00'),
-            "detalhes_por_obra": defaultdict(lambda: {
-                "obra_id": None, "obra_nome": "",
-                "total_a_pagar_obra": Decimal('0.00'),
-                "locacoes_na_obra": []
-            })
-        })
-        grand_total_geral = Decimal('0.00')
-
-        for locacao in locacoes:
-            recurso_nome = get_recurso_nome_folha(locacao)
-            obra_nome = locacao.obra.nome_obra if locacao.obra else "Obra Desconhecida"
-            obra_id = locacao.obra.id if locacao.obra else 0
-            valor_pagamento = locacao.valor_pagamento or Decimal('0.00')
-
-            recurso_data = pagamentos_por_recurso[recurso_nome]
-            recurso_data["recurso_nome"] = recurso_nome
-            recurso_data["total_a_pagar_periodo"] += valor_pagamento
-
-            obra_details = recurso_data["detalhes_por_obra"][obra_id]
-            obra_details["obra_id"] = obra_id
-            obra_details["obra_nome"] = obra_nome
-            obra_details["total_a_pagar_obra"] += valor_pagamento
-
-            obra_details["locacoes_na_obra"].append({
-                "locacao_id": locacao.id,
-                "data_servico": locacao.data_pagamento if locacao.data_pagamento else locacao.data_locacao_inicio,
-                "tipo_pagamento": locacao.get_tipo_pagamento_display(),
-                "valor_atribuido": str(valor_pagamento),
-                "observacoes": locacao.observacoes or ""
-            })
-            grand_total_geral += valor_pagamento
-
-        final_recursos_list = []
-        for rec_nome, rec_data in sorted(pagamentos_por_recurso.items()):
-            rec_data["total_a_pagar_periodo"] = str(rec_data["total_a_pagar_periodo"])
-            obras_list = []
-            for ob_id, ob_data in sorted(rec_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
-                ob_data["total_a_pagar_obra"] = str(ob_data["total_a_pagar_obra"])
-                ob_data["locacoes_na_obra"].sort(key=lambda x: x["data_servico"])
-                obras_list.append(ob_data)
-            rec_data["detalhes_por_obra"] = obras_list
-            final_recursos_list.append(rec_data)
-
-        final_recursos_list.sort(key=lambda x: x["recurso_nome"])
-
-        return {
-            "periodo": {"inicio": start_date, "fim": end_date},
-            "recursos_pagamentos": final_recursos_list,
-            "total_geral_periodo": str(grand_total_geral)
-        }
-
-    def _get_compras_report_data(self, compras_qs, start_date, end_date):
-        pagamentos_por_fornecedor = defaultdict(lambda: {
-            "fornecedor_nome": "",
-            "total_a_pagar_periodo": Decimal('0.00'),
-            "detalhes_por_obra": defaultdict(lambda: {
-                "obra_id": None, "obra_nome": "",
-                "total_a_pagar_obra": Decimal('0.00'),
-                "compras_na_obra": []
-            })
-        })
-        grand_total_geral = Decimal('0.00')
-
-        compras_qs = compras_qs.select_related('obra').prefetch_related('itens__material')
-
-        for compra in compras_qs:
-            fornecedor_nome = compra.fornecedor or "Fornecedor não especificado"
-            obra_nome = compra.obra.nome_obra if compra.obra else "Obra Desconhecida"
-            obra_id = compra.obra.id if compra.obra else 0
-            valor_pagamento = compra.valor_total_liquido or Decimal('0.00')
-
-            fornecedor_data = pagamentos_por_fornecedor[fornecedor_nome]
-            fornecedor_data["fornecedor_nome"] = fornecedor_nome
-            fornecedor_data["total_a_pagar_periodo"] += valor_pagamento
-
-            obra_details = fornecedor_data["detalhes_por_obra"][obra_id]
-            obra_details["obra_id"] = obra_id
-            obra_details["obra_nome"] = obra_nome
-            obra_details["total_a_pagar_obra"] += valor_pagamento
-
-            items_serializer = ItemCompraSerializer(compra.itens.all(), many=True)
-
-            obra_details["compras_na_obra"].append({
-                "compra_id": compra.id,
-                "data_pagamento": compra.data_pagamento,
-                "nota_fiscal": compra.nota_fiscal,
-                "valor_total_liquido": str(valor_pagamento),
-                "observacoes": compra.observacoes or "",
-                "itens": items_serializer.data,
-                "forma_pagamento": compra.get_forma_pagamento_display(),
-                "numero_parcelas": compra.numero_parcelas,
-            })
-            grand_total_geral += valor_pagamento
-
-        final_fornecedores_list = []
-        for f_nome, f_data in sorted(pagamentos_por_fornecedor.items()):
-            f_data["total_a_pagar_periodo"] = str(f_data["total_a_pagar_periodo"])
-            obras_list = []
-            for o_id, o_data in sorted(f_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
-                o_data["total_a_pagar_obra"] = str(o_data["total_a_pagar_obra"])
-                o_data["compras_na_obra"].sort(key=lambda x: x["data_pagamento"] or date.min)
-                obras_list.append(o_data)
-            f_data["detalhes_por_obra"] = obras_list
-            final_fornecedores_list.append(f_data)
-
-        final_fornecedores_list.sort(key=lambda x: x["fornecedor_nome"])
-
-        return {
-            "periodo": {"inicio": start_date, "fim": end_date},
-            "fornecedores_pagamentos": final_fornecedores_list,
-            "total_geral_periodo": str(grand_total_geral)
-        }
-
     @action(detail=False, methods=['get'], url_path='generate')
     def generate_report(self, request):
         start_date_str = request.query_params.get('start_date')
@@ -1217,7 +1089,7 @@ class RelatorioPagamentoViewSet(viewsets.ViewSet):
                 data_pagamento__range=[start_date, end_date],
                 tipo='COMPRA'
             ).order_by('data_pagamento')
-            report_data = self._get_compras_report_data(compras_qs, start_date, end_date)
+            report_data = montar_pagamento_compras(compras_qs, start_date, end_date)
             # Convert date objects to strings for JSON serialization
             report_data['periodo']['inicio'] = report_data['periodo']['inicio'].isoformat()
             report_data['periodo']['fim'] = report_data['periodo']['fim'].isoformat()
@@ -1229,8 +1101,8 @@ class RelatorioPagamentoViewSet(viewsets.ViewSet):
             return Response(report_data)
 
         elif tipo == 'locacoes':
-            locacoes = self._get_locacoes(start_date, end_date, filtro_locacao)
-            report_data = self._get_locacoes_report_data(locacoes, start_date, end_date)
+            locacoes = get_locacoes_pagamento(start_date, end_date, filtro_locacao)
+            report_data = montar_pagamento_locacoes(locacoes, start_date, end_date)
             # Convert date objects to strings for JSON serialization
             report_data['periodo']['inicio'] = report_data['periodo']['inicio'].isoformat()
             report_data['periodo']['fim'] = report_data['periodo']['fim'].isoformat()
@@ -1263,37 +1135,17 @@ class RelatorioPagamentoViewSet(viewsets.ViewSet):
         if start_date > end_date:
             return Response({"error": "start_date não pode ser posterior a end_date."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if tipo == 'compras':
-            compras_qs = Compra.objects.filter(
-                data_pagamento__range=[start_date, end_date],
-                tipo='COMPRA'
-            ).order_by('data_pagamento')
-            context = self._get_compras_report_data(compras_qs, start_date, end_date)
-            context['data_emissao'] = timezone.now()
-            template_path = 'relatorios/relatorio_pagamento_compras.html'
-            css_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_compras.css')
-            filename = f'relatorio_pagamento_compras_{start_date_str}_a_{end_date_str}.pdf'
-            return generate_pdf_response(template_path, context, css_path, filename)
-
-        elif tipo == 'locacoes':
-            locacoes = self._get_locacoes(start_date, end_date, filtro_locacao)
-            context = self._get_locacoes_report_data(locacoes, start_date, end_date)
-            context['data_emissao'] = timezone.now()
-            context['obra_filter_nome'] = None
-            if obra_id_str:
-                try:
-                    context['obra_filter_nome'] = Obra.objects.get(pk=int(obra_id_str)).nome_obra
-                except (Obra.DoesNotExist, ValueError):
-                    pass
-
-            template_path = 'relatorios/relatorio_pagamento_locacoes.html'
-            css_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_pagamento_locacoes.css')
-            filename = f'relatorio_pagamento_locacoes_{start_date_str}_a_{end_date_str}.pdf'
-            return generate_pdf_response(template_path, context, css_path, filename)
-
-        else:
+        if tipo not in ('compras', 'locacoes'):
             return Response({"error": "Tipo de relatório inválido. Use 'compras' ou 'locacoes'."}, status=status.HTTP_400_BAD_REQUEST)
 
+        parametros = {
+            'start_date': start_date_str, 'end_date': end_date_str, 'tipo': tipo,
+            'filtro_locacao': filtro_locacao, 'obra_id': obra_id_str,
+        }
+        if solicitou_relatorio_sincrono(request):
+            return responder_relatorio_pdf(montar_relatorio_pagamento(parametros, request.user))
+        return enfileirar_relatorio_pdf(request, 'pagamento', parametros)
+
 
 class DespesaExtraViewSet(viewsets.ModelViewSet):
     queryset = Despesa_Extra.objects.all()
@@ -1452,7 +1304,7 @@ class RelatorioGeralComprasView(APIView):
             "compras": serializer.data
         })
 
-from django.db.models import Sum, Count, F, DecimalField # django.utils.timezone already imported
+from django.db.models import Sum, Count, F, DecimalField, DateField # django.utils.timezone already imported
 
 class DashboardStatsView(APIView):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
@@ -1546,28 +1398,84 @@ class ObraHistoricoCustosView(APIView):
             obra = Obra.objects.get(pk=pk)
         except Obra.DoesNotExist:
             return Response({"error": "Obra não encontrada."}, status=status.HTTP_404_NOT_FOUND)
-        custos_compras = Compra.objects.filter(obra=obra, tipo='COMPRA').annotate(mes=TruncMonth('data_compra')).values('mes').annotate(total_compras=Sum('valor_total_liquido')).order_by('mes')
-        custos_despesas = Despesa_Extra.objects.filter(obra=obra).annotate(mes=TruncMonth('data')).values('mes').annotate(total_despesas=Sum('valor')).order_by('mes')
-        historico = {}
-        for compra in custos_compras:
-            if compra['mes'] is None: continue
-            mes_str = compra['mes'].strftime('%Y-%m')
-            if mes_str not in historico: historico[mes_str] = {'compras': Decimal('0.00'), 'despesas_extras': Decimal('0.00')}
-            historico[mes_str]['compras'] += compra['total_compras'] or Decimal('0.00')
-        for despesa in custos_despesas:
-            if despesa['mes'] is None: continue
-            mes_str = despesa['mes'].strftime('%Y-%m')
-            if mes_str not in historico: historico[mes_str] = {'compras': Decimal('0.00'), 'despesas_extras': Decimal('0.00')}
-            historico[mes_str]['despesas_extras'] += despesa['total_despesas'] or Decimal('0.00')
+        # Lido do consolidado diário (CustoDiarioObra), agrupado por mês em uma consulta
+        custos_mensais = CustoDiarioObra.objects.filter(obra=obra).annotate(
+            mes=TruncMonth('data', output_field=DateField())
+        ).values('mes').annotate(
+            total_compras=Sum('materiais'),
+            total_locacoes=Sum(F('mao_de_obra') + F('servicos')),
+            total_despesas=Sum('despesas_extras'),
+        ).order_by('mes')
         resultado_final = []
-        for mes, totais in sorted(historico.items()):
+        for item in custos_mensais:
+            compras = item['total_compras'] or Decimal('0.00')
+            locacoes = item['total_locacoes'] or Decimal('0.00')
+            despesas = item['total_despesas'] or Decimal('0.00')
             resultado_final.append({
-                'mes': mes, 'total_custo_compras': totais['compras'],
-                'total_custo_despesas': totais['despesas_extras'],
-                'total_geral_mes': totais['compras'] + totais['despesas_extras']
+                'mes': item['mes'].strftime('%Y-%m'), 'total_custo_compras': compras,
+                'total_custo_locacoes': locacoes,
+                'total_custo_despesas': despesas,
+                'total_geral_mes': compras + locacoes + despesas
             })
         return Response(resultado_final)
 
+
+class CustosSerieTemporalView(APIView):
+    """
+    Série temporal de custos (materiais, mão de obra, serviços e despesas extras)
+    a partir do consolidado diário.
+
+    Query params: data_inicio e data_fim (YYYY-MM-DD, obrigatórios), granularidade
+    ('dia', 'semana' ou 'mes'; padrão 'dia'), obra_id (opcional) e series
+    (lista separada por vírgula; padrão todas). O período é limitado a
+    COST_SERIES_MAX_PERIODS pontos na granularidade pedida.
+    """
+    permission_classes = [IsNivelAdmin | IsNivelGerente]
+
+    def get(self, request, *args, **kwargs):
+        data_inicio_str = request.query_params.get('data_inicio')
+        data_fim_str = request.query_params.get('data_fim')
+        granularidade = request.query_params.get('granularidade', 'dia')
+        obra_id_str = request.query_params.get('obra_id')
+        series_str = request.query_params.get('series')
+
+        if not data_inicio_str or not data_fim_str:
+            return Response({"error": "Parâmetros data_inicio e data_fim são obrigatórios."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data_inicio = datetime.strptime(data_inicio_str, '%Y-%m-%d').date()
+            data_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({"error": "Formato inválido para datas (esperado YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+        if data_inicio > data_fim:
+            return Response({"error": "A data_inicio não pode ser posterior à data_fim."}, status=status.HTTP_400_BAD_REQUEST)
+        if granularidade not in GRANULARIDADES_SERIE:
+            return Response({"error": f"Granularidade inválida. Use: {', '.join(GRANULARIDADES_SERIE)}."}, status=status.HTTP_400_BAD_REQUEST)
+        max_periodos = getattr(settings, 'COST_SERIES_MAX_PERIODS', 1000)
+        if contar_periodos(data_inicio, data_fim, granularidade) > max_periodos:
+            return Response(
+                {"error": f"O período excede {max_periodos} pontos nesta granularidade. Reduza o período ou use 'semana' ou 'mes'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        obra_id = None
+        if obra_id_str:
+            try:
+                obra_id = int(obra_id_str)
+            except ValueError:
+                return Response({"error": "ID de obra inválido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        series = None
+        if series_str:
+            series = [serie.strip() for serie in series_str.split(',') if serie.strip()]
+            invalidas = [serie for serie in series if serie not in CustoDiarioObra.CATEGORIAS]
+            if invalidas or not series:
+                return Response(
+                    {"error": f"Séries inválidas: {', '.join(invalidas)}. Use: {', '.join(CustoDiarioObra.CATEGORIAS)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        return Response(serie_temporal(data_inicio, data_fim, granularidade, obra_id=obra_id, series=series))
+
 class ObraCustosPorCategoriaView(APIView):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
     def get(self, request, pk, format=None):
@@ -1583,58 +1491,13 @@ from collections import defaultdict
 from django.utils.dateparse import parse_date
 
 
-# Helper function to get resource name
-def get_recurso_nome_folha(locacao_instance):
-    if locacao_instance.funcionario_locado:
-        return f"Funcionário: {locacao_instance.funcionario_locado.nome_completo}"
-    elif locacao_instance.equipe:
-        return f"Equipe: {locacao_instance.equipe.nome_equipe}"
-    elif locacao_instance.servico_externo:
-        return f"Serviço Externo: {locacao_instance.servico_externo}"
-    return "N/A"
+from ..services.folha_pagamento import (
+    get_recurso_nome_folha, montar_folha_por_recurso, montar_folha_por_obra
+)
 
 class RelatorioFolhaPagamentoViewSet(viewsets.ViewSet):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
 
-    def _get_locacoes_no_periodo(self, start_date, end_date, obra_id_filter=None):
-        filters = Q(
-            Q(data_locacao_inicio__gte=start_date) & Q(data_locacao_inicio__lte=end_date) &
-            (Q(data_pagamento__isnull=True) | Q(data_pagamento__lte=end_date)) & # Considera pagamentos previstos dentro ou após o período, ou não definidos
-            (Q(funcionario_locado__isnull=False) | Q(equipe__isnull=False) | (Q(servico_externo__isnull=False) & ~Q(servico_externo=''))) &
-            Q(status_locacao='ativa') &
-            Q(valor_pagamento__isnull=False) & Q(valor_pagamento__gt=Decimal('0.00'))
-        )
-        if obra_id_filter:
-            filters &= Q(obra_id=obra_id_filter)
-
-        return Locacao_Obras_Equipes.objects.filter(filters).select_related(
-            'obra', 'funcionario_locado', 'equipe'
-        ).order_by('obra__nome_obra', 'data_locacao_inicio')
-
-    def _calculate_daily_cost(self, locacao, current_day_in_loop, start_date_period, end_date_period):
-        """
-        Calculates the cost of a locacao for a specific day within the reporting period.
-        Only attributes cost if current_day_in_loop is within the locacao's effective range AND the reporting period.
-        """
-        cost_for_day = Decimal('0.00')
-
-        # Ensure the current day is within the locacao's own start/end dates
-        if not (locacao.data_locacao_inicio <= current_day_in_loop <= (locacao.data_locacao_fim or date.max)): # type: ignore
-            return cost_for_day
-
-        # Ensure the current day is within the overall report period
-        if not (start_date_period <= current_day_in_loop <= end_date_period):
-            return cost_for_day
-
-        if locacao.tipo_pagamento == 'diaria':
-            cost_for_day = locacao.valor_pagamento or Decimal('0.00')
-        elif locacao.tipo_pagamento in ['metro', 'empreitada']:
-            # For non-daily, cost is attributed entirely to the start date of the locacao,
-            # but only if that start date falls within the report period.
-            if locacao.data_locacao_inicio == current_day_in_loop:
-                cost_for_day = locacao.valor_pagamento or Decimal('0.00')
-        return cost_for_day
-
     @action(detail=False, methods=['get'], url_path='generate_report_data_for_pdf')
     def generate_report_data_for_pdf(self, request):
         start_date_str = request.query_params.get('start_date')
@@ -1659,84 +1522,7 @@ class RelatorioFolhaPagamentoViewSet(viewsets.ViewSet):
             except ValueError:
                 return Response({"error": "obra_id deve ser um número inteiro."}, status=status.HTTP_400_BAD_REQUEST)
 
-
-        locacoes_periodo = self._get_locacoes_no_periodo(start_date, end_date, obra_id_filter)
-
-        pagamentos_por_recurso = defaultdict(lambda: {
-            "recurso_nome": "",
-            "total_a_pagar_periodo": Decimal('0.00'),
-            "detalhes_por_obra": defaultdict(lambda: {
-                "obra_id": None,
-                "obra_nome": "",
-                "total_a_pagar_obra": Decimal('0.00'),
-                "locacoes_na_obra": [] # Stores {data_servico, tipo_pagamento, valor_atribuido, locacao_id}
-            })
-        })
-        grand_total_geral = Decimal('0.00')
-
-        # Iterate through each day in the period to correctly attribute daily costs
-        current_period_day = start_date
-        while current_period_day <= end_date:
-            for locacao in locacoes_periodo:
-                # We only process locacoes that are active on current_period_day
-                # and whose start_date is within the overall report period (covered by _get_locacoes_no_periodo)
-                # and whose own activity range [locacao.data_locacao_inicio, locacao.data_locacao_fim] includes current_period_day
-
-                locacao_starts_in_period = locacao.data_locacao_inicio >= start_date
-                locacao_ends_in_period = (locacao.data_locacao_fim or date.max) <= end_date # type: ignore
-
-                # Check if the current_period_day is within the locacao's active duration
-                if not (locacao.data_locacao_inicio <= current_period_day <= (locacao.data_locacao_fim or current_period_day)): # type: ignore
-                    continue
-
-                valor_atribuido_ao_dia = self._calculate_daily_cost(locacao, current_period_day, start_date, end_date)
-
-                if valor_atribuido_ao_dia > Decimal('0.00'):
-                    recurso_nome = get_recurso_nome_folha(locacao)
-                    obra_nome = locacao.obra.nome_obra if locacao.obra else "Obra Desconhecida"
-                    obra_id = locacao.obra.id if locacao.obra else 0
-
-                    recurso_data = pagamentos_por_recurso[recurso_nome]
-                    recurso_data["recurso_nome"] = recurso_nome
-                    recurso_data["total_a_pagar_periodo"] += valor_atribuido_ao_dia
-
-                    obra_details = recurso_data["detalhes_por_obra"][obra_id]
-                    obra_details["obra_id"] = obra_id
-                    obra_details["obra_nome"] = obra_nome
-                    obra_details["total_a_pagar_obra"] += valor_atribuido_ao_dia
-
-                    obra_details["locacoes_na_obra"].append({
-                        "locacao_id": locacao.id,
-                        "data_servico": current_period_day.isoformat(),
-                        "tipo_pagamento": locacao.get_tipo_pagamento_display(),
-                        "valor_atribuido": str(valor_atribuido_ao_dia),
-                        "observacoes": locacao.observacoes or ""
-                    })
-                    grand_total_geral += valor_atribuido_ao_dia
-            current_period_day += timedelta(days=1)
-
-
-        # Convert to list and format decimals as strings
-        final_recursos_list = []
-        for rec_nome, rec_data in sorted(pagamentos_por_recurso.items()):
-            rec_data["total_a_pagar_periodo"] = str(rec_data["total_a_pagar_periodo"])
-            obras_list = []
-            for ob_id, ob_data in sorted(rec_data["detalhes_por_obra"].items(), key=lambda item: item[1]['obra_nome']):
-                ob_data["total_a_pagar_obra"] = str(ob_data["total_a_pagar_obra"])
-                # Sort locacoes by date
-                ob_data["locacoes_na_obra"].sort(key=lambda x: x["data_servico"])
-                obras_list.append(ob_data)
-            rec_data["detalhes_por_obra"] = obras_list
-            final_recursos_list.append(rec_data)
-
-        final_recursos_list.sort(key=lambda x: x["recurso_nome"])
-
-
-        return Response({
-            "periodo": {"inicio": start_date_str, "fim": end_date_str},
-            "recursos_pagamentos": final_recursos_list,
-            "total_geral_periodo": str(grand_total_geral)
-        })
+        return Response(montar_folha_por_recurso(start_date, end_date, obra_id_filter))
 
     @action(detail=False, methods=['get'], url_path='pre_check_dias_sem_locacoes')
     def pre_check_dias_sem_locacoes(self, request):
@@ -1817,74 +1603,7 @@ class RelatorioFolhaPagamentoViewSet(viewsets.ViewSet):
             except ValueError:
                 return Response({"error": "obra_id deve ser um número inteiro."}, status=status.HTTP_400_BAD_REQUEST)
 
-
-        locacoes_periodo = self._get_locacoes_no_periodo(start_date, end_date, obra_id_filter) # type: ignore
-
-        # Data structure: Obra -> Dia -> Locações
-        report_data_by_obra = defaultdict(lambda: {
-            "obra_id": None, "obra_nome": "",
-            "dias": defaultdict(lambda: {
-                "data": None, "locacoes_no_dia": [], "total_dia_obra": Decimal('0.00')
-            }),
-            "total_obra_periodo": Decimal('0.00')
-        })
-
-        current_period_day = start_date
-        while current_period_day <= end_date: # type: ignore
-            for locacao in locacoes_periodo: # type: ignore
-                # Check if the current_period_day is within the locacao's active duration
-                if not (locacao.data_locacao_inicio <= current_period_day <= (locacao.data_locacao_fim or current_period_day)): # type: ignore
-                    continue
-
-                daily_cost_for_locacao = self._calculate_daily_cost(locacao, current_period_day, start_date, end_date) # type: ignore
-
-                if daily_cost_for_locacao > Decimal('0.00'):
-                    obra = locacao.obra # type: ignore
-                    if not obra: continue
-
-                    obra_entry = report_data_by_obra[obra.id] # type: ignore
-                    if obra_entry["obra_id"] is None: # type: ignore
-                        obra_entry["obra_id"] = obra.id # type: ignore
-                        obra_entry["obra_nome"] = obra.nome_obra # type: ignore
-
-                    day_iso = current_period_day.isoformat() # type: ignore
-                    day_data_dict = obra_entry["dias"][day_iso] # type: ignore
-                    if day_data_dict["data"] is None: # type: ignore
-                        day_data_dict["data"] = day_iso # type: ignore
-
-                    day_data_dict["locacoes_no_dia"].append({ # type: ignore
-                        "locacao_id": locacao.id, # type: ignore
-                        "recurso_nome": get_recurso_nome_folha(locacao), # type: ignore
-                        "tipo_pagamento_display": locacao.get_tipo_pagamento_display(), # type: ignore
-                        "valor_diario_atribuido": str(daily_cost_for_locacao),
-                        "valor_pagamento_total_locacao": str(locacao.valor_pagamento), # type: ignore
-                        "data_locacao_original_inicio": locacao.data_locacao_inicio.isoformat(), # type: ignore
-                        "data_locacao_original_fim": locacao.data_locacao_fim.isoformat() if locacao.data_locacao_fim else None, # type: ignore
-                        "data_pagamento_prevista": locacao.data_pagamento.isoformat() if locacao.data_pagamento else None, # type: ignore
-                        "observacoes": locacao.observacoes or "" # type: ignore
-                    })
-                    day_data_dict["total_dia_obra"] += daily_cost_for_locacao # type: ignore
-                    obra_entry["total_obra_periodo"] += daily_cost_for_locacao # type: ignore
-            current_period_day += timedelta(days=1) # type: ignore
-
-        final_report_list = []
-        sorted_obra_ids = sorted(report_data_by_obra.keys(), key=lambda obra_id_key: report_data_by_obra[obra_id_key]["obra_nome"]) # type: ignore
-        for obra_id_key in sorted_obra_ids: # type: ignore
-            obra_data = report_data_by_obra[obra_id_key] # type: ignore
-            sorted_dias_keys = sorted(obra_data["dias"].keys()) # type: ignore
-            dias_list = []
-            for day_key in sorted_dias_keys: # type: ignore
-                dia_info = obra_data["dias"][day_key] # type: ignore
-                dia_info["total_dia_obra"] = str(dia_info["total_dia_obra"]) # type: ignore
-                dia_info["locacoes_no_dia"].sort(key=lambda x: x["recurso_nome"]) # type: ignore
-                dias_list.append(dia_info) # type: ignore
-            final_report_list.append({ # type: ignore
-                "obra_id": obra_data["obra_id"], # type: ignore
-                "obra_nome": obra_data["obra_nome"], # type: ignore
-                "dias": dias_list,  # type: ignore
-                "total_obra_periodo": str(obra_data["total_obra_periodo"]) # type: ignore
-            })
-        return Response(final_report_list)
+        return Response(montar_folha_por_obra(start_date, end_date, obra_id_filter)) # type: ignore
 
 
 class RelatorioPagamentoMateriaisViewSet(viewsets.ViewSet): # type: ignore
@@ -1989,7 +1708,45 @@ class FotoObraViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     def perform_create(self, serializer):
-        serializer.save()
+        foto = serializer.save()
+        # Miniaturas geradas já no upload; as fotos antigas são atendidas sob demanda
+        try:
+            gerar_miniaturas_arquivo(foto.imagem)
+        except Exception as e:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.warning(f"Falha ao gerar miniaturas da foto {foto.pk}: {str(e)}")
+
+    @action(detail=True, methods=['get'], permission_classes=[])
+    def miniatura(self, request, pk=None):
+        """
+        Redireciona para a miniatura da foto (?size=sm|md|lg), gerando-a se ainda não existir.
+        Público como a própria imagem original, para uso direto em <img>.
+        """
+        return redirecionar_miniatura(request, self.get_object().imagem)
+
+
+def redirecionar_miniatura(request, arquivo):
+    """Resposta das actions de miniatura de arquivos locais (FotoObra/ArquivoObra)."""
+    tamanho = request.query_params.get('size', MINIATURA_TAMANHO_PADRAO)
+    if tamanho not in tamanhos_miniatura():
+        return Response(
+            {'error': f"Tamanho inválido. Opções: {', '.join(tamanhos_miniatura())}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not arquivo:
+        return Response({'error': 'Arquivo não encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        url = url_miniatura_arquivo(arquivo, tamanho)
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.warning(f"Falha ao gerar miniatura de {arquivo.name}: {str(e)}")
+        url = None
+    # Sem miniatura (formato não suportado ou falha): usa o original
+    response = HttpResponseRedirect(url or arquivo.url)
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 class ObraCustosPorMaterialView(APIView):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
@@ -2082,86 +1839,16 @@ class GerarRelatorioPDFObraView(APIView):
     permission_classes = [IsNivelAdmin | IsNivelGerente]
 
     def get(self, request, pk, format=None):
-        is_simple_report = request.query_params.get('is_simple', 'false').lower() == 'true'
-
-        try:
-            obra_instance = Obra.objects.select_related('responsavel').get(pk=pk)
-        except Obra.DoesNotExist:
+        if not Obra.objects.filter(pk=pk).exists():
             raise Http404("Obra não encontrada")
 
-        compras = Compra.objects.filter(obra=obra_instance, tipo='COMPRA').prefetch_related('itens__material').order_by('data_compra', 'nota_fiscal')
-        despesas_extras = Despesa_Extra.objects.filter(obra=obra_instance).order_by('data')
-        locacoes = Locacao_Obras_Equipes.objects.filter(obra=obra_instance).select_related(
-            'equipe__lider',
-            'funcionario_locado'
-        ).prefetch_related(
-            'equipe__membros'
-        ).order_by('data_locacao_inicio')
-
-        # Fetch all attachments
-        fotos_qs = FotoObra.objects.filter(obra=obra_instance).order_by('uploaded_at')
-        arquivos_qs = ArquivoObra.objects.filter(obra=obra_instance).order_by('uploaded_at')
-
-        # Combine all attachments into a single list
-        all_attachments = list(fotos_qs) + list(arquivos_qs)
-
-        # Process attachments for embedding in the PDF
-        anexos_processados = process_attachments_for_pdf(all_attachments)
-
-        custo_total_materiais = sum(c.valor_total_liquido for c in compras if c.valor_total_liquido) or Decimal('0.00')
-        custo_total_despesas_extras = sum(de.valor for de in despesas_extras if de.valor) or Decimal('0.00')
-        custo_total_locacoes = sum(loc.valor_pagamento for loc in locacoes if loc.valor_pagamento) or Decimal('0.00')
-
-        custo_total_realizado = custo_total_materiais + custo_total_despesas_extras + custo_total_locacoes
-        balanco_financeiro = (obra_instance.orcamento_previsto or Decimal('0.00')) - custo_total_realizado
-
-        custo_por_m2 = Decimal('0.00')
-        if obra_instance.area_metragem and obra_instance.area_metragem > Decimal('0.01'):  # Mínimo de 0.01 m²
-            try:
-                custo_por_m2 = custo_total_realizado / obra_instance.area_metragem
-                if not custo_por_m2.is_finite() or custo_por_m2 > Decimal('999999.99'):
-                    custo_por_m2 = Decimal('0.00')
-            except (ZeroDivisionError, InvalidOperation, OverflowError):
-                custo_por_m2 = Decimal('0.00')
-
-        # Categorize locacoes
-        locacoes_equipe = []
-        locacoes_funcionario = []
-        locacoes_servico = []
-        for loc in locacoes:
-            if loc.equipe:
-                locacoes_equipe.append(loc)
-            elif loc.funcionario_locado:
-                locacoes_funcionario.append(loc)
-            elif loc.servico_externo:
-                locacoes_servico.append(loc)
-
-        context = {
-            'obra': obra_instance,
-            'compras': compras,
-            'despesas_extras': despesas_extras,
-            'locacoes_equipe': locacoes_equipe,
-            'locacoes_funcionario': locacoes_funcionario,
-            'locacoes_servico': locacoes_servico,
-            'anexos_processados': anexos_processados,
-            'data_emissao': timezone.now(),
-            'custo_total_materiais': custo_total_materiais,
-            'custo_total_despesas_extras': custo_total_despesas_extras,
-            'custo_total_locacoes': custo_total_locacoes,
-            'custo_total_realizado': custo_total_realizado,
-            'balanco_financeiro': balanco_financeiro,
-            'custo_por_m2': custo_por_m2,
-            'MEDIA_ROOT': settings.MEDIA_ROOT,
-            'is_simple_report': is_simple_report,
+        parametros = {
+            'obra_id': pk,
+            'is_simple': request.query_params.get('is_simple', 'false').lower() == 'true',
         }
-
-        # O template pode usar a flag 'is_simple_report' para mostrar/ocultar seções
-        template_path = 'relatorios/relatorio_obra.html'
-        css_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_obra.css')
-        clean_obra_nome = "".join([c if c.isalnum() else "_" for c in obra_instance.nome_obra])
-        filename = f'Relatorio_Obra_{clean_obra_nome}_{obra_instance.id}.pdf'
-
-        return generate_pdf_response(template_path, context, css_path, filename)
+        if solicitou_relatorio_sincrono(request):
+            return responder_relatorio_pdf(montar_relatorio_obra(parametros, request.user))
+        return enfileirar_relatorio_pdf(request, 'obra', parametros)
 
 
 # View para gerar PDF do Relatório de Pagamento de Locações
@@ -2312,34 +1999,17 @@ class GerarRelatorioPagamentoLocacoesPDFView(APIView):
         if start_date_obj > end_date_obj:
             return Response({"error": "start_date não pode ser posterior a end_date."}, status=status.HTTP_400_BAD_REQUEST)
 
-        folha_pagamento_viewset = RelatorioFolhaPagamentoViewSet()
-        response_data = folha_pagamento_viewset.generate_report_data_for_pdf(request)
-
-        if response_data.status_code != 200:
-             return Response(response_data.data, status=response_data.status_code)
-
-        context = response_data.data
-        context['data_emissao'] = timezone.now()
-        context['start_date_filter'] = start_date_obj
-        context['end_date_filter'] = end_date_obj
+        obra_id_filter = None
         if obra_id_str:
             try:
-                obra_filter_instance = Obra.objects.get(pk=int(obra_id_str))
-                context['obra_filter_nome'] = obra_filter_instance.nome_obra
-            except (Obra.DoesNotExist, ValueError):
-                context['obra_filter_nome'] = None
-
-        template_path = 'relatorios/relatorio_pagamento_locacoes.html'
-        css_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_pagamento_locacoes.css')
-        filename = f'Relatorio_Pagamento_Locacoes_{start_date_str}_a_{end_date_str}.pdf'
-
-        return generate_pdf_response(template_path, context, css_path, filename)
-
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        filename = f"Relatorio_Pagamento_Locacoes_{start_date_str}_a_{end_date_str}.pdf"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+                obra_id_filter = int(obra_id_str)
+            except ValueError:
+                return Response({"error": "obra_id deve ser um número inteiro."}, status=status.HTTP_400_BAD_REQUEST)
 
-        return response
+        parametros = {'start_date': start_date_str, 'end_date': end_date_str, 'obra_id': obra_id_filter}
+        if solicitou_relatorio_sincrono(request):
+            return responder_relatorio_pdf(montar_relatorio_pagamento_locacoes(parametros, request.user))
+        return enfileirar_relatorio_pdf(request, 'pagamento_locacoes', parametros)
 
 
 class BackupViewSet(viewsets.ModelViewSet):
@@ -2375,15 +2045,9 @@ class BackupViewSet(viewsets.ModelViewSet):
             
             backup_path = os.path.join(backup_dir, filename)
             
-            # Comando para criar backup (SQLite)
-            db_path = settings.DATABASES['default']['NAME']
-            
-            # Para SQLite, fazemos uma cópia do arquivo
-            import shutil
-            shutil.copy2(db_path, backup_path)
-            
-            # Obter tamanho do arquivo
-            file_size = os.path.getsize(backup_path)
+            # Snapshot consistente pela API de backup online do SQLite (copiar o
+            # arquivo com o banco em uso pode gerar um backup corrompido)
+            file_size = SQLiteBackupEngine().dump(backup_path, compress=False)['file_size']
             
             # Criar registro no banco
             backup = Backup.objects.create(
@@ -2418,29 +2082,40 @@ class BackupViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Para SQLite, substituímos o arquivo atual
-            db_path = settings.DATABASES['default']['NAME']
-            
             # Fazer backup do estado atual antes de restaurar
             current_timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
             current_backup_filename = f'backup_pre_restore_{current_timestamp}.sql'
             current_backup_path = os.path.join(backup_dir, current_backup_filename)
             
-            import shutil
-            shutil.copy2(db_path, current_backup_path)
+            # O arquivo a restaurar é validado (estrutura e integrity_check) em
+            # paralelo com o snapshot de segurança do banco atual
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                verificacao = executor.submit(BackupService().verificar_snapshot_sqlite, backup_path)
+                current_backup_size = SQLiteBackupEngine().dump(current_backup_path, compress=False)['file_size']
+                validation = verificacao.result()
+            
+            if not validation['valid']:
+                os.remove(current_backup_path)
+                return Response(
+                    {'error': f"Backup inválido: {validation['error']}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Restaurar o backup pela API de backup do SQLite: o banco em uso é
+            # substituído de uma vez, sem copiar o arquivo por cima das conexões abertas
+            backup_filename = backup.filename
+            SQLiteBackupEngine().restore(backup_path)
+            BackupService().registrar_restauracao()
             
-            # Criar registro do backup automático
-            current_backup_size = os.path.getsize(current_backup_path)
+            # Criar registro do backup automático (depois da restauração, que
+            # substitui também a tabela de backups)
             Backup.objects.create(
                 filename=current_backup_filename,
                 tipo='automatico',
                 size_bytes=current_backup_size,
-                description=f'Backup automático antes da restauração de {backup.filename}'
+                description=f'Backup automático antes da restauração de {backup_filename}'
             )
             
-            # Restaurar o backup
-            shutil.copy2(backup_path, db_path)
-            
             return Response(
                 {'message': 'Backup restaurado com sucesso'}, 
                 status=status.HTTP_200_OK
@@ -2496,16 +2171,7 @@ class BackupSettingsViewSet(viewsets.ModelViewSet):
         """
         Retorna ou cria a única instância de configurações.
         """
-        settings_obj, created = BackupSettings.objects.get_or_create(
-            id=1,
-            defaults={
-                'auto_backup_enabled': True,
-                'backup_time': '02:00:00',
-                'retention_days': 30,
-                'max_backups': 10
-            }
-        )
-        return settings_obj
+        return BackupSettings.atual()
     
     def list(self, request, *args, **kwargs):
         """
@@ -2753,22 +2419,28 @@ class AnexoCompraViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            import os
-            from django.http import FileResponse
+            import mimetypes
             from django.utils.encoding import smart_str
             
-            if not os.path.exists(anexo.arquivo.path):
+            storage = anexo.arquivo.storage
+            if not storage.exists(anexo.arquivo.name):
                 return Response(
                     {'error': 'Arquivo físico não encontrado'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            response = FileResponse(
-                open(anexo.arquivo.path, 'rb'),
-                content_type='application/octet-stream'
+            size = storage.size(anexo.arquivo.name)
+            etag = hashlib.sha256(f"{anexo.arquivo.name}:{size}:{anexo.uploaded_at.isoformat()}".encode()).hexdigest()[:32]
+            early_response, byte_range = conditional_range_request(request, size, etag)
+            if early_response is not None:
+                return early_response
+            
+            content_type = mimetypes.guess_type(anexo.nome_original)[0] or 'application/octet-stream'
+            return streaming_file_response(
+                iter_file_chunks(storage.open(anexo.arquivo.name, 'rb'), byte_range),
+                size, content_type, smart_str(anexo.nome_original),
+                byte_range=byte_range, etag=etag
             )
-            response['Content-Disposition'] = f'attachment; filename="{smart_str(anexo.nome_original)}"'
-            return response
             
         except AnexoCompra.DoesNotExist:
             return Response(
@@ -2791,6 +2463,7 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
     serializer_class = ArquivoObraSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    allowed_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt']
 
     _s3_service_instance = None
 
@@ -2829,7 +2502,7 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
                 else:
                     return ArquivoObra.objects.none()
                 
-            return queryset.order_by('-uploaded_at')
+            return queryset.select_related('uploaded_by').order_by('-uploaded_at')
         except Exception as e:
             return ArquivoObra.objects.none()
     
@@ -2881,12 +2554,11 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            allowed_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt']
             import os
             _, ext = os.path.splitext(arquivo.name.lower())
-            if ext not in allowed_extensions:
+            if ext not in self.allowed_extensions:
                 return Response(
-                    {'error': f'Tipo de arquivo não permitido. Tipos permitidos: {", ".join(allowed_extensions)}'}, 
+                    {'error': f'Tipo de arquivo não permitido. Tipos permitidos: {", ".join(self.allowed_extensions)}'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
@@ -2955,6 +2627,107 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def presigned_upload(self, request):
+        """
+        Gera a política de presigned POST para o navegador enviar o arquivo da obra
+        direto ao S3, sem ocupar o servidor durante a transferência. Depois do envio,
+        o cliente chama complete_upload com o upload_token recebido.
+        """
+        obra_id = request.data.get('obra')
+        filename = request.data.get('filename')
+        if not obra_id or not filename:
+            return Response(
+                {'error': 'Os campos obra e filename são obrigatórios'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            obra_id = int(obra_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'ID de obra inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        if not Obra.objects.filter(id=obra_id).exists():
+            return Response(
+                {'error': f'Obra com ID {obra_id} não foi encontrada'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        _, ext = os.path.splitext(filename.lower())
+        if ext not in self.allowed_extensions:
+            return Response(
+                {'error': f'Tipo de arquivo não permitido. Tipos permitidos: {", ".join(self.allowed_extensions)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        result = self.s3_service.create_presigned_upload(
+            filename=filename,
+            content_type=request.data.get('content_type'),
+            anexo_type='obra',
+            object_id=obra_id,
+            user_id=request.user.id,
+            metadata={
+                'categoria': request.data.get('categoria', 'OUTROS'),
+                'descricao': request.data.get('descricao', ''),
+                'obra_id': obra_id
+            },
+            file_hash=request.data.get('file_hash')
+        )
+        if not result['success']:
+            return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def complete_upload(self, request):
+        """
+        Confirma o upload direto ao S3 (HEAD do objeto e hash) e cria o ArquivoObra.
+        Conteúdo já existente, conferido no objeto enviado, reaproveita o anexo.
+        """
+        upload_token = request.data.get('upload_token')
+        if not upload_token:
+            return Response({'error': 'upload_token é obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = self.s3_service.complete_presigned_upload(upload_token, user_id=request.user.id)
+        if not result['success']:
+            return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = result['upload']
+        if upload['anexo_type'] != 'obra' or not upload['object_id']:
+            return Response({'error': 'Token de upload não pertence a um arquivo de obra'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Confirmação repetida do mesmo upload devolve o arquivo já criado
+        arquivo_obra = None
+        if not result['duplicate']:
+            arquivo_obra = ArquivoObra.objects.filter(s3_anexo_id=result['anexo_id']).first()
+        if arquivo_obra is None:
+            _, ext = os.path.splitext(upload['nome_original'])
+            arquivo_obra = ArquivoObra.objects.create(
+                obra_id=upload['object_id'],
+                arquivo=None,
+                nome_original=upload['nome_original'],
+                descricao=upload['metadata'].get('descricao', ''),
+                categoria=upload['metadata'].get('categoria', 'OUTROS'),
+                tamanho_arquivo=result['anexo']['file_size'],
+                tipo_arquivo=ext.upper().lstrip('.'),
+                uploaded_by=request.user,
+                s3_anexo_id=result['anexo_id'],
+                s3_url=result['url']
+            )
+
+        serializer = self.get_serializer(arquivo_obra)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], permission_classes=[])
+    def miniatura(self, request, pk=None):
+        """
+        Redireciona para a miniatura de um arquivo de imagem local (?size=sm|md|lg).
+        Arquivos no S3 usam o preview do anexo (anexos-s3/<id>/preview/?size=).
+        """
+        arquivo_obra = self.get_object()
+        if arquivo_obra.s3_anexo_id:
+            return HttpResponseRedirect(
+                f"{reverse('anexo-s3-preview', args=[arquivo_obra.s3_anexo_id])}?size={request.query_params.get('size', MINIATURA_TAMANHO_PADRAO)}"
+            )
+        return redirecionar_miniatura(request, arquivo_obra.arquivo)
+
     def destroy(self, request, *args, **kwargs):
         """
         Remove um arquivo de obra e deleta o arquivo físico.
@@ -2989,7 +2762,7 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
     def bulk_delete(self, request):
         """
         Deleta múltiplos arquivos em lote.
@@ -3012,33 +2785,53 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            arquivos = ArquivoObra.objects.filter(id__in=arquivo_ids)
-            deleted_count = 0
+            arquivos = list(ArquivoObra.objects.filter(id__in=arquivo_ids))
+            ids_encontrados = [arquivo.id for arquivo in arquivos]
             errors = []
             
+            # Anexos S3 que deixam de ser usados: o mesmo anexo pode estar ligado a
+            # outros arquivos (uploads deduplicados pelo hash) que continuam existindo
+            s3_anexo_ids = {arquivo.s3_anexo_id for arquivo in arquivos if arquivo.s3_anexo_id}
+            ainda_usados = set(
+                ArquivoObra.objects.filter(s3_anexo_id__in=s3_anexo_ids)
+                .exclude(id__in=ids_encontrados)
+                .values_list('s3_anexo_id', flat=True)
+            )
+            
+            # Deletar arquivos físicos locais
             for arquivo in arquivos:
-                try:
-                    # Deletar arquivo físico se existir
-                    if arquivo.arquivo:
-                        try:
-                            import os
-                            if os.path.exists(arquivo.arquivo.path):
-                                os.remove(arquivo.arquivo.path)
-                        except Exception as e:
-                            # Log do erro, mas não falha a operação
-                            import logging
-                            logger = logging.getLogger(__name__)
-                            logger.error(f'Erro ao deletar arquivo físico {arquivo.id}: {e}')
-                    
-                    arquivo.delete()
-                    deleted_count += 1
-                except Exception as e:
-                    errors.append(f'Erro ao deletar arquivo {arquivo.id}: {str(e)}')
+                if arquivo.arquivo:
+                    try:
+                        arquivo.arquivo.storage.delete(arquivo.arquivo.name)
+                    except Exception as e:
+                        # Log do erro, mas não falha a operação
+                        import logging
+                        logger = logging.getLogger(__name__)
+                        logger.error(f'Erro ao deletar arquivo físico {arquivo.id}: {e}')
+            
+            ArquivoObra.objects.filter(id__in=ids_encontrados).delete()
+            deleted_count = len(ids_encontrados)
+            
+            s3_result = None
+            if s3_anexo_ids - ainda_usados:
+                s3_result = self.s3_service.delete_files(s3_anexo_ids - ainda_usados)
+                if s3_result.get('error'):
+                    errors.append(f'Erro ao deletar arquivos do S3: {s3_result["error"]}')
+                for falha in s3_result.get('failed', []):
+                    errors.append(f'Erro ao deletar {falha["key"]} do S3: {falha["error"]}')
             
             response_data = {
-                'message': f'{deleted_count} arquivo(s) deletado(s) com sucesso'
+                'message': f'{deleted_count} arquivo(s) deletado(s) com sucesso',
+                'deleted_count': deleted_count
             }
             
+            if s3_result and not s3_result.get('error'):
+                response_data['s3'] = {
+                    'deleted_objects': s3_result['deleted_objects'],
+                    'shared_objects': s3_result['shared_objects'],
+                    'failed': s3_result['failed']
+                }
+            
             if errors:
                 response_data['warnings'] = errors
             
@@ -3053,6 +2846,36 @@ class ArquivoObraViewSet(viewsets.ModelViewSet):
 
 
 
+def gerar_pdf_compras_lote(request):
+    """
+    Resposta comum dos endpoints de PDF em lote de compras (via job ou, com async=false, síncrona).
+    """
+    compra_ids = request.data.get('compra_ids', [])
+
+    if not compra_ids:
+        return Response(
+            {'error': 'Lista de IDs de compras é obrigatória'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    parametros = {'compra_ids': list(compra_ids)}
+    if not Compra.objects.filter(id__in=parametros['compra_ids']).exists():
+        return Response(
+            {'error': 'Nenhuma compra encontrada com os IDs fornecidos'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    if not solicitou_relatorio_sincrono(request):
+        return enfileirar_relatorio_pdf(request, 'compras_lote', parametros)
+
+    try:
+        return responder_relatorio_pdf(montar_relatorio_compras_lote(parametros, request.user))
+    except Exception as e:
+        return Response(
+            {'error': f'Erro ao gerar PDF: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 class GerarPDFComprasLoteView(APIView):
     """
     Endpoint para gerar PDFs de múltiplas compras em lote.
@@ -3064,54 +2887,7 @@ class GerarPDFComprasLoteView(APIView):
         return Response({'message': 'Endpoint is working', 'method': 'GET'}, status=status.HTTP_200_OK)
     
     def post(self, request):
-        compra_ids = request.data.get('compra_ids', [])
-        
-        if not compra_ids:
-            return Response(
-                {'error': 'Lista de IDs de compras é obrigatória'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            compras = Compra.objects.filter(id__in=compra_ids).prefetch_related(
-                'itens__material', 'parcelas', 'anexos'
-            )
-            
-            if not compras.exists():
-                return Response(
-                    {'error': 'Nenhuma compra encontrada com os IDs fornecidos'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            # Preparar dados das compras com anexos processados
-            compras_data = []
-            for compra in compras:
-                anexos_processados = process_anexos_for_pdf(compra.anexos.all())
-                compras_data.append({
-                    'compra': compra,
-                    'anexos_processados': anexos_processados
-                })
-            
-            # Preparar contexto para o template
-            context = {
-                'compras': compras,
-                'compras_data': compras_data,
-                'data_geracao': timezone.now(),
-                'usuario': request.user,
-            }
-            
-            # Gerar PDF
-            template_path = 'relatorios/relatorio_compras_lote.html'
-            css_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'css', 'relatorio_compras.css')
-            filename = f'Relatorio_Compras_Lote_{timezone.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-            
-            return generate_pdf_response(template_path, context, css_path, filename)
-            
-        except Exception as e:
-            return Response(
-                {'error': f'Erro ao gerar PDF: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        return gerar_pdf_compras_lote(request)
 
 
 # ===== VIEWS DE TESTE DE DADOS =====
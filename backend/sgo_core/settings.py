@@ -109,7 +109,7 @@ if os.environ.get('USE_S3') == 'TRUE':
     AWS_S3_CORS = [
         {
             'AllowedHeaders': ['*'],
-            'AllowedMethods': ['GET', 'HEAD'],
+            'AllowedMethods': ['GET', 'HEAD', 'POST'],  # POST: uploads diretos (presigned POST)
             'AllowedOrigins': ['*'],
             'ExposeHeaders': ['ETag'],
             'MaxAgeSeconds': 3000
@@ -219,6 +219,85 @@ if USE_S3:
         'max_attempts': 3,
         'mode': 'adaptive'
     }
+    
+    # Tamanho de cada parte dos uploads multipart (mínimo do S3: 5MB)
+    AWS_S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+    
+    # Cache da verificação do bucket (head_bucket), em segundos
+    AWS_S3_HEALTH_CHECK_TTL = 300
+    AWS_S3_HEALTH_CHECK_FAILURE_TTL = 30
+    
+    # Reaproveitamento de URLs assinadas (cache do Django) até esta idade
+    SIGNED_URL_CACHE_SECONDS = 50 * 60  # 50 minutos
+    
+    # Uploads diretos do navegador ao S3 (presigned POST)
+    AWS_S3_PRESIGNED_POST_MAX_SIZE = 500 * 1024 * 1024  # 500MB
+    AWS_S3_PRESIGNED_POST_EXPIRATION = 3600  # 1 hora
+
+# ==============================================================================
+# RELATÓRIOS PDF EM SEGUNDO PLANO
+# ==============================================================================
+# Os jobs rodam no executor de tarefas (manage.py executar_tarefas); o PDF fica no
+# S3, se configurado, ou em PDF_REPORTS_DIR, por PDF_REPORTS_TTL_HOURS horas
+PDF_REPORTS_DIR = config('PDF_REPORTS_DIR', default=os.path.join(BASE_DIR, 'relatorios_gerados'))
+PDF_REPORTS_TTL_HOURS = config('PDF_REPORTS_TTL_HOURS', default=24, cast=int)
+# Executa os jobs na própria requisição (testes / depuração)
+PDF_REPORTS_SYNC = config('PDF_REPORTS_SYNC', default=False, cast=bool)
+
+# ==============================================================================
+# SÉRIES TEMPORAIS DE CUSTOS
+# ==============================================================================
+# Pontos por resposta da série temporal; períodos longos usam semana ou mês
+COST_SERIES_MAX_PERIODS = config('COST_SERIES_MAX_PERIODS', default=1000, cast=int)
+
+# ==============================================================================
+# BACKUPS DO BANCO DE DADOS
+# ==============================================================================
+# SQLite: páginas copiadas por passo da API de backup online e pausa entre passos
+BACKUP_SQLITE_PAGES_PER_STEP = config('BACKUP_SQLITE_PAGES_PER_STEP', default=1024, cast=int)
+BACKUP_SQLITE_STEP_SLEEP = config('BACKUP_SQLITE_STEP_SLEEP', default=0.005, cast=float)
+# Nível do gzip aplicado aos dumps enquanto são gravados
+BACKUP_COMPRESSION_LEVEL = config('BACKUP_COMPRESSION_LEVEL', default=6, cast=int)
+# Incrementais: sobreposição com o backup anterior da cadeia, para não perder
+# transações confirmadas durante ele
+BACKUP_INCREMENTAL_OVERLAP_SECONDS = config('BACKUP_INCREMENTAL_OVERLAP_SECONDS', default=300, cast=int)
+# Repositório deduplicado dos backups completos: tamanho médio dos blocos
+# definidos pelo conteúdo (potência de 2; mínimo = 1/4, máximo = 4x)
+BACKUP_REPOSITORY = config('BACKUP_REPOSITORY', default=True, cast=bool)
+BACKUP_CHUNK_AVG_SIZE = config('BACKUP_CHUNK_AVG_SIZE', default=1024 * 1024, cast=int)
+# Agendador (manage.py agendar_backups): intervalo entre verificações e janela
+# após o backup_time configurado em que o backup agendado ainda pode começar
+BACKUP_SCHEDULER_INTERVAL_SECONDS = config('BACKUP_SCHEDULER_INTERVAL_SECONDS', default=60, cast=int)
+BACKUP_SCHEDULE_WINDOW_MINUTES = config('BACKUP_SCHEDULE_WINDOW_MINUTES', default=120, cast=int)
+# Executa os backups na própria requisição (testes / depuração)
+BACKUP_SYNC = config('BACKUP_SYNC', default=False, cast=bool)
+
+# ==============================================================================
+# EXECUTOR DE TAREFAS (manage.py executar_tarefas)
+# ==============================================================================
+# Threads por processo do executor e intervalo entre buscas na fila
+TASK_EXECUTOR_WORKERS = config('TASK_EXECUTOR_WORKERS', default=2, cast=int)
+TASK_EXECUTOR_INTERVAL_SECONDS = config('TASK_EXECUTOR_INTERVAL_SECONDS', default=5, cast=int)
+# Intervalo mínimo entre gravações de progresso (e verificações de cancelamento)
+TASK_PROGRESS_INTERVAL_SECONDS = config('TASK_PROGRESS_INTERVAL_SECONDS', default=5, cast=int)
+# Tarefa em execução sem renovação por este tempo: o worker parou e ela é marcada como falha
+TASK_STALE_SECONDS = config('TASK_STALE_SECONDS', default=300, cast=int)
+
+# ==============================================================================
+# CACHE DE DERIVADOS DE ANEXOS (miniaturas usadas nos relatórios)
+# ==============================================================================
+ATTACHMENT_CACHE_DIR = config('ATTACHMENT_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache', 'anexos_derivados'))
+ATTACHMENT_CACHE_MAX_MB = config('ATTACHMENT_CACHE_MAX_MB', default=512, cast=int)
+
+# Processamento paralelo dos anexos nos relatórios: processos para renderização
+# (0 = no próprio processo), threads para downloads do S3 e quantidade máxima de
+# anexos em memória ao mesmo tempo
+ATTACHMENT_RENDER_WORKERS = config('ATTACHMENT_RENDER_WORKERS', default=2, cast=int)
+ATTACHMENT_FETCH_WORKERS = config('ATTACHMENT_FETCH_WORKERS', default=8, cast=int)
+ATTACHMENT_MAX_IN_FLIGHT = config('ATTACHMENT_MAX_IN_FLIGHT', default=8, cast=int)
+
+# Miniaturas das fotos e imagens (galerias e preview): WEBP ou JPEG
+THUMBNAIL_FORMAT = config('THUMBNAIL_FORMAT', default='WEBP')
 
 STORAGES = {
     "default": {
@@ -187,6 +187,39 @@ apiClient.interceptors.response.use(
   }
 );
 
+// --- Relatórios PDF em segundo plano ---
+// O pedido de um PDF devolve o job (202); o status é consultado até o PDF
+// ficar pronto e o download devolve o arquivo como blob, como antes.
+const RELATORIO_PDF_INTERVALO_MS = 1500;
+const RELATORIO_PDF_TIMEOUT_MS = 5 * 60 * 1000;
+
+const aguardarRelatorioPDF = async pedido => {
+  const { data } = await pedido;
+  const taskId = data.task_id || data.job?.task_id;
+  const limite = Date.now() + RELATORIO_PDF_TIMEOUT_MS;
+
+  for (;;) {
+    const { data: situacao } = await apiClient.get(
+      `/relatorios-pdf/${taskId}/`
+    );
+    const { status, error_message: erro } = situacao.job;
+    if (status === 'completed') break;
+    if (status === 'failed' || status === 'cancelled') {
+      throw new Error(erro || 'Não foi possível gerar o relatório.');
+    }
+    if (Date.now() > limite) {
+      throw new Error('Tempo esgotado aguardando o relatório.');
+    }
+    await new Promise(resolve =>
+      setTimeout(resolve, RELATORIO_PDF_INTERVALO_MS)
+    );
+  }
+
+  return apiClient.get(`/relatorios-pdf/${taskId}/download/`, {
+    responseType: 'blob',
+  });
+};
+
 // --- Obra Service Functions ---
 export const getObras = params => apiClient.get('/obras/', { params });
 export const searchObras = query =>
@@ -266,10 +299,9 @@ export const getRelatorioPagamentoPreCheck = params =>
 export const generateRelatorioPagamento = params =>
   apiClient.get('/relatorios/pagamento/generate/', { params });
 export const generateRelatorioPagamentoPDF = params =>
-  apiClient.get('/relatorios/pagamento/generate-pdf/', {
-    params,
-    responseType: 'blob',
-  });
+  aguardarRelatorioPDF(
+    apiClient.get('/relatorios/pagamento/generate-pdf/', { params })
+  );
 
 // --- Despesa Extra Service Functions ---
 export const getDespesasExtras = params =>
@@ -525,9 +557,9 @@ export const approveOrcamento = id => apiClient.post(`/compras/${id}/approve/`);
 export const getObraComprasDetalhes = obraId =>
   apiClient.get(`/obras/${obraId}/compras-detalhes/`);
 export const generateBulkComprasPDF = compraIds =>
-  apiClient.post('/compras/bulk-pdf/', { compra_ids: compraIds }, {
-    responseType: 'blob',
-  });
+  aguardarRelatorioPDF(
+    apiClient.post('/compras/bulk-pdf/', { compra_ids: compraIds })
+  );
 
 // --- Parcela Service Functions ---
 export const getParcelasByCompra = compraId =>
@@ -604,15 +636,13 @@ export const deleteFotoObra = fotoId =>
 
 // --- PDF Report Service Functions ---
 export const getRelatorioObraGeral = obraId => {
-  return apiClient.get(`/obras/${obraId}/gerar-pdf/?is_simple=true`, {
-    responseType: 'blob',
-  });
+  return aguardarRelatorioPDF(
+    apiClient.get(`/obras/${obraId}/gerar-pdf/?is_simple=true`)
+  );
 };
 
 export const getRelatorioObraCompleto = obraId => {
-  return apiClient.get(`/obras/${obraId}/gerar-pdf/`, {
-    responseType: 'blob',
-  });
+  return aguardarRelatorioPDF(apiClient.get(`/obras/${obraId}/gerar-pdf/`));
 };
 
 // New function to download the "Relatório de Pagamento de Locações" PDF
@@ -625,10 +655,9 @@ export const gerarRelatorioPagamentoLocacoesPDF = (
   if (obraId) {
     params.obra_id = obraId;
   }
-  return apiClient.get('/relatorios/pagamento-locacoes/pdf/', {
-    params,
-    responseType: 'blob',
-  });
+  return aguardarRelatorioPDF(
+    apiClient.get('/relatorios/pagamento-locacoes/pdf/', { params })
+  );
 };
 
 // Funções para testes do sistema